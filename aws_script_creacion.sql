@@ -436,20 +436,178 @@ INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
 GROUP BY d.id_dept, d.nom_dept, s.id_sede, s.nom_sede, m.cod_med, m.nom_med, DATE_TRUNC('month', pr.fecha_emision);
 
 -- Vista 10: Utilización de recursos por sede
-CREATE VIEW vista_utilizacion_recursos AS
+CREATE OR REPLACE VIEW vista_utilizacion_recursos AS
+-- Cada dimensión se agrega por separado (por sede y mes) y luego se unen los
+-- resultados pequeños. Unir Citas x Historias x Equipamiento x Empleados antes
+-- de agrupar multiplicaba las filas por sede antes del COUNT(DISTINCT ...).
+-- Citas se lee una sola vez (en el coordinador es una vista con dblink)
+WITH citas_base AS (
+    SELECT id_sede, DATE_TRUNC('month', fecha_hora) AS mes, cod_pac
+    FROM Citas
+),
+citas_mes AS (
+    SELECT id_sede, mes, COUNT(*) AS total_citas, COUNT(DISTINCT cod_pac) AS total_pacientes
+    FROM citas_base
+    GROUP BY id_sede, mes
+),
+pacientes_mes AS (
+    SELECT DISTINCT id_sede, mes, cod_pac FROM citas_base
+),
+historias_mes AS (
+    SELECT pm.id_sede, pm.mes, COUNT(DISTINCT hc.cod_hist) AS total_historias
+    FROM pacientes_mes pm
+    INNER JOIN Historias_Clinicas hc ON hc.cod_pac = pm.cod_pac
+    GROUP BY pm.id_sede, pm.mes
+),
+equipos_sede AS (
+    SELECT id_sede, COUNT(*) AS total_equipamiento FROM Equipamiento GROUP BY id_sede
+),
+empleados_sede AS (
+    SELECT id_sede, COUNT(*) AS total_empleados FROM Empleados GROUP BY id_sede
+)
 SELECT 
     s.id_sede,
     s.nom_sede,
-    COUNT(DISTINCT c.id_cita) AS total_citas,
-    COUNT(DISTINCT hc.cod_hist) AS total_historias,
-    COUNT(DISTINCT eq.cod_eq) AS total_equipamiento,
-    COUNT(DISTINCT e.id_emp) AS total_empleados,
-    COUNT(DISTINCT pac.cod_pac) AS total_pacientes_atendidos,
-    DATE_TRUNC('month', c.fecha_hora) AS mes
+    COALESCE(cm.total_citas, 0) AS total_citas,
+    COALESCE(hm.total_historias, 0) AS total_historias,
+    COALESCE(eq.total_equipamiento, 0) AS total_equipamiento,
+    COALESCE(em.total_empleados, 0) AS total_empleados,
+    COALESCE(cm.total_pacientes, 0) AS total_pacientes_atendidos,
+    cm.mes
 FROM Sedes_Hospitalarias s
-LEFT JOIN Citas c ON s.id_sede = c.id_sede
-LEFT JOIN Historias_Clinicas hc ON c.cod_pac = hc.cod_pac
-LEFT JOIN Equipamiento eq ON s.id_sede = eq.id_sede
-LEFT JOIN Empleados e ON s.id_sede = e.id_sede
-LEFT JOIN Pacientes pac ON c.cod_pac = pac.cod_pac
-GROUP BY s.id_sede, s.nom_sede, DATE_TRUNC('month', c.fecha_hora);
\ No newline at end of file
+LEFT JOIN citas_mes cm ON cm.id_sede = s.id_sede
+LEFT JOIN historias_mes hm ON hm.id_sede = cm.id_sede AND hm.mes = cm.mes
+LEFT JOIN equipos_sede eq ON eq.id_sede = s.id_sede
+LEFT JOIN empleados_sede em ON em.id_sede = s.id_sede;
+
+-- SECUENCIAS DE IDENTIFICADORES POR SEDE
+-- Los IDs de esta sede se reservan en el coordinador (seq_<tabla>_sede_3,
+-- sección 19 de su script), donde se escriben todas las filas. Las secuencias
+-- que creaban versiones anteriores de este script ya no se usan.
+DROP SEQUENCE IF EXISTS
+    seq_personas, seq_pacientes, seq_citas, seq_historias_clinicas,
+    seq_diagnostico, seq_prescripciones, seq_equipamiento, seq_reportes_generados;
+
+-- ÍNDICES DE CITAS
+-- Soportan los filtros por sede, médico y paciente con rangos de fecha_hora
+-- (también se aplican con: python manage.py migrate cashier).
+CREATE INDEX IF NOT EXISTS idx_citas_sede_fecha ON citas (id_sede, fecha_hora);
+CREATE INDEX IF NOT EXISTS idx_citas_emp_fecha ON citas (id_emp, fecha_hora);
+CREATE INDEX IF NOT EXISTS idx_citas_pac_fecha ON citas (cod_pac, fecha_hora);
+
+-- REPLICACIÓN POR CAMBIOS
+-- Registro de cambios de las tablas replicadas en ambos sentidos
+-- (Personas, Pacientes, Historias_Clinicas). Cada cambio local queda aquí con
+-- el txid de su transacción; replicar_cambios() en el coordinador lee solo lo
+-- nuevo desde su marca y aplica con aplicar_cambios().
+CREATE TABLE IF NOT EXISTS cambios_replicacion (
+    id_cambio BIGSERIAL PRIMARY KEY,
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    tabla VARCHAR(50) NOT NULL,
+    clave BIGINT NOT NULL,
+    operacion CHAR(1) NOT NULL,          -- I / U / D
+    fila JSONB,                          -- fila nueva (NULL en D)
+    fecha_cambio TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+    nodo_origen SMALLINT NOT NULL        -- sede donde se hizo el cambio
+);
+CREATE INDEX IF NOT EXISTS idx_cambios_txid ON cambios_replicacion (txid, id_cambio);
+CREATE INDEX IF NOT EXISTS idx_cambios_fila ON cambios_replicacion (tabla, clave, fecha_cambio);
+
+-- TG_ARGV[0]: columna clave, TG_ARGV[1]: sede de este nodo.
+-- Los cambios que llegan por replicación no se vuelven a registrar.
+CREATE OR REPLACE FUNCTION registrar_cambio()
+RETURNS TRIGGER LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+BEGIN
+    IF current_setting('his_replicacion.aplicando', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, nodo_origen)
+        VALUES (TG_TABLE_NAME, (to_jsonb(OLD) ->> TG_ARGV[0])::BIGINT, 'D', NULL, TG_ARGV[1]::SMALLINT);
+    ELSE
+        INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, nodo_origen)
+        VALUES (TG_TABLE_NAME, (to_jsonb(NEW) ->> TG_ARGV[0])::BIGINT, left(TG_OP, 1), to_jsonb(NEW),
+                TG_ARGV[1]::SMALLINT);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER trg_cambios_personas AFTER INSERT OR UPDATE OR DELETE ON Personas
+    FOR EACH ROW EXECUTE FUNCTION registrar_cambio('id_persona', '3');
+CREATE OR REPLACE TRIGGER trg_cambios_pacientes AFTER INSERT OR UPDATE OR DELETE ON Pacientes
+    FOR EACH ROW EXECUTE FUNCTION registrar_cambio('cod_pac', '3');
+CREATE OR REPLACE TRIGGER trg_cambios_historias AFTER INSERT OR UPDATE OR DELETE ON Historias_Clinicas
+    FOR EACH ROW EXECUTE FUNCTION registrar_cambio('cod_hist', '3');
+
+-- Aplica un lote de cambios (jsonb_agg de filas de cambios_replicacion).
+-- Conflictos: gana la modificación más reciente; en empate gana la sede de
+-- menor número (el nodo central es la 1). Con registrar = TRUE los cambios
+-- aplicados se agregan al registro local para reenviarlos a las demás sedes.
+CREATE OR REPLACE FUNCTION aplicar_cambios(cambios JSONB, registrar BOOLEAN DEFAULT FALSE)
+RETURNS JSONB LANGUAGE plpgsql AS $$
+DECLARE
+    c RECORD;
+    vigente RECORD;
+    columna_clave TEXT;
+    asignaciones TEXT;
+    aplicados INT := 0;
+    descartados INT := 0;
+    errores INT := 0;
+BEGIN
+    PERFORM set_config('his_replicacion.aplicando', 'on', true);
+    FOR c IN
+        SELECT * FROM jsonb_to_recordset(cambios)
+            AS x(tabla TEXT, clave BIGINT, operacion CHAR(1), fila JSONB,
+                 fecha_cambio TIMESTAMPTZ, nodo_origen SMALLINT)
+        ORDER BY fecha_cambio, nodo_origen
+    LOOP
+        SELECT r.fecha_cambio, r.nodo_origen INTO vigente
+        FROM cambios_replicacion r
+        WHERE r.tabla = c.tabla AND r.clave = c.clave
+        ORDER BY r.fecha_cambio DESC, r.nodo_origen
+        LIMIT 1;
+        IF FOUND AND (vigente.fecha_cambio > c.fecha_cambio
+                      OR (vigente.fecha_cambio = c.fecha_cambio AND vigente.nodo_origen <= c.nodo_origen)) THEN
+            descartados := descartados + 1;
+            CONTINUE;
+        END IF;
+
+        columna_clave := CASE c.tabla
+            WHEN 'personas' THEN 'id_persona'
+            WHEN 'pacientes' THEN 'cod_pac'
+            WHEN 'historias_clinicas' THEN 'cod_hist'
+        END;
+        BEGIN
+            IF c.operacion = 'D' THEN
+                EXECUTE format('DELETE FROM %I WHERE %I = $1', c.tabla, columna_clave) USING c.clave;
+            ELSE
+                SELECT string_agg(format('%1$I = EXCLUDED.%1$I', attname), ', ')
+                INTO asignaciones
+                FROM pg_attribute
+                WHERE attrelid = c.tabla::regclass AND attnum > 0 AND NOT attisdropped
+                  AND attname <> columna_clave;
+                EXECUTE format(
+                    'INSERT INTO %1$I SELECT * FROM jsonb_populate_record(NULL::%1$I, $1)
+                     ON CONFLICT (%2$I) DO UPDATE SET %3$s', c.tabla, columna_clave, asignaciones)
+                USING c.fila;
+            END IF;
+            IF registrar THEN
+                INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, fecha_cambio, nodo_origen)
+                VALUES (c.tabla, c.clave, c.operacion, c.fila, c.fecha_cambio, c.nodo_origen);
+            END IF;
+            aplicados := aplicados + 1;
+        EXCEPTION WHEN OTHERS THEN
+            errores := errores + 1;
+            RAISE WARNING 'Cambio % % (%) no aplicado: %', c.tabla, c.clave, c.operacion, SQLERRM;
+        END;
+    END LOOP;
+    PERFORM set_config('his_replicacion.aplicando', 'off', true);
+    RETURN jsonb_build_object('aplicados', aplicados, 'descartados', descartados, 'errores', errores);
+END;
+$$;
+
+-- ÍNDICES PARA EL INICIO DE SESIÓN
+-- El login busca al empleado por email directamente en este nodo
+-- (Personas.email_persona es UNIQUE); este índice cubre el JOIN con Empleados.
+CREATE INDEX IF NOT EXISTS idx_empleados_persona ON Empleados (id_persona);
@@ -4,10 +4,13 @@
 -- 1. EXTENSIONES
 CREATE EXTENSION IF NOT EXISTS dblink;
 CREATE EXTENSION IF NOT EXISTS pgcrypto;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
 
 -- 2. FUNCIONES DE CONEXIÓN (mantener en memoria para mejor rendimiento)
-CREATE OR REPLACE FUNCTION get_azure_conn()
-RETURNS text LANGUAGE plpgsql STABLE AS $$
+-- Cadenas de conexión a cada nodo remoto
+CREATE OR REPLACE FUNCTION get_azure_connstr()
+RETURNS text LANGUAGE plpgsql IMMUTABLE AS $$
 BEGIN
     RETURN 'host=hospitaldb.postgres.database.azure.com
             port=5432
@@ -20,8 +23,8 @@ END;
 $$;
 
 
-CREATE OR REPLACE FUNCTION get_aws_conn()
-RETURNS text LANGUAGE plpgsql STABLE AS $$
+CREATE OR REPLACE FUNCTION get_aws_connstr()
+RETURNS text LANGUAGE plpgsql IMMUTABLE AS $$
 BEGIN
     RETURN 'host=hospital.cdg4cu8q8t0y.us-east-2.rds.amazonaws.com 
             port=5432 
@@ -32,6 +35,63 @@ BEGIN
 END;
 $$;
 
+-- Conexión dblink con nombre, abierta una sola vez por backend y reutilizada.
+-- dblink()/dblink_exec() aceptan el nombre en lugar de la cadena, así cada
+-- llamada deja de pagar TCP + TLS + autenticación contra la nube.
+-- Cada 30 s como máximo se verifica la conexión con un SELECT 1; si el nodo
+-- cerró la conexión se descarta y se vuelve a abrir. La marca del último
+-- chequeo solo avanza tras un SELECT 1 o un dblink_connect exitosos.
+CREATE OR REPLACE FUNCTION get_node_conn(nombre text, connstr text)
+RETURNS text LANGUAGE plpgsql VOLATILE AS $$
+DECLARE
+    abierta BOOLEAN;
+    ultimo_chequeo TIMESTAMPTZ;
+BEGIN
+    abierta := nombre = ANY(COALESCE(dblink_get_connections(), '{}'::text[]));
+
+    IF abierta THEN
+        ultimo_chequeo := NULLIF(current_setting('his_dblink.chequeo_' || nombre, true), '')::timestamptz;
+        IF ultimo_chequeo IS NULL OR clock_timestamp() - ultimo_chequeo > interval '30 seconds' THEN
+            BEGIN
+                PERFORM * FROM dblink(nombre, 'SELECT 1') AS t(ok INT);
+                PERFORM set_config('his_dblink.chequeo_' || nombre, clock_timestamp()::text, false);
+            EXCEPTION WHEN OTHERS THEN
+                RAISE NOTICE 'Conexión % caída, reconectando: %', nombre, SQLERRM;
+                BEGIN
+                    PERFORM dblink_disconnect(nombre);
+                EXCEPTION WHEN OTHERS THEN
+                    NULL;
+                END;
+                abierta := FALSE;
+            END;
+        END IF;
+    END IF;
+
+    IF NOT abierta THEN
+        PERFORM dblink_connect(nombre, connstr);
+        PERFORM set_config('his_dblink.chequeo_' || nombre, clock_timestamp()::text, false);
+    END IF;
+
+    RETURN nombre;
+END;
+$$;
+
+-- Nombres de las conexiones persistentes (se usan igual que antes en dblink())
+CREATE OR REPLACE FUNCTION get_azure_conn()
+RETURNS text LANGUAGE plpgsql VOLATILE AS $$
+BEGIN
+    RETURN get_node_conn('nodo_azure', get_azure_connstr());
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION get_aws_conn()
+RETURNS text LANGUAGE plpgsql VOLATILE AS $$
+BEGIN
+    RETURN get_node_conn('nodo_aws', get_aws_connstr());
+END;
+$$;
+
 -- 3. TABLAS MAESTRAS LOCALES (datos compartidos)
 CREATE TABLE Personas (
     id_persona INT PRIMARY KEY,
@@ -93,137 +153,23 @@ SELECT * FROM dblink(get_aws_conn(),
         fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
         tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200));
 
--- 6. FUNCIÓN MÁGICA PARA ESCRITURA DISTRIBUIDA AUTOMÁTICA
+-- 6. ESCRITURA DISTRIBUIDA DE CITAS
+-- Sede 1 se escribe en citas_local. Las sedes 2 y 3 no esperan a la nube: la
+-- cita queda en outbox_citas en la misma transacción y despachar_outbox_citas()
+-- la entrega al nodo (sección 27).
 CREATE OR REPLACE FUNCTION insert_cita_distributed()
 RETURNS trigger
 LANGUAGE plpgsql
 AS $$
-DECLARE
-    paciente_row Pacientes;
-    persona_row Personas; -- <--- NUEVA VARIABLE REQUERIDA
 BEGIN
-    -- 1. Si la sede es local (1), no hacer nada en dblink
-    IF NEW.id_sede = 1 THEN
-        RETURN NEW;
-    END IF;
-
-    -- 2. Obtener los registros maestros (Paciente y Persona asociada)
-    SELECT * INTO paciente_row FROM Pacientes WHERE cod_pac = NEW.cod_pac;
-    SELECT * INTO persona_row FROM Personas WHERE id_persona = paciente_row.id_persona; -- <--- Obtener la Persona
-
-    -- 3. Lógica de distribución basada en id_sede
-    IF NEW.id_sede = 2 THEN
-        -- Distribución a Azure (Clínica Norte)
-
-        -- *** PASO CLAVE 1: Replicar el registro de PERSONAS para satisfacer la FK de Pacientes ***
-        PERFORM dblink_exec(get_azure_conn(),
-            format($remote$
-                INSERT INTO Personas (id_persona, nom_persona, apellido_persona, tipo_doc, num_doc, fecha_nac, genero, dir_persona, tel_persona, email_persona, ciudad_residencia) 
-                VALUES (%s, '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')
-                ON CONFLICT (id_persona) DO UPDATE SET 
-                nom_persona = EXCLUDED.nom_persona, 
-                apellido_persona = EXCLUDED.apellido_persona, 
-                email_persona = EXCLUDED.email_persona 
-            $remote$,
-            persona_row.id_persona, persona_row.nom_persona, persona_row.apellido_persona,
-            persona_row.tipo_doc, persona_row.num_doc, persona_row.fecha_nac::text, 
-            persona_row.genero, persona_row.dir_persona, persona_row.tel_persona,
-            persona_row.email_persona, persona_row.ciudad_residencia
-            )
-        );
-
-        -- *** PASO CLAVE 2: Replicar el registro de PACIENTES ***
-        PERFORM dblink_exec(get_azure_conn(),
-            format($remote$
-                INSERT INTO Pacientes (cod_pac, id_persona)
-                VALUES (%s, %s)
-                ON CONFLICT (cod_pac) DO UPDATE SET 
-                id_persona = EXCLUDED.id_persona
-            $remote$,
-            paciente_row.cod_pac, paciente_row.id_persona
-            )
-        );
+    NEW.tipo_servicio := COALESCE(NEW.tipo_servicio, 'Consulta');
+    NEW.estado := COALESCE(NEW.estado, 'PROGRAMADA');
+    NEW.motivo := COALESCE(NEW.motivo, '');
 
-        -- *** PASO CLAVE 3: Inserción de la Cita ***
-        PERFORM dblink_exec(get_azure_conn(),
-            format($remote$
-                INSERT INTO citas (id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, fecha_hora_solicitada, tipo_servicio, estado, motivo)
-                VALUES (%s, %s, %s, %s, %s, '%s', '%s', '%s', '%s', '%s')
-                ON CONFLICT (id_cita) DO UPDATE SET
-                id_sede = EXCLUDED.id_sede,
-                id_dept = EXCLUDED.id_dept,
-                id_emp = EXCLUDED.id_emp,
-                cod_pac = EXCLUDED.cod_pac,
-                fecha_hora = EXCLUDED.fecha_hora,
-                fecha_hora_solicitada = EXCLUDED.fecha_hora_solicitada,
-                tipo_servicio = EXCLUDED.tipo_servicio,
-                estado = EXCLUDED.estado,
-                motivo = EXCLUDED.motivo
-            $remote$, 
-            NEW.id_cita, NEW.id_sede, NEW.id_dept, NEW.id_emp, NEW.cod_pac,
-            NEW.fecha_hora::text, NEW.fecha_hora_solicitada::text, 
-            COALESCE(NEW.tipo_servicio, 'Consulta'),
-            COALESCE(NEW.estado, 'PROGRAMADA'),
-            COALESCE(NEW.motivo, '')
-            )
-        );
-    
-    ELSIF NEW.id_sede = 3 THEN
-        -- Distribución a AWS (Unidad Sur)
-        
-        -- *** PASO CLAVE 1: Replicar el registro de PERSONAS para satisfacer la FK de Pacientes ***
-        PERFORM dblink_exec(get_aws_conn(),
-            format($remote$
-                INSERT INTO Personas (id_persona, nom_persona, apellido_persona, tipo_doc, num_doc, fecha_nac, genero, dir_persona, tel_persona, email_persona, ciudad_residencia) 
-                VALUES (%s, '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s')
-                ON CONFLICT (id_persona) DO UPDATE SET 
-                nom_persona = EXCLUDED.nom_persona, 
-                apellido_persona = EXCLUDED.apellido_persona, 
-                email_persona = EXCLUDED.email_persona 
-            $remote$,
-            persona_row.id_persona, persona_row.nom_persona, persona_row.apellido_persona,
-            persona_row.tipo_doc, persona_row.num_doc, persona_row.fecha_nac::text, 
-            persona_row.genero, persona_row.dir_persona, persona_row.tel_persona,
-            persona_row.email_persona, persona_row.ciudad_residencia
-            )
-        );
-        
-        -- *** PASO CLAVE 2: Replicar el registro de PACIENTES ***
-        PERFORM dblink_exec(get_aws_conn(),
-            format($remote$
-                INSERT INTO Pacientes (cod_pac, id_persona)
-                VALUES (%s, %s)
-                ON CONFLICT (cod_pac) DO UPDATE SET 
-                id_persona = EXCLUDED.id_persona
-            $remote$,
-            paciente_row.cod_pac, paciente_row.id_persona
-            )
-        );
-        
-        -- *** PASO CLAVE 3: Inserción de la Cita ***
-        PERFORM dblink_exec(get_aws_conn(),
-            format($remote$
-                INSERT INTO citas (id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, fecha_hora_solicitada, tipo_servicio, estado, motivo)
-                VALUES (%s, %s, %s, %s, %s, '%s', '%s', '%s', '%s', '%s')
-                ON CONFLICT (id_cita) DO UPDATE SET
-                id_sede = EXCLUDED.id_sede,
-                id_dept = EXCLUDED.id_dept,
-                id_emp = EXCLUDED.id_emp,
-                cod_pac = EXCLUDED.cod_pac,
-                fecha_hora = EXCLUDED.fecha_hora,
-                fecha_hora_solicitada = EXCLUDED.fecha_hora_solicitada,
-                tipo_servicio = EXCLUDED.tipo_servicio,
-                estado = EXCLUDED.estado,
-                motivo = EXCLUDED.motivo
-            $remote$, 
-            NEW.id_cita, NEW.id_sede, NEW.id_dept, NEW.id_emp, NEW.cod_pac,
-            NEW.fecha_hora::text, NEW.fecha_hora_solicitada::text, 
-            COALESCE(NEW.tipo_servicio, 'Consulta'),
-            COALESCE(NEW.estado, 'PROGRAMADA'),
-            COALESCE(NEW.motivo, '')
-            )
-        );
-    
+    IF NEW.id_sede = 1 THEN
+        INSERT INTO citas_local VALUES (NEW.*);
+    ELSIF NEW.id_sede IN (2, 3) THEN
+        PERFORM encolar_cita(NEW.id_cita, NEW.id_sede, 'I', to_jsonb(NEW));
     ELSE
         RAISE EXCEPTION 'ID de Sede no válido: %', NEW.id_sede;
     END IF;
@@ -253,32 +199,9 @@ BEGIN
             estado = NEW.estado,
             motivo = NEW.motivo
         WHERE id_cita = OLD.id_cita;
-    ELSIF OLD.id_sede = 2 THEN
-        PERFORM dblink_exec(get_azure_conn(),
-            format($remote$
-                UPDATE citas SET 
-                    id_dept = %s,
-                    id_emp = %s,
-                    fecha_hora = '%s',
-                    estado = '%s',
-                    motivo = '%s'
-                WHERE id_cita = %s
-            $remote$,
-            NEW.id_dept, NEW.id_emp, NEW.fecha_hora, 
-            NEW.estado, NEW.motivo, OLD.id_cita));
-    ELSIF OLD.id_sede = 3 THEN
-        PERFORM dblink_exec(get_aws_conn(),
-            format($remote$
-                UPDATE citas SET 
-                    id_dept = %s,
-                    id_emp = %s,
-                    fecha_hora = '%s',
-                    estado = '%s',
-                    motivo = '%s'
-                WHERE id_cita = %s
-            $remote$,
-            NEW.id_dept, NEW.id_emp, NEW.fecha_hora, 
-            NEW.estado, NEW.motivo, OLD.id_cita));
+    ELSIF OLD.id_sede IN (2, 3) THEN
+        -- Viaja la fila completa: aplicarla dos veces en el nodo deja el mismo resultado
+        PERFORM encolar_cita(NEW.id_cita, NEW.id_sede, 'U', to_jsonb(NEW));
     END IF;
     
     RETURN NEW;
@@ -318,68 +241,97 @@ CREATE TABLE Enfermedades (
 );
 
 -- Ahora sí podemos crear el procedimiento de sincronización
--- Reemplace el procedimiento sync_master_data en pruebacoordinador.sql con este código
+-- Envía una tabla maestra completa a un nodo remoto en lotes de `lote` filas.
+-- Cada lote viaja como un solo JSON (quote_literal, sin armar valores a mano) y
+-- se aplica en el nodo con un único INSERT ... ON CONFLICT; solo se reescriben
+-- las filas que cambiaron. Las idas y vueltas crecen con el volumen (filas/lote),
+-- no con el número de filas. Deja filas y duración en auditoria_sincronizacion.
+-- `filtro` limita las filas enviadas (condición SQL sobre la tabla).
+CREATE OR REPLACE FUNCTION sync_tabla_a_nodo(tabla TEXT, clave TEXT, conexion TEXT, nodo TEXT,
+                                             filtro TEXT DEFAULT 'TRUE', lote INT DEFAULT 5000)
+RETURNS VOID LANGUAGE plpgsql AS $$
+DECLARE
+    inicio TIMESTAMP := clock_timestamp();
+    columnas TEXT;
+    actualizar TEXT;
+    actuales TEXT;
+    nuevas TEXT;
+    payload TEXT;
+    ultimo BIGINT;
+    n INT;
+    resultado TEXT;
+    enviadas BIGINT := 0;
+    modificadas BIGINT := 0;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum),
+           string_agg(format('%1$I = EXCLUDED.%1$I', attname), ', ' ORDER BY attnum) FILTER (WHERE attname <> clave),
+           string_agg(format('t.%I', attname), ', ' ORDER BY attnum) FILTER (WHERE attname <> clave),
+           string_agg(format('EXCLUDED.%I', attname), ', ' ORDER BY attnum) FILTER (WHERE attname <> clave)
+    INTO columnas, actualizar, actuales, nuevas
+    FROM pg_attribute
+    WHERE attrelid = tabla::regclass AND attnum > 0 AND NOT attisdropped;
+
+    BEGIN
+        LOOP
+            -- Siguiente lote por clave primaria (sin OFFSET)
+            EXECUTE format(
+                'SELECT json_agg(x)::text, count(*), max(x.%1$I) FROM (
+                     SELECT %2$s FROM %3$s WHERE (%4$s) AND ($1 IS NULL OR %1$I > $1)
+                     ORDER BY %1$I LIMIT $2
+                 ) x', clave, columnas, tabla, filtro)
+            INTO payload, n, ultimo USING ultimo, lote;
+            EXIT WHEN n = 0;
+
+            resultado := dblink_exec(conexion, format(
+                'INSERT INTO %1$s AS t (%2$s)
+                 SELECT %2$s FROM json_populate_recordset(NULL::%1$s, %3$L)
+                 ON CONFLICT (%4$I) DO UPDATE SET %5$s
+                 WHERE ROW(%6$s) IS DISTINCT FROM ROW(%7$s)',
+                tabla, columnas, payload, clave, actualizar, actuales, nuevas));
+            -- dblink_exec retorna la etiqueta del comando: 'INSERT 0 <filas>'
+            modificadas := modificadas + split_part(resultado, ' ', 3)::BIGINT;
+            enviadas := enviadas + n;
+            EXIT WHEN n < lote;
+        END LOOP;
+
+        INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+        VALUES ('OK', tabla, nodo, enviadas, modificadas,
+                EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+    EXCEPTION WHEN OTHERS THEN
+        -- Un nodo caído no detiene la sincronización de los demás
+        INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+        VALUES ('ERROR: ' || SQLERRM, tabla, nodo, enviadas, modificadas,
+                EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+        RAISE WARNING 'Sincronización de % hacia % falló: %', tabla, nodo, SQLERRM;
+    END;
+END;
+$$;
+
 CREATE OR REPLACE PROCEDURE sync_master_data()
 LANGUAGE plpgsql AS $$
 DECLARE
-    role_record RECORD;
+    maestra RECORD;
+    nodo RECORD;
 BEGIN
-    -- 1. Sincronización de Roles (El Coordinador es la fuente de verdad)
-    -- Esto asegura que los id_rol existan en los nodos remotos.
-    FOR role_record IN SELECT id_rol, nombre_rol, descripcion FROM Roles ORDER BY id_rol LOOP
-        
-        -- Sincronizar a Azure
-        PERFORM dblink_exec(get_azure_conn(),
-            format($remote$
-                INSERT INTO Roles (id_rol, nombre_rol, descripcion) 
-                VALUES (%s, '%s', '%s') 
-                ON CONFLICT (id_rol) DO UPDATE SET 
-                nombre_rol = EXCLUDED.nombre_rol, 
-                descripcion = EXCLUDED.descripcion
-            $remote$, 
-            role_record.id_rol, role_record.nombre_rol, role_record.descripcion)
-        );
-
-        -- Sincronizar a AWS
-        PERFORM dblink_exec(get_aws_conn(),
-            format($remote$
-                INSERT INTO Roles (id_rol, nombre_rol, descripcion) 
-                VALUES (%s, '%s', '%s') 
-                ON CONFLICT (id_rol) DO UPDATE SET 
-                nombre_rol = EXCLUDED.nombre_rol, 
-                descripcion = EXCLUDED.descripcion
-            $remote$, 
-            role_record.id_rol, role_record.nombre_rol, role_record.descripcion)
-        );
+    -- 1. Tablas maestras hacia cada nodo (El Coordinador es la fuente de verdad).
+    -- Personas, Pacientes e Historias_Clinicas se replican por cambios en ambos
+    -- sentidos con replicar_cambios() (sección 26).
+    FOR nodo IN SELECT * FROM (VALUES ('azure', 2, get_azure_conn()), ('aws', 3, get_aws_conn()))
+                AS n(nombre, id_sede, conexion) LOOP
+        FOR maestra IN SELECT * FROM (VALUES
+            ('roles', 'id_rol', 'TRUE'),
+            ('especialidades', 'id_especialidad', 'TRUE'),
+            ('catalogo_medicamentos', 'cod_med', 'TRUE'),
+            ('enfermedades', 'id_enfermedad', 'TRUE')
+        ) AS m(tabla, clave, filtro) LOOP
+            PERFORM sync_tabla_a_nodo(maestra.tabla, maestra.clave, nodo.conexion, nodo.nombre, maestra.filtro);
+        END LOOP;
     END LOOP;
     
-    -- 2. Lógica para sincronizar Personas (Mantenida de su versión original)
-    
-    -- Sincronizar Personas desde Azure
-    INSERT INTO Personas 
-    SELECT * FROM dblink(get_azure_conn(), 
-        'SELECT id_persona, nom_persona, apellido_persona, tipo_doc, num_doc, 
-                fecha_nac, genero, dir_persona, tel_persona, email_persona, ciudad_residencia 
-         FROM personas') 
-    AS t(id_persona INT, nom_persona VARCHAR(100), apellido_persona VARCHAR(100),
-          tipo_doc VARCHAR(10), num_doc VARCHAR(20), fecha_nac DATE,
-          genero CHAR(1), dir_persona VARCHAR(200), tel_persona VARCHAR(20),
-          email_persona VARCHAR(150), ciudad_residencia VARCHAR(50))
-    ON CONFLICT (id_persona) DO UPDATE SET 
-        nom_persona = EXCLUDED.nom_persona,
-        email_persona = EXCLUDED.email_persona;
-        
-    -- Sincronizar Personas desde AWS
-    INSERT INTO Personas 
-    SELECT * FROM dblink(get_aws_conn(), 
-        'SELECT id_persona, nom_persona, apellido_persona, tipo_doc, num_doc, 
-                fecha_nac, genero, dir_persona, tel_persona, email_persona, ciudad_residencia 
-         FROM personas') 
-    AS t(id_persona INT, nom_persona VARCHAR(100), apellido_persona VARCHAR(100),
-          tipo_doc VARCHAR(10), num_doc VARCHAR(20), fecha_nac DATE,
-          genero CHAR(1), dir_persona VARCHAR(200), tel_persona VARCHAR(20),
-          email_persona VARCHAR(150), ciudad_residencia VARCHAR(50))
-    ON CONFLICT (id_persona) DO NOTHING;
+    -- 2. Invalidar los catálogos en caché de la aplicación (ver sección 22)
+    IF to_regclass('version_catalogos') IS NOT NULL THEN
+        UPDATE version_catalogos SET version = version + 1, fecha_actualizacion = NOW();
+    END IF;
     
 END;
 $$;
@@ -696,22 +648,48 @@ GROUP BY d.id_dept, d.nom_dept, s.id_sede, s.nom_sede, m.cod_med, m.nom_med, DAT
 
 -- Vista 10: Utilización de recursos por sede
 CREATE VIEW vista_utilizacion_recursos AS
+-- Cada dimensión se agrega por separado (por sede y mes) y luego se unen los
+-- resultados pequeños. Unir Citas x Historias x Equipamiento x Empleados antes
+-- de agrupar multiplicaba las filas por sede antes del COUNT(DISTINCT ...).
+-- Citas se lee una sola vez (en el coordinador es una vista con dblink)
+WITH citas_base AS (
+    SELECT id_sede, DATE_TRUNC('month', fecha_hora) AS mes, cod_pac
+    FROM Citas
+),
+citas_mes AS (
+    SELECT id_sede, mes, COUNT(*) AS total_citas, COUNT(DISTINCT cod_pac) AS total_pacientes
+    FROM citas_base
+    GROUP BY id_sede, mes
+),
+pacientes_mes AS (
+    SELECT DISTINCT id_sede, mes, cod_pac FROM citas_base
+),
+historias_mes AS (
+    SELECT pm.id_sede, pm.mes, COUNT(DISTINCT hc.cod_hist) AS total_historias
+    FROM pacientes_mes pm
+    INNER JOIN Historias_Clinicas hc ON hc.cod_pac = pm.cod_pac
+    GROUP BY pm.id_sede, pm.mes
+),
+equipos_sede AS (
+    SELECT id_sede, COUNT(*) AS total_equipamiento FROM Equipamiento GROUP BY id_sede
+),
+empleados_sede AS (
+    SELECT id_sede, COUNT(*) AS total_empleados FROM Empleados GROUP BY id_sede
+)
 SELECT 
     s.id_sede,
     s.nom_sede,
-    COUNT(DISTINCT c.id_cita) AS total_citas,
-    COUNT(DISTINCT hc.cod_hist) AS total_historias,
-    COUNT(DISTINCT eq.cod_eq) AS total_equipamiento,
-    COUNT(DISTINCT e.id_emp) AS total_empleados,
-    COUNT(DISTINCT pac.cod_pac) AS total_pacientes_atendidos,
-    DATE_TRUNC('month', c.fecha_hora) AS mes
+    COALESCE(cm.total_citas, 0) AS total_citas,
+    COALESCE(hm.total_historias, 0) AS total_historias,
+    COALESCE(eq.total_equipamiento, 0) AS total_equipamiento,
+    COALESCE(em.total_empleados, 0) AS total_empleados,
+    COALESCE(cm.total_pacientes, 0) AS total_pacientes_atendidos,
+    cm.mes
 FROM Sedes_Hospitalarias s
-LEFT JOIN Citas c ON s.id_sede = c.id_sede
-LEFT JOIN Historias_Clinicas hc ON c.cod_pac = hc.cod_pac
-LEFT JOIN Equipamiento eq ON s.id_sede = eq.id_sede
-LEFT JOIN Empleados e ON s.id_sede = e.id_sede
-LEFT JOIN Pacientes pac ON c.cod_pac = pac.cod_pac
-GROUP BY s.id_sede, s.nom_sede, DATE_TRUNC('month', c.fecha_hora);
+LEFT JOIN citas_mes cm ON cm.id_sede = s.id_sede
+LEFT JOIN historias_mes hm ON hm.id_sede = cm.id_sede AND hm.mes = cm.mes
+LEFT JOIN equipos_sede eq ON eq.id_sede = s.id_sede
+LEFT JOIN empleados_sede em ON em.id_sede = s.id_sede;
 
 -- ... (aquí van las otras 9 vistas, exactamente como las tienes)
 
@@ -752,10 +730,16 @@ GRANT SELECT ON Auditoria_Accesos TO auditor;
 GRANT SELECT ON Historias_Clinicas, Diagnostico TO auditor;
 
 -- 15. TABLA DE AUDITORÍA PARA SINCRONIZACIÓN
+-- Una fila por tabla y nodo en cada sync_master_data()
 CREATE TABLE auditoria_sincronizacion (
     id SERIAL PRIMARY KEY,
     fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    estado TEXT
+    estado TEXT,
+    tabla VARCHAR(50),
+    nodo VARCHAR(20),
+    filas BIGINT,
+    filas_modificadas BIGINT,
+    duracion_ms INT
 );
 
 -- 16. MENSAJE FINAL
@@ -1003,6 +987,7 @@ DECLARE
     table_name text;
     columns text;
     values_clause text;
+    fallos text[] := '{}';
 BEGIN
     -- Obtener nombre de la tabla que disparó el trigger
     table_name := TG_TABLE_NAME;
@@ -1014,7 +999,8 @@ BEGIN
     
     -- CONEXIÓN A AZURE
     BEGIN
-        azure_conn := dblink_connect('host=hospitaldb.postgres.database.azure.com port=5432 dbname=hospitalAzure user=directorHospital password=Postgr3s_DB');
+        -- Conexión persistente con nombre (no se abre ni se cierra en cada disparo)
+        azure_conn := get_azure_conn();
         
         IF TG_OP = 'INSERT' THEN
             -- Construir INSERT dinámico
@@ -1062,15 +1048,14 @@ BEGIN
                 OLD.id_rol, OLD.id_sede
             ));
         END IF;
-        
-        PERFORM dblink_disconnect(azure_conn);
+
     EXCEPTION WHEN OTHERS THEN
-        RAISE NOTICE 'Error sincronizando con Azure: %', SQLERRM;
+        fallos := fallos || format('Azure: %s', SQLERRM);
     END;
     
     -- CONEXIÓN A AWS
     BEGIN
-        aws_conn := dblink_connect('host=hospital.cdg4cu8q8t0y.us-east-2.rds.amazonaws.com port=5432 dbname=hospital user=postgres password=Postgr3s_DB');
+        aws_conn := get_aws_conn();
         
         -- Misma lógica que para Azure
         IF TG_OP = 'INSERT' THEN
@@ -1113,12 +1098,1143 @@ BEGIN
                 OLD.id_rol, OLD.id_sede
             ));
         END IF;
-        
-        PERFORM dblink_disconnect(aws_conn);
+
     EXCEPTION WHEN OTHERS THEN
-        RAISE NOTICE 'Error sincronizando con AWS: %', SQLERRM;
+        fallos := fallos || format('AWS: %s', SQLERRM);
     END;
-    
+
+    -- Se intentan ambos nodos y luego se aborta la escritura: un nodo sin la
+    -- fila de referencia quedaría divergente sin que nadie se entere
+    IF cardinality(fallos) > 0 THEN
+        RAISE EXCEPTION 'No se pudo sincronizar % con todos los nodos: %',
+            table_name, array_to_string(fallos, '; ');
+    END IF;
+
     RETURN NEW;
 END;
-$$ LANGUAGE plpgsql;
\ No newline at end of file
+$$ LANGUAGE plpgsql;
+
+-- 18. ESQUEMA nodo_local: FRAGMENTO FÍSICO DE LA SEDE 1
+-- Django abre la conexión 'sede_1' con search_path = nodo_local, public.
+-- Así las consultas de una sola sede resuelven Citas/Empleados/Departamentos
+-- contra las tablas *_local sin disparar los dblink de las vistas distribuidas.
+CREATE SCHEMA IF NOT EXISTS nodo_local;
+
+CREATE OR REPLACE VIEW nodo_local.citas AS
+SELECT * FROM public.citas_local;
+
+CREATE OR REPLACE VIEW nodo_local.empleados AS
+SELECT * FROM public.empleados_local;
+
+CREATE OR REPLACE VIEW nodo_local.departamentos AS
+SELECT * FROM public.departamentos_local;
+
+-- Agregado de consultas por médico solo con las citas de la sede 1
+-- (las sedes 2 y 3 tienen la misma vista sobre sus tablas locales)
+CREATE OR REPLACE VIEW nodo_local.vista_medicos_consultas AS
+SELECT 
+    e.id_emp,
+    p.nom_persona || ' ' || p.apellido_persona AS nombre_medico,
+    s.nom_sede,
+    d.nom_dept,
+    esp.nombre_esp AS especialidad,
+    COUNT(c.id_cita) AS total_consultas,
+    DATE_TRUNC('week', c.fecha_hora) AS semana
+FROM nodo_local.citas c
+INNER JOIN nodo_local.empleados e ON c.id_emp = e.id_emp
+INNER JOIN public.Personas p ON e.id_persona = p.id_persona
+INNER JOIN public.Roles r ON e.id_rol = r.id_rol
+INNER JOIN public.Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+INNER JOIN nodo_local.departamentos d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
+LEFT JOIN public.Emp_Posee_Esp epe ON e.id_emp = epe.id_emp
+LEFT JOIN public.Especialidades esp ON epe.id_especialidad = esp.id_especialidad
+WHERE r.nombre_rol = 'Medico'
+GROUP BY e.id_emp, p.nom_persona, p.apellido_persona, s.nom_sede, d.nom_dept, esp.nombre_esp, DATE_TRUNC('week', c.fecha_hora);
+
+GRANT USAGE ON SCHEMA nodo_local TO administrador, medico, enfermero, administrativo, auditor;
+GRANT SELECT ON ALL TABLES IN SCHEMA nodo_local TO administrador, medico, enfermero, administrativo, auditor;
+
+
+-- 19. SECUENCIAS DE IDENTIFICADORES POR SEDE
+-- Las filas de todas las sedes se escriben en el coordinador, así que la
+-- aplicación reserva aquí los bloques de IDs: una secuencia por tabla y sede
+-- (seq_citas_sede_2, ...) con el rango exclusivo de la sede (sede N:
+-- N*100000000 + 1 .. N*100000000 + 99999999), así dos sedes nunca generan el
+-- mismo ID. INCREMENT BY 50 = tamaño del bloque que la aplicación reserva con
+-- un solo nextval() (ver cashier/identificadores.py). Los nodos no tienen
+-- secuencias propias.
+DO $$
+DECLARE
+    sede INT;
+    secuencia TEXT;
+BEGIN
+    -- Sede 1 (coordinador), 2 (Azure) y 3 (AWS); una sede nueva se agrega
+    -- repitiendo este bloque o con "python manage.py migrate cashier", que
+    -- crea las de todas las filas de Sedes_Hospitalarias
+    FOR sede IN 1..3 LOOP
+        FOREACH secuencia IN ARRAY ARRAY[
+            'seq_personas', 'seq_pacientes', 'seq_citas', 'seq_historias_clinicas',
+            'seq_diagnostico', 'seq_prescripciones', 'seq_equipamiento', 'seq_reportes_generados'
+        ] LOOP
+            EXECUTE format(
+                'CREATE SEQUENCE IF NOT EXISTS %I INCREMENT BY 50 MINVALUE %s MAXVALUE %s START WITH %s NO CYCLE',
+                secuencia || '_sede_' || sede,
+                sede * 100000000 + 1,
+                sede * 100000000 + 99999999,
+                sede * 100000000 + 1
+            );
+            EXECUTE format('GRANT USAGE, SELECT ON SEQUENCE %I TO administrador, medico, administrativo',
+                           secuencia || '_sede_' || sede);
+        END LOOP;
+    END LOOP;
+END $$;
+
+-- 20. ÍNDICES DE CITAS
+-- Soportan los filtros por sede, médico y paciente con rangos de fecha_hora
+-- (también se aplican con: python manage.py migrate cashier).
+CREATE INDEX IF NOT EXISTS idx_citas_local_sede_fecha ON citas_local (id_sede, fecha_hora);
+CREATE INDEX IF NOT EXISTS idx_citas_local_emp_fecha ON citas_local (id_emp, fecha_hora);
+CREATE INDEX IF NOT EXISTS idx_citas_local_pac_fecha ON citas_local (cod_pac, fecha_hora);
+
+-- 21. ÍNDICES DE BÚSQUEDA (pg_trgm + unaccent)
+-- unaccent() es STABLE y no sirve en un índice: f_unaccent fija el diccionario
+-- y se declara IMMUTABLE. Las búsquedas de cashier/busqueda.py usan exactamente
+-- estas expresiones para que el planner elija los índices GIN.
+CREATE OR REPLACE FUNCTION f_unaccent(TEXT) RETURNS TEXT AS $$
+    SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_personas_nombre_trgm ON Personas
+    USING GIN (lower(f_unaccent(nom_persona || ' ' || apellido_persona)) gin_trgm_ops);
+-- Prefijos de documento (num_doc LIKE '123%') por btree
+CREATE INDEX IF NOT EXISTS idx_personas_num_doc_prefijo ON Personas (num_doc varchar_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_medicamentos_nombre_trgm ON Catalogo_Medicamentos
+    USING GIN (lower(f_unaccent(nom_med)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_enfermedades_nombre_trgm ON Enfermedades
+    USING GIN (lower(f_unaccent(nombre_enfermedad)) gin_trgm_ops);
+
+-- 22. VERSIONES DE CATÁLOGOS
+-- La aplicación guarda los catálogos de referencia en memoria (cashier/catalogos.py)
+-- y solo los vuelve a leer cuando cambia su versión aquí. Los triggers suben la
+-- versión con cualquier cambio; sync_master_data sube todas. Inventario_Farmacia
+-- no tiene versión: cambia con cada prescripción y su fila sería un punto de
+-- contención; la aplicación guarda el stock solo unos segundos (CATALOGOS_TTL).
+CREATE TABLE IF NOT EXISTS version_catalogos (
+    catalogo VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO version_catalogos (catalogo) VALUES
+    ('enfermedades'), ('departamentos'), ('sedes'), ('roles'),
+    ('especialidades')
+ON CONFLICT (catalogo) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION incrementar_version_catalogo()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE version_catalogos
+    SET version = version + 1, fecha_actualizacion = NOW()
+    WHERE catalogo = TG_ARGV[0];
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_version_enfermedades AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Enfermedades
+FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('enfermedades');
+CREATE OR REPLACE TRIGGER trg_version_departamentos_local AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON departamentos_local
+FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('departamentos');
+-- Departamentos de otras sedes insertados a través de la vista distribuida
+CREATE OR REPLACE TRIGGER trg_version_departamentos AFTER INSERT OR UPDATE OR DELETE ON Departamentos
+FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('departamentos');
+CREATE OR REPLACE TRIGGER trg_version_sedes AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Sedes_Hospitalarias
+FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('sedes');
+CREATE OR REPLACE TRIGGER trg_version_roles AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Roles
+FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('roles');
+CREATE OR REPLACE TRIGGER trg_version_especialidades AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Especialidades
+FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('especialidades');
+
+GRANT SELECT ON version_catalogos TO administrador, medico, enfermero, administrativo, auditor;
+GRANT UPDATE ON version_catalogos TO administrador, medico, enfermero, administrativo;
+
+-- 23. RESÚMENES MATERIALIZADOS PARA REPORTES
+-- Las vistas analíticas re-agregan Citas/Empleados/Departamentos a través de
+-- dblink en cada consulta. Los reportes leen estas copias materializadas, que se
+-- refrescan con CONCURRENTLY (sin bloquear lecturas) desde refrescar_analitica().
+-- Cada una necesita un índice único para poder refrescarse de forma concurrente.
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_consumo_medicamentos_dept AS
+SELECT * FROM vista_consumo_medicamentos_dept;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_consumo_medicamentos_dept
+    ON mv_consumo_medicamentos_dept (id_sede, id_dept, cod_med, mes);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_utilizacion_recursos AS
+SELECT * FROM vista_utilizacion_recursos;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_utilizacion_recursos
+    ON mv_utilizacion_recursos (id_sede, mes);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_medicos_consultas AS
+SELECT * FROM vista_medicos_consultas;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_medicos_consultas
+    ON mv_medicos_consultas (id_emp, nom_sede, nom_dept, especialidad, semana);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_enfermedades_por_sede AS
+SELECT * FROM vista_enfermedades_por_sede;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_enfermedades_por_sede
+    ON mv_enfermedades_por_sede (id_sede, id_enfermedad, mes);
+
+-- Fecha del último refresco de cada resumen ("datos al ..." en los reportes)
+CREATE TABLE IF NOT EXISTS refresco_analitica (
+    vista VARCHAR(100) PRIMARY KEY,
+    fecha_refresco TIMESTAMP,
+    duracion_ms INT
+);
+
+INSERT INTO refresco_analitica (vista, fecha_refresco) VALUES
+    ('mv_consumo_medicamentos_dept', NOW()), ('mv_utilizacion_recursos', NOW()),
+    ('mv_medicos_consultas', NOW()), ('mv_enfermedades_por_sede', NOW())
+ON CONFLICT (vista) DO NOTHING;
+
+CREATE OR REPLACE PROCEDURE refrescar_analitica()
+LANGUAGE plpgsql AS $$
+DECLARE
+    resumen RECORD;
+    inicio TIMESTAMP;
+BEGIN
+    FOR resumen IN SELECT vista FROM refresco_analitica ORDER BY vista LOOP
+        inicio := clock_timestamp();
+        EXECUTE format('REFRESH MATERIALIZED VIEW CONCURRENTLY %I', resumen.vista);
+        UPDATE refresco_analitica
+        SET fecha_refresco = inicio,
+            duracion_ms = EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000
+        WHERE vista = resumen.vista;
+        -- Cada resumen queda visible apenas termina, sin esperar a los demás
+        COMMIT;
+    END LOOP;
+END;
+$$;
+
+-- Programación cada 15 minutos si el servidor tiene pg_cron; si no, usar
+-- "python manage.py refrescar_analitica" desde el cron del sistema.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('refrescar_analitica', '*/15 * * * *', 'CALL refrescar_analitica()');
+    END IF;
+END $$;
+
+GRANT SELECT ON mv_consumo_medicamentos_dept, mv_utilizacion_recursos, mv_medicos_consultas,
+    mv_enfermedades_por_sede, refresco_analitica
+    TO administrador, medico, enfermero, administrativo, auditor;
+
+-- 24. COLA DE REPORTES
+-- generar_reporte solo encola: cashier/cola_reportes.py toma las filas PENDIENTE
+-- (FOR UPDATE SKIP LOCKED), genera el archivo fuera del request y registra aquí
+-- el estado y la duración. clave_dedup agrupa solicitudes idénticas
+-- del mismo empleado y sede.
+ALTER TABLE Reportes_Generados
+    ADD COLUMN IF NOT EXISTS estado VARCHAR(20) NOT NULL DEFAULT 'COMPLETADO',
+    ADD COLUMN IF NOT EXISTS clave_dedup VARCHAR(64),
+    ADD COLUMN IF NOT EXISTS fecha_inicio TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS fecha_fin TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS duracion_ms INT,
+    ADD COLUMN IF NOT EXISTS ruta_archivo VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS mensaje_error VARCHAR(500);
+
+CREATE INDEX IF NOT EXISTS idx_reportes_pendientes ON Reportes_Generados (fecha_generacion)
+    WHERE estado = 'PENDIENTE';
+CREATE INDEX IF NOT EXISTS idx_reportes_clave ON Reportes_Generados (clave_dedup, fecha_generacion);
+
+GRANT SELECT, UPDATE ON Reportes_Generados TO administrador, medico, administrativo;
+
+-- 25. ÍNDICES PARA PAGINACIÓN POR CLAVE
+-- Las listas continúan desde la última fila mostrada (cashier/paginacion.py):
+-- WHERE (fecha, id) < (%s, %s) ORDER BY fecha DESC, id DESC LIMIT n.
+-- Con estos índices cada página lee solo sus filas, sin importar cuántas van antes.
+CREATE INDEX IF NOT EXISTS idx_auditoria_fecha_id ON Auditoria_Accesos (fecha_evento, id_evento);
+CREATE INDEX IF NOT EXISTS idx_auditoria_tabla_fecha_id ON Auditoria_Accesos (tabla_afectada, fecha_evento, id_evento);
+CREATE INDEX IF NOT EXISTS idx_prescripciones_fecha_id ON Prescripciones (fecha_emision, id_presc);
+CREATE INDEX IF NOT EXISTS idx_historias_fecha_id ON Historias_Clinicas (fecha_registro, cod_hist);
+CREATE INDEX IF NOT EXISTS idx_personas_apellido_nombre ON Personas (apellido_persona, nom_persona);
+
+-- 26. REPLICACIÓN POR CAMBIOS (Personas, Pacientes, Historias_Clinicas)
+-- Registro de cambios de las tablas replicadas en ambos sentidos
+-- (Personas, Pacientes, Historias_Clinicas). Cada cambio local queda aquí con
+-- el txid de su transacción; replicar_cambios() en el coordinador lee solo lo
+-- nuevo desde su marca y aplica con aplicar_cambios().
+CREATE TABLE IF NOT EXISTS cambios_replicacion (
+    id_cambio BIGSERIAL PRIMARY KEY,
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    tabla VARCHAR(50) NOT NULL,
+    clave BIGINT NOT NULL,
+    operacion CHAR(1) NOT NULL,          -- I / U / D
+    fila JSONB,                          -- fila nueva (NULL en D)
+    fecha_cambio TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+    nodo_origen SMALLINT NOT NULL        -- sede donde se hizo el cambio
+);
+CREATE INDEX IF NOT EXISTS idx_cambios_txid ON cambios_replicacion (txid, id_cambio);
+CREATE INDEX IF NOT EXISTS idx_cambios_fila ON cambios_replicacion (tabla, clave, fecha_cambio);
+
+-- TG_ARGV[0]: columna clave, TG_ARGV[1]: sede de este nodo.
+-- Los cambios que llegan por replicación no se vuelven a registrar.
+CREATE OR REPLACE FUNCTION registrar_cambio()
+RETURNS TRIGGER LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+BEGIN
+    IF current_setting('his_replicacion.aplicando', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, nodo_origen)
+        VALUES (TG_TABLE_NAME, (to_jsonb(OLD) ->> TG_ARGV[0])::BIGINT, 'D', NULL, TG_ARGV[1]::SMALLINT);
+    ELSE
+        INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, nodo_origen)
+        VALUES (TG_TABLE_NAME, (to_jsonb(NEW) ->> TG_ARGV[0])::BIGINT, left(TG_OP, 1), to_jsonb(NEW),
+                TG_ARGV[1]::SMALLINT);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER trg_cambios_personas AFTER INSERT OR UPDATE OR DELETE ON Personas
+    FOR EACH ROW EXECUTE FUNCTION registrar_cambio('id_persona', '1');
+CREATE OR REPLACE TRIGGER trg_cambios_pacientes AFTER INSERT OR UPDATE OR DELETE ON Pacientes
+    FOR EACH ROW EXECUTE FUNCTION registrar_cambio('cod_pac', '1');
+CREATE OR REPLACE TRIGGER trg_cambios_historias AFTER INSERT OR UPDATE OR DELETE ON Historias_Clinicas
+    FOR EACH ROW EXECUTE FUNCTION registrar_cambio('cod_hist', '1');
+
+-- Aplica un lote de cambios (jsonb_agg de filas de cambios_replicacion).
+-- Conflictos: gana la modificación más reciente; en empate gana la sede de
+-- menor número (el nodo central es la 1). Con registrar = TRUE los cambios
+-- aplicados se agregan al registro local para reenviarlos a las demás sedes.
+CREATE OR REPLACE FUNCTION aplicar_cambios(cambios JSONB, registrar BOOLEAN DEFAULT FALSE)
+RETURNS JSONB LANGUAGE plpgsql AS $$
+DECLARE
+    c RECORD;
+    vigente RECORD;
+    columna_clave TEXT;
+    asignaciones TEXT;
+    aplicados INT := 0;
+    descartados INT := 0;
+    errores INT := 0;
+BEGIN
+    PERFORM set_config('his_replicacion.aplicando', 'on', true);
+    FOR c IN
+        SELECT * FROM jsonb_to_recordset(cambios)
+            AS x(tabla TEXT, clave BIGINT, operacion CHAR(1), fila JSONB,
+                 fecha_cambio TIMESTAMPTZ, nodo_origen SMALLINT)
+        ORDER BY fecha_cambio, nodo_origen
+    LOOP
+        SELECT r.fecha_cambio, r.nodo_origen INTO vigente
+        FROM cambios_replicacion r
+        WHERE r.tabla = c.tabla AND r.clave = c.clave
+        ORDER BY r.fecha_cambio DESC, r.nodo_origen
+        LIMIT 1;
+        IF FOUND AND (vigente.fecha_cambio > c.fecha_cambio
+                      OR (vigente.fecha_cambio = c.fecha_cambio AND vigente.nodo_origen <= c.nodo_origen)) THEN
+            descartados := descartados + 1;
+            CONTINUE;
+        END IF;
+
+        columna_clave := CASE c.tabla
+            WHEN 'personas' THEN 'id_persona'
+            WHEN 'pacientes' THEN 'cod_pac'
+            WHEN 'historias_clinicas' THEN 'cod_hist'
+        END;
+        BEGIN
+            IF c.operacion = 'D' THEN
+                EXECUTE format('DELETE FROM %I WHERE %I = $1', c.tabla, columna_clave) USING c.clave;
+            ELSE
+                SELECT string_agg(format('%1$I = EXCLUDED.%1$I', attname), ', ')
+                INTO asignaciones
+                FROM pg_attribute
+                WHERE attrelid = c.tabla::regclass AND attnum > 0 AND NOT attisdropped
+                  AND attname <> columna_clave;
+                EXECUTE format(
+                    'INSERT INTO %1$I SELECT * FROM jsonb_populate_record(NULL::%1$I, $1)
+                     ON CONFLICT (%2$I) DO UPDATE SET %3$s', c.tabla, columna_clave, asignaciones)
+                USING c.fila;
+            END IF;
+            IF registrar THEN
+                INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, fecha_cambio, nodo_origen)
+                VALUES (c.tabla, c.clave, c.operacion, c.fila, c.fecha_cambio, c.nodo_origen);
+            END IF;
+            aplicados := aplicados + 1;
+        EXCEPTION WHEN OTHERS THEN
+            errores := errores + 1;
+            RAISE WARNING 'Cambio % % (%) no aplicado: %', c.tabla, c.clave, c.operacion, SQLERRM;
+        END;
+    END LOOP;
+    PERFORM set_config('his_replicacion.aplicando', 'off', true);
+    RETURN jsonb_build_object('aplicados', aplicados, 'descartados', descartados, 'errores', errores);
+END;
+$$;
+
+-- Marca por nodo y sentido: txid desde el que hay que volver a leer. Se guarda
+-- el xmin del snapshot y no el último id_cambio, porque una transacción lenta
+-- puede confirmar un id_cambio menor después de que se leyó uno mayor.
+CREATE TABLE IF NOT EXISTS replicacion_marcas (
+    nodo VARCHAR(20) NOT NULL,
+    sentido VARCHAR(10) NOT NULL,        -- 'entrada' (nodo -> coordinador) / 'salida'
+    txid_desde BIGINT NOT NULL DEFAULT 0,
+    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (nodo, sentido)
+);
+
+-- Entrada: trae de cada nodo sus cambios nuevos y los aplica aquí (quedan en el
+-- registro del coordinador con su sede de origen). Salida: envía a cada nodo
+-- los cambios del coordinador que no vinieron de ese mismo nodo.
+-- El costo depende de cuántas filas cambiaron, no del tamaño de las tablas.
+-- Volver a leer un cambio es inofensivo: aplicar_cambios() lo descarta o lo repite igual.
+CREATE OR REPLACE PROCEDURE replicar_cambios(lote INT DEFAULT 2000, retencion INTERVAL DEFAULT '7 days')
+LANGUAGE plpgsql AS $$
+DECLARE
+    sede RECORD;
+    sentido_actual TEXT;
+    conexion TEXT;
+    inicio TIMESTAMP;
+    hasta BIGINT;
+    ultimo_txid BIGINT;
+    ultimo_id BIGINT;
+    payload JSONB;
+    resultado JSONB;
+    leidos BIGINT;
+    aplicados BIGINT;
+    errores BIGINT;
+BEGIN
+    FOREACH sentido_actual IN ARRAY ARRAY['entrada', 'salida'] LOOP
+        FOR sede IN SELECT * FROM (VALUES ('azure', 2), ('aws', 3)) AS x(nombre, id_sede) LOOP
+            inicio := clock_timestamp();
+            leidos := 0; aplicados := 0; errores := 0;
+
+            -- Todo lo de un nodo va en su propio bloque: si el nodo no responde
+            -- (o falla a mitad) se deshace solo lo suyo, su marca no avanza y
+            -- los demás nodos se replican igual
+            BEGIN
+                conexion := CASE sede.id_sede WHEN 2 THEN get_azure_conn() ELSE get_aws_conn() END;
+
+                INSERT INTO replicacion_marcas (nodo, sentido) VALUES (sede.nombre, sentido_actual)
+                ON CONFLICT DO NOTHING;
+                SELECT txid_desde INTO ultimo_txid FROM replicacion_marcas
+                WHERE nodo = sede.nombre AND sentido = sentido_actual;
+                ultimo_id := 0;
+
+                -- Lo anterior a este xmin ya terminó en el origen: será la próxima marca
+                IF sentido_actual = 'entrada' THEN
+                    SELECT x INTO hasta FROM dblink(conexion,
+                        'SELECT txid_snapshot_xmin(txid_current_snapshot())') AS t(x BIGINT);
+                ELSE
+                    hasta := txid_snapshot_xmin(txid_current_snapshot());
+                END IF;
+
+                LOOP
+                    IF sentido_actual = 'entrada' THEN
+                        SELECT jsonb_agg(to_jsonb(t) ORDER BY t.txid, t.id_cambio) INTO payload
+                        FROM dblink(conexion, format(
+                            'SELECT id_cambio, txid, tabla, clave, operacion, fila, fecha_cambio, nodo_origen
+                             FROM cambios_replicacion WHERE (txid, id_cambio) > (%s, %s)
+                             ORDER BY txid, id_cambio LIMIT %s', ultimo_txid, ultimo_id, lote))
+                        AS t(id_cambio BIGINT, txid BIGINT, tabla TEXT, clave BIGINT, operacion CHAR(1),
+                             fila JSONB, fecha_cambio TIMESTAMPTZ, nodo_origen SMALLINT);
+                    ELSE
+                        SELECT jsonb_agg(to_jsonb(t) ORDER BY t.txid, t.id_cambio) INTO payload
+                        FROM (
+                            SELECT id_cambio, txid, tabla, clave, operacion, fila, fecha_cambio, nodo_origen
+                            FROM cambios_replicacion
+                            WHERE (txid, id_cambio) > (ultimo_txid, ultimo_id) AND nodo_origen <> sede.id_sede
+                            ORDER BY txid, id_cambio LIMIT lote
+                        ) t;
+                    END IF;
+                    EXIT WHEN payload IS NULL;
+
+                    IF sentido_actual = 'entrada' THEN
+                        resultado := aplicar_cambios(payload, TRUE);
+                    ELSE
+                        SELECT r INTO resultado FROM dblink(conexion,
+                            format('SELECT aplicar_cambios(%L::jsonb)', payload)) AS t(r JSONB);
+                    END IF;
+
+                    leidos := leidos + jsonb_array_length(payload);
+                    aplicados := aplicados + (resultado ->> 'aplicados')::INT;
+                    errores := errores + (resultado ->> 'errores')::INT;
+                    ultimo_txid := (payload -> -1 ->> 'txid')::BIGINT;
+                    ultimo_id := (payload -> -1 ->> 'id_cambio')::BIGINT;
+                    EXIT WHEN jsonb_array_length(payload) < lote;
+                END LOOP;
+
+                UPDATE replicacion_marcas SET txid_desde = hasta, fecha = NOW()
+                WHERE nodo = sede.nombre AND sentido = sentido_actual;
+
+                -- El nodo ya no necesita guardar lo que el coordinador leyó hace más de `retencion`
+                IF sentido_actual = 'entrada' THEN
+                    PERFORM dblink_exec(conexion, format(
+                        'DELETE FROM cambios_replicacion WHERE txid < %s AND fecha_cambio < NOW() - %L::interval',
+                        hasta, retencion));
+                END IF;
+
+                INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+                VALUES (CASE WHEN errores = 0 THEN 'OK' ELSE format('OK (%s cambios con error)', errores) END,
+                        'cambios (' || sentido_actual || ')', sede.nombre, leidos, aplicados,
+                        EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+            EXCEPTION WHEN OTHERS THEN
+                INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+                VALUES ('ERROR: ' || SQLERRM, 'cambios (' || sentido_actual || ')', sede.nombre, leidos, aplicados,
+                        EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+                RAISE WARNING 'Replicación de cambios (%) con % falló: %', sentido_actual, sede.nombre, SQLERRM;
+            END;
+            -- Cada nodo queda confirmado apenas termina (COMMIT no puede ir dentro
+            -- del bloque con EXCEPTION): un nodo caído no deshace a los demás
+            COMMIT;
+        END LOOP;
+    END LOOP;
+
+    DELETE FROM cambios_replicacion
+    WHERE fecha_cambio < NOW() - retencion
+      AND txid < (SELECT min(txid_desde) FROM replicacion_marcas WHERE sentido = 'salida');
+END;
+$$;
+
+-- Programación cada minuto si el servidor tiene pg_cron; si no, usar
+-- "python manage.py replicar_cambios" desde el cron del sistema.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('replicar_cambios', '* * * * *', 'CALL replicar_cambios()');
+    END IF;
+END $$;
+
+-- 27. OUTBOX DE CITAS PARA LAS SEDES REMOTAS
+-- Las citas de las sedes 2 y 3 se guardan aquí en la misma transacción del
+-- INSERT/UPDATE sobre la vista Citas (secciones 6 y 8). despachar_outbox_citas()
+-- las entrega después al nodo por lotes; si el nodo no responde se reintenta
+-- con espera creciente y la cita sigue en cola en lugar de fallar la reserva.
+CREATE TABLE IF NOT EXISTS outbox_citas (
+    id_mensaje BIGSERIAL PRIMARY KEY,
+    id_cita BIGINT NOT NULL,
+    id_sede INT NOT NULL,
+    operacion CHAR(1) NOT NULL,                         -- I / U
+    fila JSONB NOT NULL,                                -- cita completa como debe quedar en el nodo
+    estado VARCHAR(20) NOT NULL DEFAULT 'PENDIENTE',    -- PENDIENTE / ENTREGADO / FALLIDO
+    intentos INT NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    ultimo_error VARCHAR(500),
+    fecha_creacion TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    fecha_entrega TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_citas_pendientes ON outbox_citas (id_sede, id_mensaje)
+    WHERE estado = 'PENDIENTE';
+CREATE UNIQUE INDEX IF NOT EXISTS ux_outbox_citas_cita_pendiente ON outbox_citas (id_cita)
+    WHERE estado = 'PENDIENTE';
+
+-- Una cita tiene a lo sumo un mensaje pendiente: si aún no se entregó, se
+-- reemplaza su fila y el nodo recibe solo el estado final. Si el despachador
+-- la está enviando, el UPDATE espera su bloqueo y luego encola un mensaje nuevo.
+CREATE OR REPLACE FUNCTION encolar_cita(cita BIGINT, sede INT, op CHAR(1), datos JSONB)
+RETURNS VOID LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE outbox_citas SET fila = datos, fecha_creacion = NOW()
+    WHERE id_cita = cita AND estado = 'PENDIENTE';
+    IF NOT FOUND THEN
+        INSERT INTO outbox_citas (id_cita, id_sede, operacion, fila)
+        VALUES (cita, sede, op, datos);
+    END IF;
+END;
+$$;
+
+-- Entrega el siguiente lote de una sede en una sola ida y vuelta y retorna
+-- cuántos mensajes entregó. Los mensajes van en orden de id_mensaje y un solo
+-- despachador por sede los toma a la vez (advisory lock).
+-- Después de un fallo se reintenta solo el mensaje de cabeza, así un error de
+-- datos queda aislado en su mensaje. Los errores de conexión (SQLSTATE 08xxx)
+-- se reintentan siempre; los demás pasan a FALLIDO a los max_intentos.
+CREATE OR REPLACE FUNCTION despachar_lote_citas(sede INT, lote INT DEFAULT 500, max_intentos INT DEFAULT 10)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+    cabeza RECORD;
+    mensajes BIGINT[];
+    filas_citas JSONB;
+    filas_pacientes JSONB;
+    filas_personas JSONB;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('outbox_citas'), sede) THEN
+        RETURN 0;
+    END IF;
+
+    SELECT id_mensaje, intentos, proximo_intento INTO cabeza
+    FROM outbox_citas
+    WHERE estado = 'PENDIENTE' AND id_sede = sede
+    ORDER BY id_mensaje LIMIT 1;
+    IF NOT FOUND OR cabeza.proximo_intento > NOW() THEN
+        RETURN 0;
+    END IF;
+    IF cabeza.intentos > 0 THEN
+        lote := 1;
+    END IF;
+
+    SELECT array_agg(id_mensaje ORDER BY id_mensaje), jsonb_agg(fila ORDER BY id_mensaje)
+    INTO mensajes, filas_citas
+    FROM (
+        SELECT id_mensaje, fila FROM outbox_citas
+        WHERE estado = 'PENDIENTE' AND id_sede = sede
+        ORDER BY id_mensaje LIMIT lote
+        FOR UPDATE
+    ) m;
+
+    -- Pacientes y personas de esas citas, por si el nodo aún no los tiene (FK de citas)
+    SELECT jsonb_agg(to_jsonb(pa)) INTO filas_pacientes
+    FROM Pacientes pa
+    WHERE pa.cod_pac IN (SELECT (c ->> 'cod_pac')::INT FROM jsonb_array_elements(filas_citas) c);
+    SELECT jsonb_agg(to_jsonb(pe)) INTO filas_personas
+    FROM Personas pe
+    WHERE pe.id_persona IN (
+        SELECT (p ->> 'id_persona')::INT FROM jsonb_array_elements(COALESCE(filas_pacientes, '[]')) p
+    );
+
+    BEGIN
+        -- Varias sentencias en un dblink_exec = una transacción en el nodo.
+        -- his_replicacion.aplicando evita que los triggers de la sección 26 las
+        -- registren como cambios propios del nodo.
+        PERFORM dblink_exec(CASE sede WHEN 2 THEN get_azure_conn() ELSE get_aws_conn() END, format($remote$
+            SELECT set_config('his_replicacion.aplicando', 'on', true);
+            INSERT INTO Personas SELECT * FROM jsonb_populate_recordset(NULL::Personas, %L)
+                ON CONFLICT (id_persona) DO NOTHING;
+            INSERT INTO Pacientes SELECT * FROM jsonb_populate_recordset(NULL::Pacientes, %L)
+                ON CONFLICT (cod_pac) DO NOTHING;
+            INSERT INTO citas (id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora,
+                               fecha_hora_solicitada, tipo_servicio, estado, motivo)
+            SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora,
+                   fecha_hora_solicitada, tipo_servicio, estado, motivo
+            FROM jsonb_populate_recordset(NULL::citas, %L)
+            ON CONFLICT (id_cita) DO UPDATE SET
+                id_dept = EXCLUDED.id_dept,
+                id_emp = EXCLUDED.id_emp,
+                cod_pac = EXCLUDED.cod_pac,
+                fecha_hora = EXCLUDED.fecha_hora,
+                fecha_hora_solicitada = EXCLUDED.fecha_hora_solicitada,
+                tipo_servicio = EXCLUDED.tipo_servicio,
+                estado = EXCLUDED.estado,
+                motivo = EXCLUDED.motivo
+        $remote$, COALESCE(filas_personas, '[]'), COALESCE(filas_pacientes, '[]'), filas_citas));
+    EXCEPTION WHEN OTHERS THEN
+        UPDATE outbox_citas SET
+            intentos = intentos + 1,
+            proximo_intento = NOW() + LEAST(make_interval(secs => 5 * power(2, LEAST(cabeza.intentos, 10))),
+                                            INTERVAL '10 minutes'),
+            ultimo_error = left(SQLERRM, 500),
+            estado = CASE WHEN SQLSTATE NOT LIKE '08%' AND cabeza.intentos + 1 >= max_intentos
+                          THEN 'FALLIDO' ELSE estado END
+        WHERE id_mensaje = cabeza.id_mensaje;
+        RAISE WARNING 'Outbox de citas hacia la sede % falló (intento %): %', sede, cabeza.intentos + 1, SQLERRM;
+        RETURN 0;
+    END;
+
+    -- Si esta transacción no llega a confirmar, el lote se reenvía: el nodo lo aplica igual
+    UPDATE outbox_citas SET estado = 'ENTREGADO', fecha_entrega = NOW(), intentos = intentos + 1,
+        ultimo_error = NULL
+    WHERE id_mensaje = ANY(mensajes);
+    RETURN array_length(mensajes, 1);
+END;
+$$;
+
+CREATE OR REPLACE PROCEDURE despachar_outbox_citas(lote INT DEFAULT 500)
+LANGUAGE plpgsql AS $$
+DECLARE
+    sede INT;
+BEGIN
+    FOREACH sede IN ARRAY ARRAY[2, 3] LOOP
+        LOOP
+            EXIT WHEN despachar_lote_citas(sede, lote) = 0;
+            -- Cada lote queda confirmado apenas llega al nodo
+            COMMIT;
+        END LOOP;
+        COMMIT;
+    END LOOP;
+
+    DELETE FROM outbox_citas WHERE estado = 'ENTREGADO' AND fecha_entrega < NOW() - INTERVAL '7 days';
+END;
+$$;
+
+-- Las citas que el nodo todavía no recibió se siguen viendo en Citas (y se
+-- pueden editar o cancelar: el UPDATE reemplaza el mensaje pendiente). Una
+-- cita con un mensaje pendiente se toma del outbox y no del nodo.
+CREATE OR REPLACE VIEW Citas AS
+-- Datos locales (sede 1)
+SELECT * FROM citas_local
+UNION ALL
+-- Datos de Azure (sede 2)
+SELECT t.* FROM dblink(get_azure_conn(), 
+    'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+     fecha_hora_solicitada, tipo_servicio, estado, motivo 
+     FROM citas')
+    AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+        fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+        tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+WHERE NOT EXISTS (SELECT 1 FROM outbox_citas o
+                  WHERE o.estado = 'PENDIENTE' AND o.id_cita = t.id_cita)
+UNION ALL
+-- Datos de AWS (sede 3)
+SELECT t.* FROM dblink(get_aws_conn(), 
+    'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+     fecha_hora_solicitada, tipo_servicio, estado, motivo 
+     FROM citas')
+    AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+        fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+        tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+WHERE NOT EXISTS (SELECT 1 FROM outbox_citas o
+                  WHERE o.estado = 'PENDIENTE' AND o.id_cita = t.id_cita)
+UNION ALL
+-- Citas de las sedes remotas aún en el outbox: nuevas ('I') o modificadas
+-- ('U', p. ej. una cancelación), en lugar de la fila que todavía tiene el nodo
+SELECT (jsonb_populate_record(NULL::citas_local, fila)).*
+FROM outbox_citas
+WHERE estado = 'PENDIENTE';
+
+GRANT SELECT, INSERT, UPDATE ON outbox_citas TO administrador, medico, administrativo;
+GRANT USAGE, SELECT ON SEQUENCE outbox_citas_id_mensaje_seq TO administrador, medico, administrativo;
+
+-- Respaldo cada minuto con pg_cron (la aplicación además despacha apenas
+-- encola, ver cashier/outbox.py); sin pg_cron: "python manage.py despachar_citas".
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('despachar_outbox_citas', '* * * * *', 'CALL despachar_outbox_citas()');
+    END IF;
+END $$;
+
+-- 28. ÍNDICES PARA EL INICIO DE SESIÓN
+-- cashier/autenticacion.py busca al empleado por email en el nodo de su sede:
+-- Personas.email_persona ya tiene índice único y este cubre el JOIN con Empleados
+-- (en la sede 1 a través de nodo_local.empleados).
+CREATE INDEX IF NOT EXISTS idx_empleados_local_persona ON empleados_local (id_persona);
+
+-- 29. PARTICIONAMIENTO MENSUAL (citas_local, Prescripciones, Auditoria_Accesos)
+-- Las tres tablas se consultan siempre por rango de fecha: particionadas por mes,
+-- un reporte del último mes o trimestre lee solo esas particiones y purgar
+-- auditoría vieja es un DETACH (metadatos) en lugar de un DELETE masivo.
+-- La PK de una tabla particionada tiene que incluir la fecha, así que el ID
+-- único se garantiza con una tabla de llaves por tabla (citas_local_llaves, ...)
+-- que mantiene un trigger; las llaves foráneas hacia la tabla apuntan a ella.
+-- No se subdivide por id_sede: en el coordinador citas_local solo tiene la sede 1
+-- (las citas de Azure/AWS viven en su nodo, que ya es la división por sede) y
+-- las otras dos tablas no llevan sede.
+CREATE SCHEMA IF NOT EXISTS archivo;
+GRANT USAGE ON SCHEMA archivo TO administrador, auditor;
+
+CREATE TABLE IF NOT EXISTS particiones_config (
+    tabla VARCHAR(63) PRIMARY KEY,
+    columna VARCHAR(63) NOT NULL,
+    meses_adelante INT NOT NULL DEFAULT 3,              -- particiones futuras a mantener creadas
+    meses_retencion INT,                                -- NULL = no se archiva nada
+    accion_vencidas VARCHAR(10) NOT NULL DEFAULT 'ARCHIVAR' -- ARCHIVAR (esquema archivo) / ELIMINAR
+);
+
+INSERT INTO particiones_config (tabla, columna, meses_adelante, meses_retencion, accion_vencidas) VALUES
+    ('citas_local', 'fecha_hora', 3, NULL, 'ARCHIVAR'),
+    ('prescripciones', 'fecha_emision', 3, NULL, 'ARCHIVAR'),
+    ('auditoria_accesos', 'fecha_evento', 3, 24, 'ARCHIVAR')
+ON CONFLICT (tabla) DO NOTHING;
+
+-- Particiones que salieron de su tabla (consultables en el esquema archivo)
+CREATE TABLE IF NOT EXISTS particiones_archivadas (
+    particion VARCHAR(63) PRIMARY KEY,
+    tabla VARCHAR(63) NOT NULL,
+    esquema VARCHAR(63),                                -- NULL si se eliminó
+    desde DATE NOT NULL,
+    hasta DATE NOT NULL,
+    filas BIGINT NOT NULL,
+    fecha_archivo TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Crea la partición del mes (tabla_pAAAAMM). Las filas de ese mes que hubieran
+-- caído en la partición por defecto pasan a la nueva antes de adjuntarla.
+CREATE OR REPLACE FUNCTION crear_particion_mes(nombre_tabla TEXT, mes DATE)
+RETURNS BOOLEAN LANGUAGE plpgsql AS $$
+DECLARE
+    columna_fecha TEXT;
+    inicio DATE := date_trunc('month', mes)::DATE;
+    fin DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+    particion TEXT := format('%s_p%s', nombre_tabla, to_char(mes, 'YYYYMM'));
+BEGIN
+    IF to_regclass(particion) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', particion, nombre_tabla);
+    -- Las filas no dejan la tabla: sus llaves se quedan en la tabla de llaves
+    PERFORM set_config('his_particiones.moviendo', 'on', true);
+    EXECUTE format(
+        'WITH movidas AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM movidas',
+        nombre_tabla || '_default', columna_fecha, inicio, columna_fecha, fin, particion
+    );
+    PERFORM set_config('his_particiones.moviendo', 'off', true);
+    -- Con el CHECK el ATTACH no vuelve a recorrer la partición para validarla
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (%I >= %L AND %I < %L)',
+                   particion, particion || '_rango', columna_fecha, inicio, columna_fecha, fin);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   nombre_tabla, particion, inicio, fin);
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', particion, particion || '_rango');
+    RETURN TRUE;
+END;
+$$;
+
+-- Separa las particiones anteriores a la retención: pasan al esquema archivo
+-- (o se eliminan) y quedan registradas en particiones_archivadas
+CREATE OR REPLACE FUNCTION archivar_particiones(nombre_tabla TEXT)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+    cfg particiones_config%ROWTYPE;
+    limite DATE;
+    particion RECORD;
+    mes DATE;
+    filas BIGINT;
+    archivadas INT := 0;
+BEGIN
+    SELECT * INTO STRICT cfg FROM particiones_config c WHERE c.tabla = nombre_tabla;
+    IF cfg.meses_retencion IS NULL THEN
+        RETURN 0;
+    END IF;
+    limite := (date_trunc('month', current_date) - make_interval(months => cfg.meses_retencion))::DATE;
+
+    FOR particion IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = nombre_tabla::regclass AND c.relname ~ '_p[0-9]{6}$'
+        ORDER BY c.relname
+    LOOP
+        mes := to_date(right(particion.relname, 6), 'YYYYMM');
+        CONTINUE WHEN mes >= limite;
+        EXECUTE format('SELECT COUNT(*) FROM %I', particion.relname) INTO filas;
+        EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', nombre_tabla, particion.relname);
+        IF cfg.accion_vencidas = 'ELIMINAR' THEN
+            EXECUTE format('DROP TABLE %I', particion.relname);
+        ELSIF to_regclass(format('archivo.%I', particion.relname)) IS NOT NULL THEN
+            -- El mes ya se había archivado (llegaron filas atrasadas): se suman
+            EXECUTE format('INSERT INTO archivo.%1$I SELECT * FROM %1$I', particion.relname);
+            EXECUTE format('DROP TABLE %I', particion.relname);
+        ELSE
+            EXECUTE format('ALTER TABLE %I SET SCHEMA archivo', particion.relname);
+            EXECUTE format('GRANT SELECT ON archivo.%I TO administrador, auditor', particion.relname);
+        END IF;
+        INSERT INTO particiones_archivadas (particion, tabla, esquema, desde, hasta, filas)
+        VALUES (particion.relname, nombre_tabla,
+                CASE WHEN cfg.accion_vencidas = 'ELIMINAR' THEN NULL ELSE 'archivo' END,
+                mes, (mes + INTERVAL '1 month')::DATE, filas)
+        ON CONFLICT (particion) DO UPDATE SET
+            filas = particiones_archivadas.filas + EXCLUDED.filas,
+            fecha_archivo = NOW();
+        archivadas := archivadas + 1;
+    END LOOP;
+    RETURN archivadas;
+END;
+$$;
+
+-- Mantiene la tabla de llaves de una tabla particionada (ver
+-- proteger_llave_particionada): un ID repetido falla aunque caiga en otra
+-- partición. Las llaves de particiones archivadas se quedan reservadas.
+-- TG_ARGV[0]: tabla de llaves, TG_ARGV[1]: columna llave, TG_ARGV[2]: tabla particionada
+-- (ambas calificadas con su esquema)
+CREATE OR REPLACE FUNCTION mantener_llave_particionada()
+RETURNS TRIGGER LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, pg_temp AS $$
+DECLARE
+    vieja JSONB;
+    nueva JSONB;
+    filas BIGINT;
+BEGIN
+    -- crear_particion_mes() mueve filas de la partición por defecto a una nueva
+    IF current_setting('his_particiones.moviendo', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        vieja := to_jsonb(OLD);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        nueva := to_jsonb(NEW);
+    END IF;
+    IF TG_OP = 'UPDATE' AND vieja -> TG_ARGV[1] = nueva -> TG_ARGV[1] THEN
+        RETURN NULL;
+    END IF;
+
+    IF vieja IS NOT NULL THEN
+        -- Un UPDATE de la fecha que cambia de partición llega como DELETE + INSERT:
+        -- si la llave sigue en la tabla se conserva
+        EXECUTE format(
+            'DELETE FROM %1$s g WHERE g.%2$I = (jsonb_populate_record(NULL::%1$s, $1)).%2$I
+               AND NOT EXISTS (SELECT 1 FROM %3$s t WHERE t.%2$I = g.%2$I)',
+            TG_ARGV[0], TG_ARGV[1], TG_ARGV[2]
+        ) USING vieja;
+    END IF;
+    IF nueva IS NOT NULL THEN
+        EXECUTE format('INSERT INTO %s SELECT * FROM jsonb_populate_record(NULL::%s, $1) ON CONFLICT DO NOTHING',
+                       TG_ARGV[0], TG_ARGV[0]) USING nueva;
+        GET DIAGNOSTICS filas = ROW_COUNT;
+        IF filas = 0 THEN
+            -- La llave ya estaba: solo vale si es la misma fila que cambió de partición
+            EXECUTE format('SELECT COUNT(*) FROM %1$s WHERE %2$I = (jsonb_populate_record(NULL::%3$s, $1)).%2$I',
+                           TG_ARGV[2], TG_ARGV[1], TG_ARGV[0]) INTO filas USING nueva;
+            IF filas > 1 THEN
+                RAISE unique_violation USING
+                    MESSAGE = format('%s = %s ya existe en %s', TG_ARGV[1], nueva ->> TG_ARGV[1], TG_ARGV[2]);
+            END IF;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Crea la tabla de llaves (<tabla>_llaves, con el ID como PK) y su trigger en
+-- una tabla ya particionada. Retorna su nombre; no hace nada si ya existe.
+CREATE OR REPLACE FUNCTION proteger_llave_particionada(nombre_tabla TEXT)
+RETURNS TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    tabla_oid OID := to_regclass(nombre_tabla);
+    tabla TEXT;
+    llaves TEXT;
+    columna_fecha TEXT;
+    columnas TEXT[];
+    tipo TEXT;
+BEGIN
+    IF tabla_oid IS NULL OR NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = tabla_oid) THEN
+        RETURN NULL;
+    END IF;
+    SELECT format('%I.%I', n.nspname, c.relname), format('%I.%I', n.nspname, c.relname || '_llaves')
+    INTO tabla, llaves
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = tabla_oid;
+    IF to_regclass(llaves) IS NOT NULL THEN
+        RETURN llaves;
+    END IF;
+    SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+    -- La llave es la PK sin la columna de fecha que se le agregó al particionar
+    SELECT array_agg(a.attname ORDER BY a.attnum), min(format_type(a.atttypid, a.atttypmod))
+    INTO columnas, tipo
+    FROM pg_constraint c
+    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+    WHERE c.conrelid = tabla_oid AND c.contype = 'p' AND a.attname <> columna_fecha;
+    IF columnas IS NULL THEN
+        RETURN NULL;
+    ELSIF array_length(columnas, 1) > 1 THEN
+        RAISE EXCEPTION 'La PK de % tiene más de una columna además de %: crear la tabla de llaves a mano',
+            nombre_tabla, columna_fecha;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %s (%I %s PRIMARY KEY)', llaves, columnas[1], tipo);
+    EXECUTE format('INSERT INTO %s SELECT %I FROM %s', llaves, columnas[1], tabla);
+    EXECUTE format(
+        'CREATE TRIGGER %I AFTER INSERT OR DELETE OR UPDATE OF %I ON %s
+         FOR EACH ROW EXECUTE FUNCTION mantener_llave_particionada(%L, %L, %L)',
+        'trg_' || left(nombre_tabla, 50) || '_llave', columnas[1], tabla, llaves, columnas[1], tabla
+    );
+    RETURN llaves;
+END;
+$$;
+
+-- Convierte una tabla normal en particionada por mes conservando datos,
+-- índices, llaves foráneas (las que llegan a ella pasan a su tabla de llaves),
+-- triggers, secuencias, permisos y las vistas que la leen (se recrean con la
+-- misma definición). Bloquea la tabla mientras copia:
+-- correr en una ventana de mantenimiento. No hace nada si ya está particionada.
+CREATE OR REPLACE FUNCTION convertir_a_particionada(nombre_tabla TEXT)
+RETURNS VOID LANGUAGE plpgsql AS $$
+DECLARE
+    tabla_oid OID := to_regclass(nombre_tabla);
+    anterior TEXT := nombre_tabla || '_sin_particionar';
+    columna_fecha TEXT;
+    columnas_pk TEXT;
+    nombre_pk TEXT;
+    llaves TEXT;
+    vistas TEXT[] := '{}';
+    definiciones TEXT[] := '{}';
+    indices TEXT[] := '{}';
+    foraneas TEXT[] := '{}';
+    entrantes TEXT[] := '{}';
+    disparadores TEXT[] := '{}';
+    fila RECORD;
+    sentencia TEXT;
+    desde DATE;
+    mes DATE;
+BEGIN
+    IF tabla_oid IS NULL OR EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = tabla_oid) THEN
+        RETURN;
+    END IF;
+    SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+    -- Lo que hay que recrear sobre la tabla nueva (capturado antes de renombrar)
+    FOR fila IN
+        SELECT DISTINCT v.oid, v.relkind, format('%I.%I', n.nspname, v.relname) AS nombre,
+               pg_get_viewdef(v.oid) AS definicion
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class v ON v.oid = r.ev_class
+        JOIN pg_namespace n ON n.oid = v.relnamespace
+        WHERE d.classid = 'pg_rewrite'::regclass
+          AND ((d.refclassid = 'pg_class'::regclass AND d.refobjid = tabla_oid)
+            OR (d.refclassid = 'pg_type'::regclass
+                AND d.refobjid = (SELECT reltype FROM pg_class WHERE oid = tabla_oid)))
+          AND v.oid <> tabla_oid
+    LOOP
+        IF fila.relkind <> 'v' THEN
+            RAISE EXCEPTION 'La vista materializada % lee % directamente: recrearla a mano', fila.nombre, nombre_tabla;
+        END IF;
+        vistas := vistas || fila.nombre;
+        definiciones := definiciones || fila.definicion;
+    END LOOP;
+
+    SELECT c.conname, string_agg(quote_ident(a.attname), ', ' ORDER BY k.orden)
+    INTO nombre_pk, columnas_pk
+    FROM pg_constraint c
+    CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, orden)
+    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+    WHERE c.conrelid = tabla_oid AND c.contype = 'p'
+    GROUP BY c.conname;
+
+    FOR fila IN
+        SELECT c.relname, pg_get_indexdef(i.indexrelid) AS definicion
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = tabla_oid AND NOT i.indisprimary
+    LOOP
+        indices := indices || fila.definicion;
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', fila.relname, left(fila.relname, 55) || '_sp');
+    END LOOP;
+    SELECT array_agg(format('ADD CONSTRAINT %I %s', conname, pg_get_constraintdef(oid)))
+    INTO foraneas FROM pg_constraint WHERE conrelid = tabla_oid AND contype = 'f' AND confrelid <> tabla_oid;
+    SELECT array_agg(pg_get_triggerdef(oid))
+    INTO disparadores FROM pg_trigger WHERE tgrelid = tabla_oid AND NOT tgisinternal;
+    -- Llaves foráneas de otras tablas (o de la misma) hacia esta: se quitan y al
+    -- final se recrean contra la tabla de llaves, que es la que tiene el ID único
+    FOR fila IN
+        SELECT conrelid::regclass::text AS tabla, conname, pg_get_constraintdef(oid) AS definicion
+        FROM pg_constraint WHERE confrelid = tabla_oid AND contype = 'f'
+    LOOP
+        entrantes := entrantes || format('ALTER TABLE %s ADD CONSTRAINT %I %s', fila.tabla, fila.conname, fila.definicion);
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fila.tabla, fila.conname);
+    END LOOP;
+
+    -- Tabla particionada con el nombre original
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', nombre_tabla, anterior);
+    IF nombre_pk IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I', anterior, nombre_pk, left(nombre_pk, 55) || '_sp');
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMMENTS) PARTITION BY RANGE (%I)',
+                   nombre_tabla, anterior, columna_fecha);
+    IF columnas_pk IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (%s%s)', nombre_tabla, columnas_pk,
+                       CASE WHEN quote_ident(columna_fecha) = ANY(string_to_array(columnas_pk, ', '))
+                            THEN '' ELSE ', ' || quote_ident(columna_fecha) END);
+    END IF;
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', nombre_tabla || '_default', nombre_tabla);
+    FOREACH sentencia IN ARRAY indices LOOP
+        EXECUTE sentencia;
+    END LOOP;
+    FOREACH sentencia IN ARRAY coalesce(foraneas, '{}') LOOP
+        EXECUTE format('ALTER TABLE %I %s', nombre_tabla, sentencia);
+    END LOOP;
+    FOREACH sentencia IN ARRAY coalesce(disparadores, '{}') LOOP
+        EXECUTE sentencia;
+    END LOOP;
+
+    -- Las secuencias (SERIAL) pasan a la tabla nueva antes de borrar la anterior
+    FOR fila IN
+        SELECT a.attname, pg_get_serial_sequence(anterior, a.attname) AS secuencia
+        FROM pg_attribute a
+        WHERE a.attrelid = anterior::regclass AND a.attnum > 0 AND NOT a.attisdropped
+          AND pg_get_serial_sequence(anterior, a.attname) IS NOT NULL
+    LOOP
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.%I', fila.secuencia, nombre_tabla, fila.attname);
+    END LOOP;
+    FOR fila IN
+        SELECT p.privilege_type, p.grantee
+        FROM pg_class c CROSS JOIN LATERAL aclexplode(c.relacl) p
+        WHERE c.oid = anterior::regclass AND p.grantee <> c.relowner
+    LOOP
+        EXECUTE format('GRANT %s ON %I TO %s', fila.privilege_type, nombre_tabla,
+                       CASE WHEN fila.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(fila.grantee)) END);
+    END LOOP;
+
+    -- Un mes por partición desde el dato más antiguo hasta meses_adelante
+    EXECUTE format('SELECT date_trunc(''month'', MIN(%I))::DATE FROM %I', columna_fecha, anterior) INTO desde;
+    FOR mes IN
+        SELECT generate_series(
+            LEAST(coalesce(desde, current_date), date_trunc('month', current_date)::DATE),
+            date_trunc('month', current_date) + make_interval(months => c.meses_adelante),
+            INTERVAL '1 month')::DATE
+        FROM particiones_config c WHERE c.tabla = nombre_tabla
+    LOOP
+        PERFORM crear_particion_mes(nombre_tabla, mes);
+    END LOOP;
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', nombre_tabla, anterior);
+
+    llaves := proteger_llave_particionada(nombre_tabla);
+    FOREACH sentencia IN ARRAY entrantes LOOP
+        IF llaves IS NOT NULL THEN
+            sentencia := regexp_replace(sentencia, 'REFERENCES [^ (]+[(]', 'REFERENCES ' || llaves || '(');
+        END IF;
+        EXECUTE sentencia;
+    END LOOP;
+
+    FOR i IN 1 .. coalesce(array_length(vistas, 1), 0) LOOP
+        EXECUTE format('CREATE OR REPLACE VIEW %s AS %s', vistas[i], definiciones[i]);
+    END LOOP;
+    EXECUTE format('DROP TABLE %I', anterior);
+    EXECUTE format('ANALYZE %I', nombre_tabla);
+END;
+$$;
+
+-- Mantenimiento diario: particiones de los próximos meses (y de meses pasados
+-- que llegaron a la partición por defecto) y archivo de las vencidas
+CREATE OR REPLACE PROCEDURE mantener_particiones()
+LANGUAGE plpgsql AS $$
+DECLARE
+    cfg RECORD;
+    desde DATE;
+    mes DATE;
+BEGIN
+    FOR cfg IN SELECT * FROM particiones_config ORDER BY tabla LOOP
+        EXECUTE format('SELECT date_trunc(''month'', MIN(%I))::DATE FROM %I', cfg.columna, cfg.tabla || '_default')
+        INTO desde;
+        FOR mes IN
+            SELECT generate_series(
+                LEAST(coalesce(desde, current_date), date_trunc('month', current_date)::DATE),
+                date_trunc('month', current_date) + make_interval(months => cfg.meses_adelante),
+                INTERVAL '1 month')::DATE
+        LOOP
+            PERFORM crear_particion_mes(cfg.tabla, mes);
+        END LOOP;
+        PERFORM archivar_particiones(cfg.tabla);
+        COMMIT;
+    END LOOP;
+END;
+$$;
+
+SELECT convertir_a_particionada('citas_local');
+SELECT convertir_a_particionada('prescripciones');
+SELECT convertir_a_particionada('auditoria_accesos');
+
+-- Todos los días a las 03:15 con pg_cron; sin pg_cron: "python manage.py mantener_particiones"
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule('mantener_particiones', '15 3 * * *', 'CALL mantener_particiones()');
+    END IF;
+END $$;
+
+-- 30. ARCHIVO FRÍO DE AUDITORÍA
+-- Auditoria_Accesos conserva en la base 6 meses (meses_retencion). Los meses
+-- vencidos pasan al esquema archivo con mantener_particiones() y
+-- "python manage.py archivar_auditoria" (cron del sistema, 03:45) los escribe en
+-- archivos por mes (Parquet, o CSV con gzip) fuera de la base y los elimina.
+-- filtrar_auditoria lee la tabla, el esquema archivo y los archivos registrados
+-- aquí (ver cashier/archivo_auditoria.py).
+CREATE TABLE IF NOT EXISTS auditoria_archivos (
+    ruta TEXT PRIMARY KEY,                              -- relativa a AUDITORIA_ARCHIVO_DIR
+    particion VARCHAR(63) NOT NULL,
+    desde DATE NOT NULL,
+    hasta DATE NOT NULL,
+    filas BIGINT NOT NULL,
+    bytes BIGINT NOT NULL,
+    fecha_archivo TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+UPDATE particiones_config SET meses_retencion = 6, accion_vencidas = 'ARCHIVAR'
+WHERE tabla = 'auditoria_accesos';
+
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -15,6 +16,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero: mide todas las consultas del request (cashier/instrumentacion.py)
+    'cashier.instrumentacion.InstrumentacionSQLMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,17 +50,77 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 WSGI_APPLICATION = 'automatic_cashier.wsgi.application'
 
+# Conexiones persistentes al coordinador: cada request reutiliza la conexión
+# del hilo en vez de abrir y cerrar una nueva (CONN_MAX_AGE en segundos).
+# CONN_HEALTH_CHECKS verifica la conexión reutilizada al inicio de cada request.
+DB_CONN_MAX_AGE = int(os.environ.get('HIS_DB_CONN_MAX_AGE', '600'))
+
+# Modo pgbouncer (pool_mode = transaction): HIS_PGBOUNCER=1 conecta 'default'
+# al pgbouncer en lugar de PostgreSQL. Es seguro con ejecutar_query/ejecutar_update
+# porque cada sentencia corre en autocommit (una transacción por sentencia) y no
+# dejan estado de sesión. Los cursores del lado del servidor con nombre solo se
+# usan dentro de transaction.atomic(), que fija la conexión del servidor.
+USAR_PGBOUNCER = os.environ.get('HIS_PGBOUNCER', '0') == '1'
+
 DATABASES = {
     'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': 'Hospital',
+        'USER': 'postgres',
+        'PASSWORD': 'postgres',
+        'HOST': os.environ.get('HIS_PGBOUNCER_HOST', '127.0.0.1') if USAR_PGBOUNCER else '127.0.0.1',
+        'PORT': os.environ.get('HIS_PGBOUNCER_PORT', '6432') if USAR_PGBOUNCER else '5432',
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        # pgbouncer en modo transacción no mantiene cursores declarados fuera de una transacción
+        'DISABLE_SERVER_SIDE_CURSORS': USAR_PGBOUNCER,
+    },
+    # Nodos físicos por sede (lecturas locales sin pasar por las vistas dblink)
+    # Sede 1: mismo coordinador, pero resolviendo Citas/Empleados/Departamentos
+    # contra el esquema nodo_local (solo las tablas *_local). Siempre va directo
+    # a PostgreSQL: pgbouncer no acepta el parámetro de arranque search_path.
+    'sede_1': {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': 'Hospital',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
         'HOST': '127.0.0.1',
         'PORT': '5432',
-    }
+        'OPTIONS': {'options': '-c search_path=nodo_local,public'},
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Sede 2: Clínica Norte (Azure)
+    'sede_2': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': 'postgres',
+        'USER': 'directorHospital',
+        'PASSWORD': 'Postgr3s_DB',
+        'HOST': 'hospitaldb.postgres.database.azure.com',
+        'PORT': '5432',
+        'OPTIONS': {'sslmode': 'require', 'connect_timeout': 10},
+        # Conexiones remotas persistentes: el handshake TLS se paga una vez por hilo
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Sede 3: Unidad de Urgencias Sur (AWS)
+    'sede_3': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': 'postgres',
+        'USER': 'postgres',
+        'PASSWORD': 'Postgr3s_DB',
+        'HOST': 'hospital.cdg4cu8q8t0y.us-east-2.rds.amazonaws.com',
+        'PORT': '5432',
+        'OPTIONS': {'connect_timeout': 10},
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
 }
 
+# Enrutamiento de consultas por sede (ver cashier/distribucion.py)
+DATABASE_ROUTERS = ['cashier.distribucion.SedeRouter']
+SEDE_DB_ALIAS = {1: 'sede_1', 2: 'sede_2', 3: 'sede_3'}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -75,3 +138,87 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Usar sesiones basadas en cookies (no necesita tabla django_session)
 SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 SESSION_COOKIE_HTTPONLY = True
+
+# Consultas en paralelo a los nodos de sede: plazo por nodo (segundos) y tamaño del pool
+SEDE_TIMEOUT_NODO = 5
+SEDE_MAX_WORKERS = 8
+
+# Auditoría por lotes en segundo plano (ver cashier/auditoria.py)
+AUDITORIA_ASINCRONA = os.environ.get('HIS_AUDITORIA_ASINCRONA', '1') == '1'
+AUDITORIA_LOTE = 100
+AUDITORIA_INTERVALO = 2.0
+AUDITORIA_ARCHIVO_RESPALDO = BASE_DIR / 'auditoria_pendiente.jsonl'
+# Eventos que la base rechazó por sus datos (no se reintentan; revisar a mano)
+AUDITORIA_ARCHIVO_CUARENTENA = BASE_DIR / 'auditoria_cuarentena.jsonl'
+
+# Meses de auditoría fuera de la base (cashier/archivo_auditoria.py): un archivo
+# por mes; con varios servidores web debe ser un directorio compartido
+AUDITORIA_ARCHIVO_DIR = os.environ.get('HIS_AUDITORIA_ARCHIVO_DIR', str(BASE_DIR / 'archivo_auditoria'))
+
+# Segundos que se reutilizan los contadores del dashboard por sede (cashier/estadisticas.py).
+# La caché local es por proceso: es también lo que otro proceso tarda en ver un cambio
+DASHBOARD_CACHE_TTL = int(os.environ.get('HIS_DASHBOARD_CACHE_TTL', '30'))
+
+# Segundos entre revisiones de version_catalogos (cashier/catalogos.py). La
+# caché es por proceso: es el máximo que otro proceso sirve un catálogo viejo
+CATALOGOS_REVISION = int(os.environ.get('HIS_CATALOGOS_REVISION', '30'))
+# Segundos que se reutiliza un catálogo sin versión (medicamentos con stock)
+CATALOGOS_TTL = int(os.environ.get('HIS_CATALOGOS_TTL', '30'))
+
+# Cola de reportes en segundo plano (cashier/cola_reportes.py)
+REPORTES_DIR = BASE_DIR / 'reportes_generados'
+REPORTES_EN_PROCESO = os.environ.get('HIS_REPORTES_EN_PROCESO', '1') == '1'
+REPORTES_INTERVALO = 5.0
+REPORTES_VENTANA_DEDUP = 600
+REPORTES_TIEMPO_MAXIMO = 1800
+
+# Outbox de citas hacia las sedes remotas (cashier/outbox.py)
+OUTBOX_EN_PROCESO = os.environ.get('HIS_OUTBOX_EN_PROCESO', '1') == '1'
+OUTBOX_INTERVALO = 10.0
+OUTBOX_LOTE = 500
+
+# Inicio de sesión (cashier/autenticacion.py): costo bcrypt de los hashes
+# nuevos (los de otro costo se regeneran al iniciar sesión; medir con
+# "python manage.py calibrar_bcrypt") y límite de intentos fallidos por
+# email y por IP dentro de la ventana (segundos)
+AUTH_BCRYPT_COSTO = int(os.environ.get('HIS_AUTH_BCRYPT_COSTO', '10'))
+AUTH_MAX_FALLOS = 5
+AUTH_MAX_FALLOS_IP = 50
+AUTH_VENTANA_FALLOS = 300
+# Proxies inversos propios (separados por coma): solo detrás de ellos se usa
+# X-Forwarded-For para el límite de intentos por IP
+AUTH_PROXIES_CONFIABLES = tuple(
+    ip.strip() for ip in os.environ.get('HIS_AUTH_PROXIES_CONFIABLES', '').split(',') if ip.strip()
+)
+
+# Instrumentación de SQL por request (cashier/instrumentacion.py): cabecera
+# Server-Timing, aviso de N+1 y registro de consultas lentas con parámetros
+# redactados. /metricas/sql/ y el detalle de la consulta más lenta en
+# Server-Timing (fuera de DEBUG) solo para las IPs de SQL_METRICAS_IPS
+SQL_INSTRUMENTACION = os.environ.get('HIS_SQL_INSTRUMENTACION', '1') == '1'
+SQL_UMBRAL_LENTO_MS = float(os.environ.get('HIS_SQL_UMBRAL_LENTO_MS', '200'))
+SQL_UMBRAL_N_MAS_1 = 10
+SQL_METRICAS_IPS = ('127.0.0.1', '::1')
+SQL_LOG_ARCHIVO = BASE_DIR / 'sql_lento.log'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(message)s'},
+    },
+    'handlers': {
+        'sql_lento': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SQL_LOG_ARCHIVO,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'encoding': 'utf-8',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'his.sql': {'handlers': ['sql_lento'], 'level': 'WARNING', 'propagate': False},
+    },
+}
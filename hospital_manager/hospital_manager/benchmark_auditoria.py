@@ -0,0 +1,91 @@
+"""
+Prueba de rendimiento: auditoría síncrona vs. escritor por lotes
+Ejecutar: python benchmark_auditoria.py [--eventos 500] [--requests 100] [--url /pacientes/1/]
+
+Mide el tiempo que registrar_auditoria agrega a cada llamada y los requests por
+segundo de una vista que audita, primero con el INSERT síncrono (comportamiento
+anterior) y luego con el escritor en segundo plano.
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+
+# Configurar Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automatic_cashier.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+
+from cashier.auditoria import escritor
+from cashier.views import registrar_auditoria
+
+# Mismo usuario de prueba que test_db_simple.py
+EMAIL = 'carlos.rodriguez@hospital.com'
+PASSWORD = 'admin123'
+
+
+def medir_llamadas(asincrona, total):
+    """Retorna la latencia media (ms) de registrar_auditoria"""
+    settings.AUDITORIA_ASINCRONA = asincrona
+    inicio = time.perf_counter()
+    for i in range(total):
+        registrar_auditoria(None, 'BENCHMARK', 'Auditoria_Accesos', i, '127.0.0.1')
+    duracion = time.perf_counter() - inicio
+    escritor.vaciar()
+    return duracion * 1000 / total
+
+
+def medir_requests(asincrona, url, total):
+    """Retorna requests/segundo contra una vista que registra auditoría"""
+    settings.AUDITORIA_ASINCRONA = asincrona
+    client = Client(HTTP_HOST='localhost')
+    response = client.post('/login/', {'email': EMAIL, 'password': PASSWORD})
+    if response.status_code != 302:
+        print(f"❌ No se pudo iniciar sesión como {EMAIL}")
+        sys.exit(1)
+    client.get(url)  # Calentamiento
+    inicio = time.perf_counter()
+    for _ in range(total):
+        client.get(url)
+    duracion = time.perf_counter() - inicio
+    escritor.vaciar()
+    return total / duracion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--eventos', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--url', default='/pacientes/1/')
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print("PRUEBA DE RENDIMIENTO - AUDITORÍA")
+    print("=" * 60)
+
+    sync_ms = medir_llamadas(False, args.eventos)
+    async_ms = medir_llamadas(True, args.eventos)
+    print(f"  registrar_auditoria síncrona:   {sync_ms:8.3f} ms/evento")
+    print(f"  registrar_auditoria por lotes:  {async_ms:8.3f} ms/evento")
+    print("-" * 60)
+
+    sync_rps = medir_requests(False, args.url, args.requests)
+    async_rps = medir_requests(True, args.url, args.requests)
+    print(f"  {args.url} síncrona:   {sync_rps:8.1f} req/s")
+    print(f"  {args.url} por lotes:  {async_rps:8.1f} req/s")
+    print("-" * 60)
+    print(f"  Mejora: x{async_rps / sync_rps:.2f}")
+    print("=" * 60 + "\n")
+
+    # Limpiar los eventos de la prueba
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM Auditoria_Accesos WHERE accion = 'BENCHMARK'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Prueba de rendimiento: búsqueda de personas con ILIKE '%q%' vs. pg_trgm
+Ejecutar: python benchmark_busqueda.py [--personas 1000000] [--repeticiones 20]
+
+Crea el esquema temporal benchmark_busqueda con una copia de Personas (con los
+mismos índices) y --personas filas sintéticas, y mide la latencia de la búsqueda
+anterior (ILIKE con comodín inicial) contra cashier/busqueda.py. Al terminar
+elimina el esquema; no toca los datos reales.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+# Configurar Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automatic_cashier.settings')
+django.setup()
+
+from django.db import connection
+
+from cashier.busqueda import filtro_personas
+
+ESQUEMA = 'benchmark_busqueda'
+TERMINOS = ['garcia', 'rodríguez', 'MARIA', 'lopez', '1012', 'fernan']
+
+QUERY_ANTERIOR = """
+    SELECT p.id_persona FROM Personas p
+    WHERE p.num_doc LIKE %s OR p.nom_persona ILIKE %s OR p.apellido_persona ILIKE %s
+    ORDER BY p.apellido_persona, p.nom_persona LIMIT 10
+"""
+
+
+def preparar(cursor, total):
+    """Crea la copia de Personas con `total` filas sintéticas"""
+    print(f"  Generando {total:,} personas en {ESQUEMA}...")
+    cursor.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {ESQUEMA}")
+    cursor.execute(f"CREATE TABLE {ESQUEMA}.personas (LIKE public.Personas INCLUDING INDEXES)")
+    cursor.execute(f"""
+        INSERT INTO {ESQUEMA}.personas (id_persona, nom_persona, apellido_persona, tipo_doc,
+            num_doc, fecha_nac, email_persona)
+        SELECT g,
+               (ARRAY['María','José','Ana','Luis','Carlos','Sofía','Andrés','Lucía'])[1 + g %% 8],
+               (ARRAY['García','Rodríguez','López','Martínez','Gómez','Fernández','Pérez','Díaz'])[1 + (g / 8) %% 8]
+                   || ' ' || substr(md5(g::text), 1, 6),
+               'CC', (1000000000 + g)::text, DATE '1950-01-01' + (g %% 20000),
+               'persona' || g || '@benchmark.local'
+        FROM generate_series(1, %s) g
+    """, [total])
+    cursor.execute(f"ANALYZE {ESQUEMA}.personas")
+    cursor.execute(f"SET search_path = {ESQUEMA}, public")
+
+
+def medir(cursor, query, params_por_termino, repeticiones):
+    """Retorna (p50, p95) en milisegundos"""
+    tiempos = []
+    for _ in range(repeticiones):
+        for params in params_por_termino:
+            inicio = time.perf_counter()
+            cursor.execute(query, params)
+            cursor.fetchall()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--personas', type=int, default=1000000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print("PRUEBA DE RENDIMIENTO - BÚSQUEDA DE PERSONAS")
+    print("=" * 60)
+
+    with connection.cursor() as cursor:
+        try:
+            preparar(cursor, args.personas)
+
+            anteriores = [[f'%{t}%'] * 3 for t in TERMINOS]
+            p50, p95 = medir(cursor, QUERY_ANTERIOR, anteriores, args.repeticiones)
+            print(f"  ILIKE '%q%' (antes)      p50 {p50:8.2f} ms   p95 {p95:8.2f} ms")
+
+            nuevas = []
+            for termino in TERMINOS:
+                where, order, params_where, params_order = filtro_personas(termino)
+                nuevas.append(params_where + params_order)
+            query = f"SELECT p.id_persona FROM Personas p WHERE {where} ORDER BY {order} LIMIT 10"
+            p50, p95 = medir(cursor, query, nuevas, args.repeticiones)
+            print(f"  pg_trgm + unaccent       p50 {p50:8.2f} ms   p95 {p95:8.2f} ms")
+        finally:
+            cursor.execute("RESET search_path")
+            cursor.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+
+    print("=" * 60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Prueba de carga: conexiones persistentes vs. una conexión por request
+Ejecutar: python benchmark_conexiones.py [--requests 200] [--hilos 4] [--url /dashboard/]
+
+Mide requests por segundo contra las vistas reales (cliente de pruebas de Django,
+en proceso) primero con CONN_MAX_AGE = 0 (comportamiento anterior) y luego con
+la configuración actual de settings.py.
+
+El cliente de pruebas desconecta close_old_connections de las señales de
+request (las conexiones nunca se cerrarían y las dos fases medirían lo mismo),
+así que aquí se llama antes y después de cada request, igual que el servidor.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import django
+
+# Configurar Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automatic_cashier.settings')
+django.setup()
+
+from django.db import close_old_connections, connections
+from django.test import Client
+
+# Mismo usuario de prueba que test_db_simple.py
+EMAIL = 'carlos.rodriguez@hospital.com'
+PASSWORD = 'admin123'
+
+
+def request(client, metodo, url, datos=None):
+    """Un request con el ciclo de conexiones de un servidor real (request_started/finished)"""
+    close_old_connections()
+    try:
+        return getattr(client, metodo)(url, datos)
+    finally:
+        close_old_connections()
+
+
+def crear_cliente():
+    """Crea un cliente con sesión iniciada"""
+    client = Client(HTTP_HOST='localhost')
+    response = request(client, 'post', '/login/', {'email': EMAIL, 'password': PASSWORD})
+    if response.status_code != 302:
+        print(f"❌ No se pudo iniciar sesión como {EMAIL}")
+        sys.exit(1)
+    return client
+
+
+def ejecutar_fase(nombre, conn_max_age, url, total, hilos):
+    """
+    Lanza `total` requests repartidos en `hilos` y retorna requests/segundo.
+    conn_max_age: alias -> CONN_MAX_AGE (el dashboard también consulta los nodos de sede)
+    """
+    for alias, valor in conn_max_age.items():
+        connections.settings[alias]['CONN_MAX_AGE'] = valor
+    connections.close_all()
+
+    por_hilo = total // hilos
+    errores = []
+
+    def trabajador():
+        client = crear_cliente()
+        for _ in range(por_hilo):
+            response = request(client, 'get', url)
+            if response.status_code != 200:
+                errores.append(response.status_code)
+        connections.close_all()
+
+    # Calentamiento (compilación de plantillas, imports)
+    request(crear_cliente(), 'get', url)
+
+    threads = [threading.Thread(target=trabajador) for _ in range(hilos)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracion = time.perf_counter() - inicio
+
+    rps = (por_hilo * hilos) / duracion
+    print(f"  {nombre:<28} CONN_MAX_AGE={str(conn_max_age['default']):<5} "
+          f"{rps:8.1f} req/s  ({duracion:.2f}s, errores: {len(errores)})")
+    return rps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--hilos', type=int, default=4)
+    parser.add_argument('--url', default='/dashboard/')
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print("PRUEBA DE CARGA - CONEXIONES A BASE DE DATOS")
+    print("=" * 60)
+    print(f"  URL: {args.url} | requests: {args.requests} | hilos: {args.hilos}")
+    print("-" * 60)
+
+    configurado = {alias: db.get('CONN_MAX_AGE', 0) for alias, db in connections.settings.items()}
+    antes = ejecutar_fase('Sin persistencia (antes)', dict.fromkeys(configurado, 0),
+                          args.url, args.requests, args.hilos)
+    despues = ejecutar_fase('Persistentes (después)', configurado, args.url, args.requests, args.hilos)
+
+    print("-" * 60)
+    print(f"  Mejora: x{despues / antes:.2f}")
+    print("=" * 60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
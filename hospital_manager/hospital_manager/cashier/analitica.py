@@ -0,0 +1,47 @@
+"""
+Resúmenes Analíticos del Sistema Hospitalario HIS+
+Los reportes pesados leen vistas materializadas del coordinador y muestran la
+fecha de su último refresco
+"""
+
+from django.db import connection
+
+from .forms import ejecutar_query, ejecutar_query_one
+
+# ============================================================================
+# RESÚMENES MATERIALIZADOS
+# ============================================================================
+
+# Vista materializada -> vista analítica de la que se calcula (ver sección
+# "RESÚMENES MATERIALIZADOS PARA REPORTES" del script del coordinador)
+RESUMENES = {
+    'mv_consumo_medicamentos_dept': 'vista_consumo_medicamentos_dept',
+    'mv_utilizacion_recursos': 'vista_utilizacion_recursos',
+    'mv_medicos_consultas': 'vista_medicos_consultas',
+    'mv_enfermedades_por_sede': 'vista_enfermedades_por_sede',
+}
+
+
+def consultar_resumen(vista, orden, limite=None):
+    """
+    Retorna (filas, fecha_refresco) de una vista materializada.
+    `orden` es el ORDER BY (texto fijo del código, nunca del usuario).
+    """
+    if vista not in RESUMENES:
+        raise ValueError(f'Resumen desconocido: {vista}')
+    query = f"SELECT * FROM {vista} ORDER BY {orden}"
+    params = []
+    if limite is not None:
+        query += " LIMIT %s"
+        params.append(limite)
+    filas = ejecutar_query(query, params)
+    fila = ejecutar_query_one(
+        "SELECT fecha_refresco FROM refresco_analitica WHERE vista = %s", [vista]
+    )
+    return filas, (fila[0] if fila else None)
+
+
+def refrescar_resumenes():
+    """Refresca todas las vistas materializadas (CALL refrescar_analitica())"""
+    with connection.cursor() as cursor:
+        cursor.execute("CALL refrescar_analitica()")
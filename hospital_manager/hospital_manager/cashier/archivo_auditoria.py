@@ -0,0 +1,445 @@
+"""
+Archivo de Auditoría del Sistema Hospitalario HIS+
+Auditoria_Accesos guarda en la base solo los meses recientes (capa caliente,
+meses_retencion en particiones_config). mantener_particiones() separa los
+meses vencidos al esquema archivo (capa tibia) y exportar_particion() los
+escribe en un archivo por mes (<AUDITORIA_ARCHIVO_DIR>/mes=AAAA-MM/) y los
+elimina de la base (capa fría, registrada en auditoria_archivos).
+buscar_auditoria() consulta las tres capas y las mezcla con la paginación por
+clave de paginacion.py.
+
+Con pyarrow los archivos son Parquet (columnar, zstd, ordenado por fecha: una
+búsqueda solo descomprime los grupos de filas de su rango); sin pyarrow, CSV
+con gzip. Un archivo solo se lee si está registrado en auditoria_archivos y el
+registro se hace en la misma transacción que elimina la partición: una búsqueda
+nunca ve las mismas filas dos veces ni se las salta.
+"""
+
+import csv
+import gzip
+import operator
+import os
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import ProgrammingError, connection, transaction
+
+from .exportacion import lotes_consulta
+from .forms import ejecutar_query, ejecutar_query_one
+from .paginacion import decodificar_token, paginar
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Sin pyarrow los meses fríos se guardan como CSV con gzip
+    pa = pq = None
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+TABLA = 'auditoria_accesos'
+
+# Filas por grupo de Parquet (la unidad que se puede saltar al filtrar)
+TAMANO_GRUPO = 100000
+
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+def _directorio():
+    return str(_config('AUDITORIA_ARCHIVO_DIR', settings.BASE_DIR / 'archivo_auditoria'))
+
+
+class ErrorArchivo(Exception):
+    """Un mes no se pudo escribir o leer"""
+
+
+# Misma forma en la base y en los archivos: las columnas de la vista de
+# auditoría y al final id_emp (solo para filtrar). En los archivos el nombre,
+# rol y sede del empleado quedan fijados al momento de archivar.
+CONSULTA_AUDITORIA = """
+    SELECT aa.id_evento, aa.fecha_evento, p.nom_persona || ' ' || p.apellido_persona AS empleado,
+           r.nombre_rol, s.nom_sede, aa.accion, aa.tabla_afectada, aa.id_registro_afectado, aa.ip_origen,
+           aa.id_emp
+    FROM {origen} aa
+    LEFT JOIN Empleados e ON aa.id_emp = e.id_emp
+    LEFT JOIN Personas p ON e.id_persona = p.id_persona
+    LEFT JOIN Roles r ON e.id_rol = r.id_rol
+    LEFT JOIN Sedes_Hospitalarias s ON e.id_sede = s.id_sede
+"""
+CLAVES_AUDITORIA = [('fecha_evento', 1, True), ('id_evento', 0, True)]
+
+COLUMNAS = [
+    ('id_evento', 'entero'), ('fecha_evento', 'fecha'), ('empleado', 'texto'), ('nombre_rol', 'texto'),
+    ('nom_sede', 'texto'), ('accion', 'texto'), ('tabla_afectada', 'texto'),
+    ('id_registro_afectado', 'texto'), ('ip_origen', 'texto'), ('id_emp', 'entero'),
+]
+POSICION = {nombre: i for i, (nombre, _) in enumerate(COLUMNAS)}
+
+# Columnas de Auditoria_Accesos (las particiones tibias se unen a la tabla con ellas)
+COLUMNAS_TABLA = 'id_evento, id_emp, accion, tabla_afectada, id_registro_afectado, fecha_evento, ip_origen'
+
+# Filtro de búsqueda -> columna de igualdad
+FILTROS_IGUALDAD = {
+    'tabla': 'tabla_afectada',
+    'accion': 'accion',
+    'id_emp': 'id_emp',
+    'id_registro': 'id_registro_afectado',
+}
+
+# Particiones tibias (separadas por archivar_particiones, aún en la base)
+CONSULTA_TIBIAS = """
+    SELECT c.relname, c.oid, to_date(right(c.relname, 6), 'YYYYMM') AS desde
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'archivo' AND c.relkind = 'r' AND c.relname ~ '^auditoria_accesos_p[0-9]{6}$'
+"""
+
+# Lo que lee una búsqueda: particiones tibias y archivos fríos
+CONSULTA_CATALOGO = f"""
+    SELECT relname, NULL::DATE, NULL::DATE FROM ({CONSULTA_TIBIAS}) tibias
+    UNION ALL
+    SELECT ruta, desde, hasta FROM auditoria_archivos
+"""
+
+
+# ============================================================================
+# FILTROS
+# ============================================================================
+
+def filtros_busqueda(datos):
+    """Filtros de búsqueda desde request.GET; los valores inválidos se ignoran"""
+    filtros = {}
+    for filtro in ('tabla', 'accion', 'id_registro'):
+        valor = (datos.get(filtro) or '').strip()
+        if valor:
+            filtros[filtro] = valor.upper() if filtro == 'accion' else valor
+    id_emp = (datos.get('id_emp') or '').strip()
+    if id_emp.isdigit():
+        filtros['id_emp'] = int(id_emp)
+    for filtro, dias in (('desde', 0), ('hasta', 1)):
+        try:
+            fecha = date.fromisoformat((datos.get(filtro) or '').strip())
+        except ValueError:
+            continue
+        # hasta incluye el día: se guarda como el inicio del día siguiente
+        filtros[filtro] = datetime.combine(fecha + timedelta(days=dias), time.min)
+    return filtros
+
+
+def _where(filtros):
+    condiciones, params = [], []
+    for filtro, columna in FILTROS_IGUALDAD.items():
+        if filtro in filtros:
+            condiciones.append(f'aa.{columna} = %s')
+            params.append(filtros[filtro])
+    if 'desde' in filtros:
+        condiciones.append('aa.fecha_evento >= %s')
+        params.append(filtros['desde'])
+    if 'hasta' in filtros:
+        condiciones.append('aa.fecha_evento < %s')
+        params.append(filtros['hasta'])
+    return (' WHERE ' + ' AND '.join(condiciones) if condiciones else ''), params
+
+
+def _condiciones(filtros):
+    """Los filtros como (columna, operador, valor): pyarrow los usa para saltar grupos de filas"""
+    condiciones = [(columna, '=', filtros[filtro]) for filtro, columna in FILTROS_IGUALDAD.items()
+                   if filtro in filtros]
+    if 'desde' in filtros:
+        condiciones.append(('fecha_evento', '>=', filtros['desde']))
+    if 'hasta' in filtros:
+        condiciones.append(('fecha_evento', '<', filtros['hasta']))
+    return condiciones
+
+
+_OPERADORES = {'=': operator.eq, '<': operator.lt, '<=': operator.le, '>=': operator.ge}
+
+
+def _cumple(fila, condiciones):
+    for columna, operador, valor in condiciones:
+        actual = fila[POSICION[columna]]
+        if actual is None or not _OPERADORES[operador](actual, valor):
+            return False
+    return True
+
+
+def _mes_posible(desde, hasta, condiciones):
+    """False si ninguna fila del mes [desde, hasta) puede cumplir las condiciones de fecha"""
+    inicio, fin = datetime.combine(desde, time.min), datetime.combine(hasta, time.min)
+    for columna, operador, valor in condiciones:
+        if columna != 'fecha_evento':
+            continue
+        if operador in ('<', '<=') and inicio > valor:
+            return False
+        if operador == '>=' and fin <= valor:
+            return False
+    return True
+
+
+def _clave(fila):
+    return (fila[1], fila[0])
+
+
+# ============================================================================
+# ARCHIVOS
+# ============================================================================
+
+def _tipo_arrow(tipo):
+    return {'entero': pa.int64(), 'fecha': pa.timestamp('us'), 'texto': pa.string()}[tipo]
+
+
+def _escribir_parquet(ruta, lotes):
+    esquema = pa.schema([(nombre, _tipo_arrow(tipo)) for nombre, tipo in COLUMNAS])
+
+    def grupo(filas):
+        columnas = zip(*filas)
+        return pa.table([pa.array(list(valores), type=campo.type) for valores, campo in zip(columnas, esquema)],
+                        schema=esquema)
+
+    total, pendientes = 0, []
+    with pq.ParquetWriter(ruta, esquema, compression='zstd') as escritor:
+        for filas in lotes:
+            pendientes.extend(filas)
+            if len(pendientes) >= TAMANO_GRUPO:
+                escritor.write_table(grupo(pendientes))
+                total += len(pendientes)
+                pendientes = []
+        if pendientes:
+            escritor.write_table(grupo(pendientes))
+            total += len(pendientes)
+    return total
+
+
+def _escribir_csv(ruta, lotes):
+    total = 0
+    with gzip.open(ruta, 'wt', encoding='utf-8', newline='') as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow([nombre for nombre, _ in COLUMNAS])
+        for filas in lotes:
+            escritor.writerows(
+                ['' if valor is None else valor.isoformat() if isinstance(valor, datetime) else valor
+                 for valor in fila]
+                for fila in filas
+            )
+            total += len(filas)
+    return total
+
+
+def _leer_parquet(ruta, condiciones):
+    if pq is None:
+        raise ErrorArchivo('pyarrow no está instalado')
+    tabla = pq.read_table(ruta, filters=condiciones or None)
+    return list(zip(*(tabla.column(nombre).to_pylist() for nombre, _ in COLUMNAS)))
+
+
+def _leer_csv(ruta, condiciones):
+    conversiones = {'entero': int, 'fecha': datetime.fromisoformat, 'texto': str}
+    tipos = [conversiones[tipo] for _, tipo in COLUMNAS]
+    filas = []
+    with gzip.open(ruta, 'rt', encoding='utf-8', newline='') as archivo:
+        lector = csv.reader(archivo)
+        next(lector, None)
+        for registro in lector:
+            fila = tuple(tipo(valor) if valor != '' else None for tipo, valor in zip(tipos, registro))
+            if _cumple(fila, condiciones):
+                filas.append(fila)
+    return filas
+
+
+def leer_mes(ruta, condiciones=()):
+    """Filas de un archivo frío (ruta relativa a AUDITORIA_ARCHIVO_DIR) que cumplen las condiciones"""
+    completa = os.path.join(_directorio(), ruta)
+    try:
+        if ruta.endswith('.parquet'):
+            return _leer_parquet(completa, list(condiciones))
+        return _leer_csv(completa, condiciones)
+    except (OSError, ValueError) as error:
+        raise ErrorArchivo(f'{ruta}: {error}') from error
+
+
+def _sincronizar(ruta):
+    with open(ruta, 'rb') as archivo:
+        os.fsync(archivo.fileno())
+
+
+# ============================================================================
+# EXPORTACIÓN (CAPA TIBIA -> FRÍA)
+# ============================================================================
+
+def definir_horizonte(meses):
+    """Meses que Auditoria_Accesos conserva en la base (lo usa mantener_particiones)"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE particiones_config SET meses_retencion = %s, accion_vencidas = 'ARCHIVAR' WHERE tabla = %s",
+            [meses, TABLA],
+        )
+
+
+def separar_vencidas():
+    """Pasa al esquema archivo los meses fuera del horizonte; retorna cuántos"""
+    return ejecutar_query_one('SELECT archivar_particiones(%s)', [TABLA])[0]
+
+
+def particiones_tibias():
+    """(partición, oid, primer día del mes) de los meses que esperan exportarse"""
+    return ejecutar_query(CONSULTA_TIBIAS + ' ORDER BY desde')
+
+
+def exportar_particion(particion, oid, desde):
+    """
+    Escribe archivo.<particion> en un archivo de su mes, la elimina de la base y
+    registra el archivo. Retorna (filas, ruta relativa, bytes).
+
+    Un mes puede tener más de un archivo: si llegan filas atrasadas de un mes ya
+    exportado, mantener_particiones vuelve a crear la partición y se exporta
+    aparte (el oid de la tabla distingue los archivos).
+    """
+    nombre = f'archivo.{connection.ops.quote_name(particion)}'
+    extension = 'parquet' if pq is not None else 'csv.gz'
+    relativa = f'mes={desde:%Y-%m}/{particion}-{oid}.{extension}'
+    ruta = os.path.join(_directorio(), relativa)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Las lecturas siguen; solo se bloquea que se agreguen filas al mes
+            cursor.execute(f'LOCK TABLE {nombre} IN SHARE MODE')
+            cursor.execute(f'SELECT COUNT(*) FROM {nombre}')
+            esperadas = cursor.fetchone()[0]
+
+        consulta = CONSULTA_AUDITORIA.format(origen=nombre) + ' ORDER BY aa.fecha_evento, aa.id_evento'
+        lotes = (filas for _, filas in lotes_consulta(consulta))
+        escribir = _escribir_parquet if pq is not None else _escribir_csv
+        try:
+            escritas = escribir(temporal, lotes)
+            if escritas != esperadas:
+                raise ErrorArchivo(f'{particion}: se escribieron {escritas} de {esperadas} filas')
+            _sincronizar(temporal)
+        except (OSError, ErrorArchivo) as error:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise ErrorArchivo(str(error)) from error
+        # Mismo nombre en cada intento: si la transacción falla, el próximo lo reemplaza
+        os.replace(temporal, ruta)
+
+        tamano = os.path.getsize(ruta)
+        hasta = (desde.replace(day=28) + timedelta(days=4)).replace(day=1)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {nombre}')
+            cursor.execute("""
+                INSERT INTO auditoria_archivos (ruta, particion, desde, hasta, filas, bytes)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (ruta) DO UPDATE SET filas = EXCLUDED.filas, bytes = EXCLUDED.bytes,
+                                                 fecha_archivo = NOW()
+            """, [relativa, particion, desde, hasta, escritas, tamano])
+            cursor.execute("UPDATE particiones_archivadas SET esquema = NULL WHERE particion = %s", [particion])
+    return escritas, relativa, tamano
+
+
+# ============================================================================
+# BÚSQUEDA EN LAS TRES CAPAS
+# ============================================================================
+
+def _catalogo():
+    """(particiones tibias como nombre SQL, archivos fríos como (desde, hasta, ruta))"""
+    tibias, frios = [], []
+    for nombre, desde, hasta in ejecutar_query(CONSULTA_CATALOGO):
+        if desde is None:
+            tibias.append(f'archivo.{connection.ops.quote_name(nombre)}')
+        else:
+            frios.append((desde, hasta, nombre))
+    return tibias, frios
+
+
+def _consulta(tibias, filtros):
+    origen = 'Auditoria_Accesos'
+    if tibias:
+        origen = '(' + ' UNION ALL '.join(
+            f'SELECT {COLUMNAS_TABLA} FROM {tabla}' for tabla in ['Auditoria_Accesos'] + tibias
+        ) + ')'
+    where, params = _where(filtros)
+    return CONSULTA_AUDITORIA.format(origen=origen) + where, params
+
+
+def _buscar_frios(archivos, filtros, cursor, adelante, limite, tope, sin_leer):
+    """
+    Hasta `limite` filas de los archivos fríos después de `cursor` en el orden
+    de la página. `tope` es la última fila de la base cuando llenó la página:
+    los meses enteramente después de ella no pueden aportar.
+    """
+    condiciones = _condiciones(filtros)
+    if cursor is not None:
+        condiciones.append(('fecha_evento', '<=' if adelante else '>=', cursor[0]))
+    poda = condiciones + ([('fecha_evento', '>=' if adelante else '<=', tope[1])] if tope else [])
+
+    meses = {}
+    for desde, hasta, ruta in archivos:
+        if _mes_posible(desde, hasta, poda):
+            meses.setdefault(desde, []).append(ruta)
+
+    encontradas = []
+    for desde in sorted(meses, reverse=adelante):
+        for ruta in meses[desde]:
+            try:
+                filas = leer_mes(ruta, condiciones)
+            except ErrorArchivo:
+                sin_leer.append(f'{desde:%Y-%m}')
+                continue
+            for fila in filas:
+                if not _cumple(fila, condiciones):
+                    continue
+                if cursor is None or (_clave(fila) < cursor if adelante else _clave(fila) > cursor):
+                    encontradas.append(fila)
+        # Los meses no se solapan: los siguientes quedan después de todo lo encontrado
+        if len(encontradas) >= limite:
+            break
+    encontradas.sort(key=_clave, reverse=adelante)
+    return encontradas[:limite]
+
+
+def buscar_auditoria(request, filtros=None):
+    """
+    Página de eventos de auditoría (más recientes primero) de la base y del
+    archivo, con los filtros de filtros_busqueda(). La página lleva en
+    meses_sin_leer los meses fríos cuyo archivo no se pudo leer.
+    """
+    filtros = filtros or {}
+    valores, direccion = decodificar_token(request.GET.get('cursor'), len(CLAVES_AUDITORIA))
+    adelante = direccion == 'sig'
+    cursor = None
+    if valores is not None:
+        try:
+            cursor = (datetime.fromisoformat(valores[0]), int(valores[1]))
+        except (TypeError, ValueError):
+            cursor = None
+    sin_leer = []
+
+    def ejecutar(frios, sql, params):
+        filas = list(ejecutar_query(sql, params))
+        limite = params[-1]
+        tope = filas[-1] if len(filas) >= limite else None
+        frias = _buscar_frios(frios, filtros, cursor, adelante, limite, tope, sin_leer) if frios else []
+        if not frias:
+            return filas
+        filas.extend(frias)
+        filas.sort(key=_clave, reverse=adelante)
+        return filas[:limite]
+
+    for intento in range(2):
+        tibias, frios = _catalogo()
+        query, params = _consulta(tibias, filtros)
+        try:
+            pagina = paginar(request, query, params, CLAVES_AUDITORIA,
+                             ejecutar=lambda sql, p: ejecutar(frios, sql, p))
+            break
+        except ProgrammingError:
+            # Una partición tibia se exportó entre el catálogo y la consulta
+            if intento:
+                raise
+            sin_leer.clear()
+    pagina.meses_sin_leer = sorted(set(sin_leer))
+    return pagina
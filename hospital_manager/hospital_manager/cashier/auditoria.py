@@ -0,0 +1,227 @@
+"""
+Auditoría Asíncrona del Sistema Hospitalario HIS+
+Acumula los eventos de auditoría en memoria y los escribe por lotes en un hilo
+aparte, fuera del camino del request
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.db import DataError, DatabaseError, IntegrityError, connections
+from django.utils import timezone
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+logger = logging.getLogger('his.auditoria')
+
+COLUMNAS = '(id_emp, accion, tabla_afectada, id_registro_afectado, ip_origen, fecha_evento)'
+
+# Largo de las columnas VARCHAR de Auditoria_Accesos (accion, tabla, id_registro, ip_origen)
+LARGOS = (50, 50, 50, 45)
+
+# Errores con los que la base rechaza un evento por sus datos (reintentarlo no
+# sirve). ValueError: psycopg rechaza antes de enviar, p. ej. un texto con NUL
+RECHAZOS_DE_DATOS = (DataError, IntegrityError, ValueError)
+
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+def _archivo_respaldo():
+    """Archivo local donde se guardan los eventos si la base de datos no responde"""
+    return str(_config('AUDITORIA_ARCHIVO_RESPALDO', settings.BASE_DIR / 'auditoria_pendiente.jsonl'))
+
+
+def _archivo_cuarentena():
+    """Archivo local con los eventos que la base rechazó, para revisarlos a mano"""
+    return str(_config('AUDITORIA_ARCHIVO_CUARENTENA', settings.BASE_DIR / 'auditoria_cuarentena.jsonl'))
+
+
+def _texto(valor, largo):
+    """Texto que cabe en la columna: sin NUL y recortado (la IP sale de X-Forwarded-For)"""
+    if valor is None:
+        return None
+    return str(valor).replace('\x00', '').strip()[:largo]
+
+
+# ============================================================================
+# ESCRITURA POR LOTES
+# ============================================================================
+
+def insertar_eventos(eventos, using='default'):
+    """Inserta una lista de eventos con un solo INSERT de varias filas"""
+    if not eventos:
+        return
+    valores = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(eventos))
+    params = []
+    for evento in eventos:
+        params.extend(evento)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'INSERT INTO Auditoria_Accesos {COLUMNAS} VALUES {valores}', params)
+
+
+class EscritorAuditoria:
+    """
+    Buffer de eventos de auditoría compartido por el proceso.
+    Se vacía cuando llega a AUDITORIA_LOTE eventos o cada AUDITORIA_INTERVALO
+    segundos. Si la base no responde, el lote se agrega al archivo de respaldo y
+    se reintenta en el siguiente vaciado, así no se pierde ningún evento. Si la
+    base rechaza el lote por los datos de algún evento, se inserta uno a uno y
+    los rechazados pasan al archivo de cuarentena.
+    """
+
+    def __init__(self):
+        self._eventos = []
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    def registrar(self, id_emp, accion, tabla, id_registro, ip):
+        """Encola un evento (la fecha se toma ahora, no al escribir)"""
+        evento = (id_emp,) + tuple(
+            _texto(valor, largo) for valor, largo in zip((accion, tabla, id_registro, ip), LARGOS)
+        ) + (timezone.now(),)
+        with self._lock:
+            self._eventos.append(evento)
+            lleno = len(self._eventos) >= _config('AUDITORIA_LOTE', 100)
+        self._iniciar()
+        if lleno:
+            self._despertar.set()
+
+    def _iniciar(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._ciclo, name='auditoria', daemon=True)
+            self._hilo.start()
+
+    def _ciclo(self):
+        while True:
+            self._despertar.wait(timeout=_config('AUDITORIA_INTERVALO', 2.0))
+            self._despertar.clear()
+            # Un error inesperado no puede terminar el hilo: los eventos
+            # siguientes quedarían en memoria sin que nadie los escriba
+            try:
+                self.vaciar()
+            except Exception:
+                logger.exception('Falló la escritura de auditoría; eventos en %s', _archivo_respaldo())
+
+    def vaciar(self):
+        """
+        Escribe todos los eventos pendientes (y los del archivo de respaldo).
+        Si la base de datos no responde, los que faltan quedan en el respaldo;
+        ante cualquier otro error también se guardan antes de propagarlo.
+        """
+        with self._lock:
+            eventos, self._eventos = self._eventos, []
+        conn = connections['default']
+        try:
+            conn.close_if_unusable_or_obsolete()
+            self._reintentar_respaldo()
+            self._insertar(eventos)
+        except Exception as error:
+            self._guardar_respaldo(eventos)
+            try:
+                conn.close()
+            except DatabaseError:
+                pass
+            if not isinstance(error, DatabaseError):
+                raise
+
+    def _insertar(self, pendientes):
+        """
+        Inserta los eventos y vacía la lista `pendientes`. Si la base rechaza el
+        lote por los datos, repite evento por evento y manda los rechazados a
+        cuarentena: una fila inválida no puede bloquear el respaldo en cada
+        reintento. Si se cae la conexión a mitad, en `pendientes` quedan solo
+        los eventos que faltan (los ya escritos no se duplican en el respaldo).
+        """
+        try:
+            insertar_eventos(pendientes)
+        except RECHAZOS_DE_DATOS:
+            # En autocommit el INSERT rechazado no dejó filas
+            while pendientes:
+                try:
+                    insertar_eventos(pendientes[:1])
+                except RECHAZOS_DE_DATOS as error:
+                    self._guardar_cuarentena(pendientes[0], error)
+                del pendientes[0]
+        else:
+            pendientes.clear()
+
+    # ------------------------------------------------------------------------
+    # Respaldo y cuarentena en disco
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def _linea(evento, *extra):
+        return json.dumps(list(evento[:5]) + [evento[5].isoformat()] + list(extra)) + '\n'
+
+    def _guardar_respaldo(self, eventos):
+        if not eventos:
+            return
+        lineas = ''.join(self._linea(e) for e in eventos)
+        with open(_archivo_respaldo(), 'a', encoding='utf-8') as archivo:
+            archivo.write(lineas)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+
+    def _guardar_cuarentena(self, evento, error):
+        """Misma línea que el respaldo más el error (leer_respaldo la puede volver a cargar)"""
+        logger.error('Evento de auditoría rechazado por la base, a cuarentena: %s', error)
+        with open(_archivo_cuarentena(), 'a', encoding='utf-8') as archivo:
+            archivo.write(self._linea(evento, str(error)[:500]))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+
+    def _reintentar_respaldo(self):
+        ruta = _archivo_respaldo()
+        if not os.path.exists(ruta):
+            return
+        # Renombrar primero: otros procesos pueden seguir agregando al archivo
+        # original. El nombre lleva proceso e hilo (vaciar() también corre en atexit)
+        en_proceso = f'{ruta}.{os.getpid()}.{threading.get_ident()}'
+        try:
+            os.replace(ruta, en_proceso)
+        except FileNotFoundError:
+            return
+        with open(en_proceso, encoding='utf-8') as archivo:
+            eventos = leer_respaldo(archivo)
+        try:
+            self._insertar(eventos)
+        finally:
+            # Lo que no se escribió vuelve al respaldo
+            self._guardar_respaldo(eventos)
+            os.remove(en_proceso)
+
+
+def leer_respaldo(lineas):
+    """
+    Eventos de las líneas del archivo de respaldo. Una línea dañada (p. ej. la
+    última de un proceso que murió escribiendo) se omite en vez de bloquear a
+    todas las demás en cada reintento.
+    """
+    eventos = []
+    for numero, linea in enumerate(lineas, 1):
+        if not linea.strip():
+            continue
+        try:
+            e = json.loads(linea)
+            eventos.append(tuple(e[:5]) + (datetime.fromisoformat(e[5]),))
+        except (ValueError, TypeError, IndexError):
+            logger.warning('Línea %s del respaldo de auditoría descartada: %r', numero, linea[:200])
+    return eventos
+
+
+escritor = EscritorAuditoria()
+atexit.register(escritor.vaciar)
@@ -0,0 +1,243 @@
+"""
+Autenticación del Sistema Hospitalario HIS+
+Busca al empleado por email en el nodo de su sede (índice único de
+Personas.email_persona, sin pasar por la vista dblink Empleados), verifica el
+hash bcrypt una sola vez y limita en memoria los intentos fallidos. Si el hash
+se generó con un costo distinto de AUTH_BCRYPT_COSTO se vuelve a generar al
+iniciar sesión, así el costo se ajusta sin pedir contraseñas nuevas.
+
+Con la librería bcrypt instalada la verificación corre en el proceso web (la
+CPU del coordinador no la paga); sin ella se usa crypt() de pgcrypto en el
+nodo dueño del empleado.
+"""
+
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .distribucion import alias_para_sede, aliases_fragmentos, ejecutar_query_fragmentos
+from .forms import ejecutar_query_one
+
+try:
+    import bcrypt
+except ImportError:  # Sin la librería se verifica con crypt() de pgcrypto
+    bcrypt = None
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+class ErrorAutenticacion(Exception):
+    """Credenciales inválidas o cuenta desactivada (el mensaje va al usuario)"""
+
+
+class DemasiadosIntentos(ErrorAutenticacion):
+    """Bloqueo temporal por intentos fallidos"""
+
+
+# En un nodo "Empleados" es su tabla local (en sede_1, nodo_local.empleados)
+CONSULTA_EMPLEADO = """
+    SELECT e.id_emp, p.nom_persona, p.apellido_persona, r.nombre_rol,
+           e.id_sede, e.id_dept, e.activo, e.hash_contra
+    FROM Personas p
+    INNER JOIN Empleados e ON e.id_persona = p.id_persona
+    INNER JOIN Roles r ON e.id_rol = r.id_rol
+    WHERE p.email_persona = %s
+"""
+
+_COSTO_HASH = re.compile(r'^\$2[abxy]?\$(\d{2})\$')
+
+
+# ============================================================================
+# LÍMITE DE INTENTOS
+# ============================================================================
+
+class LimiteIntentos:
+    """
+    Fallos recientes por email y por IP en memoria del proceso. Se bloquea
+    antes de verificar el hash: un ataque no consume bcrypt. Cada proceso
+    cuenta por su lado, así que el límite real es por proceso.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fallos = {}    # clave -> deque de instantes (time.monotonic)
+
+    def _recientes(self, clave, ahora):
+        fallos = self._fallos.get(clave)
+        if fallos is None:
+            return None
+        ventana = _config('AUTH_VENTANA_FALLOS', 300)
+        while fallos and fallos[0] <= ahora - ventana:
+            fallos.popleft()
+        if not fallos:
+            del self._fallos[clave]
+            return None
+        return fallos
+
+    def espera(self, claves):
+        """Segundos que faltan para volver a intentar (0 si no hay bloqueo)"""
+        ahora = time.monotonic()
+        espera = 0
+        with self._lock:
+            for clave, maximo in claves:
+                fallos = self._recientes(clave, ahora)
+                if fallos and len(fallos) >= maximo:
+                    espera = max(espera, fallos[0] + _config('AUTH_VENTANA_FALLOS', 300) - ahora)
+        return espera
+
+    def fallo(self, claves):
+        ahora = time.monotonic()
+        with self._lock:
+            # Evitar que el diccionario crezca sin límite con claves viejas
+            if len(self._fallos) > 10000:
+                for clave in list(self._fallos):
+                    self._recientes(clave, ahora)
+            for clave, _ in claves:
+                self._fallos.setdefault(clave, deque()).append(ahora)
+
+    def exito(self, clave):
+        with self._lock:
+            self._fallos.pop(clave, None)
+
+
+limite = LimiteIntentos()
+
+
+def _claves(email, ip):
+    claves = [(f'email:{email}', _config('AUTH_MAX_FALLOS', 5))]
+    if ip:
+        # Estaciones compartidas detrás de la misma IP: límite más alto
+        claves.append((f'ip:{ip}', _config('AUTH_MAX_FALLOS_IP', 50)))
+    return claves
+
+
+# ============================================================================
+# BÚSQUEDA DEL EMPLEADO
+# ============================================================================
+
+_sede_por_email = {}
+
+
+def buscar_empleado(email):
+    """
+    Retorna (fila de CONSULTA_EMPLEADO, alias del nodo) o (None, None).
+    La sede de cada email se recuerda: desde el segundo inicio de sesión se
+    consulta solo su nodo; la primera vez se pregunta a todos en paralelo.
+    """
+    if aliases_fragmentos() is None:
+        return ejecutar_query_one(CONSULTA_EMPLEADO, [email]), 'default'
+
+    id_sede = _sede_por_email.get(email)
+    if id_sede is not None:
+        alias = alias_para_sede(id_sede)
+        fila = ejecutar_query_one(CONSULTA_EMPLEADO, [email], using=alias)
+        if fila and fila[4] == id_sede:
+            return fila, alias
+        _sede_por_email.pop(email, None)
+
+    filas = ejecutar_query_fragmentos(CONSULTA_EMPLEADO, [email])
+    if not filas:
+        if filas.parcial:
+            raise ErrorAutenticacion('No se pudo verificar el usuario: hay sedes sin conexión. Intente de nuevo.')
+        return None, None
+    fila = filas[0]
+    if len(_sede_por_email) > 10000:
+        _sede_por_email.clear()
+    _sede_por_email[email] = fila[4]
+    return fila, alias_para_sede(fila[4])
+
+
+# ============================================================================
+# HASH
+# ============================================================================
+
+def costo_hash(hash_contra):
+    """Costo (log2 de rondas) de un hash bcrypt, o None si no es bcrypt"""
+    coincidencia = _COSTO_HASH.match(hash_contra or '')
+    return int(coincidencia.group(1)) if coincidencia else None
+
+
+def verificar_hash(password, hash_contra, alias='default'):
+    if bcrypt is not None and costo_hash(hash_contra) is not None:
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), hash_contra.encode('ascii'))
+        except ValueError:
+            pass
+    fila = ejecutar_query_one("SELECT crypt(%s, %s) = %s", [password, hash_contra, hash_contra], using=alias)
+    return bool(fila and fila[0])
+
+
+def generar_hash(password, alias='default', costo=None):
+    """Hash bcrypt compatible con pgcrypto ($2a$) con el costo configurado"""
+    costo = costo or _config('AUTH_BCRYPT_COSTO', 10)
+    if bcrypt is not None:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(costo, prefix=b'2a')).decode('ascii')
+    return ejecutar_query_one("SELECT crypt(%s, gen_salt('bf', %s))", [password, costo], using=alias)[0]
+
+
+def guardar_hash(id_emp, hash_nuevo, alias, hash_anterior=None):
+    """Actualiza hash_contra en el nodo dueño; con hash_anterior solo si nadie lo cambió antes"""
+    query = "UPDATE Empleados SET hash_contra = %s WHERE id_emp = %s"
+    params = [hash_nuevo, id_emp]
+    if hash_anterior is not None:
+        query += " AND hash_contra = %s"
+        params.append(hash_anterior)
+    with connections[alias].cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.rowcount
+
+
+def _rehash_si_corresponde(fila, password, alias):
+    if costo_hash(fila[7]) == _config('AUTH_BCRYPT_COSTO', 10):
+        return
+    try:
+        guardar_hash(fila[0], generar_hash(password, alias), alias, hash_anterior=fila[7])
+    except DatabaseError:
+        pass  # No bloquear el inicio de sesión: se reintenta en el próximo
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+def autenticar(email, password, ip=None):
+    """
+    Verifica las credenciales y retorna el empleado como diccionario
+    (id_emp, nombre, apellido, rol, id_sede, id_dept). Lanza
+    ErrorAutenticacion con el mensaje para el usuario.
+    """
+    email = (email or '').strip()
+    claves = _claves(email.lower(), ip)
+    espera = limite.espera(claves)
+    if espera:
+        minutos = max(1, round(espera / 60))
+        raise DemasiadosIntentos(f'Demasiados intentos fallidos. Intente de nuevo en {minutos} minuto(s).')
+
+    fila, alias = buscar_empleado(email)
+    if fila is None or not verificar_hash(password, fila[7], alias):
+        limite.fallo(claves)
+        raise ErrorAutenticacion('Credenciales inválidas. Verifique su email y contraseña.')
+    limite.exito(claves[0][0])
+    if not fila[6]:
+        raise ErrorAutenticacion('Su cuenta está desactivada. Contacte al administrador.')
+
+    _rehash_si_corresponde(fila, password, alias)
+    return {
+        'id_emp': fila[0], 'nombre': fila[1], 'apellido': fila[2], 'rol': fila[3],
+        'id_sede': fila[4], 'id_dept': fila[5],
+    }
+
+
+def establecer_password(empleado, nueva):
+    """Guarda la nueva contraseña de un empleado ya autenticado (diccionario de autenticar)"""
+    alias = alias_para_sede(empleado['id_sede']) if aliases_fragmentos() else 'default'
+    guardar_hash(empleado['id_emp'], generar_hash(nueva, alias), alias)
@@ -0,0 +1,77 @@
+"""
+Búsqueda del Sistema Hospitalario HIS+
+Búsqueda por nombre (pg_trgm + unaccent) y por prefijo de documento, con ranking
+"""
+
+# ============================================================================
+# EXPRESIONES INDEXADAS
+# ============================================================================
+
+# Deben coincidir con los índices de la sección "ÍNDICES DE BÚSQUEDA" del
+# script del coordinador; si cambian aquí hay que cambiarlas allá.
+EXPR_NOMBRE_PERSONA = "lower(f_unaccent({a}.nom_persona || ' ' || {a}.apellido_persona))"
+EXPR_NOMBRE_MEDICAMENTO = "lower(f_unaccent({a}.nom_med))"
+EXPR_NOMBRE_ENFERMEDAD = "lower(f_unaccent({a}.nombre_enfermedad))"
+
+# Término normalizado igual que la columna
+TERMINO = "lower(f_unaccent(%s))"
+
+
+def escapar_like(texto):
+    """Escapa los comodines de LIKE para buscar el texto literal"""
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def filtro_texto(expr, q):
+    """
+    Retorna (where_sql, order_sql, params_where, params_order) para buscar `q`
+    dentro de `expr`.
+    LIKE '%q%' sobre la expresión usa el índice GIN de trigramas; el orden pone
+    primero los que empiezan por q y luego los más parecidos.
+    """
+    termino = q.strip()
+    contiene = f'%{escapar_like(termino)}%'
+    prefijo = f'{escapar_like(termino)}%'
+    where = f"{expr} LIKE {TERMINO}"
+    order = f"({expr} LIKE {TERMINO}) DESC, similarity({expr}, {TERMINO}) DESC"
+    return where, order, [contiene], [prefijo, termino]
+
+
+# ============================================================================
+# PERSONAS / PACIENTES
+# ============================================================================
+
+def filtro_personas(q, alias='p'):
+    """
+    Retorna (where_sql, order_sql, params_where, params_order) para buscar
+    personas por nombre/apellido (sin tildes ni mayúsculas) o por prefijo de
+    documento. Un documento que empieza por q va antes que cualquier nombre.
+    """
+    expr = EXPR_NOMBRE_PERSONA.format(a=alias)
+    where_nombre, order_nombre, params_where, params_order = filtro_texto(expr, q)
+    prefijo_doc = f'{escapar_like(q.strip())}%'
+    where = f"({alias}.num_doc LIKE %s OR {where_nombre})"
+    order = f"({alias}.num_doc LIKE %s) DESC, {order_nombre}"
+    return where, order, [prefijo_doc] + params_where, [prefijo_doc] + params_order
+
+
+def relevancia_personas(q, alias='p'):
+    """
+    Retorna (expr_sql, params): un solo número que ordena igual que el ORDER BY
+    de filtro_personas (documento > prefijo de nombre > similitud), para usarlo
+    como columna de la clave de paginación.
+    """
+    expr = EXPR_NOMBRE_PERSONA.format(a=alias)
+    termino = q.strip()
+    prefijo = f'{escapar_like(termino)}%'
+    sql = (f"(({alias}.num_doc LIKE %s)::int * 4 + ({expr} LIKE {TERMINO})::int * 2"
+           f" + similarity({expr}, {TERMINO}))::float8")
+    return sql, [prefijo, prefijo, termino]
+
+
+def filtro_medicamentos(q, alias='m'):
+    return filtro_texto(EXPR_NOMBRE_MEDICAMENTO.format(a=alias), q)
+
+
+def filtro_enfermedades(q, alias='e'):
+    return filtro_texto(EXPR_NOMBRE_ENFERMEDAD.format(a=alias), q)
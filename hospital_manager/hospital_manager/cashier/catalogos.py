@@ -0,0 +1,158 @@
+"""
+Catálogos de Referencia del Sistema Hospitalario HIS+
+Carga una vez por proceso los catálogos que casi no cambian (por sede cuando
+aplica) y los recarga solo cuando sube su versión en version_catalogos.
+Los que cambian con cada operación (stock) se guardan unos segundos (TTL).
+
+La caché es de cada proceso. Cuánto puede estar desactualizado un catálogo:
+- Con versión: hasta CATALOGOS_REVISION segundos (más lo que tarde la carga)
+  tras el cambio, en cualquier proceso. El trigger de version_catalogos sube
+  la versión en la misma transacción que el cambio.
+- Sin versión (TTL): hasta CATALOGOS_TTL segundos en los demás procesos.
+- En el proceso que escribió desde la app: nada, porque la vista llama a
+  invalidar_catalogos(), que fuerza la revisión y descarta los de TTL.
+Por eso los formularios vuelven a validar contra la base lo que importa al
+guardar (p. ej. el stock en PrescripcionForm).
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router
+
+# ============================================================================
+# DEFINICIÓN DE CATÁLOGOS
+# ============================================================================
+
+# nombre -> (query, por_sede, versión de la que depende, leer en el nodo de la sede)
+# Las queries por sede reciben [id_sede]. Sin versión (None) el catálogo vence
+# a los CATALOGOS_TTL segundos.
+CATALOGOS = {
+    'enfermedades': (
+        "SELECT id_enfermedad, nombre_enfermedad FROM Enfermedades ORDER BY nombre_enfermedad",
+        False, 'enfermedades', False
+    ),
+    'departamentos': (
+        "SELECT id_dept, nom_dept FROM Departamentos WHERE id_sede = %s ORDER BY nom_dept",
+        True, 'departamentos', True
+    ),
+    'sedes': (
+        "SELECT * FROM Sedes_Hospitalarias ORDER BY nom_sede",
+        False, 'sedes', False
+    ),
+    'roles': (
+        "SELECT * FROM Roles ORDER BY id_rol",
+        False, 'roles', False
+    ),
+    'especialidades': (
+        "SELECT * FROM Especialidades ORDER BY nombre_esp",
+        False, 'especialidades', False
+    ),
+    # Medicamentos con stock en la sede (PrescripcionForm vuelve a validar el stock al enviar).
+    # El stock cambia con cada prescripción: una versión por trigger volvía
+    # version_catalogos una fila caliente, así que este catálogo usa TTL.
+    'medicamentos_disponibles': (
+        """
+        SELECT m.cod_med,
+               m.nom_med || ' - ' || m.principio_activo || ' (Stock: ' || i.stock_actual || ')' as descripcion
+        FROM Catalogo_Medicamentos m
+        INNER JOIN Inventario_Farmacia i ON m.cod_med = i.cod_med
+        WHERE i.id_sede = %s AND i.stock_actual > 0
+        ORDER BY m.nom_med
+        """,
+        True, None, False
+    ),
+}
+
+# (nombre, id_sede) -> (versión con la que se cargó, filas, momento de la carga)
+_cache = {}
+_versiones = {}
+_ultima_revision = 0.0
+_lock = threading.Lock()
+
+
+# ============================================================================
+# VERSIONES
+# ============================================================================
+
+def _ejecutar(query, params=None, using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(query, params or [])
+        return [tuple(fila) for fila in cursor.fetchall()]
+
+
+def _revisar_versiones():
+    """
+    Lee version_catalogos como máximo una vez cada CATALOGOS_REVISION segundos.
+    Entre revisiones los formularios no tocan la base de datos. La lectura se
+    hace fuera del lock: solo el hilo que reclama la revisión va a la base.
+    """
+    global _versiones, _ultima_revision
+    with _lock:
+        ahora = time.monotonic()
+        if ahora - _ultima_revision < getattr(settings, 'CATALOGOS_REVISION', 30):
+            return
+        _ultima_revision = ahora
+    try:
+        versiones = dict(_ejecutar("SELECT catalogo, version FROM version_catalogos"))
+    except DatabaseError:
+        # Sin tabla de versiones (o sin conexión): se sigue con lo que hay en memoria
+        return
+    with _lock:
+        _versiones = versiones
+
+
+def invalidar_catalogos():
+    """
+    Fuerza revisar las versiones en la siguiente lectura y descarta los
+    catálogos con TTL (p. ej. tras un cambio de stock desde la app). Llamarla
+    tras toda escritura de la app sobre una tabla de catálogo: solo afecta a
+    este proceso, los demás se enteran dentro del plazo del módulo.
+    """
+    global _ultima_revision
+    with _lock:
+        _ultima_revision = 0.0
+        for clave in [c for c in _cache if CATALOGOS[c[0]][2] is None]:
+            del _cache[clave]
+
+
+# ============================================================================
+# LECTURA
+# ============================================================================
+
+def _vigente(guardado, version, clave_version):
+    if clave_version is None:
+        return time.monotonic() - guardado[2] < getattr(settings, 'CATALOGOS_TTL', 30)
+    return guardado[0] == version
+
+
+def obtener_catalogo(nombre, id_sede=None):
+    """
+    Retorna las filas del catálogo (de memoria si sigue vigente). La consulta
+    corre sin el lock, que solo protege leer y reemplazar la entrada: un nodo
+    lento no detiene a los hilos que leen otros catálogos.
+    """
+    query, por_sede, clave_version, en_nodo = CATALOGOS[nombre]
+    clave = (nombre, id_sede if por_sede else None)
+    _revisar_versiones()
+    with _lock:
+        version = _versiones.get(clave_version) if clave_version else None
+        guardado = _cache.get(clave)
+    if guardado is not None and _vigente(guardado, version, clave_version):
+        return guardado[1]
+
+    alias = 'default'
+    if en_nodo:
+        alias = router.db_for_read(None, id_sede=id_sede) or 'default'
+    # Se guarda con la versión leída antes de cargar: si cambió mientras tanto,
+    # la próxima lectura vuelve a cargar
+    filas = _ejecutar(query, [id_sede] if por_sede else None, using=alias)
+    with _lock:
+        _cache[clave] = (version, filas, time.monotonic())
+    return filas
+
+
+def obtener_choices(nombre, id_sede=None):
+    """Retorna el catálogo como choices (id, nombre) para un Select"""
+    return [(fila[0], fila[1]) for fila in obtener_catalogo(nombre, id_sede)]
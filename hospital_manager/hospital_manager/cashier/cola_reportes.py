@@ -0,0 +1,225 @@
+"""
+Cola de Reportes del Sistema Hospitalario HIS+
+Los reportes pedidos con generar_reporte quedan como filas PENDIENTE en
+Reportes_Generados; un hilo (o el comando procesar_reportes) los genera fuera
+del request y deja el archivo en disco para descargarlo después
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+from .exportacion import FORMATOS, generar_exportacion
+from .identificadores import siguiente_id
+from .reportes import CONSULTAS_REPORTE, consulta_reporte
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+PENDIENTE, EN_PROCESO, COMPLETADO, ERROR = 'PENDIENTE', 'EN_PROCESO', 'COMPLETADO', 'ERROR'
+
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+def _directorio():
+    directorio = str(_config('REPORTES_DIR', settings.BASE_DIR / 'reportes_generados'))
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def ruta_artefacto(id_reporte, formato):
+    """Archivo del reporte en disco: <REPORTES_DIR>/<id_reporte>.<formato>"""
+    return os.path.join(_directorio(), f'{id_reporte}.{formato}')
+
+
+def clave_reporte(tipo, parametros, id_sede, id_emp):
+    """
+    Misma clave para el mismo tipo con los mismos parámetros (en cualquier
+    orden) pedido por el mismo empleado de la misma sede: un reporte reutilizado
+    tiene que ser uno que quien lo pide puede ver y descargar (puede_ver_reporte)
+    """
+    texto = f'{tipo}|{int(id_sede)}|{int(id_emp)}|' + json.dumps(parametros, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def puede_ver_reporte(reporte, id_sede, id_emp):
+    """Misma regla que la lista de Reportes Generados: de su sede o generado por el empleado"""
+    return reporte['id_sede'] == id_sede or reporte['id_emp_generador'] == id_emp
+
+
+# ============================================================================
+# ENCOLAR
+# ============================================================================
+
+def encolar_reporte(tipo, formato, id_sede, id_emp, parametros=None):
+    """
+    Registra el reporte como PENDIENTE y retorna (id_reporte, nuevo).
+    Si el mismo empleado ya pidió el mismo reporte dentro de
+    REPORTES_VENTANA_DEDUP segundos (y no falló, ni se borró su archivo),
+    retorna ese id en lugar de generarlo otra vez.
+    """
+    if tipo not in CONSULTAS_REPORTE or formato not in FORMATOS:
+        raise ValueError(f'Reporte no soportado: {tipo} ({formato})')
+    parametros = dict(parametros or {}, formato=formato)
+    clave = clave_reporte(tipo, parametros, id_sede, id_emp)
+
+    with transaction.atomic(), connections['default'].cursor() as cursor:
+        # Serializa solo las solicitudes con la misma clave
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [clave])
+        cursor.execute("""
+            SELECT id_reporte, estado, ruta_archivo FROM Reportes_Generados
+            WHERE clave_dedup = %s AND estado <> %s
+              AND fecha_generacion >= NOW() - make_interval(secs => %s)
+            ORDER BY fecha_generacion DESC LIMIT 1
+        """, [clave, ERROR, _config('REPORTES_VENTANA_DEDUP', 600)])
+        existente = cursor.fetchone()
+        # Un COMPLETADO cuyo archivo ya no está no sirve: se genera de nuevo
+        if existente and (existente[1] != COMPLETADO or (existente[2] and os.path.exists(existente[2]))):
+            return existente[0], False
+
+        id_reporte = siguiente_id('Reportes_Generados', id_sede)
+        cursor.execute("""
+            INSERT INTO Reportes_Generados (id_reporte, id_sede, id_emp_generador, fecha_generacion,
+                tipo_reporte, parametros_json, estado, clave_dedup)
+            VALUES (%s, %s, %s, NOW(), %s, %s, %s, %s)
+        """, [id_reporte, id_sede, id_emp, tipo, json.dumps(parametros), PENDIENTE, clave])
+
+    trabajador.despertar()
+    return id_reporte, True
+
+
+def estado_reporte(id_reporte):
+    """Retorna un dict con el estado del reporte, o None si no existe"""
+    with connections['default'].cursor() as cursor:
+        cursor.execute("""
+            SELECT id_reporte, id_sede, id_emp_generador, tipo_reporte, parametros_json, estado,
+                   fecha_generacion, fecha_fin, duracion_ms, ruta_archivo, mensaje_error
+            FROM Reportes_Generados WHERE id_reporte = %s
+        """, [id_reporte])
+        fila = cursor.fetchone()
+    if fila is None:
+        return None
+    columnas = ('id_reporte', 'id_sede', 'id_emp_generador', 'tipo', 'parametros', 'estado',
+                'fecha_generacion', 'fecha_fin', 'duracion_ms', 'ruta_archivo', 'mensaje_error')
+    reporte = dict(zip(columnas, fila))
+    reporte['parametros'] = json.loads(reporte['parametros'] or '{}')
+    return reporte
+
+
+# ============================================================================
+# PROCESAMIENTO
+# ============================================================================
+
+def _tomar_siguiente(cursor):
+    """Marca EN_PROCESO el pendiente más antiguo (SKIP LOCKED: varios trabajadores no chocan)"""
+    cursor.execute("""
+        UPDATE Reportes_Generados SET estado = %s, fecha_inicio = NOW()
+        WHERE id_reporte = (
+            SELECT id_reporte FROM Reportes_Generados
+            WHERE estado = %s
+            ORDER BY fecha_generacion
+            FOR UPDATE SKIP LOCKED LIMIT 1
+        )
+        RETURNING id_reporte, tipo_reporte, parametros_json
+    """, [EN_PROCESO, PENDIENTE])
+    return cursor.fetchone()
+
+
+def _recuperar_abandonados(cursor):
+    """Vuelve a PENDIENTE los reportes EN_PROCESO de un trabajador que murió"""
+    cursor.execute("""
+        UPDATE Reportes_Generados SET estado = %s, fecha_inicio = NULL
+        WHERE estado = %s AND fecha_inicio < NOW() - make_interval(secs => %s)
+    """, [PENDIENTE, EN_PROCESO, _config('REPORTES_TIEMPO_MAXIMO', 1800)])
+
+
+def generar_artefacto(id_reporte, tipo, parametros):
+    """Genera el archivo del reporte y registra estado y duración"""
+    formato = parametros.get('formato', 'csv')
+    ruta = ruta_artefacto(id_reporte, formato)
+    inicio = time.monotonic()
+    try:
+        contenido, _ = generar_exportacion(formato, consulta_reporte(tipo), CONSULTAS_REPORTE[tipo][0])
+        # Se escribe a un temporal: la descarga nunca ve un archivo a medias
+        with open(f'{ruta}.tmp', 'wb') as archivo:
+            for parte in contenido:
+                archivo.write(parte)
+        os.replace(f'{ruta}.tmp', ruta)
+        estado, error = COMPLETADO, None
+    except Exception as exc:
+        if os.path.exists(f'{ruta}.tmp'):
+            os.remove(f'{ruta}.tmp')
+        estado, error, ruta = ERROR, str(exc)[:500], None
+    duracion_ms = int((time.monotonic() - inicio) * 1000)
+
+    with connections['default'].cursor() as cursor:
+        cursor.execute("""
+            UPDATE Reportes_Generados
+            SET estado = %s, fecha_fin = NOW(), duracion_ms = %s, ruta_archivo = %s, mensaje_error = %s
+            WHERE id_reporte = %s
+        """, [estado, duracion_ms, ruta, error, id_reporte])
+    return estado
+
+
+def procesar_pendientes(maximo=None):
+    """Genera reportes pendientes hasta vaciar la cola (o `maximo`). Retorna cuántos procesó"""
+    procesados = 0
+    with connections['default'].cursor() as cursor:
+        _recuperar_abandonados(cursor)
+    while maximo is None or procesados < maximo:
+        with connections['default'].cursor() as cursor:
+            trabajo = _tomar_siguiente(cursor)
+        if trabajo is None:
+            break
+        id_reporte, tipo, parametros_json = trabajo
+        generar_artefacto(id_reporte, tipo, json.loads(parametros_json or '{}'))
+        procesados += 1
+    return procesados
+
+
+class TrabajadorReportes:
+    """
+    Hilo del proceso web que atiende la cola. Se inicia con el primer reporte
+    encolado y revisa la cola cada REPORTES_INTERVALO segundos. Con
+    REPORTES_EN_PROCESO = False la cola la atiende solo "manage.py procesar_reportes".
+    """
+
+    def __init__(self):
+        self._despertar = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def despertar(self):
+        if not _config('REPORTES_EN_PROCESO', True):
+            return
+        self._iniciar()
+        self._despertar.set()
+
+    def _iniciar(self):
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._ciclo, name='reportes', daemon=True)
+            self._hilo.start()
+
+    def _ciclo(self):
+        while True:
+            self._despertar.wait(timeout=_config('REPORTES_INTERVALO', 5.0))
+            self._despertar.clear()
+            conn = connections['default']
+            conn.close_if_unusable_or_obsolete()
+            try:
+                procesar_pendientes()
+            except DatabaseError:
+                conn.close()
+
+
+trabajador = TrabajadorReportes()
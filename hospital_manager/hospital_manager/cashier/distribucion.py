@@ -0,0 +1,323 @@
+"""
+Enrutamiento Distribuido del Sistema Hospitalario HIS+
+Envía las consultas de una sola sede directamente al nodo que la almacena
+"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router, transaction
+
+from .forms import ejecutar_query, ejecutar_query_one
+
+# ============================================================================
+# MAPA DE FRAGMENTOS POR SEDE
+# ============================================================================
+
+# Alias de DATABASES que almacena físicamente los fragmentos de cada sede.
+# Sede 1 vive en el coordinador (esquema nodo_local), sede 2 en Azure y sede 3 en AWS.
+SEDE_DB_ALIAS_DEFAULT = {
+    1: 'sede_1',
+    2: 'sede_2',
+    3: 'sede_3',
+}
+
+
+def alias_para_sede(id_sede):
+    """Retorna el alias de base de datos dueño de la sede (o 'default' si no hay nodo)"""
+    mapa = getattr(settings, 'SEDE_DB_ALIAS', SEDE_DB_ALIAS_DEFAULT)
+    try:
+        alias = mapa.get(int(id_sede))
+    except (TypeError, ValueError):
+        return 'default'
+    if alias and alias in settings.DATABASES:
+        return alias
+    return 'default'
+
+
+class SedeRouter:
+    """
+    Router de Django que dirige lecturas y escrituras al nodo de la sede.
+    Se usa con el hint id_sede; sin hint deja la decisión al coordinador.
+    """
+
+    def db_for_read(self, model, **hints):
+        id_sede = hints.get('id_sede')
+        if id_sede is None:
+            return None
+        return alias_para_sede(id_sede)
+
+    def db_for_write(self, model, **hints):
+        id_sede = hints.get('id_sede')
+        if id_sede is None:
+            return None
+        return alias_para_sede(id_sede)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Los esquemas de los nodos se crean con los scripts SQL, no con migraciones
+        return db == 'default'
+
+
+# ============================================================================
+# CONSULTAS ENRUTADAS POR SEDE
+# ============================================================================
+
+def ejecutar_query_sede(query, params=None, id_sede=None):
+    """
+    Ejecuta una query de una sola sede en el nodo que la almacena.
+    La query debe filtrar por id_sede y solo usar tablas presentes en todos los
+    nodos (Citas, Empleados, Departamentos, Personas, Pacientes, Roles, Sedes).
+    """
+    alias = router.db_for_read(None, id_sede=id_sede) if id_sede is not None else 'default'
+    return ejecutar_query(query, params, using=alias)
+
+
+def ejecutar_query_one_sede(query, params=None, id_sede=None):
+    """Igual que ejecutar_query_sede pero retorna un solo resultado"""
+    alias = router.db_for_read(None, id_sede=id_sede) if id_sede is not None else 'default'
+    return ejecutar_query_one(query, params, using=alias)
+
+
+# Citas escritas en el coordinador que el outbox aún no entregó al nodo
+# (inserciones y modificaciones: `fila` es la cita completa como quedará).
+# Hay a lo sumo un mensaje PENDIENTE por cita (ux_outbox_citas_cita_pendiente).
+CONSULTA_OUTBOX_SEDE = """
+    SELECT id_mensaje, id_cita FROM outbox_citas
+    WHERE estado = 'PENDIENTE' AND id_sede = %s
+"""
+CONSULTA_OUTBOX = """
+    SELECT id_mensaje, id_cita FROM outbox_citas
+    WHERE estado = 'PENDIENTE'
+"""
+
+# Tablas de las vistas distribuidas del coordinador que puede unir una query de
+# citas, y su versión vacía (mismas columnas) para cuando algún nodo no responde
+_TABLAS_REMOTAS = {
+    '{empleados}': ('Empleados', '(SELECT * FROM empleados_local WHERE FALSE)'),
+    '{departamentos}': ('Departamentos', '(SELECT * FROM departamentos_local WHERE FALSE)'),
+}
+
+
+def _con_tablas(query, vacias=False):
+    for marca, (tabla, vacia) in _TABLAS_REMOTAS.items():
+        query = query.replace(marca, vacia if vacias else tabla)
+    return query
+
+
+def _sin_outbox(query, pendientes):
+    """La query con {citas} sin las citas del outbox (en el nodo, la versión anterior)"""
+    if not pendientes:
+        return _con_tablas(query.replace('{citas}', 'Citas'))
+    # Los ids son enteros de la base: se pueden escribir en el SQL sin cambiar los parámetros
+    ids_cita = ', '.join(str(int(fila[1])) for fila in pendientes)
+    return _con_tablas(query.replace('{citas}', f'(SELECT * FROM Citas WHERE id_cita NOT IN ({ids_cita}))'))
+
+
+def _consultar_outbox(query, params, pendientes, nodo_caido):
+    """
+    La query con {citas} sobre las citas encoladas, en el coordinador (Pacientes
+    y Personas replicados; Empleados y Departamentos a través de dblink)
+    """
+    mensajes = ', '.join(str(int(fila[0])) for fila in pendientes)
+    outbox = query.replace(
+        '{citas}',
+        '(SELECT (jsonb_populate_record(NULL::citas_local, fila)).* FROM outbox_citas '
+        f'WHERE id_mensaje IN ({mensajes}))',
+    )
+    try:
+        return ejecutar_query(_con_tablas(outbox, vacias=nodo_caido), params)
+    except DatabaseError:
+        # Otro nodo caído rompe las vistas distribuidas: sin los datos del empleado
+        return ejecutar_query(_con_tablas(outbox, vacias=True), params)
+
+
+def ejecutar_citas_sede(query, params=None, id_sede=None):
+    """
+    Ejecuta una query de citas de una sede en su nodo y le agrega las citas que
+    siguen en outbox_citas. La query usa {citas} (y {empleados} o
+    {departamentos} si une esas tablas) en lugar de los nombres de tabla; las
+    filas no quedan ordenadas entre las dos fuentes (paginar las reordena).
+
+    Si el nodo no responde se retornan solo las del outbox en un
+    ResultadoDistribuido parcial: una cita recién agendada sigue visible.
+    """
+    alias = alias_para_sede(id_sede)
+    if alias == 'default':
+        # Sin nodo propio la vista Citas del coordinador ya incluye el outbox
+        return ResultadoDistribuido(ejecutar_query(_sin_outbox(query, []), params))
+    pendientes = ejecutar_query(CONSULTA_OUTBOX_SEDE, [id_sede])
+
+    filas, fallidos = [], []
+    try:
+        filas.extend(_consultar_nodo(alias, _sin_outbox(query, pendientes), params,
+                                     getattr(settings, 'SEDE_TIMEOUT_NODO', 5)))
+    except DatabaseError:
+        fallidos.append(alias)
+    if pendientes:
+        filas.extend(_consultar_outbox(query, params, pendientes, bool(fallidos)))
+    return ResultadoDistribuido(filas, fallidos)
+
+
+# ============================================================================
+# CONSULTAS ENTRE SEDES CON FILTROS EN CADA FRAGMENTO
+# ============================================================================
+
+def aliases_fragmentos():
+    """
+    Retorna los alias de todos los nodos de sede, o None si alguna sede no
+    tiene nodo propio (en ese caso hay que usar las vistas del coordinador).
+    """
+    mapa = getattr(settings, 'SEDE_DB_ALIAS', SEDE_DB_ALIAS_DEFAULT)
+    aliases = [alias_para_sede(id_sede) for id_sede in sorted(mapa)]
+    if not aliases or 'default' in aliases:
+        return None
+    return aliases
+
+
+def filtro_citas(alias='c', id_emp=None, cod_pac=None, desde=None, hasta=None, estado=None,
+                 ids_cita=None):
+    """
+    Construye el WHERE (sql, params) sobre Citas con los filtros recibidos.
+    El rango de fechas es semiabierto: desde <= fecha_hora < hasta.
+    """
+    condiciones = []
+    params = []
+    if ids_cita is not None:
+        condiciones.append(f'{alias}.id_cita = ANY(%s)')
+        params.append(list(ids_cita))
+    if id_emp is not None:
+        condiciones.append(f'{alias}.id_emp = %s')
+        params.append(id_emp)
+    if cod_pac is not None:
+        condiciones.append(f'{alias}.cod_pac = %s')
+        params.append(cod_pac)
+    if desde is not None:
+        condiciones.append(f'{alias}.fecha_hora >= %s')
+        params.append(desde)
+    if hasta is not None:
+        condiciones.append(f'{alias}.fecha_hora < %s')
+        params.append(hasta)
+    if estado is not None:
+        condiciones.append(f'{alias}.estado = %s')
+        params.append(estado)
+    return ' AND '.join(condiciones) or 'TRUE', params
+
+
+class ResultadoDistribuido(list):
+    """
+    Filas combinadas de varios nodos. Si algún nodo no respondió dentro del
+    plazo (o falló) sus filas no están y el resultado queda marcado como parcial.
+    """
+
+    def __init__(self, filas=(), nodos_fallidos=()):
+        super().__init__(filas)
+        self.nodos_fallidos = list(nodos_fallidos)
+
+    @property
+    def parcial(self):
+        return bool(self.nodos_fallidos)
+
+
+_pool_fragmentos = None
+
+
+def _get_pool():
+    """Pool de hilos compartido por el proceso para consultar los nodos en paralelo"""
+    global _pool_fragmentos
+    if _pool_fragmentos is None:
+        _pool_fragmentos = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'SEDE_MAX_WORKERS', 8),
+            thread_name_prefix='fragmentos'
+        )
+    return _pool_fragmentos
+
+
+def _consultar_nodo(alias, query, params, timeout):
+    """Ejecuta la query en un nodo desde un hilo del pool (cada hilo tiene su conexión)"""
+    conn = connections[alias]
+    # Los hilos del pool no reciben las señales de request: revisar aquí la conexión
+    conn.close_if_unusable_or_obsolete()
+    try:
+        # SET LOCAL dura solo la transacción: la conexión es persistente
+        # (CONN_MAX_AGE) y en el hilo del request la reusa el resto de la vista
+        with transaction.atomic(using=alias), conn.cursor() as cursor:
+            # Que el nodo aborte por sí mismo una query que ya no vamos a esperar
+            cursor.execute('SET LOCAL statement_timeout = %s', [int(timeout * 1000)])
+            cursor.execute(query, params or [])
+            return cursor.fetchall()
+    except DatabaseError:
+        conn.close()
+        raise
+
+
+def ejecutar_query_fragmentos(query, params=None, orden=None, descendente=False, limite=None,
+                              timeout=None):
+    """
+    Ejecuta la misma query (con sus filtros) en el nodo de cada sede y combina
+    las filas ya filtradas. Cada nodo solo devuelve lo que cumple el WHERE, en
+    vez de traer la tabla remota completa a través de dblink.
+
+    Los nodos se consultan en paralelo, así que la latencia es la del nodo más
+    lento y no la suma. Un nodo que no responde en `timeout` segundos se omite
+    y el ResultadoDistribuido queda con parcial=True.
+
+    orden: función clave para reordenar la combinación (p. ej. lambda r: r[1])
+    limite: máximo de filas tras combinar (la query puede llevar su propio LIMIT)
+    """
+    aliases = aliases_fragmentos()
+    if aliases is None:
+        resultado = ResultadoDistribuido(ejecutar_query(query, params))
+    else:
+        if timeout is None:
+            timeout = getattr(settings, 'SEDE_TIMEOUT_NODO', 5)
+        pool = _get_pool()
+        # Cada tarea corre en una copia del contexto del request: sus consultas
+        # quedan en la instrumentación de ese request (cashier/instrumentacion.py)
+        futuros = {
+            pool.submit(contextvars.copy_context().run, _consultar_nodo, alias, query, params, timeout): alias
+            for alias in aliases
+        }
+        terminados, pendientes = wait(futuros, timeout=timeout)
+
+        filas = []
+        fallidos = [futuros[f] for f in pendientes]
+        # Recorrer en el orden de los nodos para que la combinación sea estable
+        for futuro, alias in futuros.items():
+            if futuro not in terminados:
+                continue
+            try:
+                filas.extend(futuro.result())
+            except DatabaseError:
+                fallidos.append(alias)
+        resultado = ResultadoDistribuido(filas, sorted(fallidos))
+
+    if orden is not None:
+        resultado.sort(key=orden, reverse=descendente)
+    if limite is not None:
+        del resultado[limite:]
+    return resultado
+
+
+def ejecutar_citas_fragmentos(query, params=None, orden=None, descendente=False, limite=None,
+                              timeout=None):
+    """
+    ejecutar_query_fragmentos para queries sobre citas de varias sedes, con
+    las marcas de ejecutar_citas_sede ({citas}, {empleados}, {departamentos}).
+    Cada nodo excluye las citas que siguen en outbox_citas y esas se toman de
+    la fila encolada en el coordinador, que es la versión que quedará en el
+    nodo: una cita recién agendada (o cancelada) se ve igual que en las listas.
+    """
+    pendientes = ejecutar_query(CONSULTA_OUTBOX) if aliases_fragmentos() is not None else []
+    # Sin nodos propios se usa la vista Citas del coordinador, que ya incluye el outbox
+    resultado = ejecutar_query_fragmentos(_sin_outbox(query, pendientes), params, timeout=timeout)
+    if pendientes:
+        resultado.extend(_consultar_outbox(query, params, pendientes, resultado.parcial))
+    if orden is not None:
+        resultado.sort(key=orden, reverse=descendente)
+    if limite is not None:
+        del resultado[limite:]
+    return resultado
@@ -0,0 +1,66 @@
+"""
+Estadísticas del Dashboard del Sistema Hospitalario HIS+
+Contadores del día en una sola consulta, con caché corta por sede
+
+Sin CACHES configurado la caché de Django es LocMemCache, de cada proceso:
+invalidar_estadisticas_dashboard() solo limpia la del proceso que escribió, y
+los demás pueden mostrar contadores de hasta DASHBOARD_CACHE_TTL segundos.
+Con una caché compartida (Redis, Memcached) la invalidación llega a todos.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .distribucion import ejecutar_citas_sede
+
+# ============================================================================
+# CONTADORES DEL DASHBOARD
+# ============================================================================
+
+# Todas las tablas están en el nodo de la sede (Citas e Inventario_Farmacia
+# se fragmentan por id_sede), así que basta un solo viaje al nodo; las citas
+# que siguen en outbox_citas se cuentan aparte en el coordinador
+# (ejecutar_citas_sede). Los tres contadores de citas solo miran desde hoy en adelante.
+QUERY_ESTADISTICAS = """
+    SELECT
+        COUNT(*) FILTER (WHERE c.fecha_hora >= CURRENT_DATE
+                         AND c.fecha_hora < CURRENT_DATE + 1),
+        COUNT(*) FILTER (WHERE c.fecha_hora >= CURRENT_DATE
+                         AND c.fecha_hora < CURRENT_DATE + 1
+                         AND c.estado = 'COMPLETADA'),
+        COUNT(*) FILTER (WHERE c.estado = 'PROGRAMADA' AND c.fecha_hora >= NOW()),
+        (SELECT COUNT(*) FROM Inventario_Farmacia i
+         WHERE i.id_sede = %s AND i.stock_actual < 50)
+    FROM {citas} c
+    WHERE c.id_sede = %s AND c.fecha_hora >= CURRENT_DATE
+"""
+
+
+def _clave(id_sede):
+    return f'dashboard_stats:{id_sede}'
+
+
+def obtener_estadisticas_dashboard(id_sede):
+    """Retorna el dict de contadores de la sede (de la caché si está vigente)"""
+    stats = cache.get(_clave(id_sede))
+    if stats is not None:
+        return stats
+    filas = ejecutar_citas_sede(QUERY_ESTADISTICAS, [id_sede, id_sede], id_sede)
+    # Una fila del nodo y otra del outbox: los contadores de citas se suman; la
+    # subconsulta de stock se repite en cada fila y se toma una sola vez
+    stats = {
+        'citas_hoy': sum(fila[0] for fila in filas),
+        'pacientes_atendidos': sum(fila[1] for fila in filas),
+        'citas_pendientes': sum(fila[2] for fila in filas),
+        'alertas_stock': max((fila[3] for fila in filas), default=0),
+    }
+    # Sin el nodo los contadores quedan cortos: no se guardan
+    if not filas.parcial:
+        cache.set(_clave(id_sede), stats, getattr(settings, 'DASHBOARD_CACHE_TTL', 30))
+    return stats
+
+
+def invalidar_estadisticas_dashboard(id_sede):
+    """Descarta los contadores en caché de la sede tras un cambio en sus datos"""
+    if id_sede is not None:
+        cache.delete(_clave(id_sede))
@@ -0,0 +1,294 @@
+"""
+Exportación de Reportes del Sistema Hospitalario HIS+
+CSV, XLSX y PDF generados por partes desde un cursor del servidor, para que la
+memoria no crezca con el número de filas
+"""
+
+import csv
+import io
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from django.db import connection, transaction
+
+from .instrumentacion import registrar_consulta
+
+# Filas que se traen del servidor en cada viaje
+TAMANO_LOTE = 2000
+
+# ============================================================================
+# LECTURA POR LOTES
+# ============================================================================
+
+def lotes_consulta(query, params=None, tamano=TAMANO_LOTE):
+    """
+    Ejecuta la query con un cursor con nombre (server-side) y produce
+    (columnas, filas) de `tamano` filas cada vez.
+
+    El cursor vive dentro de transaction.atomic y no es WITH HOLD: así funciona
+    también detrás de pgbouncer en modo transacción (donde Django desactiva sus
+    propios cursores de servidor con DISABLE_SERVER_SIDE_CURSORS).
+
+    El cursor de psycopg no pasa por los execute_wrapper de Django: el tiempo
+    en la base (execute y cada fetchmany, no lo que tarda quien consume los
+    lotes) se mide aquí y se registra en la instrumentación al cerrar el cursor.
+    Una descarga en streaming termina después del middleware, así que solo
+    llega al registro de consultas lentas y no a Server-Timing.
+    """
+    with transaction.atomic():
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name=f'exportar_{uuid.uuid4().hex}')
+        cursor.itersize = tamano
+        en_base = 0.0
+        try:
+            inicio = time.perf_counter()
+            cursor.execute(query, params or [])
+            en_base += time.perf_counter() - inicio
+            columnas = None
+            while True:
+                inicio = time.perf_counter()
+                filas = cursor.fetchmany(tamano)
+                en_base += time.perf_counter() - inicio
+                if columnas is None:
+                    columnas = [col[0] for col in cursor.description]
+                if not filas:
+                    if columnas is not None:
+                        yield columnas, []
+                    break
+                yield columnas, filas
+        finally:
+            cursor.close()
+            registrar_consulta(connection.alias, query, params, en_base * 1000)
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M')
+    return str(valor)
+
+
+# ============================================================================
+# CSV
+# ============================================================================
+
+def generar_csv(lotes, titulo=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para que Excel abra bien las tildes
+    yield '\ufeff'.encode('utf-8')
+    encabezado = False
+    for columnas, filas in lotes:
+        if not encabezado:
+            writer.writerow(columnas)
+            encabezado = True
+        writer.writerows([[_texto(v) for v in fila] for fila in filas])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# ============================================================================
+# XLSX (zip escrito en flujo, hoja con cadenas en línea)
+# ============================================================================
+
+class _SalidaFlujo:
+    """Archivo de solo escritura sin seek: zipfile escribe los tamaños al final de cada entrada"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+XLSX_ESTATICOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _celda_xlsx(valor):
+    if isinstance(valor, bool) or valor is None:
+        return f'<c t="inlineStr"><is><t>{escape(_texto(valor))}</t></is></c>'
+    if isinstance(valor, (int, float)) or type(valor).__name__ == 'Decimal':
+        return f'<c><v>{valor}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_texto(valor))}</t></is></c>'
+
+
+def generar_xlsx(lotes, titulo='Reporte'):
+    salida = _SalidaFlujo()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in XLSX_ESTATICOS.items():
+            libro.writestr(nombre, contenido)
+        libro.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(titulo[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+        yield salida.vaciar()
+
+        with libro.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja:
+            hoja.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            encabezado = False
+            for columnas, filas in lotes:
+                partes = []
+                if not encabezado:
+                    partes.append('<row>' + ''.join(_celda_xlsx(c) for c in columnas) + '</row>')
+                    encabezado = True
+                for fila in filas:
+                    partes.append('<row>' + ''.join(_celda_xlsx(v) for v in fila) + '</row>')
+                hoja.write(''.join(partes).encode('utf-8'))
+                yield salida.vaciar()
+            hoja.write(b'</sheetData></worksheet>')
+    yield salida.vaciar()
+
+
+# ============================================================================
+# PDF (una página por vez, texto en Helvetica)
+# ============================================================================
+
+PDF_ANCHO, PDF_ALTO = 842, 595          # A4 horizontal, en puntos
+PDF_MARGEN = 36
+PDF_FUENTE = 7
+PDF_INTERLINEA = 10
+PDF_LINEAS = (PDF_ALTO - 2 * PDF_MARGEN) // PDF_INTERLINEA - 3   # menos título y encabezado
+
+
+def _texto_pdf(texto):
+    texto = texto.encode('cp1252', 'replace').decode('latin-1')
+    return texto.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def generar_pdf(lotes, titulo='Reporte'):
+    """
+    Escribe cada página en cuanto se llena. El objeto /Pages (que lista las
+    páginas) va al final, así solo se guardan los números de objeto y offsets.
+    """
+    offsets = {}
+    posicion = 0
+    paginas = []
+    siguiente_obj = 4   # 1 catálogo, 2 páginas, 3 fuente
+
+    def objeto(numero, cuerpo):
+        nonlocal posicion
+        offsets[numero] = posicion
+        datos = f'{numero} 0 obj\n'.encode('latin-1') + cuerpo + b'\nendobj\n'
+        posicion += len(datos)
+        return datos
+
+    def pagina(columnas, lineas, numero_pagina):
+        nonlocal siguiente_obj
+        ancho_col = (PDF_ANCHO - 2 * PDF_MARGEN) / max(len(columnas), 1)
+        max_chars = max(int(ancho_col / (PDF_FUENTE * 0.5)) - 1, 3)
+        y = PDF_ALTO - PDF_MARGEN
+        comandos = [f'BT /F1 10 Tf {PDF_MARGEN} {y} Td ({_texto_pdf(titulo)} - pag. {numero_pagina}) Tj ET']
+        for indice, valores in enumerate([columnas] + lineas):
+            y = PDF_ALTO - PDF_MARGEN - (indice + 2) * PDF_INTERLINEA
+            for col, valor in enumerate(valores):
+                texto = _texto(valor)[:max_chars]
+                x = PDF_MARGEN + col * ancho_col
+                comandos.append(f'BT /F1 {PDF_FUENTE} Tf {x:.1f} {y} Td ({_texto_pdf(texto)}) Tj ET')
+        contenido = '\n'.join(comandos).encode('latin-1')
+        num_contenido, num_pagina = siguiente_obj, siguiente_obj + 1
+        siguiente_obj += 2
+        paginas.append(num_pagina)
+        return (
+            objeto(num_contenido, f'<< /Length {len(contenido)} >>\nstream\n'.encode('latin-1')
+                   + contenido + b'\nendstream')
+            + objeto(num_pagina, (
+                f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PDF_ANCHO} {PDF_ALTO}] '
+                f'/Resources << /Font << /F1 3 0 R >> >> /Contents {num_contenido} 0 R >>'
+            ).encode('latin-1'))
+        )
+
+    cabecera = b'%PDF-1.4\n'
+    posicion = len(cabecera)
+    yield cabecera
+    yield objeto(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+
+    columnas = []
+    pendientes = []
+    for columnas, filas in lotes:
+        for fila in filas:
+            pendientes.append(fila)
+            if len(pendientes) == PDF_LINEAS:
+                yield pagina(columnas, pendientes, len(paginas) + 1)
+                pendientes = []
+    if pendientes or not paginas:
+        yield pagina(columnas, pendientes, len(paginas) + 1)
+
+    kids = ' '.join(f'{n} 0 R' for n in paginas)
+    final = objeto(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(paginas)} >>'.encode('latin-1'))
+    final += objeto(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    total = max(offsets) + 1
+    xref = [f'xref\n0 {total}\n', '0000000000 65535 f \n']
+    xref += [f'{offsets[n]:010d} 00000 n \n' for n in range(1, total)]
+    xref.append(f'trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{posicion}\n%%EOF\n')
+    yield final + ''.join(xref).encode('latin-1')
+
+
+# ============================================================================
+# FORMATOS
+# ============================================================================
+
+# formato -> (generador, content type)
+FORMATOS = {
+    'csv': (generar_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (generar_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'pdf': (generar_pdf, 'application/pdf'),
+}
+
+
+def generar_exportacion(formato, query, titulo, params=None):
+    """Retorna (iterador de bytes, content type) para el formato pedido"""
+    generador, content_type = FORMATOS[formato]
+    return generador(lotes_consulta(query, params), titulo), content_type
@@ -5,24 +5,28 @@ Sistema SIN ORM - Validación de datos con consultas SQL directas
 
 from django import forms
 from django.core.exceptions import ValidationError
-from django.db import connection
+from django.db import connection, connections
 from datetime import datetime, date
 import re
 
+from .catalogos import obtener_choices
+
 # ============================================================================
 # FUNCIONES HELPER PARA CONSULTAS SQL
 # ============================================================================
 
-def ejecutar_query(query, params=None):
+def ejecutar_query(query, params=None, using=None):
     """Ejecuta una query y retorna los resultados"""
-    with connection.cursor() as cursor:
+    conn = connections[using] if using else connection
+    with conn.cursor() as cursor:
         cursor.execute(query, params or [])
         return cursor.fetchall()
 
 
-def ejecutar_query_one(query, params=None):
+def ejecutar_query_one(query, params=None, using=None):
     """Ejecuta una query y retorna un solo resultado"""
-    with connection.cursor() as cursor:
+    conn = connections[using] if using else connection
+    with conn.cursor() as cursor:
         cursor.execute(query, params or [])
         return cursor.fetchone()
 
@@ -65,21 +69,12 @@ class LoginForm(forms.Form):
         password = cleaned_data.get('password')
         
         if email and password:
-            # Verificar credenciales en la BD
-            query = """
-                SELECT e.id_emp, e.activo
-                FROM Empleados e
-                INNER JOIN Personas p ON e.id_persona = p.id_persona
-                WHERE p.email_persona = %s 
-                AND e.hash_contra = crypt(%s, e.hash_contra)
-            """
-            result = ejecutar_query_one(query, [email, password])
-            
-            if not result:
-                raise ValidationError('Credenciales inválidas.')
-            
-            if not result[1]:  # activo = False
-                raise ValidationError('Su cuenta está desactivada. Contacte al administrador.')
+            # Importado aquí: autenticacion usa los helpers de este módulo
+            from .autenticacion import ErrorAutenticacion, autenticar
+            try:
+                self.empleado = autenticar(email, password)
+            except ErrorAutenticacion as e:
+                raise ValidationError(str(e))
         
         return cleaned_data
 
@@ -101,24 +96,22 @@ class CambiarPasswordForm(forms.Form):
         widget=forms.PasswordInput(attrs={'class': 'form-control'})
     )
     
-    def __init__(self, user_email, *args, **kwargs):
+    def __init__(self, user_email, *args, ip=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.user_email = user_email
+        self.ip = ip
+        self.empleado = None
     
     def clean_password_actual(self):
+        from .autenticacion import DemasiadosIntentos, ErrorAutenticacion, autenticar
         password = self.cleaned_data.get('password_actual')
         
-        # Verificar que la contraseña actual sea correcta
-        query = """
-            SELECT e.id_emp
-            FROM Empleados e
-            INNER JOIN Personas p ON e.id_persona = p.id_persona
-            WHERE p.email_persona = %s 
-            AND e.hash_contra = crypt(%s, e.hash_contra)
-        """
-        result = ejecutar_query_one(query, [self.user_email, password])
-        
-        if not result:
+        # Verificar que la contraseña actual sea correcta (mismo límite de intentos que el login)
+        try:
+            self.empleado = autenticar(self.user_email, password, self.ip)
+        except DemasiadosIntentos as e:
+            raise ValidationError(str(e))
+        except ErrorAutenticacion:
             raise ValidationError('La contraseña actual es incorrecta.')
         
         return password
@@ -265,9 +258,11 @@ class PacienteForm(PersonaForm):
 class CitaForm(forms.Form):
     """Formulario para programar/editar citas"""
     
+    # El paciente se elige con autocompletado (api_buscar_pacientes); el form
+    # solo recibe el cod_pac y valida ese único valor
     cod_pac = forms.IntegerField(
         label='Paciente',
-        widget=forms.Select(attrs={'class': 'form-select'})
+        widget=forms.HiddenInput()
     )
     id_emp = forms.IntegerField(
         label='Médico',
@@ -315,21 +310,26 @@ class CitaForm(forms.Form):
         self.id_sede = id_sede
         
         # Cargar opciones dinámicamente desde la BD
-        self._cargar_pacientes()
+        self._cargar_paciente_seleccionado()
         self._cargar_medicos(id_sede)
         self._cargar_departamentos(id_sede)
     
-    def _cargar_pacientes(self):
-        """Cargar lista de pacientes"""
+    def _cargar_paciente_seleccionado(self):
+        """Cargar solo el paciente enviado (o el inicial) para validarlo y mostrar su nombre"""
+        self.paciente_seleccionado = None
+        valor = self.data.get('cod_pac') if self.is_bound else self.initial.get('cod_pac')
+        try:
+            cod_pac = int(valor)
+        except (TypeError, ValueError):
+            return
         query = """
             SELECT pac.cod_pac, 
                    p.nom_persona || ' ' || p.apellido_persona || ' (' || p.num_doc || ')' as nombre_completo
             FROM Pacientes pac
             INNER JOIN Personas p ON pac.id_persona = p.id_persona
-            ORDER BY p.apellido_persona, p.nom_persona
+            WHERE pac.cod_pac = %s
         """
-        choices = obtener_choices_from_db(query)
-        self.fields['cod_pac'].widget.choices = [('', 'Seleccione un paciente')] + choices
+        self.paciente_seleccionado = ejecutar_query_one(query, [cod_pac])
     
     def _cargar_medicos(self, id_sede):
         """Cargar lista de médicos de la sede"""
@@ -349,15 +349,15 @@ class CitaForm(forms.Form):
     
     def _cargar_departamentos(self, id_sede):
         """Cargar departamentos de la sede"""
-        query = """
-            SELECT id_dept, nom_dept
-            FROM Departamentos
-            WHERE id_sede = %s
-            ORDER BY nom_dept
-        """
-        choices = obtener_choices_from_db(query, [id_sede])
+        choices = obtener_choices('departamentos', id_sede)
         self.fields['id_dept'].widget.choices = [('', 'Seleccione un departamento')] + choices
     
+    def clean_cod_pac(self):
+        cod_pac = self.cleaned_data.get('cod_pac')
+        if self.paciente_seleccionado is None or self.paciente_seleccionado[0] != cod_pac:
+            raise ValidationError('El paciente seleccionado no existe.')
+        return cod_pac
+    
     def clean_fecha_hora(self):
         fecha = self.cleaned_data.get('fecha_hora')
         
@@ -403,12 +403,7 @@ class DiagnosticoForm(forms.Form):
     
     def _cargar_enfermedades(self):
         """Cargar catálogo de enfermedades"""
-        query = """
-            SELECT id_enfermedad, nombre_enfermedad
-            FROM Enfermedades
-            ORDER BY nombre_enfermedad
-        """
-        choices = obtener_choices_from_db(query)
+        choices = obtener_choices('enfermedades')
         self.fields['id_enfermedad'].widget.choices = [('', 'Seleccione una enfermedad')] + choices
 
 
@@ -455,15 +450,7 @@ class PrescripcionForm(forms.Form):
     
     def _cargar_medicamentos(self, id_sede):
         """Cargar medicamentos disponibles en la sede"""
-        query = """
-            SELECT m.cod_med, 
-                   m.nom_med || ' - ' || m.principio_activo || ' (Stock: ' || i.stock_actual || ')' as descripcion
-            FROM Catalogo_Medicamentos m
-            INNER JOIN Inventario_Farmacia i ON m.cod_med = i.cod_med
-            WHERE i.id_sede = %s AND i.stock_actual > 0
-            ORDER BY m.nom_med
-        """
-        choices = obtener_choices_from_db(query, [id_sede])
+        choices = obtener_choices('medicamentos_disponibles', id_sede)
         self.fields['cod_med'].widget.choices = [('', 'Seleccione un medicamento')] + choices
     
     def clean(self):
@@ -564,13 +551,7 @@ class EquipamientoForm(forms.Form):
         self._cargar_empleados(id_sede)
     
     def _cargar_departamentos(self, id_sede):
-        query = """
-            SELECT id_dept, nom_dept
-            FROM Departamentos
-            WHERE id_sede = %s
-            ORDER BY nom_dept
-        """
-        choices = obtener_choices_from_db(query, [id_sede])
+        choices = obtener_choices('departamentos', id_sede)
         self.fields['id_dept'].widget.choices = [('', 'Seleccione un departamento')] + choices
     
     def _cargar_empleados(self, id_sede):
@@ -613,6 +594,5 @@ class FiltroReportesForm(forms.Form):
         self._cargar_sedes()
     
     def _cargar_sedes(self):
-        query = "SELECT id_sede, nom_sede FROM Sedes_Hospitalarias ORDER BY nom_sede"
-        choices = obtener_choices_from_db(query)
+        choices = obtener_choices('sedes')
         self.fields['id_sede'].widget.choices = [('', 'Todas las sedes')] + choices
\ No newline at end of file
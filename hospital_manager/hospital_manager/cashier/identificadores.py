@@ -0,0 +1,88 @@
+"""
+Generación de Identificadores del Sistema Hospitalario HIS+
+Reserva bloques de IDs desde las secuencias de cada sede (sin MAX + 1)
+"""
+
+import threading
+
+from django.db import connections
+
+# ============================================================================
+# SECUENCIAS POR TABLA
+# ============================================================================
+
+# Nombre base de las secuencias del coordinador: hay una por sede con el rango
+# exclusivo de la sede (seq_citas_sede_N: N*100000000 + 1 ..). Ver sección 19
+# del script del coordinador.
+SECUENCIAS = {
+    'Personas': 'seq_personas',
+    'Pacientes': 'seq_pacientes',
+    'Citas': 'seq_citas',
+    'Historias_Clinicas': 'seq_historias_clinicas',
+    'Diagnostico': 'seq_diagnostico',
+    'Prescripciones': 'seq_prescripciones',
+    'Equipamiento': 'seq_equipamiento',
+    'Reportes_Generados': 'seq_reportes_generados',
+}
+
+def secuencia_coordinador(tabla, id_sede):
+    """
+    Secuencia del coordinador con el rango de la sede (seq_citas_sede_2, ...).
+    Las filas se escriben en el coordinador, así que los IDs también salen de
+    ahí: reservar un bloque no depende de que el nodo de la sede responda.
+    """
+    return f'{SECUENCIAS[tabla]}_sede_{int(id_sede)}'
+
+
+# Bloques reservados por el proceso: secuencia -> [siguiente, limite)
+_bloques = {}
+_bloques_lock = threading.Lock()
+
+
+def _reservar_bloque(secuencia):
+    """
+    Reserva un bloque de IDs con un solo nextval(). La secuencia avanza de a
+    INCREMENT BY, así que el valor retornado y los siguientes (incremento - 1)
+    quedan reservados para este proceso.
+    """
+    with connections['default'].cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(%s::regclass), seqincrement FROM pg_sequence WHERE seqrelid = %s::regclass",
+            [secuencia, secuencia]
+        )
+        inicio, incremento = cursor.fetchone()
+    return [inicio, inicio + incremento]
+
+
+def _tomar(secuencia):
+    """Toma un ID del bloque del proceso; None si está agotado (llamar con el lock)"""
+    bloque = _bloques.get(secuencia)
+    if bloque is None or bloque[0] >= bloque[1]:
+        return None
+    nuevo_id = bloque[0]
+    bloque[0] += 1
+    return nuevo_id
+
+
+def siguiente_id(tabla, id_sede):
+    """
+    Retorna un ID nuevo para `tabla` dentro del rango de la sede.
+    Solo consulta la base de datos cuando se agota el bloque reservado, y lo
+    hace sin el lock: los demás hilos siguen tomando IDs de otras secuencias.
+    """
+    secuencia = secuencia_coordinador(tabla, id_sede)
+    with _bloques_lock:
+        nuevo_id = _tomar(secuencia)
+    if nuevo_id is not None:
+        return nuevo_id
+
+    bloque = _reservar_bloque(secuencia)
+    with _bloques_lock:
+        nuevo_id = bloque[0]
+        bloque[0] += 1
+        # Si otro hilo repuso el bloque mientras tanto se conserva el suyo y
+        # del nuestro solo se usa este ID (el resto queda como hueco)
+        actual = _bloques.get(secuencia)
+        if actual is None or actual[0] >= actual[1]:
+            _bloques[secuencia] = bloque
+    return nuevo_id
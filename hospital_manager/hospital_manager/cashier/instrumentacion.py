@@ -0,0 +1,301 @@
+"""
+Instrumentación de SQL del Sistema Hospitalario HIS+
+Toda consulta que pasa por un cursor de Django (ejecutar_query, ejecutar_update,
+los fragmentos por nodo...) se mide con un execute_wrapper. Por request se
+acumulan las consultas y el tiempo en la base por destino (alias del nodo, o
+"dblink" si en el coordinador tocó las vistas distribuidas) y la consulta más
+lenta; el middleware lo devuelve en la cabecera Server-Timing y avisa de
+patrones N+1. Las consultas lentas van al logger his.sql con los parámetros
+redactados. Los totales por ruta y por huella quedan en memoria del proceso
+para /metricas/sql/.
+"""
+
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('his.sql')
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+# ============================================================================
+# HUELLAS Y REDACCIÓN
+# ============================================================================
+
+_COMENTARIOS = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+_LISTAS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_ESPACIOS = re.compile(r'\s+')
+# Vistas del coordinador que unen las sedes con dblink (y llamadas directas)
+_DBLINK = re.compile(r'\b(?:citas|empleados|departamentos|dblink\w*)\b', re.IGNORECASE)
+
+
+def huella(sql):
+    """SQL sin literales ni parámetros: agrupa las ejecuciones de la misma consulta"""
+    sql = _COMENTARIOS.sub(' ', sql)
+    sql = _LITERALES.sub('?', sql)
+    sql = _LISTAS.sub('(...)', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+def _redactar_valor(valor):
+    if valor is None or isinstance(valor, (bool, int, float, Decimal)):
+        return valor
+    if isinstance(valor, (date, datetime)):
+        return '<fecha>'
+    if isinstance(valor, str):
+        return f'<texto:{len(valor)}>'
+    if isinstance(valor, (list, tuple)):
+        return f'<{len(valor)} valores>'
+    return f'<{type(valor).__name__}>'
+
+
+def redactar(params):
+    """Parámetros sin datos de pacientes: se conservan los números y se ocultan textos y fechas"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {clave: _redactar_valor(valor) for clave, valor in params.items()}
+    return [_redactar_valor(valor) for valor in params]
+
+
+def _texto_cabecera(texto, largo=80):
+    """desc de Server-Timing: ASCII, sin comillas y corto"""
+    texto = texto.encode('ascii', 'ignore').decode().replace('"', "'").replace('\\', '')
+    return texto if len(texto) <= largo else texto[:largo - 3] + '...'
+
+
+# ============================================================================
+# RECOLECCIÓN POR REQUEST
+# ============================================================================
+
+class Recolector:
+    """Consultas de un request (los hilos del pool de fragmentos suman aquí también)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ruta = None
+        self.consultas = 0
+        self.tiempo_ms = 0.0
+        self.por_destino = {}    # destino -> [consultas, ms]
+        self.por_huella = {}     # huella -> [consultas, ms, destino]
+        self.mas_lenta = None    # (ms, destino, huella)
+
+    def registrar(self, destino, texto, ms):
+        with self._lock:
+            self.consultas += 1
+            self.tiempo_ms += ms
+            total = self.por_destino.setdefault(destino, [0, 0.0])
+            total[0] += 1
+            total[1] += ms
+            por_huella = self.por_huella.setdefault(texto, [0, 0.0, destino])
+            por_huella[0] += 1
+            por_huella[1] += ms
+            if self.mas_lenta is None or ms > self.mas_lenta[0]:
+                self.mas_lenta = (ms, destino, texto)
+
+    def repetidas(self, umbral):
+        """Huellas ejecutadas `umbral` veces o más en el request (candidatas a N+1)"""
+        return [(texto, n, ms) for texto, (n, ms, _) in self.por_huella.items() if n >= umbral]
+
+    def server_timing(self, total_ms, detalle=False):
+        """
+        Valor de la cabecera Server-Timing. La consulta más lenta (su huella)
+        solo va con detalle=True: la cabecera la ve cualquier cliente.
+        """
+        partes = [f'db;dur={self.tiempo_ms:.1f};desc="{self.consultas} consultas"']
+        for destino, (n, ms) in sorted(self.por_destino.items()):
+            partes.append(f'db-{destino};dur={ms:.1f};desc="{n} consultas"')
+        if detalle and self.mas_lenta:
+            ms, destino, texto = self.mas_lenta
+            partes.append(f'sql-lenta;dur={ms:.1f};desc="{destino}: {_texto_cabecera(texto)}"')
+        partes.append(f'app;dur={total_ms:.1f}')
+        return ', '.join(partes)
+
+
+_recolector_actual = contextvars.ContextVar('his_recolector_sql', default=None)
+
+
+def _destino(alias, sql):
+    if alias == 'default' and _DBLINK.search(sql):
+        return 'dblink'
+    return alias
+
+
+def _registrar(alias, sql, params, many, ms):
+    recolector = _recolector_actual.get()
+    umbral_lento = _config('SQL_UMBRAL_LENTO_MS', 200)
+    # Fuera de un request solo interesa el registro de lentas
+    if recolector is None and ms < umbral_lento:
+        return
+    texto = huella(sql)
+    destino = _destino(alias, texto)
+    if recolector is not None:
+        recolector.registrar(destino, texto, ms)
+    if ms >= umbral_lento:
+        logger.warning(json.dumps({
+            'ms': round(ms, 1),
+            'destino': destino,
+            'ruta': recolector.ruta if recolector else 'segundo plano',
+            'huella': texto,
+            'params': f'<{len(params)} filas>' if many else redactar(params),
+        }, ensure_ascii=False, default=str))
+
+
+def registrar_consulta(alias, sql, params, ms):
+    """
+    Registra una consulta que no pasó por un cursor de Django (p. ej. el cursor
+    con nombre de psycopg de exportacion.lotes_consulta), medida por quien la ejecuta
+    """
+    _registrar(alias, sql, params, False, ms)
+
+
+def _envoltura(alias):
+    def envoltura(execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            _registrar(alias, sql, params, many, (time.perf_counter() - inicio) * 1000)
+    return envoltura
+
+
+def _al_crear_conexion(sender, connection, **kwargs):
+    # connection_created se emite en cada reconexión del mismo wrapper: instalar una sola vez
+    if not getattr(connection, '_his_instrumentada', False):
+        connection.execute_wrappers.append(_envoltura(connection.alias))
+        connection._his_instrumentada = True
+
+
+def instalar():
+    """Mide todas las conexiones que se abran desde ahora (llamado en CashierConfig.ready)"""
+    if _config('SQL_INSTRUMENTACION', True):
+        connection_created.connect(_al_crear_conexion, dispatch_uid='his_instrumentacion_sql')
+
+
+# ============================================================================
+# MÉTRICAS DEL PROCESO
+# ============================================================================
+
+class MetricasSQL:
+    """Totales acumulados por ruta y por huella desde que arrancó el proceso"""
+
+    MAX_HUELLAS = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.desde = datetime.now()
+            self.rutas = {}
+            self.huellas = {}
+
+    def acumular(self, ruta, recolector, total_ms, n_mas_1):
+        with self._lock:
+            r = self.rutas.setdefault(ruta, {
+                'requests': 0, 'consultas': 0, 'db_ms': 0.0, 'total_ms': 0.0,
+                'max_consultas': 0, 'max_db_ms': 0.0, 'n_mas_1': 0, 'por_destino': {},
+            })
+            r['requests'] += 1
+            r['consultas'] += recolector.consultas
+            r['db_ms'] += recolector.tiempo_ms
+            r['total_ms'] += total_ms
+            r['max_consultas'] = max(r['max_consultas'], recolector.consultas)
+            r['max_db_ms'] = max(r['max_db_ms'], recolector.tiempo_ms)
+            r['n_mas_1'] += n_mas_1
+            for destino, (n, ms) in recolector.por_destino.items():
+                total = r['por_destino'].setdefault(destino, {'consultas': 0, 'ms': 0.0})
+                total['consultas'] += n
+                total['ms'] += ms
+
+            for texto, (n, ms, destino) in recolector.por_huella.items():
+                h = self.huellas.get(texto)
+                if h is None:
+                    if len(self.huellas) >= self.MAX_HUELLAS:
+                        # Se descarta la huella que menos tiempo acumula
+                        del self.huellas[min(self.huellas, key=lambda k: self.huellas[k]['ms'])]
+                    h = self.huellas[texto] = {'destino': destino, 'consultas': 0, 'ms': 0.0, 'rutas': set()}
+                h['consultas'] += n
+                h['ms'] += ms
+                h['rutas'].add(ruta)
+
+    def resumen(self, limite=50):
+        with self._lock:
+            rutas = [
+                {'ruta': ruta, **datos,
+                 'promedio_consultas': datos['consultas'] / datos['requests'],
+                 'promedio_db_ms': datos['db_ms'] / datos['requests']}
+                for ruta, datos in self.rutas.items()
+            ]
+            huellas = [
+                {'huella': texto, 'destino': h['destino'], 'consultas': h['consultas'], 'ms': h['ms'],
+                 'promedio_ms': h['ms'] / h['consultas'], 'rutas': sorted(h['rutas'])}
+                for texto, h in self.huellas.items()
+            ]
+            desde = self.desde
+        rutas.sort(key=lambda r: -r['db_ms'])
+        huellas.sort(key=lambda h: -h['ms'])
+        return {'desde': desde.isoformat(), 'rutas': rutas, 'huellas': huellas[:limite]}
+
+
+metricas = MetricasSQL()
+
+
+# ============================================================================
+# MIDDLEWARE
+# ============================================================================
+
+class InstrumentacionSQLMiddleware:
+    """Mide las consultas de cada request y agrega la cabecera Server-Timing"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _config('SQL_INSTRUMENTACION', True):
+            return self.get_response(request)
+        recolector = Recolector()
+        recolector.ruta = request.path
+        token = _recolector_actual.set(recolector)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _recolector_actual.reset(token)
+        total_ms = (time.perf_counter() - inicio) * 1000
+
+        repetidas = recolector.repetidas(_config('SQL_UMBRAL_N_MAS_1', 10))
+        for texto, n, ms in repetidas:
+            logger.warning(json.dumps({
+                'n_mas_1': n, 'ms': round(ms, 1), 'ruta': recolector.ruta, 'huella': texto,
+            }, ensure_ascii=False))
+        metricas.acumular(recolector.ruta, recolector, total_ms, len(repetidas))
+        # La huella de la consulta más lenta solo en DEBUG o para las IPs de
+        # /metricas/sql/ (REMOTE_ADDR: X-Forwarded-For lo escribe el cliente)
+        detalle = settings.DEBUG or request.META.get('REMOTE_ADDR') in _config(
+            'SQL_METRICAS_IPS', ('127.0.0.1', '::1'))
+        response['Server-Timing'] = recolector.server_timing(total_ms, detalle)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Agrupar por nombre de ruta y no por URL (que lleva los IDs)
+        recolector = _recolector_actual.get()
+        if recolector is not None and request.resolver_match is not None:
+            recolector.ruta = request.resolver_match.view_name
+        return None
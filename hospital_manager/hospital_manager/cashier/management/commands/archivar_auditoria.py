@@ -0,0 +1,50 @@
+"""
+Pasa a archivos los meses de Auditoria_Accesos fuera del horizonte caliente
+(meses_retencion en particiones_config) y los elimina de la base. Para el cron
+del sistema, después de mantener_particiones:
+    45 3 * * * python manage.py archivar_auditoria
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cashier.archivo_auditoria import (
+    ErrorArchivo, definir_horizonte, exportar_particion, particiones_tibias, pq, separar_vencidas,
+)
+
+
+class Command(BaseCommand):
+    help = 'Exporta a archivos (Parquet o CSV con gzip) los meses viejos de Auditoria_Accesos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int,
+                            help='Nuevo horizonte: meses que se conservan en la base (queda en particiones_config)')
+        parser.add_argument('--solo-exportar', action='store_true',
+                            help='No separar meses nuevos; solo exportar los que ya están en el esquema archivo')
+
+    def handle(self, *args, **options):
+        if options['meses'] is not None:
+            if options['meses'] < 1:
+                raise CommandError('--meses debe ser al menos 1')
+            definir_horizonte(options['meses'])
+        if not options['solo_exportar']:
+            self.stdout.write(f'{separar_vencidas()} meses separados al esquema archivo')
+
+        formato = 'Parquet' if pq is not None else 'CSV con gzip (instalar pyarrow para Parquet)'
+        fallidos = 0
+        for particion, oid, desde in particiones_tibias():
+            inicio = time.perf_counter()
+            try:
+                filas, ruta, tamano = exportar_particion(particion, oid, desde)
+            except ErrorArchivo as error:
+                fallidos += 1
+                self.stderr.write(self.style.ERROR(str(error)))
+                continue
+            self.stdout.write(
+                f'{desde:%Y-%m}  {filas:>10} filas  {tamano / 1048576:8.1f} MB  '
+                f'{time.perf_counter() - inicio:6.1f} s  {ruta}'
+            )
+        self.stdout.write(f'Formato: {formato}')
+        if fallidos:
+            raise CommandError(f'{fallidos} meses no se pudieron exportar (siguen en el esquema archivo)')
@@ -0,0 +1,45 @@
+"""
+Mide cuánto tarda un hash bcrypt con cada costo para elegir AUTH_BCRYPT_COSTO:
+    python manage.py calibrar_bcrypt --objetivo-ms 250
+Mide donde se verifica de verdad: en este proceso si está la librería bcrypt,
+si no con crypt() de pgcrypto en el coordinador.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cashier.autenticacion import bcrypt, generar_hash, verificar_hash
+
+
+class Command(BaseCommand):
+    help = 'Tiempo de verificación bcrypt por costo y costo recomendado para un objetivo en ms'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objetivo-ms', type=float, default=250, help='Tiempo máximo aceptable por login')
+        parser.add_argument('--desde', type=int, default=8)
+        parser.add_argument('--hasta', type=int, default=14)
+        parser.add_argument('--repeticiones', type=int, default=3)
+
+    def handle(self, *args, **options):
+        donde = 'librería bcrypt (proceso web)' if bcrypt is not None else 'pgcrypto (coordinador)'
+        self.stdout.write(f'Midiendo con {donde}; costo actual {getattr(settings, "AUTH_BCRYPT_COSTO", 10)}')
+        recomendado = None
+        for costo in range(options['desde'], options['hasta'] + 1):
+            hash_prueba = generar_hash('calibracion', costo=costo)
+            inicio = time.perf_counter()
+            for _ in range(options['repeticiones']):
+                verificar_hash('calibracion', hash_prueba)
+            ms = (time.perf_counter() - inicio) * 1000 / options['repeticiones']
+            self.stdout.write(f'costo {costo:>2}  {ms:>8.1f} ms  ({1000 / ms:.1f} logins/s por núcleo)')
+            if ms <= options['objetivo_ms']:
+                recomendado = costo
+            else:
+                break
+        if recomendado is None:
+            self.stdout.write(self.style.WARNING('Ningún costo del rango cumple el objetivo'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Recomendado: AUTH_BCRYPT_COSTO = {recomendado} (o HIS_AUTH_BCRYPT_COSTO={recomendado})'
+            ))
@@ -0,0 +1,33 @@
+"""
+Entrega a los nodos remotos las citas pendientes en outbox_citas.
+Pensado para el cron del sistema cuando el servidor no tiene pg_cron:
+    * * * * * python manage.py despachar_citas
+Con --reintentar-fallidas vuelve a encolar las citas que agotaron sus intentos
+(p. ej. después de corregir el dato que el nodo rechazaba).
+"""
+
+from django.core.management.base import BaseCommand
+
+from cashier.outbox import despachar, reintentar_fallidas, resumen_outbox
+
+
+class Command(BaseCommand):
+    help = 'Despacha el outbox de citas hacia Azure y AWS y muestra lo que sigue pendiente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=None, help='Mensajes por viaje a cada nodo')
+        parser.add_argument('--reintentar-fallidas', action='store_true',
+                            help='Volver a PENDIENTE las citas en estado FALLIDO antes de despachar')
+
+    def handle(self, *args, **options):
+        if options['reintentar_fallidas']:
+            self.stdout.write(f'{reintentar_fallidas()} citas FALLIDO vuelven a PENDIENTE')
+        despachar(options['lote'])
+        filas = resumen_outbox()
+        if not filas:
+            self.stdout.write('Outbox vacío')
+        for id_sede, estado, mensajes, intentos, proximo, error in filas:
+            self.stdout.write(
+                f'sede {id_sede}  {estado:<10} {mensajes:>6} mensajes  '
+                f'(intentos {intentos}, próximo {proximo}){"  " + error if error else ""}'
+            )
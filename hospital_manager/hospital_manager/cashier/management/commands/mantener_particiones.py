@@ -0,0 +1,36 @@
+"""
+Crea las particiones mensuales de los próximos meses y archiva las vencidas.
+Pensado para el cron del sistema cuando el servidor no tiene pg_cron:
+    15 3 * * * python manage.py mantener_particiones
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cashier.forms import ejecutar_query
+
+
+class Command(BaseCommand):
+    help = 'Mantiene las particiones de citas_local, Prescripciones y Auditoria_Accesos'
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute("CALL mantener_particiones()")
+        for tabla, particiones, primera, ultima, retencion in ejecutar_query("""
+            SELECT c.tabla, COUNT(p.relname), MIN(p.relname), MAX(p.relname), c.meses_retencion
+            FROM particiones_config c
+            LEFT JOIN pg_inherits i ON i.inhparent = c.tabla::regclass
+            LEFT JOIN pg_class p ON p.oid = i.inhrelid AND p.relname ~ '_p[0-9]{6}$'
+            GROUP BY c.tabla, c.meses_retencion
+            ORDER BY c.tabla
+        """):
+            self.stdout.write(
+                f'{tabla:<20} {particiones:>3} particiones ({primera} .. {ultima}), '
+                f'retención {f"{retencion} meses" if retencion else "sin límite"}'
+            )
+        for particion, esquema, filas, fecha in ejecutar_query("""
+            SELECT particion, esquema, filas, fecha_archivo FROM particiones_archivadas
+            WHERE fecha_archivo >= NOW() - INTERVAL '1 day' ORDER BY particion
+        """):
+            destino = f'{esquema}.{particion}' if esquema else 'eliminada'
+            self.stdout.write(f'archivada {particion} -> {destino} ({filas} filas, {fecha})')
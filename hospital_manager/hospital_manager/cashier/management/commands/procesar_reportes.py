@@ -0,0 +1,31 @@
+"""
+Atiende la cola de reportes (Reportes_Generados en estado PENDIENTE).
+Para un trabajador dedicado, con REPORTES_EN_PROCESO = False en el servidor web:
+    python manage.py procesar_reportes
+o desde el cron del sistema:
+    * * * * * python manage.py procesar_reportes --una-vez
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cashier.cola_reportes import procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Genera los reportes pendientes y deja los archivos en REPORTES_DIR'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Vaciar la cola una vez y terminar')
+
+    def handle(self, *args, **options):
+        while True:
+            procesados = procesar_pendientes()
+            if procesados:
+                self.stdout.write(f'{procesados} reporte(s) generados')
+            if options['una_vez']:
+                break
+            time.sleep(getattr(settings, 'REPORTES_INTERVALO', 5.0))
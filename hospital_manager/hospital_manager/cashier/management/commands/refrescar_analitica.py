@@ -0,0 +1,21 @@
+"""
+Refresca los resúmenes materializados de los reportes.
+Pensado para el cron del sistema cuando el servidor no tiene pg_cron:
+    */15 * * * * python manage.py refrescar_analitica
+"""
+
+from django.core.management.base import BaseCommand
+
+from cashier.analitica import refrescar_resumenes
+from cashier.forms import ejecutar_query
+
+
+class Command(BaseCommand):
+    help = 'Refresca (CONCURRENTLY) las vistas materializadas de los reportes'
+
+    def handle(self, *args, **options):
+        refrescar_resumenes()
+        for vista, fecha, duracion in ejecutar_query(
+            "SELECT vista, fecha_refresco, duracion_ms FROM refresco_analitica ORDER BY vista"
+        ):
+            self.stdout.write(f'{vista:<32} {fecha}  ({duracion} ms)')
@@ -0,0 +1,26 @@
+"""
+Replica los cambios de Personas, Pacientes e Historias_Clinicas entre el
+coordinador y los nodos. Pensado para el cron del sistema cuando el servidor
+no tiene pg_cron:
+    * * * * * python manage.py replicar_cambios
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cashier.forms import ejecutar_query
+
+
+class Command(BaseCommand):
+    help = 'Aplica en ambos sentidos los cambios registrados desde la última marca de cada nodo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help='Cambios por viaje a cada nodo')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute("CALL replicar_cambios(%s)", [options['lote']])
+        for nodo, sentido, txid, fecha in ejecutar_query(
+            "SELECT nodo, sentido, txid_desde, fecha FROM replicacion_marcas ORDER BY sentido, nodo"
+        ):
+            self.stdout.write(f'{nodo:<8} {sentido:<8} txid >= {txid}  ({fecha})')
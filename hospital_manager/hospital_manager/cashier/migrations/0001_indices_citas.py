@@ -0,0 +1,58 @@
+"""
+Índices compuestos de Citas en el coordinador.
+
+Las consultas por día / médico / paciente filtran con rangos semiabiertos sobre
+fecha_hora, así que estos índices cubren el filtro de igualdad y el rango.
+Se crean con CONCURRENTLY para no bloquear escrituras (por eso atomic = False).
+
+Las migraciones solo tocan el coordinador (citas_local guarda la sede 1); los
+nodos Azure/AWS crean los mismos índices sobre su tabla Citas en la sección
+"ÍNDICES DE CITAS" de su script de creación.
+"""
+
+from django.db import migrations
+
+INDICES = [
+    ('sede_fecha', 'id_sede, fecha_hora'),
+    ('emp_fecha', 'id_emp, fecha_hora'),
+    ('pac_fecha', 'cod_pac, fecha_hora'),
+]
+
+
+def _concurrently(cursor):
+    """
+    CONCURRENTLY no existe para tablas particionadas: si citas_local ya lo está
+    (script del coordinador, sección 29) el índice se crea en la tabla padre y
+    PostgreSQL lo propaga a cada partición. En una instalación nueva los
+    índices ya existen (sección 20) y IF NOT EXISTS no hace nada.
+    """
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('citas_local')")
+    fila = cursor.fetchone()
+    return '' if fila and fila[0] == 'p' else 'CONCURRENTLY '
+
+
+def crear_indices(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        modo = _concurrently(cursor)
+        for sufijo, columnas in INDICES:
+            cursor.execute(
+                f'CREATE INDEX {modo}IF NOT EXISTS idx_citas_local_{sufijo} ON citas_local ({columnas})'
+            )
+
+
+def eliminar_indices(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        modo = _concurrently(cursor)
+        for sufijo, _ in INDICES:
+            cursor.execute(f'DROP INDEX {modo}IF EXISTS idx_citas_local_{sufijo}')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = []
+
+    operations = [
+        migrations.RunPython(crear_indices, eliminar_indices),
+    ]
@@ -0,0 +1,41 @@
+"""
+Índices de búsqueda (pg_trgm + unaccent) en el coordinador.
+Ver cashier/busqueda.py: las expresiones deben coincidir con las de los índices.
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('cashier', '0001_indices_citas'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+                "CREATE EXTENSION IF NOT EXISTS unaccent",
+                """CREATE OR REPLACE FUNCTION f_unaccent(TEXT) RETURNS TEXT AS $$
+                       SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+                   $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_personas_nombre_trgm ON Personas
+                   USING GIN (lower(f_unaccent(nom_persona || ' ' || apellido_persona)) gin_trgm_ops)""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_personas_num_doc_prefijo
+                   ON Personas (num_doc varchar_pattern_ops)""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_medicamentos_nombre_trgm ON Catalogo_Medicamentos
+                   USING GIN (lower(f_unaccent(nom_med)) gin_trgm_ops)""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_enfermedades_nombre_trgm ON Enfermedades
+                   USING GIN (lower(f_unaccent(nombre_enfermedad)) gin_trgm_ops)""",
+            ],
+            reverse_sql=[
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_enfermedades_nombre_trgm",
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_medicamentos_nombre_trgm",
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_personas_num_doc_prefijo",
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_personas_nombre_trgm",
+            ],
+        ),
+    ]
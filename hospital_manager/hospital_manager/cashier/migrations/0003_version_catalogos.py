@@ -0,0 +1,58 @@
+"""
+Versiones de catálogos en el coordinador (ver cashier/catalogos.py y la
+sección "VERSIONES DE CATÁLOGOS" del script del coordinador).
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0002_indices_busqueda'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """CREATE TABLE IF NOT EXISTS version_catalogos (
+                       catalogo VARCHAR(50) PRIMARY KEY,
+                       version BIGINT NOT NULL DEFAULT 1,
+                       fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                   )""",
+                """INSERT INTO version_catalogos (catalogo) VALUES
+                       ('enfermedades'), ('departamentos'), ('sedes'), ('roles'),
+                       ('especialidades'), ('inventario')
+                   ON CONFLICT (catalogo) DO NOTHING""",
+                """CREATE OR REPLACE FUNCTION incrementar_version_catalogo()
+                   RETURNS TRIGGER AS $$
+                   BEGIN
+                       UPDATE version_catalogos
+                       SET version = version + 1, fecha_actualizacion = NOW()
+                       WHERE catalogo = TG_ARGV[0];
+                       RETURN NULL;
+                   END;
+                   $$ LANGUAGE plpgsql""",
+                """CREATE OR REPLACE TRIGGER trg_version_enfermedades AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Enfermedades
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('enfermedades')""",
+                """CREATE OR REPLACE TRIGGER trg_version_departamentos_local AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON departamentos_local
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('departamentos')""",
+                """CREATE OR REPLACE TRIGGER trg_version_departamentos AFTER INSERT OR UPDATE OR DELETE ON Departamentos
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('departamentos')""",
+                """CREATE OR REPLACE TRIGGER trg_version_sedes AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Sedes_Hospitalarias
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('sedes')""",
+                """CREATE OR REPLACE TRIGGER trg_version_roles AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Roles
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('roles')""",
+                """CREATE OR REPLACE TRIGGER trg_version_especialidades AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Especialidades
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('especialidades')""",
+                """CREATE OR REPLACE TRIGGER trg_version_inventario AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Inventario_Farmacia
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('inventario')""",
+                """GRANT SELECT ON version_catalogos TO administrador, medico, enfermero, administrativo, auditor""",
+                """GRANT UPDATE ON version_catalogos TO administrador, medico, enfermero, administrativo""",
+            ],
+            reverse_sql=[
+                "DROP TABLE IF EXISTS version_catalogos CASCADE",
+                "DROP FUNCTION IF EXISTS incrementar_version_catalogo() CASCADE",
+            ],
+        ),
+    ]
@@ -0,0 +1,80 @@
+"""
+Resúmenes materializados para los reportes (ver cashier/analitica.py y la
+sección "RESÚMENES MATERIALIZADOS PARA REPORTES" del script del coordinador).
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0003_version_catalogos'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """CREATE MATERIALIZED VIEW IF NOT EXISTS mv_consumo_medicamentos_dept AS
+                   SELECT * FROM vista_consumo_medicamentos_dept""",
+                """CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_consumo_medicamentos_dept
+                       ON mv_consumo_medicamentos_dept (id_sede, id_dept, cod_med, mes)""",
+                """CREATE MATERIALIZED VIEW IF NOT EXISTS mv_utilizacion_recursos AS
+                   SELECT * FROM vista_utilizacion_recursos""",
+                """CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_utilizacion_recursos
+                       ON mv_utilizacion_recursos (id_sede, mes)""",
+                """CREATE MATERIALIZED VIEW IF NOT EXISTS mv_medicos_consultas AS
+                   SELECT * FROM vista_medicos_consultas""",
+                """CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_medicos_consultas
+                       ON mv_medicos_consultas (id_emp, nom_sede, nom_dept, especialidad, semana)""",
+                """CREATE MATERIALIZED VIEW IF NOT EXISTS mv_enfermedades_por_sede AS
+                   SELECT * FROM vista_enfermedades_por_sede""",
+                """CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_enfermedades_por_sede
+                       ON mv_enfermedades_por_sede (id_sede, id_enfermedad, mes)""",
+                """CREATE TABLE IF NOT EXISTS refresco_analitica (
+                       vista VARCHAR(100) PRIMARY KEY,
+                       fecha_refresco TIMESTAMP,
+                       duracion_ms INT
+                   )""",
+                """INSERT INTO refresco_analitica (vista, fecha_refresco) VALUES
+                       ('mv_consumo_medicamentos_dept', NOW()), ('mv_utilizacion_recursos', NOW()),
+                       ('mv_medicos_consultas', NOW()), ('mv_enfermedades_por_sede', NOW())
+                   ON CONFLICT (vista) DO NOTHING""",
+                """CREATE OR REPLACE PROCEDURE refrescar_analitica()
+                   LANGUAGE plpgsql AS $$
+                   DECLARE
+                       resumen RECORD;
+                       inicio TIMESTAMP;
+                   BEGIN
+                       FOR resumen IN SELECT vista FROM refresco_analitica ORDER BY vista LOOP
+                           inicio := clock_timestamp();
+                           EXECUTE format('REFRESH MATERIALIZED VIEW CONCURRENTLY %I', resumen.vista);
+                           UPDATE refresco_analitica
+                           SET fecha_refresco = inicio,
+                               duracion_ms = EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000
+                           WHERE vista = resumen.vista;
+                           -- Cada resumen queda visible apenas termina, sin esperar a los demás
+                           COMMIT;
+                       END LOOP;
+                   END;
+                   $$""",
+                """DO $$
+                   BEGIN
+                       IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+                           PERFORM cron.schedule('refrescar_analitica', '*/15 * * * *', 'CALL refrescar_analitica()');
+                       END IF;
+                   END $$""",
+                """GRANT SELECT ON mv_consumo_medicamentos_dept, mv_utilizacion_recursos, mv_medicos_consultas,
+                       mv_enfermedades_por_sede, refresco_analitica
+                       TO administrador, medico, enfermero, administrativo, auditor""",
+            ],
+            reverse_sql=[
+                "DROP PROCEDURE IF EXISTS refrescar_analitica()",
+                "DROP TABLE IF EXISTS refresco_analitica",
+                "DROP MATERIALIZED VIEW IF EXISTS mv_enfermedades_por_sede",
+                "DROP MATERIALIZED VIEW IF EXISTS mv_medicos_consultas",
+                "DROP MATERIALIZED VIEW IF EXISTS mv_utilizacion_recursos",
+                "DROP MATERIALIZED VIEW IF EXISTS mv_consumo_medicamentos_dept",
+            ],
+        ),
+    ]
@@ -0,0 +1,68 @@
+"""
+vista_utilizacion_recursos agregando cada dimensión por separado.
+
+La versión anterior unía Citas, Historias_Clinicas, Equipamiento, Empleados y
+Pacientes a cada sede antes de agrupar, así que las filas intermedias crecían
+como citas x historias x equipos x empleados. Las columnas no cambian, por eso
+basta CREATE OR REPLACE (mv_utilizacion_recursos depende de la vista).
+
+La migración solo toca el coordinador. Los nodos Azure/AWS tienen la misma
+vista en su script de creación (Vista 10, también CREATE OR REPLACE: en un
+nodo existente basta ejecutar esa sentencia).
+"""
+
+from django.db import migrations
+
+VISTA = """
+    CREATE OR REPLACE VIEW vista_utilizacion_recursos AS
+    -- Citas se lee una sola vez (en el coordinador es una vista con dblink)
+    WITH citas_base AS (
+        SELECT id_sede, DATE_TRUNC('month', fecha_hora) AS mes, cod_pac
+        FROM Citas
+    ),
+    citas_mes AS (
+        SELECT id_sede, mes, COUNT(*) AS total_citas, COUNT(DISTINCT cod_pac) AS total_pacientes
+        FROM citas_base
+        GROUP BY id_sede, mes
+    ),
+    pacientes_mes AS (
+        SELECT DISTINCT id_sede, mes, cod_pac FROM citas_base
+    ),
+    historias_mes AS (
+        SELECT pm.id_sede, pm.mes, COUNT(DISTINCT hc.cod_hist) AS total_historias
+        FROM pacientes_mes pm
+        INNER JOIN Historias_Clinicas hc ON hc.cod_pac = pm.cod_pac
+        GROUP BY pm.id_sede, pm.mes
+    ),
+    equipos_sede AS (
+        SELECT id_sede, COUNT(*) AS total_equipamiento FROM Equipamiento GROUP BY id_sede
+    ),
+    empleados_sede AS (
+        SELECT id_sede, COUNT(*) AS total_empleados FROM Empleados GROUP BY id_sede
+    )
+    SELECT 
+        s.id_sede,
+        s.nom_sede,
+        COALESCE(cm.total_citas, 0) AS total_citas,
+        COALESCE(hm.total_historias, 0) AS total_historias,
+        COALESCE(eq.total_equipamiento, 0) AS total_equipamiento,
+        COALESCE(em.total_empleados, 0) AS total_empleados,
+        COALESCE(cm.total_pacientes, 0) AS total_pacientes_atendidos,
+        cm.mes
+    FROM Sedes_Hospitalarias s
+    LEFT JOIN citas_mes cm ON cm.id_sede = s.id_sede
+    LEFT JOIN historias_mes hm ON hm.id_sede = cm.id_sede AND hm.mes = cm.mes
+    LEFT JOIN equipos_sede eq ON eq.id_sede = s.id_sede
+    LEFT JOIN empleados_sede em ON em.id_sede = s.id_sede
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0004_resumenes_analitica'),
+    ]
+
+    operations = [
+        migrations.RunSQL(VISTA, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,46 @@
+"""
+Estado, duración y clave de deduplicación de Reportes_Generados en el
+coordinador (ver cashier/cola_reportes.py y la sección "COLA DE REPORTES" del
+script del coordinador).
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0005_utilizacion_recursos_por_dimension'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                # Los reportes registrados antes de la cola quedan como COMPLETADO
+                """ALTER TABLE Reportes_Generados
+                       ADD COLUMN IF NOT EXISTS estado VARCHAR(20) NOT NULL DEFAULT 'COMPLETADO',
+                       ADD COLUMN IF NOT EXISTS clave_dedup VARCHAR(64),
+                       ADD COLUMN IF NOT EXISTS fecha_inicio TIMESTAMP,
+                       ADD COLUMN IF NOT EXISTS fecha_fin TIMESTAMP,
+                       ADD COLUMN IF NOT EXISTS duracion_ms INT,
+                       ADD COLUMN IF NOT EXISTS ruta_archivo VARCHAR(255),
+                       ADD COLUMN IF NOT EXISTS mensaje_error VARCHAR(500)""",
+                """CREATE INDEX IF NOT EXISTS idx_reportes_pendientes ON Reportes_Generados (fecha_generacion)
+                   WHERE estado = 'PENDIENTE'""",
+                """CREATE INDEX IF NOT EXISTS idx_reportes_clave
+                   ON Reportes_Generados (clave_dedup, fecha_generacion)""",
+            ],
+            reverse_sql=[
+                "DROP INDEX IF EXISTS idx_reportes_clave",
+                "DROP INDEX IF EXISTS idx_reportes_pendientes",
+                """ALTER TABLE Reportes_Generados
+                       DROP COLUMN IF EXISTS mensaje_error,
+                       DROP COLUMN IF EXISTS ruta_archivo,
+                       DROP COLUMN IF EXISTS duracion_ms,
+                       DROP COLUMN IF EXISTS fecha_fin,
+                       DROP COLUMN IF EXISTS fecha_inicio,
+                       DROP COLUMN IF EXISTS clave_dedup,
+                       DROP COLUMN IF EXISTS estado""",
+            ],
+        ),
+    ]
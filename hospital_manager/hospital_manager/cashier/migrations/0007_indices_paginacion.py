@@ -0,0 +1,39 @@
+"""
+Índices de las claves de paginación en el coordinador (ver cashier/paginacion.py
+y la sección "ÍNDICES PARA PAGINACIÓN POR CLAVE" del script del coordinador).
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('cashier', '0006_cola_reportes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_auditoria_fecha_id
+                   ON Auditoria_Accesos (fecha_evento, id_evento)""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_auditoria_tabla_fecha_id
+                   ON Auditoria_Accesos (tabla_afectada, fecha_evento, id_evento)""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_prescripciones_fecha_id
+                   ON Prescripciones (fecha_emision, id_presc)""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_historias_fecha_id
+                   ON Historias_Clinicas (fecha_registro, cod_hist)""",
+                """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_personas_apellido_nombre
+                   ON Personas (apellido_persona, nom_persona)""",
+            ],
+            reverse_sql=[
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_personas_apellido_nombre",
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_historias_fecha_id",
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_prescripciones_fecha_id",
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_auditoria_tabla_fecha_id",
+                "DROP INDEX CONCURRENTLY IF EXISTS idx_auditoria_fecha_id",
+            ],
+        ),
+    ]
@@ -0,0 +1,156 @@
+"""
+sync_master_data por lotes: cada tabla maestra viaja a cada nodo como JSON en
+lotes de 5000 filas y se aplica con un INSERT ... ON CONFLICT por lote, en lugar
+de un dblink_exec por fila. auditoria_sincronizacion registra filas y duración
+por tabla y nodo (ver sección 9 del script del coordinador).
+"""
+
+from django.db import migrations
+
+SYNC_TABLA_A_NODO = """
+    CREATE OR REPLACE FUNCTION sync_tabla_a_nodo(tabla TEXT, clave TEXT, conexion TEXT, nodo TEXT,
+                                                 filtro TEXT DEFAULT 'TRUE', lote INT DEFAULT 5000)
+    RETURNS VOID LANGUAGE plpgsql AS $$
+    DECLARE
+        inicio TIMESTAMP := clock_timestamp();
+        columnas TEXT;
+        actualizar TEXT;
+        actuales TEXT;
+        nuevas TEXT;
+        payload TEXT;
+        ultimo BIGINT;
+        n INT;
+        resultado TEXT;
+        enviadas BIGINT := 0;
+        modificadas BIGINT := 0;
+    BEGIN
+        SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum),
+               string_agg(format('%1$I = EXCLUDED.%1$I', attname), ', ' ORDER BY attnum) FILTER (WHERE attname <> clave),
+               string_agg(format('t.%I', attname), ', ' ORDER BY attnum) FILTER (WHERE attname <> clave),
+               string_agg(format('EXCLUDED.%I', attname), ', ' ORDER BY attnum) FILTER (WHERE attname <> clave)
+        INTO columnas, actualizar, actuales, nuevas
+        FROM pg_attribute
+        WHERE attrelid = tabla::regclass AND attnum > 0 AND NOT attisdropped;
+
+        BEGIN
+            LOOP
+                -- Siguiente lote por clave primaria (sin OFFSET)
+                EXECUTE format(
+                    'SELECT json_agg(x)::text, count(*), max(x.%1$I) FROM (
+                         SELECT %2$s FROM %3$s WHERE (%4$s) AND ($1 IS NULL OR %1$I > $1)
+                         ORDER BY %1$I LIMIT $2
+                     ) x', clave, columnas, tabla, filtro)
+                INTO payload, n, ultimo USING ultimo, lote;
+                EXIT WHEN n = 0;
+
+                resultado := dblink_exec(conexion, format(
+                    'INSERT INTO %1$s AS t (%2$s)
+                     SELECT %2$s FROM json_populate_recordset(NULL::%1$s, %3$L)
+                     ON CONFLICT (%4$I) DO UPDATE SET %5$s
+                     WHERE ROW(%6$s) IS DISTINCT FROM ROW(%7$s)',
+                    tabla, columnas, payload, clave, actualizar, actuales, nuevas));
+                -- dblink_exec retorna la etiqueta del comando: 'INSERT 0 <filas>'
+                modificadas := modificadas + split_part(resultado, ' ', 3)::BIGINT;
+                enviadas := enviadas + n;
+                EXIT WHEN n < lote;
+            END LOOP;
+
+            INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+            VALUES ('OK', tabla, nodo, enviadas, modificadas,
+                    EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+        EXCEPTION WHEN OTHERS THEN
+            -- Un nodo caído no detiene la sincronización de los demás
+            INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+            VALUES ('ERROR: ' || SQLERRM, tabla, nodo, enviadas, modificadas,
+                    EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+            RAISE WARNING 'Sincronización de % hacia % falló: %', tabla, nodo, SQLERRM;
+        END;
+    END;
+    $$
+"""
+
+SYNC_MASTER_DATA = """
+    CREATE OR REPLACE PROCEDURE sync_master_data()
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        maestra RECORD;
+        nodo RECORD;
+    BEGIN
+        -- 1. Personas registradas en los nodos remotos (una consulta por nodo)
+
+        -- Sincronizar Personas desde Azure
+        INSERT INTO Personas 
+        SELECT * FROM dblink(get_azure_conn(), 
+            'SELECT id_persona, nom_persona, apellido_persona, tipo_doc, num_doc, 
+                    fecha_nac, genero, dir_persona, tel_persona, email_persona, ciudad_residencia 
+             FROM personas') 
+        AS t(id_persona INT, nom_persona VARCHAR(100), apellido_persona VARCHAR(100),
+              tipo_doc VARCHAR(10), num_doc VARCHAR(20), fecha_nac DATE,
+              genero CHAR(1), dir_persona VARCHAR(200), tel_persona VARCHAR(20),
+              email_persona VARCHAR(150), ciudad_residencia VARCHAR(50))
+        ON CONFLICT (id_persona) DO UPDATE SET 
+            nom_persona = EXCLUDED.nom_persona,
+            email_persona = EXCLUDED.email_persona;
+
+        -- Sincronizar Personas desde AWS
+        INSERT INTO Personas 
+        SELECT * FROM dblink(get_aws_conn(), 
+            'SELECT id_persona, nom_persona, apellido_persona, tipo_doc, num_doc, 
+                    fecha_nac, genero, dir_persona, tel_persona, email_persona, ciudad_residencia 
+             FROM personas') 
+        AS t(id_persona INT, nom_persona VARCHAR(100), apellido_persona VARCHAR(100),
+              tipo_doc VARCHAR(10), num_doc VARCHAR(20), fecha_nac DATE,
+              genero CHAR(1), dir_persona VARCHAR(200), tel_persona VARCHAR(20),
+              email_persona VARCHAR(150), ciudad_residencia VARCHAR(50))
+        ON CONFLICT (id_persona) DO NOTHING;
+
+        -- 2. Tablas maestras hacia cada nodo (El Coordinador es la fuente de verdad).
+        -- Las personas creadas en el nodo (su rango de IDs, sección 19) no se le
+        -- devuelven: la copia del nodo es la vigente.
+        FOR nodo IN SELECT * FROM (VALUES ('azure', 2, get_azure_conn()), ('aws', 3, get_aws_conn()))
+                    AS n(nombre, id_sede, conexion) LOOP
+            FOR maestra IN SELECT * FROM (VALUES
+                ('roles', 'id_rol', 'TRUE'),
+                ('especialidades', 'id_especialidad', 'TRUE'),
+                ('catalogo_medicamentos', 'cod_med', 'TRUE'),
+                ('enfermedades', 'id_enfermedad', 'TRUE'),
+                ('personas', 'id_persona', format('id_persona NOT BETWEEN %s AND %s',
+                    nodo.id_sede * 100000000 + 1, nodo.id_sede * 100000000 + 99999999))
+            ) AS m(tabla, clave, filtro) LOOP
+                PERFORM sync_tabla_a_nodo(maestra.tabla, maestra.clave, nodo.conexion, nodo.nombre, maestra.filtro);
+            END LOOP;
+        END LOOP;
+
+        -- 3. Invalidar los catálogos en caché de la aplicación (ver sección 22)
+        IF to_regclass('version_catalogos') IS NOT NULL THEN
+            UPDATE version_catalogos SET version = version + 1, fecha_actualizacion = NOW();
+        END IF;
+
+    END;
+    $$
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0007_indices_paginacion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """ALTER TABLE auditoria_sincronizacion
+                       ADD COLUMN IF NOT EXISTS tabla VARCHAR(50),
+                       ADD COLUMN IF NOT EXISTS nodo VARCHAR(20),
+                       ADD COLUMN IF NOT EXISTS filas BIGINT,
+                       ADD COLUMN IF NOT EXISTS filas_modificadas BIGINT,
+                       ADD COLUMN IF NOT EXISTS duracion_ms INT""",
+                SYNC_TABLA_A_NODO,
+                SYNC_MASTER_DATA,
+            ],
+            reverse_sql=[
+                "DROP FUNCTION IF EXISTS sync_tabla_a_nodo(TEXT, TEXT, TEXT, TEXT, TEXT, INT)",
+            ],
+        ),
+    ]
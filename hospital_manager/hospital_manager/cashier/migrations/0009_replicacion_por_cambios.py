@@ -0,0 +1,308 @@
+"""
+Replicación por cambios de Personas, Pacientes e Historias_Clinicas.
+
+Cada nodo registra sus cambios en cambios_replicacion con triggers y
+replicar_cambios() (en el coordinador) mueve solo lo nuevo desde la última
+marca de cada nodo, en lugar de copiar las tablas completas. Los conflictos se
+resuelven con "última modificación gana" y, en empate, gana el nodo central
+(ver sección 26 del script del coordinador).
+
+La migración solo toca el coordinador (sede 1). Los nodos Azure/AWS crean
+cambios_replicacion, registrar_cambio(), sus triggers y aplicar_cambios() en la
+sección "REPLICACIÓN POR CAMBIOS" de su script de creación.
+"""
+
+from django.db import migrations
+
+REGISTRO = """
+    CREATE TABLE IF NOT EXISTS cambios_replicacion (
+        id_cambio BIGSERIAL PRIMARY KEY,
+        txid BIGINT NOT NULL DEFAULT txid_current(),
+        tabla VARCHAR(50) NOT NULL,
+        clave BIGINT NOT NULL,
+        operacion CHAR(1) NOT NULL,          -- I / U / D
+        fila JSONB,                          -- fila nueva (NULL en D)
+        fecha_cambio TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+        nodo_origen SMALLINT NOT NULL        -- sede donde se hizo el cambio
+    );
+    CREATE INDEX IF NOT EXISTS idx_cambios_txid ON cambios_replicacion (txid, id_cambio);
+    CREATE INDEX IF NOT EXISTS idx_cambios_fila ON cambios_replicacion (tabla, clave, fecha_cambio);
+"""
+
+REGISTRAR_CAMBIO = """
+    CREATE OR REPLACE FUNCTION registrar_cambio()
+    RETURNS TRIGGER LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+    BEGIN
+        IF current_setting('his_replicacion.aplicando', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, nodo_origen)
+            VALUES (TG_TABLE_NAME, (to_jsonb(OLD) ->> TG_ARGV[0])::BIGINT, 'D', NULL, TG_ARGV[1]::SMALLINT);
+        ELSE
+            INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, nodo_origen)
+            VALUES (TG_TABLE_NAME, (to_jsonb(NEW) ->> TG_ARGV[0])::BIGINT, left(TG_OP, 1), to_jsonb(NEW),
+                    TG_ARGV[1]::SMALLINT);
+        END IF;
+        RETURN NULL;
+    END;
+    $$
+"""
+
+# El coordinador registra sus cambios como sede 1
+TRIGGERS = """
+    CREATE OR REPLACE TRIGGER trg_cambios_personas AFTER INSERT OR UPDATE OR DELETE ON Personas
+        FOR EACH ROW EXECUTE FUNCTION registrar_cambio('id_persona', '1');
+    CREATE OR REPLACE TRIGGER trg_cambios_pacientes AFTER INSERT OR UPDATE OR DELETE ON Pacientes
+        FOR EACH ROW EXECUTE FUNCTION registrar_cambio('cod_pac', '1');
+    CREATE OR REPLACE TRIGGER trg_cambios_historias AFTER INSERT OR UPDATE OR DELETE ON Historias_Clinicas
+        FOR EACH ROW EXECUTE FUNCTION registrar_cambio('cod_hist', '1');
+"""
+
+APLICAR_CAMBIOS = """
+    CREATE OR REPLACE FUNCTION aplicar_cambios(cambios JSONB, registrar BOOLEAN DEFAULT FALSE)
+    RETURNS JSONB LANGUAGE plpgsql AS $$
+    DECLARE
+        c RECORD;
+        vigente RECORD;
+        columna_clave TEXT;
+        asignaciones TEXT;
+        aplicados INT := 0;
+        descartados INT := 0;
+        errores INT := 0;
+    BEGIN
+        PERFORM set_config('his_replicacion.aplicando', 'on', true);
+        FOR c IN
+            SELECT * FROM jsonb_to_recordset(cambios)
+                AS x(tabla TEXT, clave BIGINT, operacion CHAR(1), fila JSONB,
+                     fecha_cambio TIMESTAMPTZ, nodo_origen SMALLINT)
+            ORDER BY fecha_cambio, nodo_origen
+        LOOP
+            SELECT r.fecha_cambio, r.nodo_origen INTO vigente
+            FROM cambios_replicacion r
+            WHERE r.tabla = c.tabla AND r.clave = c.clave
+            ORDER BY r.fecha_cambio DESC, r.nodo_origen
+            LIMIT 1;
+            IF FOUND AND (vigente.fecha_cambio > c.fecha_cambio
+                          OR (vigente.fecha_cambio = c.fecha_cambio AND vigente.nodo_origen <= c.nodo_origen)) THEN
+                descartados := descartados + 1;
+                CONTINUE;
+            END IF;
+
+            columna_clave := CASE c.tabla
+                WHEN 'personas' THEN 'id_persona'
+                WHEN 'pacientes' THEN 'cod_pac'
+                WHEN 'historias_clinicas' THEN 'cod_hist'
+            END;
+            BEGIN
+                IF c.operacion = 'D' THEN
+                    EXECUTE format('DELETE FROM %I WHERE %I = $1', c.tabla, columna_clave) USING c.clave;
+                ELSE
+                    SELECT string_agg(format('%1$I = EXCLUDED.%1$I', attname), ', ')
+                    INTO asignaciones
+                    FROM pg_attribute
+                    WHERE attrelid = c.tabla::regclass AND attnum > 0 AND NOT attisdropped
+                      AND attname <> columna_clave;
+                    EXECUTE format(
+                        'INSERT INTO %1$I SELECT * FROM jsonb_populate_record(NULL::%1$I, $1)
+                         ON CONFLICT (%2$I) DO UPDATE SET %3$s', c.tabla, columna_clave, asignaciones)
+                    USING c.fila;
+                END IF;
+                IF registrar THEN
+                    INSERT INTO cambios_replicacion (tabla, clave, operacion, fila, fecha_cambio, nodo_origen)
+                    VALUES (c.tabla, c.clave, c.operacion, c.fila, c.fecha_cambio, c.nodo_origen);
+                END IF;
+                aplicados := aplicados + 1;
+            EXCEPTION WHEN OTHERS THEN
+                errores := errores + 1;
+                RAISE WARNING 'Cambio % % (%) no aplicado: %', c.tabla, c.clave, c.operacion, SQLERRM;
+            END;
+        END LOOP;
+        PERFORM set_config('his_replicacion.aplicando', 'off', true);
+        RETURN jsonb_build_object('aplicados', aplicados, 'descartados', descartados, 'errores', errores);
+    END;
+    $$
+"""
+
+MARCAS = """
+    CREATE TABLE IF NOT EXISTS replicacion_marcas (
+        nodo VARCHAR(20) NOT NULL,
+        sentido VARCHAR(10) NOT NULL,        -- 'entrada' (nodo -> coordinador) / 'salida'
+        txid_desde BIGINT NOT NULL DEFAULT 0,
+        fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (nodo, sentido)
+    )
+"""
+
+REPLICAR_CAMBIOS = """
+    CREATE OR REPLACE PROCEDURE replicar_cambios(lote INT DEFAULT 2000, retencion INTERVAL DEFAULT '7 days')
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        sede RECORD;
+        sentido_actual TEXT;
+        conexion TEXT;
+        inicio TIMESTAMP;
+        hasta BIGINT;
+        ultimo_txid BIGINT;
+        ultimo_id BIGINT;
+        payload JSONB;
+        resultado JSONB;
+        leidos BIGINT;
+        aplicados BIGINT;
+        errores BIGINT;
+    BEGIN
+        FOREACH sentido_actual IN ARRAY ARRAY['entrada', 'salida'] LOOP
+            FOR sede IN SELECT * FROM (VALUES ('azure', 2), ('aws', 3)) AS x(nombre, id_sede) LOOP
+                inicio := clock_timestamp();
+                leidos := 0; aplicados := 0; errores := 0;
+
+                -- Todo lo de un nodo va en su propio bloque: si el nodo no responde
+                -- (o falla a mitad) se deshace solo lo suyo, su marca no avanza y
+                -- los demás nodos se replican igual
+                BEGIN
+                    conexion := CASE sede.id_sede WHEN 2 THEN get_azure_conn() ELSE get_aws_conn() END;
+
+                    INSERT INTO replicacion_marcas (nodo, sentido) VALUES (sede.nombre, sentido_actual)
+                    ON CONFLICT DO NOTHING;
+                    SELECT txid_desde INTO ultimo_txid FROM replicacion_marcas
+                    WHERE nodo = sede.nombre AND sentido = sentido_actual;
+                    ultimo_id := 0;
+
+                    -- Lo anterior a este xmin ya terminó en el origen: será la próxima marca
+                    IF sentido_actual = 'entrada' THEN
+                        SELECT x INTO hasta FROM dblink(conexion,
+                            'SELECT txid_snapshot_xmin(txid_current_snapshot())') AS t(x BIGINT);
+                    ELSE
+                        hasta := txid_snapshot_xmin(txid_current_snapshot());
+                    END IF;
+
+                    LOOP
+                        IF sentido_actual = 'entrada' THEN
+                            SELECT jsonb_agg(to_jsonb(t) ORDER BY t.txid, t.id_cambio) INTO payload
+                            FROM dblink(conexion, format(
+                                'SELECT id_cambio, txid, tabla, clave, operacion, fila, fecha_cambio, nodo_origen
+                                 FROM cambios_replicacion WHERE (txid, id_cambio) > (%s, %s)
+                                 ORDER BY txid, id_cambio LIMIT %s', ultimo_txid, ultimo_id, lote))
+                            AS t(id_cambio BIGINT, txid BIGINT, tabla TEXT, clave BIGINT, operacion CHAR(1),
+                                 fila JSONB, fecha_cambio TIMESTAMPTZ, nodo_origen SMALLINT);
+                        ELSE
+                            SELECT jsonb_agg(to_jsonb(t) ORDER BY t.txid, t.id_cambio) INTO payload
+                            FROM (
+                                SELECT id_cambio, txid, tabla, clave, operacion, fila, fecha_cambio, nodo_origen
+                                FROM cambios_replicacion
+                                WHERE (txid, id_cambio) > (ultimo_txid, ultimo_id) AND nodo_origen <> sede.id_sede
+                                ORDER BY txid, id_cambio LIMIT lote
+                            ) t;
+                        END IF;
+                        EXIT WHEN payload IS NULL;
+
+                        IF sentido_actual = 'entrada' THEN
+                            resultado := aplicar_cambios(payload, TRUE);
+                        ELSE
+                            SELECT r INTO resultado FROM dblink(conexion,
+                                format('SELECT aplicar_cambios(%L::jsonb)', payload)) AS t(r JSONB);
+                        END IF;
+
+                        leidos := leidos + jsonb_array_length(payload);
+                        aplicados := aplicados + (resultado ->> 'aplicados')::INT;
+                        errores := errores + (resultado ->> 'errores')::INT;
+                        ultimo_txid := (payload -> -1 ->> 'txid')::BIGINT;
+                        ultimo_id := (payload -> -1 ->> 'id_cambio')::BIGINT;
+                        EXIT WHEN jsonb_array_length(payload) < lote;
+                    END LOOP;
+
+                    UPDATE replicacion_marcas SET txid_desde = hasta, fecha = NOW()
+                    WHERE nodo = sede.nombre AND sentido = sentido_actual;
+
+                    -- El nodo ya no necesita guardar lo que el coordinador leyó hace más de `retencion`
+                    IF sentido_actual = 'entrada' THEN
+                        PERFORM dblink_exec(conexion, format(
+                            'DELETE FROM cambios_replicacion WHERE txid < %s AND fecha_cambio < NOW() - %L::interval',
+                            hasta, retencion));
+                    END IF;
+
+                    INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+                    VALUES (CASE WHEN errores = 0 THEN 'OK' ELSE format('OK (%s cambios con error)', errores) END,
+                            'cambios (' || sentido_actual || ')', sede.nombre, leidos, aplicados,
+                            EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+                EXCEPTION WHEN OTHERS THEN
+                    INSERT INTO auditoria_sincronizacion (estado, tabla, nodo, filas, filas_modificadas, duracion_ms)
+                    VALUES ('ERROR: ' || SQLERRM, 'cambios (' || sentido_actual || ')', sede.nombre, leidos, aplicados,
+                            EXTRACT(EPOCH FROM (clock_timestamp() - inicio)) * 1000);
+                    RAISE WARNING 'Replicación de cambios (%) con % falló: %', sentido_actual, sede.nombre, SQLERRM;
+                END;
+                -- Cada nodo queda confirmado apenas termina (COMMIT no puede ir dentro
+                -- del bloque con EXCEPTION): un nodo caído no deshace a los demás
+                COMMIT;
+            END LOOP;
+        END LOOP;
+
+        DELETE FROM cambios_replicacion
+        WHERE fecha_cambio < NOW() - retencion
+          AND txid < (SELECT min(txid_desde) FROM replicacion_marcas WHERE sentido = 'salida');
+    END;
+    $$
+"""
+
+PROGRAMACION = """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+            PERFORM cron.schedule('replicar_cambios', '* * * * *', 'CALL replicar_cambios()');
+        END IF;
+    END $$
+"""
+
+SYNC_MASTER_DATA = """
+    CREATE OR REPLACE PROCEDURE sync_master_data()
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        maestra RECORD;
+        nodo RECORD;
+    BEGIN
+        -- 1. Tablas maestras hacia cada nodo (El Coordinador es la fuente de verdad).
+        -- Personas, Pacientes e Historias_Clinicas se replican por cambios en ambos
+        -- sentidos con replicar_cambios() (sección 26).
+        FOR nodo IN SELECT * FROM (VALUES ('azure', 2, get_azure_conn()), ('aws', 3, get_aws_conn()))
+                    AS n(nombre, id_sede, conexion) LOOP
+            FOR maestra IN SELECT * FROM (VALUES
+                ('roles', 'id_rol', 'TRUE'),
+                ('especialidades', 'id_especialidad', 'TRUE'),
+                ('catalogo_medicamentos', 'cod_med', 'TRUE'),
+                ('enfermedades', 'id_enfermedad', 'TRUE')
+            ) AS m(tabla, clave, filtro) LOOP
+                PERFORM sync_tabla_a_nodo(maestra.tabla, maestra.clave, nodo.conexion, nodo.nombre, maestra.filtro);
+            END LOOP;
+        END LOOP;
+
+        -- 2. Invalidar los catálogos en caché de la aplicación (ver sección 22)
+        IF to_regclass('version_catalogos') IS NOT NULL THEN
+            UPDATE version_catalogos SET version = version + 1, fecha_actualizacion = NOW();
+        END IF;
+
+    END;
+    $$
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0008_sincronizacion_por_lotes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                REGISTRO,
+                REGISTRAR_CAMBIO,
+                TRIGGERS,
+                APLICAR_CAMBIOS,
+                MARCAS,
+                REPLICAR_CAMBIOS,
+                PROGRAMACION,
+                SYNC_MASTER_DATA,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
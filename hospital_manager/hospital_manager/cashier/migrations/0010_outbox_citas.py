@@ -0,0 +1,268 @@
+"""
+Outbox para las citas de las sedes remotas.
+
+insert_cita_distributed() y update_cita_distributed() ya no llaman a dblink_exec
+dentro del trigger de la vista Citas: dejan la cita en outbox_citas y
+despachar_outbox_citas() la entrega al nodo por lotes, con reintentos (ver
+sección 27 del script del coordinador). La vista Citas incluye las citas nuevas
+que siguen en el outbox.
+"""
+
+from django.db import migrations
+
+OUTBOX = """
+    CREATE TABLE IF NOT EXISTS outbox_citas (
+        id_mensaje BIGSERIAL PRIMARY KEY,
+        id_cita BIGINT NOT NULL,
+        id_sede INT NOT NULL,
+        operacion CHAR(1) NOT NULL,                         -- I / U
+        fila JSONB NOT NULL,                                -- cita completa como debe quedar en el nodo
+        estado VARCHAR(20) NOT NULL DEFAULT 'PENDIENTE',    -- PENDIENTE / ENTREGADO / FALLIDO
+        intentos INT NOT NULL DEFAULT 0,
+        proximo_intento TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        ultimo_error VARCHAR(500),
+        fecha_creacion TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        fecha_entrega TIMESTAMPTZ
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_citas_pendientes ON outbox_citas (id_sede, id_mensaje)
+        WHERE estado = 'PENDIENTE';
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_outbox_citas_cita_pendiente ON outbox_citas (id_cita)
+        WHERE estado = 'PENDIENTE';
+"""
+
+ENCOLAR_CITA = """
+    CREATE OR REPLACE FUNCTION encolar_cita(cita BIGINT, sede INT, op CHAR(1), datos JSONB)
+    RETURNS VOID LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE outbox_citas SET fila = datos, fecha_creacion = NOW()
+        WHERE id_cita = cita AND estado = 'PENDIENTE';
+        IF NOT FOUND THEN
+            INSERT INTO outbox_citas (id_cita, id_sede, operacion, fila)
+            VALUES (cita, sede, op, datos);
+        END IF;
+    END;
+    $$
+"""
+
+DESPACHAR_LOTE_CITAS = """
+    CREATE OR REPLACE FUNCTION despachar_lote_citas(sede INT, lote INT DEFAULT 500, max_intentos INT DEFAULT 10)
+    RETURNS INT LANGUAGE plpgsql AS $$
+    DECLARE
+        cabeza RECORD;
+        mensajes BIGINT[];
+        filas_citas JSONB;
+        filas_pacientes JSONB;
+        filas_personas JSONB;
+    BEGIN
+        IF NOT pg_try_advisory_xact_lock(hashtext('outbox_citas'), sede) THEN
+            RETURN 0;
+        END IF;
+
+        SELECT id_mensaje, intentos, proximo_intento INTO cabeza
+        FROM outbox_citas
+        WHERE estado = 'PENDIENTE' AND id_sede = sede
+        ORDER BY id_mensaje LIMIT 1;
+        IF NOT FOUND OR cabeza.proximo_intento > NOW() THEN
+            RETURN 0;
+        END IF;
+        IF cabeza.intentos > 0 THEN
+            lote := 1;
+        END IF;
+
+        SELECT array_agg(id_mensaje ORDER BY id_mensaje), jsonb_agg(fila ORDER BY id_mensaje)
+        INTO mensajes, filas_citas
+        FROM (
+            SELECT id_mensaje, fila FROM outbox_citas
+            WHERE estado = 'PENDIENTE' AND id_sede = sede
+            ORDER BY id_mensaje LIMIT lote
+            FOR UPDATE
+        ) m;
+
+        -- Pacientes y personas de esas citas, por si el nodo aún no los tiene (FK de citas)
+        SELECT jsonb_agg(to_jsonb(pa)) INTO filas_pacientes
+        FROM Pacientes pa
+        WHERE pa.cod_pac IN (SELECT (c ->> 'cod_pac')::INT FROM jsonb_array_elements(filas_citas) c);
+        SELECT jsonb_agg(to_jsonb(pe)) INTO filas_personas
+        FROM Personas pe
+        WHERE pe.id_persona IN (
+            SELECT (p ->> 'id_persona')::INT FROM jsonb_array_elements(COALESCE(filas_pacientes, '[]')) p
+        );
+
+        BEGIN
+            -- Varias sentencias en un dblink_exec = una transacción en el nodo.
+            -- his_replicacion.aplicando evita que los triggers de la sección 26 las
+            -- registren como cambios propios del nodo.
+            PERFORM dblink_exec(CASE sede WHEN 2 THEN get_azure_conn() ELSE get_aws_conn() END, format($remote$
+                SELECT set_config('his_replicacion.aplicando', 'on', true);
+                INSERT INTO Personas SELECT * FROM jsonb_populate_recordset(NULL::Personas, %L)
+                    ON CONFLICT (id_persona) DO NOTHING;
+                INSERT INTO Pacientes SELECT * FROM jsonb_populate_recordset(NULL::Pacientes, %L)
+                    ON CONFLICT (cod_pac) DO NOTHING;
+                INSERT INTO citas (id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora,
+                                   fecha_hora_solicitada, tipo_servicio, estado, motivo)
+                SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora,
+                       fecha_hora_solicitada, tipo_servicio, estado, motivo
+                FROM jsonb_populate_recordset(NULL::citas, %L)
+                ON CONFLICT (id_cita) DO UPDATE SET
+                    id_dept = EXCLUDED.id_dept,
+                    id_emp = EXCLUDED.id_emp,
+                    cod_pac = EXCLUDED.cod_pac,
+                    fecha_hora = EXCLUDED.fecha_hora,
+                    fecha_hora_solicitada = EXCLUDED.fecha_hora_solicitada,
+                    tipo_servicio = EXCLUDED.tipo_servicio,
+                    estado = EXCLUDED.estado,
+                    motivo = EXCLUDED.motivo
+            $remote$, COALESCE(filas_personas, '[]'), COALESCE(filas_pacientes, '[]'), filas_citas));
+        EXCEPTION WHEN OTHERS THEN
+            UPDATE outbox_citas SET
+                intentos = intentos + 1,
+                proximo_intento = NOW() + LEAST(make_interval(secs => 5 * power(2, LEAST(cabeza.intentos, 10))),
+                                                INTERVAL '10 minutes'),
+                ultimo_error = left(SQLERRM, 500),
+                estado = CASE WHEN SQLSTATE NOT LIKE '08%' AND cabeza.intentos + 1 >= max_intentos
+                              THEN 'FALLIDO' ELSE estado END
+            WHERE id_mensaje = cabeza.id_mensaje;
+            RAISE WARNING 'Outbox de citas hacia la sede % falló (intento %): %', sede, cabeza.intentos + 1, SQLERRM;
+            RETURN 0;
+        END;
+
+        -- Si esta transacción no llega a confirmar, el lote se reenvía: el nodo lo aplica igual
+        UPDATE outbox_citas SET estado = 'ENTREGADO', fecha_entrega = NOW(), intentos = intentos + 1,
+            ultimo_error = NULL
+        WHERE id_mensaje = ANY(mensajes);
+        RETURN array_length(mensajes, 1);
+    END;
+    $$
+"""
+
+DESPACHAR_OUTBOX_CITAS = """
+    CREATE OR REPLACE PROCEDURE despachar_outbox_citas(lote INT DEFAULT 500)
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        sede INT;
+    BEGIN
+        FOREACH sede IN ARRAY ARRAY[2, 3] LOOP
+            LOOP
+                EXIT WHEN despachar_lote_citas(sede, lote) = 0;
+                -- Cada lote queda confirmado apenas llega al nodo
+                COMMIT;
+            END LOOP;
+            COMMIT;
+        END LOOP;
+
+        DELETE FROM outbox_citas WHERE estado = 'ENTREGADO' AND fecha_entrega < NOW() - INTERVAL '7 days';
+    END;
+    $$
+"""
+
+INSERT_CITA_DISTRIBUTED = """
+    CREATE OR REPLACE FUNCTION insert_cita_distributed()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        NEW.tipo_servicio := COALESCE(NEW.tipo_servicio, 'Consulta');
+        NEW.estado := COALESCE(NEW.estado, 'PROGRAMADA');
+        NEW.motivo := COALESCE(NEW.motivo, '');
+
+        IF NEW.id_sede = 1 THEN
+            INSERT INTO citas_local VALUES (NEW.*);
+        ELSIF NEW.id_sede IN (2, 3) THEN
+            PERFORM encolar_cita(NEW.id_cita, NEW.id_sede, 'I', to_jsonb(NEW));
+        ELSE
+            RAISE EXCEPTION 'ID de Sede no válido: %', NEW.id_sede;
+        END IF;
+
+        RETURN NEW;
+    END;
+    $$
+"""
+
+UPDATE_CITA_DISTRIBUTED = """
+    CREATE OR REPLACE FUNCTION update_cita_distributed()
+    RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    BEGIN
+        IF NEW.id_sede != OLD.id_sede THEN
+            RAISE EXCEPTION 'No se puede cambiar id_sede en update';
+        END IF;
+
+        IF OLD.id_sede = 1 THEN
+            UPDATE citas_local SET 
+                id_dept = NEW.id_dept,
+                id_emp = NEW.id_emp,
+                fecha_hora = NEW.fecha_hora,
+                estado = NEW.estado,
+                motivo = NEW.motivo
+            WHERE id_cita = OLD.id_cita;
+        ELSIF OLD.id_sede IN (2, 3) THEN
+            -- Viaja la fila completa: aplicarla dos veces en el nodo deja el mismo resultado
+            PERFORM encolar_cita(NEW.id_cita, NEW.id_sede, 'U', to_jsonb(NEW));
+        END IF;
+
+        RETURN NEW;
+    END;
+    $$
+"""
+
+VISTA_CITAS = """
+    CREATE OR REPLACE VIEW Citas AS
+    -- Datos locales (sede 1)
+    SELECT * FROM citas_local
+    UNION ALL
+    -- Datos de Azure (sede 2)
+    SELECT * FROM dblink(get_azure_conn(), 
+        'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+         fecha_hora_solicitada, tipo_servicio, estado, motivo 
+         FROM citas')
+        AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+            fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+            tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+    UNION ALL
+    -- Datos de AWS (sede 3)
+    SELECT * FROM dblink(get_aws_conn(), 
+        'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+         fecha_hora_solicitada, tipo_servicio, estado, motivo 
+         FROM citas')
+        AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+            fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+            tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+    UNION ALL
+    -- Citas nuevas de las sedes remotas aún en el outbox
+    SELECT (jsonb_populate_record(NULL::citas_local, fila)).*
+    FROM outbox_citas
+    WHERE estado = 'PENDIENTE' AND operacion = 'I'
+"""
+
+PROGRAMACION = """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+            PERFORM cron.schedule('despachar_outbox_citas', '* * * * *', 'CALL despachar_outbox_citas()');
+        END IF;
+    END $$
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0009_replicacion_por_cambios'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                OUTBOX,
+                ENCOLAR_CITA,
+                DESPACHAR_LOTE_CITAS,
+                DESPACHAR_OUTBOX_CITAS,
+                INSERT_CITA_DISTRIBUTED,
+                UPDATE_CITA_DISTRIBUTED,
+                VISTA_CITAS,
+                "GRANT SELECT, INSERT, UPDATE ON outbox_citas TO administrador, medico, administrativo",
+                "GRANT USAGE, SELECT ON SEQUENCE outbox_citas_id_mensaje_seq TO administrador, medico, administrativo",
+                PROGRAMACION,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,29 @@
+"""
+Índice de Empleados por persona en el coordinador.
+
+El inicio de sesión (cashier/autenticacion.py) busca al empleado por email en el
+nodo de su sede: Personas.email_persona ya es UNIQUE y este índice cubre el JOIN
+con Empleados. Se crea con CONCURRENTLY (por eso atomic = False).
+
+La migración solo toca el coordinador (empleados_local guarda la sede 1); los
+nodos Azure/AWS crean idx_empleados_persona en la sección "ÍNDICES PARA EL
+INICIO DE SESIÓN" de su script de creación.
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('cashier', '0010_outbox_citas'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_empleados_local_persona ON empleados_local (id_persona)',
+            'DROP INDEX CONCURRENTLY IF EXISTS idx_empleados_local_persona',
+        ),
+    ]
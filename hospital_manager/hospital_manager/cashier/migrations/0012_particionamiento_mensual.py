@@ -0,0 +1,315 @@
+"""
+Particionamiento mensual de citas_local, Prescripciones y Auditoria_Accesos.
+
+Las tres tablas pasan a estar particionadas por rango de fecha (un mes por
+partición, más una partición por defecto) con convertir_a_particionada(), que
+conserva datos, índices, llaves, triggers, permisos y las vistas que las leen.
+mantener_particiones() (pg_cron diario o "manage.py mantener_particiones") crea
+las particiones de los próximos meses y separa las que pasan la retención de
+particiones_config (ver sección 29 del script del coordinador).
+
+Bloquea las tres tablas mientras copia los datos: aplicar en una ventana de
+mantenimiento.
+"""
+
+from django.db import migrations
+
+CONFIGURACION = """
+    CREATE SCHEMA IF NOT EXISTS archivo;
+    GRANT USAGE ON SCHEMA archivo TO administrador, auditor;
+
+    CREATE TABLE IF NOT EXISTS particiones_config (
+        tabla VARCHAR(63) PRIMARY KEY,
+        columna VARCHAR(63) NOT NULL,
+        meses_adelante INT NOT NULL DEFAULT 3,              -- particiones futuras a mantener creadas
+        meses_retencion INT,                                -- NULL = no se archiva nada
+        accion_vencidas VARCHAR(10) NOT NULL DEFAULT 'ARCHIVAR' -- ARCHIVAR (esquema archivo) / ELIMINAR
+    );
+
+    INSERT INTO particiones_config (tabla, columna, meses_adelante, meses_retencion, accion_vencidas) VALUES
+        ('citas_local', 'fecha_hora', 3, NULL, 'ARCHIVAR'),
+        ('prescripciones', 'fecha_emision', 3, NULL, 'ARCHIVAR'),
+        ('auditoria_accesos', 'fecha_evento', 3, 24, 'ARCHIVAR')
+    ON CONFLICT (tabla) DO NOTHING;
+
+    -- Particiones que salieron de su tabla (consultables en el esquema archivo)
+    CREATE TABLE IF NOT EXISTS particiones_archivadas (
+        particion VARCHAR(63) PRIMARY KEY,
+        tabla VARCHAR(63) NOT NULL,
+        esquema VARCHAR(63),                                -- NULL si se eliminó
+        desde DATE NOT NULL,
+        hasta DATE NOT NULL,
+        filas BIGINT NOT NULL,
+        fecha_archivo TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+"""
+
+CREAR_PARTICION_MES = """
+    CREATE OR REPLACE FUNCTION crear_particion_mes(nombre_tabla TEXT, mes DATE)
+    RETURNS BOOLEAN LANGUAGE plpgsql AS $$
+    DECLARE
+        columna_fecha TEXT;
+        inicio DATE := date_trunc('month', mes)::DATE;
+        fin DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+        particion TEXT := format('%s_p%s', nombre_tabla, to_char(mes, 'YYYYMM'));
+    BEGIN
+        IF to_regclass(particion) IS NOT NULL THEN
+            RETURN FALSE;
+        END IF;
+        SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', particion, nombre_tabla);
+        EXECUTE format(
+            'WITH movidas AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM movidas',
+            nombre_tabla || '_default', columna_fecha, inicio, columna_fecha, fin, particion
+        );
+        -- Con el CHECK el ATTACH no vuelve a recorrer la partición para validarla
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (%I >= %L AND %I < %L)',
+                       particion, particion || '_rango', columna_fecha, inicio, columna_fecha, fin);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       nombre_tabla, particion, inicio, fin);
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', particion, particion || '_rango');
+        RETURN TRUE;
+    END;
+    $$;
+"""
+
+ARCHIVAR_PARTICIONES = """
+    CREATE OR REPLACE FUNCTION archivar_particiones(nombre_tabla TEXT)
+    RETURNS INT LANGUAGE plpgsql AS $$
+    DECLARE
+        cfg particiones_config%ROWTYPE;
+        limite DATE;
+        particion RECORD;
+        mes DATE;
+        filas BIGINT;
+        archivadas INT := 0;
+    BEGIN
+        SELECT * INTO STRICT cfg FROM particiones_config c WHERE c.tabla = nombre_tabla;
+        IF cfg.meses_retencion IS NULL THEN
+            RETURN 0;
+        END IF;
+        limite := (date_trunc('month', current_date) - make_interval(months => cfg.meses_retencion))::DATE;
+
+        FOR particion IN
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = nombre_tabla::regclass AND c.relname ~ '_p[0-9]{6}$'
+            ORDER BY c.relname
+        LOOP
+            mes := to_date(right(particion.relname, 6), 'YYYYMM');
+            CONTINUE WHEN mes >= limite;
+            EXECUTE format('SELECT COUNT(*) FROM %I', particion.relname) INTO filas;
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', nombre_tabla, particion.relname);
+            IF cfg.accion_vencidas = 'ELIMINAR' THEN
+                EXECUTE format('DROP TABLE %I', particion.relname);
+            ELSIF to_regclass(format('archivo.%I', particion.relname)) IS NOT NULL THEN
+                -- El mes ya se había archivado (llegaron filas atrasadas): se suman
+                EXECUTE format('INSERT INTO archivo.%1$I SELECT * FROM %1$I', particion.relname);
+                EXECUTE format('DROP TABLE %I', particion.relname);
+            ELSE
+                EXECUTE format('ALTER TABLE %I SET SCHEMA archivo', particion.relname);
+                EXECUTE format('GRANT SELECT ON archivo.%I TO administrador, auditor', particion.relname);
+            END IF;
+            INSERT INTO particiones_archivadas (particion, tabla, esquema, desde, hasta, filas)
+            VALUES (particion.relname, nombre_tabla,
+                    CASE WHEN cfg.accion_vencidas = 'ELIMINAR' THEN NULL ELSE 'archivo' END,
+                    mes, (mes + INTERVAL '1 month')::DATE, filas)
+            ON CONFLICT (particion) DO UPDATE SET
+                filas = particiones_archivadas.filas + EXCLUDED.filas,
+                fecha_archivo = NOW();
+            archivadas := archivadas + 1;
+        END LOOP;
+        RETURN archivadas;
+    END;
+    $$;
+"""
+
+CONVERTIR_A_PARTICIONADA = """
+    CREATE OR REPLACE FUNCTION convertir_a_particionada(nombre_tabla TEXT)
+    RETURNS VOID LANGUAGE plpgsql AS $$
+    DECLARE
+        tabla_oid OID := to_regclass(nombre_tabla);
+        anterior TEXT := nombre_tabla || '_sin_particionar';
+        columna_fecha TEXT;
+        columnas_pk TEXT;
+        nombre_pk TEXT;
+        vistas TEXT[] := '{}';
+        definiciones TEXT[] := '{}';
+        indices TEXT[] := '{}';
+        foraneas TEXT[] := '{}';
+        disparadores TEXT[] := '{}';
+        fila RECORD;
+        sentencia TEXT;
+        desde DATE;
+        mes DATE;
+    BEGIN
+        IF tabla_oid IS NULL OR EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = tabla_oid) THEN
+            RETURN;
+        END IF;
+        SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+        -- Lo que hay que recrear sobre la tabla nueva (capturado antes de renombrar)
+        FOR fila IN
+            SELECT DISTINCT v.oid, v.relkind, format('%I.%I', n.nspname, v.relname) AS nombre,
+                   pg_get_viewdef(v.oid) AS definicion
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            JOIN pg_class v ON v.oid = r.ev_class
+            JOIN pg_namespace n ON n.oid = v.relnamespace
+            WHERE d.classid = 'pg_rewrite'::regclass
+              AND ((d.refclassid = 'pg_class'::regclass AND d.refobjid = tabla_oid)
+                OR (d.refclassid = 'pg_type'::regclass
+                    AND d.refobjid = (SELECT reltype FROM pg_class WHERE oid = tabla_oid)))
+              AND v.oid <> tabla_oid
+        LOOP
+            IF fila.relkind <> 'v' THEN
+                RAISE EXCEPTION 'La vista materializada % lee % directamente: recrearla a mano', fila.nombre, nombre_tabla;
+            END IF;
+            vistas := vistas || fila.nombre;
+            definiciones := definiciones || fila.definicion;
+        END LOOP;
+
+        SELECT c.conname, string_agg(quote_ident(a.attname), ', ' ORDER BY k.orden)
+        INTO nombre_pk, columnas_pk
+        FROM pg_constraint c
+        CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, orden)
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+        WHERE c.conrelid = tabla_oid AND c.contype = 'p'
+        GROUP BY c.conname;
+
+        FOR fila IN
+            SELECT c.relname, pg_get_indexdef(i.indexrelid) AS definicion
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = tabla_oid AND NOT i.indisprimary
+        LOOP
+            indices := indices || fila.definicion;
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', fila.relname, left(fila.relname, 55) || '_sp');
+        END LOOP;
+        SELECT array_agg(format('ADD CONSTRAINT %I %s', conname, pg_get_constraintdef(oid)))
+        INTO foraneas FROM pg_constraint WHERE conrelid = tabla_oid AND contype = 'f';
+        SELECT array_agg(pg_get_triggerdef(oid))
+        INTO disparadores FROM pg_trigger WHERE tgrelid = tabla_oid AND NOT tgisinternal;
+
+        -- Tabla particionada con el nombre original
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', nombre_tabla, anterior);
+        IF nombre_pk IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I', anterior, nombre_pk, left(nombre_pk, 55) || '_sp');
+        END IF;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMMENTS) PARTITION BY RANGE (%I)',
+                       nombre_tabla, anterior, columna_fecha);
+        IF columnas_pk IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (%s%s)', nombre_tabla, columnas_pk,
+                           CASE WHEN quote_ident(columna_fecha) = ANY(string_to_array(columnas_pk, ', '))
+                                THEN '' ELSE ', ' || quote_ident(columna_fecha) END);
+        END IF;
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', nombre_tabla || '_default', nombre_tabla);
+        FOREACH sentencia IN ARRAY indices LOOP
+            EXECUTE sentencia;
+        END LOOP;
+        FOREACH sentencia IN ARRAY coalesce(foraneas, '{}') LOOP
+            EXECUTE format('ALTER TABLE %I %s', nombre_tabla, sentencia);
+        END LOOP;
+        FOREACH sentencia IN ARRAY coalesce(disparadores, '{}') LOOP
+            EXECUTE sentencia;
+        END LOOP;
+
+        -- Las secuencias (SERIAL) pasan a la tabla nueva antes de borrar la anterior
+        FOR fila IN
+            SELECT a.attname, pg_get_serial_sequence(anterior, a.attname) AS secuencia
+            FROM pg_attribute a
+            WHERE a.attrelid = anterior::regclass AND a.attnum > 0 AND NOT a.attisdropped
+              AND pg_get_serial_sequence(anterior, a.attname) IS NOT NULL
+        LOOP
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.%I', fila.secuencia, nombre_tabla, fila.attname);
+        END LOOP;
+        FOR fila IN
+            SELECT p.privilege_type, p.grantee
+            FROM pg_class c CROSS JOIN LATERAL aclexplode(c.relacl) p
+            WHERE c.oid = anterior::regclass AND p.grantee <> c.relowner
+        LOOP
+            EXECUTE format('GRANT %s ON %I TO %s', fila.privilege_type, nombre_tabla,
+                           CASE WHEN fila.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(fila.grantee)) END);
+        END LOOP;
+
+        -- Un mes por partición desde el dato más antiguo hasta meses_adelante
+        EXECUTE format('SELECT date_trunc(''month'', MIN(%I))::DATE FROM %I', columna_fecha, anterior) INTO desde;
+        FOR mes IN
+            SELECT generate_series(
+                LEAST(coalesce(desde, current_date), date_trunc('month', current_date)::DATE),
+                date_trunc('month', current_date) + make_interval(months => c.meses_adelante),
+                INTERVAL '1 month')::DATE
+            FROM particiones_config c WHERE c.tabla = nombre_tabla
+        LOOP
+            PERFORM crear_particion_mes(nombre_tabla, mes);
+        END LOOP;
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', nombre_tabla, anterior);
+
+        FOR i IN 1 .. coalesce(array_length(vistas, 1), 0) LOOP
+            EXECUTE format('CREATE OR REPLACE VIEW %s AS %s', vistas[i], definiciones[i]);
+        END LOOP;
+        EXECUTE format('DROP TABLE %I', anterior);
+        EXECUTE format('ANALYZE %I', nombre_tabla);
+    END;
+    $$;
+"""
+
+MANTENER_PARTICIONES = """
+    CREATE OR REPLACE PROCEDURE mantener_particiones()
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        cfg RECORD;
+        desde DATE;
+        mes DATE;
+    BEGIN
+        FOR cfg IN SELECT * FROM particiones_config ORDER BY tabla LOOP
+            EXECUTE format('SELECT date_trunc(''month'', MIN(%I))::DATE FROM %I', cfg.columna, cfg.tabla || '_default')
+            INTO desde;
+            FOR mes IN
+                SELECT generate_series(
+                    LEAST(coalesce(desde, current_date), date_trunc('month', current_date)::DATE),
+                    date_trunc('month', current_date) + make_interval(months => cfg.meses_adelante),
+                    INTERVAL '1 month')::DATE
+            LOOP
+                PERFORM crear_particion_mes(cfg.tabla, mes);
+            END LOOP;
+            PERFORM archivar_particiones(cfg.tabla);
+            COMMIT;
+        END LOOP;
+    END;
+    $$;
+"""
+
+PROGRAMACION = """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+            PERFORM cron.schedule('mantener_particiones', '15 3 * * *', 'CALL mantener_particiones()');
+        END IF;
+    END $$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0011_indices_login'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                CONFIGURACION,
+                CREAR_PARTICION_MES,
+                ARCHIVAR_PARTICIONES,
+                CONVERTIR_A_PARTICIONADA,
+                MANTENER_PARTICIONES,
+                "SELECT convertir_a_particionada('citas_local')",
+                "SELECT convertir_a_particionada('prescripciones')",
+                "SELECT convertir_a_particionada('auditoria_accesos')",
+                PROGRAMACION,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
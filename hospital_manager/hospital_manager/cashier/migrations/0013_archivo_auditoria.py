@@ -0,0 +1,43 @@
+"""
+Archivo frío de Auditoria_Accesos.
+
+La tabla conserva en la base 6 meses; los vencidos se separan al esquema
+archivo (mantener_particiones) y "manage.py archivar_auditoria" los escribe en
+archivos por mes y los registra en auditoria_archivos (ver sección 30 del
+script del coordinador y cashier/archivo_auditoria.py).
+"""
+
+from django.db import migrations
+
+ARCHIVOS = """
+    CREATE TABLE IF NOT EXISTS auditoria_archivos (
+        ruta TEXT PRIMARY KEY,                              -- relativa a AUDITORIA_ARCHIVO_DIR
+        particion VARCHAR(63) NOT NULL,
+        desde DATE NOT NULL,
+        hasta DATE NOT NULL,
+        filas BIGINT NOT NULL,
+        bytes BIGINT NOT NULL,
+        fecha_archivo TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+HORIZONTE = """
+    UPDATE particiones_config SET meses_retencion = 6, accion_vencidas = 'ARCHIVAR'
+    WHERE tabla = 'auditoria_accesos'
+"""
+
+HORIZONTE_ANTERIOR = """
+    UPDATE particiones_config SET meses_retencion = 24 WHERE tabla = 'auditoria_accesos'
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0012_particionamiento_mensual'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=ARCHIVOS, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(sql=HORIZONTE, reverse_sql=HORIZONTE_ANTERIOR),
+    ]
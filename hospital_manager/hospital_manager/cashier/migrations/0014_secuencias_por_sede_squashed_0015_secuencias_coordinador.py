@@ -0,0 +1,123 @@
+"""
+Secuencias de identificadores de todas las sedes en el coordinador.
+
+Las filas de todas las sedes se escriben en el coordinador, así que los bloques
+de IDs también se reservan ahí (cashier/identificadores.py): una secuencia por
+tabla y sede (seq_citas_sede_2, ...) con el rango exclusivo de la sede
+N*100000000 + 1 .. N*100000000 + 99999999 (ver sección 19 del script del
+coordinador). Cada secuencia arranca por encima del MAX(id) ya escrito en su
+rango.
+
+Reemplaza a 0014_secuencias_por_sede (secuencias seq_<tabla> en cada nodo) y
+0015_secuencias_coordinador. Las seq_<tabla> que quedaban en el coordinador se
+eliminan aquí, tomando antes lo que ya entregaron; las de los nodos Azure/AWS
+las eliminan sus scripts de creación (las migraciones solo tocan el coordinador).
+"""
+
+from django.db import migrations
+
+# [tabla, llave primaria, secuencia base] (en minúsculas: %I las cita tal cual).
+# citas es la vista del coordinador sobre todos los nodos
+SECUENCIAS = """
+    DO $$
+    DECLARE
+        tablas CONSTANT TEXT[][] := ARRAY[
+            ['personas', 'id_persona', 'seq_personas'],
+            ['pacientes', 'cod_pac', 'seq_pacientes'],
+            ['citas', 'id_cita', 'seq_citas'],
+            ['historias_clinicas', 'cod_hist', 'seq_historias_clinicas'],
+            ['diagnostico', 'id_diagnostico', 'seq_diagnostico'],
+            ['prescripciones', 'id_presc', 'seq_prescripciones'],
+            ['equipamiento', 'cod_eq', 'seq_equipamiento'],
+            ['reportes_generados', 'id_reporte', 'seq_reportes_generados']
+        ];
+        sede INT;
+        i INT;
+        inicio BIGINT;
+        fin BIGINT;
+        maximo BIGINT;
+        entregado BIGINT;
+        secuencia TEXT;
+        consulta TEXT;
+    BEGIN
+        FOR sede IN SELECT id_sede FROM Sedes_Hospitalarias UNION SELECT generate_series(1, 3) LOOP
+            inicio := sede * 100000000::BIGINT + 1;
+            fin := sede * 100000000::BIGINT + 99999999;
+            FOR i IN 1 .. array_length(tablas, 1) LOOP
+                secuencia := tablas[i][3] || '_sede_' || sede;
+                EXECUTE format(
+                    'CREATE SEQUENCE IF NOT EXISTS %I INCREMENT BY 50 MINVALUE %s MAXVALUE %s START WITH %s NO CYCLE',
+                    secuencia, inicio, fin, inicio
+                );
+
+                consulta := format('SELECT MAX(%I) FROM %I WHERE %I BETWEEN %s AND %s',
+                                   tablas[i][2], tablas[i][1], tablas[i][2], inicio, fin);
+                IF tablas[i][1] = 'citas' THEN
+                    BEGIN
+                        EXECUTE consulta INTO maximo;
+                    EXCEPTION WHEN OTHERS THEN
+                        -- La vista necesita a todos los nodos: sin alguno se usa lo que
+                        -- tiene el coordinador (citas de la sede 1 y las del outbox)
+                        RAISE WARNING 'Citas de los nodos no disponibles (%); se usa el coordinador', SQLERRM;
+                        SELECT MAX(id_cita) INTO maximo FROM (
+                            SELECT id_cita FROM citas_local
+                            UNION ALL
+                            SELECT id_cita FROM outbox_citas
+                        ) c WHERE id_cita BETWEEN inicio AND fin;
+                    END;
+                ELSE
+                    EXECUTE consulta INTO maximo;
+                END IF;
+
+                -- Lo que ya entregó la secuencia anterior de la sede 1 (bloques de 50)
+                IF sede = 1 AND to_regclass(tablas[i][3]) IS NOT NULL THEN
+                    EXECUTE format('SELECT last_value + 49 FROM %I WHERE is_called', tablas[i][3]) INTO entregado;
+                    maximo := GREATEST(maximo, entregado);
+                END IF;
+
+                IF maximo IS NOT NULL THEN
+                    -- Nunca retroceder una secuencia que ya entregó valores mayores
+                    EXECUTE format('SELECT setval(%L, GREATEST(%s, (SELECT last_value FROM %I)))',
+                                   secuencia, LEAST(maximo, fin), secuencia);
+                END IF;
+                EXECUTE format('GRANT USAGE, SELECT ON SEQUENCE %I TO administrador, medico, administrativo',
+                               secuencia);
+            END LOOP;
+        END LOOP;
+
+        -- Las seq_<tabla> de la sede 1 ya no se usan
+        FOR i IN 1 .. array_length(tablas, 1) LOOP
+            EXECUTE format('DROP SEQUENCE IF EXISTS %I', tablas[i][3]);
+        END LOOP;
+    END $$
+"""
+
+ELIMINAR_SECUENCIAS = """
+    DO $$
+    DECLARE
+        secuencia TEXT;
+    BEGIN
+        FOR secuencia IN
+            SELECT relname FROM pg_class
+            WHERE relkind = 'S' AND relname ~ '^seq_[a-z_]+_sede_[0-9]+$'
+        LOOP
+            EXECUTE format('DROP SEQUENCE IF EXISTS %I', secuencia);
+        END LOOP;
+    END $$
+"""
+
+
+class Migration(migrations.Migration):
+
+    replaces = [
+        ('cashier', '0014_secuencias_por_sede'),
+        ('cashier', '0015_secuencias_coordinador'),
+    ]
+
+    dependencies = [
+        ('cashier', '0013_archivo_auditoria'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=SECUENCIAS, reverse_sql=ELIMINAR_SECUENCIAS),
+    ]
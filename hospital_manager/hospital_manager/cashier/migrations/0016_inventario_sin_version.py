@@ -0,0 +1,32 @@
+"""
+Inventario_Farmacia deja de subir su versión en version_catalogos.
+
+Cada prescripción descuenta stock, así que trg_version_inventario actualizaba
+la misma fila de version_catalogos en casi todas las transacciones (bloqueo
+de fila compartido por todas las sedes). El catálogo medicamentos_disponibles
+ahora vence por tiempo (CATALOGOS_TTL en cashier/catalogos.py).
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0014_secuencias_por_sede_squashed_0015_secuencias_coordinador'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "DROP TRIGGER IF EXISTS trg_version_inventario ON Inventario_Farmacia",
+                "DELETE FROM version_catalogos WHERE catalogo = 'inventario'",
+            ],
+            reverse_sql=[
+                """INSERT INTO version_catalogos (catalogo) VALUES ('inventario')
+                   ON CONFLICT (catalogo) DO NOTHING""",
+                """CREATE OR REPLACE TRIGGER trg_version_inventario AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Inventario_Farmacia
+                   FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_catalogo('inventario')""",
+            ],
+        ),
+    ]
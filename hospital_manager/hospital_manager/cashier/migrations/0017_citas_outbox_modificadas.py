@@ -0,0 +1,85 @@
+"""
+La vista Citas toma del outbox también las modificaciones pendientes.
+
+Hasta ahora solo unía las citas nuevas ('I') que seguían en outbox_citas: una
+cita ya entregada y luego cancelada seguía viéndose como PROGRAMADA hasta que
+el despacho llegaba al nodo. Ahora cualquier cita con un mensaje PENDIENTE se
+toma del outbox y se excluye de lo que devuelve el nodo (ver sección 27 del
+script del coordinador y distribucion.ejecutar_citas_sede).
+"""
+
+from django.db import migrations
+
+VISTA_CITAS = """
+    CREATE OR REPLACE VIEW Citas AS
+    -- Datos locales (sede 1)
+    SELECT * FROM citas_local
+    UNION ALL
+    -- Datos de Azure (sede 2)
+    SELECT t.* FROM dblink(get_azure_conn(), 
+        'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+         fecha_hora_solicitada, tipo_servicio, estado, motivo 
+         FROM citas')
+        AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+            fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+            tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+    WHERE NOT EXISTS (SELECT 1 FROM outbox_citas o
+                      WHERE o.estado = 'PENDIENTE' AND o.id_cita = t.id_cita)
+    UNION ALL
+    -- Datos de AWS (sede 3)
+    SELECT t.* FROM dblink(get_aws_conn(), 
+        'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+         fecha_hora_solicitada, tipo_servicio, estado, motivo 
+         FROM citas')
+        AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+            fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+            tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+    WHERE NOT EXISTS (SELECT 1 FROM outbox_citas o
+                      WHERE o.estado = 'PENDIENTE' AND o.id_cita = t.id_cita)
+    UNION ALL
+    -- Citas de las sedes remotas aún en el outbox: nuevas ('I') o modificadas
+    -- ('U', p. ej. una cancelación), en lugar de la fila que todavía tiene el nodo
+    SELECT (jsonb_populate_record(NULL::citas_local, fila)).*
+    FROM outbox_citas
+    WHERE estado = 'PENDIENTE'
+"""
+
+VISTA_CITAS_ANTERIOR = """
+    CREATE OR REPLACE VIEW Citas AS
+    -- Datos locales (sede 1)
+    SELECT * FROM citas_local
+    UNION ALL
+    -- Datos de Azure (sede 2)
+    SELECT * FROM dblink(get_azure_conn(), 
+        'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+         fecha_hora_solicitada, tipo_servicio, estado, motivo 
+         FROM citas')
+        AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+            fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+            tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+    UNION ALL
+    -- Datos de AWS (sede 3)
+    SELECT * FROM dblink(get_aws_conn(), 
+        'SELECT id_cita, id_sede, id_dept, id_emp, cod_pac, fecha_hora, 
+         fecha_hora_solicitada, tipo_servicio, estado, motivo 
+         FROM citas')
+        AS t(id_cita BIGINT, id_sede INT, id_dept INT, id_emp INT, cod_pac INT,
+            fecha_hora TIMESTAMP, fecha_hora_solicitada TIMESTAMP,
+            tipo_servicio VARCHAR(50), estado VARCHAR(20), motivo VARCHAR(200))
+    UNION ALL
+    -- Citas nuevas de las sedes remotas aún en el outbox
+    SELECT (jsonb_populate_record(NULL::citas_local, fila)).*
+    FROM outbox_citas
+    WHERE estado = 'PENDIENTE' AND operacion = 'I'
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0016_inventario_sin_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=VISTA_CITAS, reverse_sql=VISTA_CITAS_ANTERIOR),
+    ]
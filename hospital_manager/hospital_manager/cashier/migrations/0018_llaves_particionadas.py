@@ -0,0 +1,322 @@
+"""
+Unicidad de los IDs en las tablas particionadas por mes.
+
+Una tabla particionada por rango solo admite llaves únicas que incluyan la
+columna de partición, así que 0012 dejó la PK de citas_local, Prescripciones y
+Auditoria_Accesos como (id, fecha) y el ID solo ya no era único. Cada tabla
+tiene ahora una tabla de llaves (citas_local_llaves, ...) con el ID como PK,
+mantenida por un trigger: insertar un ID repetido falla aunque la fila caiga en
+otra partición, y las llaves foráneas hacia la tabla apuntan a su tabla de
+llaves (convertir_a_particionada ya no las pierde).
+
+citas_local no lleva un nivel de lista por id_sede: en el coordinador solo
+guarda la sede 1 (las citas de Azure/AWS viven en su propio nodo, que ya es la
+división por sede), así que ese nivel tendría una sola partición.
+
+Ver sección 29 del script del coordinador.
+"""
+
+from django.db import migrations
+
+MANTENER_LLAVE = """
+    -- TG_ARGV[0]: tabla de llaves, TG_ARGV[1]: columna llave, TG_ARGV[2]: tabla particionada
+    -- (ambas calificadas con su esquema)
+    CREATE OR REPLACE FUNCTION mantener_llave_particionada()
+    RETURNS TRIGGER LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, pg_temp AS $$
+    DECLARE
+        vieja JSONB;
+        nueva JSONB;
+        filas BIGINT;
+    BEGIN
+        -- crear_particion_mes() mueve filas de la partición por defecto a una nueva
+        IF current_setting('his_particiones.moviendo', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            vieja := to_jsonb(OLD);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            nueva := to_jsonb(NEW);
+        END IF;
+        IF TG_OP = 'UPDATE' AND vieja -> TG_ARGV[1] = nueva -> TG_ARGV[1] THEN
+            RETURN NULL;
+        END IF;
+
+        IF vieja IS NOT NULL THEN
+            -- Un UPDATE de la fecha que cambia de partición llega como DELETE + INSERT:
+            -- si la llave sigue en la tabla se conserva
+            EXECUTE format(
+                'DELETE FROM %1$s g WHERE g.%2$I = (jsonb_populate_record(NULL::%1$s, $1)).%2$I
+                   AND NOT EXISTS (SELECT 1 FROM %3$s t WHERE t.%2$I = g.%2$I)',
+                TG_ARGV[0], TG_ARGV[1], TG_ARGV[2]
+            ) USING vieja;
+        END IF;
+        IF nueva IS NOT NULL THEN
+            EXECUTE format('INSERT INTO %s SELECT * FROM jsonb_populate_record(NULL::%s, $1) ON CONFLICT DO NOTHING',
+                           TG_ARGV[0], TG_ARGV[0]) USING nueva;
+            GET DIAGNOSTICS filas = ROW_COUNT;
+            IF filas = 0 THEN
+                -- La llave ya estaba: solo vale si es la misma fila que cambió de partición
+                EXECUTE format('SELECT COUNT(*) FROM %1$s WHERE %2$I = (jsonb_populate_record(NULL::%3$s, $1)).%2$I',
+                               TG_ARGV[2], TG_ARGV[1], TG_ARGV[0]) INTO filas USING nueva;
+                IF filas > 1 THEN
+                    RAISE unique_violation USING
+                        MESSAGE = format('%s = %s ya existe en %s', TG_ARGV[1], nueva ->> TG_ARGV[1], TG_ARGV[2]);
+                END IF;
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$;
+"""
+
+PROTEGER_LLAVE = """
+    CREATE OR REPLACE FUNCTION proteger_llave_particionada(nombre_tabla TEXT)
+    RETURNS TEXT LANGUAGE plpgsql AS $$
+    DECLARE
+        tabla_oid OID := to_regclass(nombre_tabla);
+        tabla TEXT;
+        llaves TEXT;
+        columna_fecha TEXT;
+        columnas TEXT[];
+        tipo TEXT;
+    BEGIN
+        IF tabla_oid IS NULL OR NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = tabla_oid) THEN
+            RETURN NULL;
+        END IF;
+        SELECT format('%I.%I', n.nspname, c.relname), format('%I.%I', n.nspname, c.relname || '_llaves')
+        INTO tabla, llaves
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.oid = tabla_oid;
+        IF to_regclass(llaves) IS NOT NULL THEN
+            RETURN llaves;
+        END IF;
+        SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+        -- La llave es la PK sin la columna de fecha que se le agregó al particionar
+        SELECT array_agg(a.attname ORDER BY a.attnum), min(format_type(a.atttypid, a.atttypmod))
+        INTO columnas, tipo
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = tabla_oid AND c.contype = 'p' AND a.attname <> columna_fecha;
+        IF columnas IS NULL THEN
+            RETURN NULL;
+        ELSIF array_length(columnas, 1) > 1 THEN
+            RAISE EXCEPTION 'La PK de % tiene más de una columna además de %: crear la tabla de llaves a mano',
+                nombre_tabla, columna_fecha;
+        END IF;
+
+        EXECUTE format('CREATE TABLE %s (%I %s PRIMARY KEY)', llaves, columnas[1], tipo);
+        EXECUTE format('INSERT INTO %s SELECT %I FROM %s', llaves, columnas[1], tabla);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT OR DELETE OR UPDATE OF %I ON %s
+             FOR EACH ROW EXECUTE FUNCTION mantener_llave_particionada(%L, %L, %L)',
+            'trg_' || left(nombre_tabla, 50) || '_llave', columnas[1], tabla, llaves, columnas[1], tabla
+        );
+        RETURN llaves;
+    END;
+    $$;
+"""
+
+CREAR_PARTICION_MES = """
+    CREATE OR REPLACE FUNCTION crear_particion_mes(nombre_tabla TEXT, mes DATE)
+    RETURNS BOOLEAN LANGUAGE plpgsql AS $$
+    DECLARE
+        columna_fecha TEXT;
+        inicio DATE := date_trunc('month', mes)::DATE;
+        fin DATE := (date_trunc('month', mes) + INTERVAL '1 month')::DATE;
+        particion TEXT := format('%s_p%s', nombre_tabla, to_char(mes, 'YYYYMM'));
+    BEGIN
+        IF to_regclass(particion) IS NOT NULL THEN
+            RETURN FALSE;
+        END IF;
+        SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', particion, nombre_tabla);
+        -- Las filas no dejan la tabla: sus llaves se quedan en la tabla de llaves
+        PERFORM set_config('his_particiones.moviendo', 'on', true);
+        EXECUTE format(
+            'WITH movidas AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM movidas',
+            nombre_tabla || '_default', columna_fecha, inicio, columna_fecha, fin, particion
+        );
+        PERFORM set_config('his_particiones.moviendo', 'off', true);
+        -- Con el CHECK el ATTACH no vuelve a recorrer la partición para validarla
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (%I >= %L AND %I < %L)',
+                       particion, particion || '_rango', columna_fecha, inicio, columna_fecha, fin);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       nombre_tabla, particion, inicio, fin);
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', particion, particion || '_rango');
+        RETURN TRUE;
+    END;
+    $$;
+"""
+
+CONVERTIR_A_PARTICIONADA = """
+    CREATE OR REPLACE FUNCTION convertir_a_particionada(nombre_tabla TEXT)
+    RETURNS VOID LANGUAGE plpgsql AS $$
+    DECLARE
+        tabla_oid OID := to_regclass(nombre_tabla);
+        anterior TEXT := nombre_tabla || '_sin_particionar';
+        columna_fecha TEXT;
+        columnas_pk TEXT;
+        nombre_pk TEXT;
+        llaves TEXT;
+        vistas TEXT[] := '{}';
+        definiciones TEXT[] := '{}';
+        indices TEXT[] := '{}';
+        foraneas TEXT[] := '{}';
+        entrantes TEXT[] := '{}';
+        disparadores TEXT[] := '{}';
+        fila RECORD;
+        sentencia TEXT;
+        desde DATE;
+        mes DATE;
+    BEGIN
+        IF tabla_oid IS NULL OR EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = tabla_oid) THEN
+            RETURN;
+        END IF;
+        SELECT c.columna INTO STRICT columna_fecha FROM particiones_config c WHERE c.tabla = nombre_tabla;
+
+        -- Lo que hay que recrear sobre la tabla nueva (capturado antes de renombrar)
+        FOR fila IN
+            SELECT DISTINCT v.oid, v.relkind, format('%I.%I', n.nspname, v.relname) AS nombre,
+                   pg_get_viewdef(v.oid) AS definicion
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            JOIN pg_class v ON v.oid = r.ev_class
+            JOIN pg_namespace n ON n.oid = v.relnamespace
+            WHERE d.classid = 'pg_rewrite'::regclass
+              AND ((d.refclassid = 'pg_class'::regclass AND d.refobjid = tabla_oid)
+                OR (d.refclassid = 'pg_type'::regclass
+                    AND d.refobjid = (SELECT reltype FROM pg_class WHERE oid = tabla_oid)))
+              AND v.oid <> tabla_oid
+        LOOP
+            IF fila.relkind <> 'v' THEN
+                RAISE EXCEPTION 'La vista materializada % lee % directamente: recrearla a mano', fila.nombre, nombre_tabla;
+            END IF;
+            vistas := vistas || fila.nombre;
+            definiciones := definiciones || fila.definicion;
+        END LOOP;
+
+        SELECT c.conname, string_agg(quote_ident(a.attname), ', ' ORDER BY k.orden)
+        INTO nombre_pk, columnas_pk
+        FROM pg_constraint c
+        CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, orden)
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+        WHERE c.conrelid = tabla_oid AND c.contype = 'p'
+        GROUP BY c.conname;
+
+        FOR fila IN
+            SELECT c.relname, pg_get_indexdef(i.indexrelid) AS definicion
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = tabla_oid AND NOT i.indisprimary
+        LOOP
+            indices := indices || fila.definicion;
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', fila.relname, left(fila.relname, 55) || '_sp');
+        END LOOP;
+        SELECT array_agg(format('ADD CONSTRAINT %I %s', conname, pg_get_constraintdef(oid)))
+        INTO foraneas FROM pg_constraint WHERE conrelid = tabla_oid AND contype = 'f' AND confrelid <> tabla_oid;
+        SELECT array_agg(pg_get_triggerdef(oid))
+        INTO disparadores FROM pg_trigger WHERE tgrelid = tabla_oid AND NOT tgisinternal;
+        -- Llaves foráneas de otras tablas (o de la misma) hacia esta: se quitan y al
+        -- final se recrean contra la tabla de llaves, que es la que tiene el ID único
+        FOR fila IN
+            SELECT conrelid::regclass::text AS tabla, conname, pg_get_constraintdef(oid) AS definicion
+            FROM pg_constraint WHERE confrelid = tabla_oid AND contype = 'f'
+        LOOP
+            entrantes := entrantes || format('ALTER TABLE %s ADD CONSTRAINT %I %s', fila.tabla, fila.conname, fila.definicion);
+            EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fila.tabla, fila.conname);
+        END LOOP;
+
+        -- Tabla particionada con el nombre original
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', nombre_tabla, anterior);
+        IF nombre_pk IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I', anterior, nombre_pk, left(nombre_pk, 55) || '_sp');
+        END IF;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING COMMENTS) PARTITION BY RANGE (%I)',
+                       nombre_tabla, anterior, columna_fecha);
+        IF columnas_pk IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (%s%s)', nombre_tabla, columnas_pk,
+                           CASE WHEN quote_ident(columna_fecha) = ANY(string_to_array(columnas_pk, ', '))
+                                THEN '' ELSE ', ' || quote_ident(columna_fecha) END);
+        END IF;
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', nombre_tabla || '_default', nombre_tabla);
+        FOREACH sentencia IN ARRAY indices LOOP
+            EXECUTE sentencia;
+        END LOOP;
+        FOREACH sentencia IN ARRAY coalesce(foraneas, '{}') LOOP
+            EXECUTE format('ALTER TABLE %I %s', nombre_tabla, sentencia);
+        END LOOP;
+        FOREACH sentencia IN ARRAY coalesce(disparadores, '{}') LOOP
+            EXECUTE sentencia;
+        END LOOP;
+
+        -- Las secuencias (SERIAL) pasan a la tabla nueva antes de borrar la anterior
+        FOR fila IN
+            SELECT a.attname, pg_get_serial_sequence(anterior, a.attname) AS secuencia
+            FROM pg_attribute a
+            WHERE a.attrelid = anterior::regclass AND a.attnum > 0 AND NOT a.attisdropped
+              AND pg_get_serial_sequence(anterior, a.attname) IS NOT NULL
+        LOOP
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.%I', fila.secuencia, nombre_tabla, fila.attname);
+        END LOOP;
+        FOR fila IN
+            SELECT p.privilege_type, p.grantee
+            FROM pg_class c CROSS JOIN LATERAL aclexplode(c.relacl) p
+            WHERE c.oid = anterior::regclass AND p.grantee <> c.relowner
+        LOOP
+            EXECUTE format('GRANT %s ON %I TO %s', fila.privilege_type, nombre_tabla,
+                           CASE WHEN fila.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(fila.grantee)) END);
+        END LOOP;
+
+        -- Un mes por partición desde el dato más antiguo hasta meses_adelante
+        EXECUTE format('SELECT date_trunc(''month'', MIN(%I))::DATE FROM %I', columna_fecha, anterior) INTO desde;
+        FOR mes IN
+            SELECT generate_series(
+                LEAST(coalesce(desde, current_date), date_trunc('month', current_date)::DATE),
+                date_trunc('month', current_date) + make_interval(months => c.meses_adelante),
+                INTERVAL '1 month')::DATE
+            FROM particiones_config c WHERE c.tabla = nombre_tabla
+        LOOP
+            PERFORM crear_particion_mes(nombre_tabla, mes);
+        END LOOP;
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', nombre_tabla, anterior);
+
+        llaves := proteger_llave_particionada(nombre_tabla);
+        FOREACH sentencia IN ARRAY entrantes LOOP
+            IF llaves IS NOT NULL THEN
+                sentencia := regexp_replace(sentencia, 'REFERENCES [^ (]+[(]', 'REFERENCES ' || llaves || '(');
+            END IF;
+            EXECUTE sentencia;
+        END LOOP;
+
+        FOR i IN 1 .. coalesce(array_length(vistas, 1), 0) LOOP
+            EXECUTE format('CREATE OR REPLACE VIEW %s AS %s', vistas[i], definiciones[i]);
+        END LOOP;
+        EXECUTE format('DROP TABLE %I', anterior);
+        EXECUTE format('ANALYZE %I', nombre_tabla);
+    END;
+    $$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0017_citas_outbox_modificadas'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                MANTENER_LLAVE,
+                PROTEGER_LLAVE,
+                CREAR_PARTICION_MES,
+                CONVERTIR_A_PARTICIONADA,
+                "SELECT proteger_llave_particionada('citas_local')",
+                "SELECT proteger_llave_particionada('prescripciones')",
+                "SELECT proteger_llave_particionada('auditoria_accesos')",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,118 @@
+"""
+Outbox de Citas del Sistema Hospitalario HIS+
+Las citas de las sedes remotas quedan primero en outbox_citas (en la misma
+transacción del INSERT/UPDATE sobre Citas); este hilo las entrega al nodo con
+despachar_outbox_citas() apenas se encolan y vuelve a intentar las pendientes
+cada OUTBOX_INTERVALO segundos
+"""
+
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+def _config(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+# ============================================================================
+# DESPACHO
+# ============================================================================
+
+def despachar(lote=None):
+    """Entrega lo pendiente a los nodos (los que no respondan quedan para el próximo intento)"""
+    with connections['default'].cursor() as cursor:
+        cursor.execute("CALL despachar_outbox_citas(%s)", [lote or _config('OUTBOX_LOTE', 500)])
+
+
+def resumen_outbox():
+    """Retorna (id_sede, estado, mensajes, intentos máximos, próximo intento, último error) por sede y estado"""
+    with connections['default'].cursor() as cursor:
+        cursor.execute("""
+            SELECT id_sede, estado, COUNT(*), MAX(intentos), MIN(proximo_intento),
+                   (ARRAY_AGG(ultimo_error ORDER BY id_mensaje) FILTER (WHERE ultimo_error IS NOT NULL))[1]
+            FROM outbox_citas
+            WHERE estado <> 'ENTREGADO'
+            GROUP BY id_sede, estado
+            ORDER BY id_sede, estado
+        """)
+        return cursor.fetchall()
+
+
+def citas_fallidas(id_sede, limite=20):
+    """
+    Citas de la sede que el outbox dejó de reintentar (FALLIDO tras
+    max_intentos) y que ningún mensaje posterior entregó o tiene pendiente:
+    no están en el nodo (o el nodo tiene una versión vieja)
+    """
+    with connections['default'].cursor() as cursor:
+        cursor.execute("""
+            SELECT f.id_cita, f.operacion, f.intentos, f.ultimo_error, f.fecha_creacion
+            FROM outbox_citas f
+            WHERE f.estado = 'FALLIDO' AND f.id_sede = %s
+              AND NOT EXISTS (SELECT 1 FROM outbox_citas o
+                              WHERE o.id_cita = f.id_cita AND o.id_mensaje > f.id_mensaje
+                                AND o.estado <> 'FALLIDO')
+            ORDER BY f.id_mensaje DESC LIMIT %s
+        """, [id_sede, limite])
+        return cursor.fetchall()
+
+
+def reintentar_fallidas():
+    """Vuelve a PENDIENTE los mensajes FALLIDO (uno por cita, el último). Retorna cuántos"""
+    with connections['default'].cursor() as cursor:
+        cursor.execute("""
+            UPDATE outbox_citas f
+            SET estado = 'PENDIENTE', intentos = 0, proximo_intento = NOW()
+            WHERE f.estado = 'FALLIDO'
+              AND NOT EXISTS (SELECT 1 FROM outbox_citas o
+                              WHERE o.id_cita = f.id_cita AND o.id_mensaje > f.id_mensaje)
+              AND NOT EXISTS (SELECT 1 FROM outbox_citas o
+                              WHERE o.id_cita = f.id_cita AND o.estado = 'PENDIENTE')
+        """)
+        return cursor.rowcount
+
+
+class DespachadorCitas:
+    """
+    Hilo del proceso web que vacía el outbox. Se inicia con la primera cita
+    remota que se escribe y además revisa cada OUTBOX_INTERVALO segundos (así
+    se reintentan las que fallaron). Con OUTBOX_EN_PROCESO = False lo atienden
+    solo pg_cron o "manage.py despachar_citas".
+    """
+
+    def __init__(self):
+        self._despertar = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def despertar(self):
+        if not _config('OUTBOX_EN_PROCESO', True):
+            return
+        self._iniciar()
+        self._despertar.set()
+
+    def _iniciar(self):
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._ciclo, name='outbox_citas', daemon=True)
+            self._hilo.start()
+
+    def _ciclo(self):
+        while True:
+            self._despertar.wait(timeout=_config('OUTBOX_INTERVALO', 10.0))
+            self._despertar.clear()
+            conn = connections['default']
+            conn.close_if_unusable_or_obsolete()
+            try:
+                despachar()
+            except DatabaseError:
+                conn.close()
+
+
+despachador = DespachadorCitas()
@@ -0,0 +1,172 @@
+"""
+Paginación por Clave del Sistema Hospitalario HIS+
+Paginación "seek" para las vistas con SQL crudo: cada página continúa desde la
+clave de la última fila mostrada, así la página N cuesta lo mismo que la 1
+(sin OFFSET que vuelva a recorrer las anteriores)
+"""
+
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+
+from .forms import ejecutar_query
+
+# ============================================================================
+# TOKENS
+# ============================================================================
+
+def _a_json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+def codificar_token(valores, direccion):
+    """Token opaco para la URL con los valores de la clave y la dirección ('sig'/'ant')"""
+    texto = json.dumps({'v': [_a_json(v) for v in valores], 'd': direccion}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_token(token, num_claves):
+    """Retorna (valores, direccion), o (None, 'sig') si el token no es válido"""
+    if not token:
+        return None, 'sig'
+    try:
+        relleno = '=' * (-len(token) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(token + relleno))
+        valores, direccion = datos['v'], datos['d']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None, 'sig'
+    if not isinstance(valores, list) or len(valores) != num_claves or direccion not in ('sig', 'ant'):
+        return None, 'sig'
+    return valores, direccion
+
+
+# ============================================================================
+# PÁGINA
+# ============================================================================
+
+class Pagina:
+    """Filas de una página y los parámetros GET para ir a la siguiente/anterior"""
+
+    def __init__(self, filas, request, siguiente=None, anterior=None, es_primera=True, nodos_fallidos=()):
+        self.filas = filas
+        # Como ResultadoDistribuido: avisar_resultado_parcial() funciona con la página
+        self.nodos_fallidos = list(nodos_fallidos)
+        self.siguiente = self._url(request, siguiente)
+        self.anterior = self._url(request, anterior)
+        self.primera = None if es_primera else self._url(request, '')
+
+    @staticmethod
+    def _url(request, token):
+        if token is None:
+            return None
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        if token:
+            params['cursor'] = token
+        return params.urlencode()
+
+    def __iter__(self):
+        return iter(self.filas)
+
+    def __len__(self):
+        return len(self.filas)
+
+    def __bool__(self):
+        return bool(self.filas)
+
+    @property
+    def parcial(self):
+        return bool(self.nodos_fallidos)
+
+
+# ============================================================================
+# CONSULTA
+# ============================================================================
+
+def _condicion(columnas, descendente, adelante):
+    """
+    Condición "después de la clave". Si todas las columnas van en el mismo
+    sentido se usa la comparación de filas (a, b) < (x, y), que el planner
+    resuelve con un índice sobre (a, b); con sentidos mezclados se expande.
+    """
+    mayor = [desc != adelante for desc in descendente]   # True: la columna debe crecer
+    if len(set(mayor)) == 1:
+        operador = '>' if mayor[0] else '<'
+        marcadores = ', '.join(['%s'] * len(columnas))
+        return f"({', '.join(columnas)}) {operador} ({marcadores})", list(range(len(columnas)))
+    partes, indices = [], []
+    for i, columna in enumerate(columnas):
+        iguales = [f"{c} = %s" for c in columnas[:i]]
+        iguales.append(f"{columna} {'>' if mayor[i] else '<'} %s")
+        partes.append('(' + ' AND '.join(iguales) + ')')
+        indices.extend(range(i + 1))
+    return '(' + ' OR '.join(partes) + ')', indices
+
+
+def _ordenar(filas, posiciones, descendente, adelante):
+    """Ordena como el ORDER BY de la página (ordenamientos estables de la última clave a la primera)"""
+    for posicion, desc in reversed(list(zip(posiciones, descendente))):
+        filas.sort(key=lambda fila: fila[posicion], reverse=desc == adelante)
+
+
+def paginar(request, query, params, claves, ejecutar=ejecutar_query, tamano=None):
+    """
+    Ejecuta `query` (sin ORDER BY ni LIMIT) paginada por `claves` y retorna una Pagina.
+
+    claves: lista de (columna, posición en la fila, descendente). Las columnas
+    son nombres de la salida de `query` y en conjunto deben ser únicas y no
+    nulas; la última suele ser el id como desempate. El cursor viaja en
+    ?cursor=<token>.
+
+    `ejecutar` puede combinar varias fuentes (cada una con su ORDER BY y
+    LIMIT): las filas se reordenan aquí, y si retorna un ResultadoDistribuido
+    parcial la página queda parcial.
+    """
+    tamano = tamano or getattr(settings, 'PAGINACION_TAMANO', 100)
+    columnas = [c[0] for c in claves]
+    posiciones = [c[1] for c in claves]
+    descendente = [c[2] for c in claves]
+
+    valores, direccion = decodificar_token(request.GET.get('cursor'), len(claves))
+    adelante = direccion == 'sig'
+
+    sql = f"SELECT * FROM ({query}) AS pagina"
+    params = list(params or [])
+    if valores is not None:
+        condicion, indices = _condicion(columnas, descendente, adelante)
+        sql += f" WHERE {condicion}"
+        params += [valores[i] for i in indices]
+    orden = ', '.join(
+        f"{c} {'DESC' if desc == adelante else 'ASC'}" for c, desc in zip(columnas, descendente)
+    )
+    sql += f" ORDER BY {orden} LIMIT %s"
+    params.append(tamano + 1)
+
+    resultado = ejecutar(sql, params)
+    filas = list(resultado)
+    _ordenar(filas, posiciones, descendente, adelante)
+    hay_mas = len(filas) > tamano
+    filas = filas[:tamano]
+    if not adelante:
+        filas.reverse()
+
+    def clave(fila):
+        return [fila[p] for p in posiciones]
+
+    siguiente = anterior = None
+    if filas:
+        # Hacia adelante siempre hay anterior si se llegó con cursor; hacia atrás, siempre siguiente
+        if (hay_mas if adelante else True):
+            siguiente = codificar_token(clave(filas[-1]), 'sig')
+        if (valores is not None if adelante else hay_mas):
+            anterior = codificar_token(clave(filas[0]), 'ant')
+    return Pagina(filas, request, siguiente, anterior, es_primera=valores is None,
+                  nodos_fallidos=getattr(resultado, 'nodos_fallidos', ()))
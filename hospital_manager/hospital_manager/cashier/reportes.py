@@ -0,0 +1,124 @@
+"""
+Consultas de Reportes del Sistema Hospitalario HIS+
+Una sola definición por reporte, usada por las vistas (con su LIMIT de pantalla)
+y por la exportación (completa)
+"""
+
+# ============================================================================
+# CONSULTAS POR TIPO DE REPORTE
+# ============================================================================
+
+# tipo -> (título, query sin LIMIT). Las vistas agregan el LIMIT que muestran.
+CONSULTAS_REPORTE = {
+    'medicamentos': ('Medicamentos más Recetados', """
+        SELECT s.nom_sede, s.ciudad, m.nom_med, COUNT(pr.id_presc) AS total_prescripciones,
+               SUM(pr.cantidad_total) AS cantidad_total_recetada
+        FROM Prescripciones pr
+        INNER JOIN Catalogo_Medicamentos m ON pr.cod_med = m.cod_med
+        INNER JOIN Citas c ON pr.id_cita = c.id_cita
+        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+        WHERE pr.fecha_emision >= CURRENT_DATE - INTERVAL '1 month'
+        GROUP BY s.id_sede, s.nom_sede, s.ciudad, m.cod_med, m.nom_med
+        ORDER BY s.nom_sede, total_prescripciones DESC
+    """),
+    'medicos': ('Médicos con más Consultas', """
+        SELECT p.nom_persona || ' ' || p.apellido_persona AS nombre_medico,
+               s.nom_sede, d.nom_dept, esp.nombre_esp AS especialidad,
+               DATE_TRUNC('week', c.fecha_hora) AS semana, COUNT(c.id_cita) AS total_consultas
+        FROM Citas c
+        INNER JOIN Empleados e ON c.id_emp = e.id_emp
+        INNER JOIN Personas p ON e.id_persona = p.id_persona
+        INNER JOIN Roles r ON e.id_rol = r.id_rol
+        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+        INNER JOIN Departamentos d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
+        LEFT JOIN Emp_Posee_Esp epe ON e.id_emp = epe.id_emp
+        LEFT JOIN Especialidades esp ON epe.id_especialidad = esp.id_especialidad
+        WHERE r.nombre_rol = 'Medico' AND c.estado = 'COMPLETADA'
+        GROUP BY e.id_emp, p.nom_persona, p.apellido_persona, s.nom_sede, d.nom_dept, esp.nombre_esp, DATE_TRUNC('week', c.fecha_hora)
+        ORDER BY semana DESC, total_consultas DESC
+    """),
+    'tiempos': ('Tiempos de Atención', """
+        SELECT s.nom_sede, d.nom_dept,
+               ROUND(AVG(EXTRACT(EPOCH FROM (c.fecha_hora - c.fecha_hora_solicitada))/86400)::numeric, 2) AS dias_promedio,
+               COUNT(*) AS total_casos
+        FROM Citas c
+        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+        INNER JOIN Departamentos d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
+        WHERE c.estado = 'COMPLETADA'
+        GROUP BY s.id_sede, s.nom_sede, d.nom_dept ORDER BY dias_promedio
+    """),
+    'enfermedades': ('Pacientes por Enfermedad', """
+        SELECT s.nom_sede, enf.nombre_enfermedad, COUNT(DISTINCT hc.cod_pac) AS total_pacientes,
+               COUNT(diag.id_diagnostico) AS total_diagnosticos
+        FROM Diagnostico diag
+        INNER JOIN Enfermedades enf ON diag.id_enfermedad = enf.id_enfermedad
+        INNER JOIN Historias_Clinicas hc ON diag.cod_hist = hc.cod_hist
+        INNER JOIN Citas c ON diag.id_cita = c.id_cita
+        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+        GROUP BY s.id_sede, s.nom_sede, enf.id_enfermedad, enf.nombre_enfermedad
+        ORDER BY s.nom_sede, total_pacientes DESC
+    """),
+    'equipamiento': ('Equipamiento Compartido', """
+        WITH equipo_compartido AS (
+            SELECT eq.nom_eq, eq.marca_modelo, COUNT(DISTINCT eq.id_sede) AS sedes_con_equipo
+            FROM Equipamiento eq GROUP BY eq.nom_eq, eq.marca_modelo HAVING COUNT(DISTINCT eq.id_sede) > 1
+        )
+        SELECT ec.nom_eq, ec.marca_modelo, s.nom_sede, d.nom_dept, eq.estado_equipo
+        FROM equipo_compartido ec
+        INNER JOIN Equipamiento eq ON ec.nom_eq = eq.nom_eq AND ec.marca_modelo = eq.marca_modelo
+        INNER JOIN Sedes_Hospitalarias s ON eq.id_sede = s.id_sede
+        INNER JOIN Departamentos d ON eq.id_dept = d.id_dept AND eq.id_sede = d.id_sede
+        ORDER BY ec.nom_eq, s.nom_sede
+    """),
+    'trimestre': ('Enfermedades del Trimestre', """
+        SELECT d.nom_dept, s.nom_sede, enf.nombre_enfermedad, COUNT(diag.id_diagnostico) AS total_casos
+        FROM Diagnostico diag
+        INNER JOIN Enfermedades enf ON diag.id_enfermedad = enf.id_enfermedad
+        INNER JOIN Citas c ON diag.id_cita = c.id_cita
+        INNER JOIN Departamentos d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
+        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+        WHERE c.fecha_hora >= CURRENT_DATE - INTERVAL '3 months'
+        GROUP BY d.nom_dept, s.nom_sede, enf.nombre_enfermedad ORDER BY total_casos DESC
+    """),
+    'consumo': ('Consumo de Medicamentos', """
+        SELECT * FROM mv_consumo_medicamentos_dept ORDER BY cantidad_consumida DESC
+    """),
+    'recursos': ('Utilización de Recursos', """
+        SELECT * FROM mv_utilizacion_recursos ORDER BY total_citas DESC
+    """),
+    'indices': ('Índices de Atención', """
+        SELECT s.nom_sede, COUNT(c.id_cita) AS total_citas,
+               ROUND(AVG(EXTRACT(EPOCH FROM (c.fecha_hora - c.fecha_hora_solicitada))/86400)::numeric, 1) AS dias_espera
+        FROM Citas c
+        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+        WHERE c.fecha_hora >= CURRENT_DATE - INTERVAL '1 month'
+        GROUP BY s.id_sede, s.nom_sede ORDER BY dias_espera
+    """),
+    'especialidades': ('Especialidades Demandadas', """
+        SELECT esp.nombre_esp, s.nom_sede, COUNT(c.id_cita) AS total_consultas
+        FROM Especialidades esp
+        INNER JOIN Emp_Posee_Esp epe ON esp.id_especialidad = epe.id_especialidad
+        INNER JOIN Empleados e ON epe.id_emp = e.id_emp
+        INNER JOIN Citas c ON e.id_emp = c.id_emp
+        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+        WHERE c.fecha_hora >= CURRENT_DATE - INTERVAL '1 month'
+        GROUP BY esp.nombre_esp, s.nom_sede ORDER BY total_consultas DESC
+    """),
+    'inventario': ('Inventario Crítico', """
+        SELECT * FROM vista_inventario_consolidado WHERE stock_actual < 100 ORDER BY stock_actual
+    """),
+    'productividad': ('Productividad Médicos', """
+        SELECT * FROM mv_medicos_consultas ORDER BY total_consultas DESC
+    """),
+    'tendencias': ('Tendencias de Enfermedades', """
+        SELECT * FROM mv_enfermedades_por_sede ORDER BY total_diagnosticos DESC
+    """),
+}
+
+
+def consulta_reporte(tipo, limite=None):
+    """Retorna la query del reporte, con LIMIT si se indica"""
+    query = CONSULTAS_REPORTE[tipo][1]
+    if limite is not None:
+        query = f"{query.rstrip()} LIMIT {int(limite)}"
+    return query
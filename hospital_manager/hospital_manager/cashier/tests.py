@@ -1,3 +1,793 @@
-from django.test import TestCase
+"""
+Pruebas unitarias del Sistema Hospitalario HIS+
+Cubren las funciones puras y la lógica que no necesita base de datos
+(los accesos se reemplazan con mock), así que usan SimpleTestCase
+"""
 
-# Create your tests here.
+import contextlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.db import DatabaseError, DataError, OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import (auditoria, autenticacion, catalogos, cola_reportes, distribucion, estadisticas, identificadores,
+               instrumentacion)
+from .archivo_auditoria import _buscar_frios, _escribir_csv
+from .busqueda import escapar_like
+from .distribucion import ResultadoDistribuido, filtro_citas
+from .exportacion import PDF_LINEAS, generar_pdf, generar_xlsx
+from .paginacion import _condicion, codificar_token, decodificar_token, paginar
+
+# ============================================================================
+# PAGINACIÓN POR CLAVE
+# ============================================================================
+
+
+class TokenTests(SimpleTestCase):
+
+    def test_ida_y_vuelta_con_fechas_y_decimales(self):
+        token = codificar_token([datetime(2024, 5, 1, 8, 30), 12.5, Decimal('3.10'), 7], 'ant')
+        self.assertNotIn('=', token)
+        valores, direccion = decodificar_token(token, 4)
+        # Las fechas y Decimal viajan como texto; los float y enteros quedan igual
+        self.assertEqual(valores, ['2024-05-01T08:30:00', 12.5, '3.10', 7])
+        self.assertEqual(direccion, 'ant')
+
+    def test_fecha_sin_hora(self):
+        valores, _ = decodificar_token(codificar_token([date(2024, 2, 29), 1], 'sig'), 2)
+        self.assertEqual(valores, ['2024-02-29', 1])
+
+    def test_tokens_invalidos(self):
+        valido = codificar_token([1, 2], 'sig')
+        for token, num_claves in [
+            (None, 2),
+            ('', 2),
+            ('no-es-base64!', 2),
+            ('e30', 2),                                   # {} sin 'v' ni 'd'
+            (valido, 3),                                  # otra cantidad de claves
+            (codificar_token([1, 2], 'atras'), 2),        # dirección desconocida
+        ]:
+            with self.subTest(token=token):
+                self.assertEqual(decodificar_token(token, num_claves), (None, 'sig'))
+
+
+class CondicionTests(SimpleTestCase):
+
+    def test_mismo_sentido_usa_comparacion_de_filas(self):
+        sql, indices = _condicion(['fecha_hora', 'id_cita'], [True, True], True)
+        self.assertEqual(sql, '(fecha_hora, id_cita) < (%s, %s)')
+        self.assertEqual(indices, [0, 1])
+
+    def test_mismo_sentido_hacia_atras_invierte_el_operador(self):
+        sql, _ = _condicion(['fecha_hora', 'id_cita'], [True, True], False)
+        self.assertEqual(sql, '(fecha_hora, id_cita) > (%s, %s)')
+
+    def test_sentidos_mezclados_se_expanden_con_or(self):
+        sql, indices = _condicion(['apellido', 'fecha', 'id'], [False, True, False], True)
+        self.assertEqual(
+            sql,
+            '((apellido > %s) OR (apellido = %s AND fecha < %s) '
+            'OR (apellido = %s AND fecha = %s AND id > %s))'
+        )
+        self.assertEqual(indices, [0, 0, 1, 0, 1, 2])
+
+    def test_sentidos_mezclados_hacia_atras(self):
+        sql, indices = _condicion(['apellido', 'id'], [False, True], False)
+        self.assertEqual(sql, '((apellido < %s) OR (apellido = %s AND id > %s))')
+        self.assertEqual(indices, [0, 0, 1])
+
+
+class PaginarTests(SimpleTestCase):
+    CLAVES = [('fecha_hora', 1, True), ('id_cita', 0, True)]
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        # (id_cita, fecha_hora), de la más reciente a la más antigua
+        self.filas = [(10 - i, datetime(2024, 1, 10 - i, 9)) for i in range(10)]
+
+    def _ejecutar(self, filas):
+        llamadas = []
+
+        def ejecutar(sql, params):
+            llamadas.append((sql, params))
+            return filas
+        return ejecutar, llamadas
+
+    def test_primera_pagina(self):
+        ejecutar, llamadas = self._ejecutar(self.filas[:4])
+        pagina = paginar(self.factory.get('/citas/'), 'SELECT * FROM Citas', [], self.CLAVES,
+                         ejecutar=ejecutar, tamano=3)
+        sql, params = llamadas[0]
+        self.assertNotIn('WHERE', sql)
+        self.assertTrue(sql.endswith('ORDER BY fecha_hora DESC, id_cita DESC LIMIT %s'))
+        self.assertEqual(params, [4])
+        self.assertEqual([f[0] for f in pagina], [10, 9, 8])
+        self.assertIsNone(pagina.anterior)
+        self.assertIsNone(pagina.primera)
+        valores, direccion = decodificar_token(pagina.siguiente.split('=', 1)[1], 2)
+        self.assertEqual((valores, direccion), (['2024-01-08T09:00:00', 8], 'sig'))
+
+    def test_hacia_atras_invierte_orden_y_filas(self):
+        cursor = codificar_token(['2024-01-05T09:00:00', 5], 'ant')
+        # Hacia atrás la base devuelve en orden ascendente (las más cercanas al cursor primero)
+        ejecutar, llamadas = self._ejecutar([self.filas[4], self.filas[3], self.filas[2], self.filas[1]])
+        pagina = paginar(self.factory.get('/citas/', {'cursor': cursor, 'q': 'x'}), 'SELECT * FROM Citas',
+                         [1], self.CLAVES, ejecutar=ejecutar, tamano=3)
+        sql, params = llamadas[0]
+        self.assertIn('WHERE (fecha_hora, id_cita) > (%s, %s)', sql)
+        self.assertTrue(sql.endswith('ORDER BY fecha_hora ASC, id_cita ASC LIMIT %s'))
+        self.assertEqual(params, [1, '2024-01-05T09:00:00', 5, 4])
+        # Se muestran en el orden normal de la lista
+        self.assertEqual([f[0] for f in pagina], [8, 7, 6])
+        self.assertIn('q=x', pagina.siguiente)
+        self.assertIsNotNone(pagina.anterior)     # quedó una fila más hacia atrás
+        self.assertEqual(pagina.primera, 'q=x')
+
+    def test_combina_fuentes_y_marca_parcial(self):
+        # Nodo y outbox cada uno con su propio orden: paginar reordena la mezcla
+        combinadas = ResultadoDistribuido(
+            [self.filas[1], self.filas[3], self.filas[0], self.filas[2]], ['sede_2']
+        )
+        ejecutar, _ = self._ejecutar(combinadas)
+        pagina = paginar(self.factory.get('/citas/'), 'SELECT * FROM Citas', [], self.CLAVES,
+                         ejecutar=ejecutar, tamano=3)
+        self.assertEqual([f[0] for f in pagina], [10, 9, 8])
+        self.assertTrue(pagina.parcial)
+        self.assertEqual(pagina.nodos_fallidos, ['sede_2'])
+
+
+# ============================================================================
+# CONSULTAS DISTRIBUIDAS
+# ============================================================================
+
+
+class FiltroCitasTests(SimpleTestCase):
+
+    def test_sin_filtros(self):
+        self.assertEqual(filtro_citas(), ('TRUE', []))
+
+    def test_todos_los_filtros(self):
+        desde, hasta = datetime(2024, 1, 1), datetime(2024, 1, 2)
+        sql, params = filtro_citas('ci', id_emp=4, cod_pac=9, desde=desde, hasta=hasta,
+                                   estado='Programada', ids_cita=(3, 1))
+        self.assertEqual(
+            sql,
+            'ci.id_cita = ANY(%s) AND ci.id_emp = %s AND ci.cod_pac = %s AND ci.fecha_hora >= %s '
+            'AND ci.fecha_hora < %s AND ci.estado = %s'
+        )
+        self.assertEqual(params, [[3, 1], 4, 9, desde, hasta, 'Programada'])
+
+    def test_lista_de_ids_vacia_no_se_omite(self):
+        sql, params = filtro_citas(ids_cita=[])
+        self.assertEqual((sql, params), ('c.id_cita = ANY(%s)', [[]]))
+
+
+class ResultadoDistribuidoTests(SimpleTestCase):
+
+    def test_completo_y_parcial(self):
+        completo = ResultadoDistribuido([(1,), (2,)])
+        self.assertEqual(completo, [(1,), (2,)])
+        self.assertFalse(completo.parcial)
+        parcial = ResultadoDistribuido([], ('sede_3',))
+        self.assertTrue(parcial.parcial)
+        self.assertEqual(parcial.nodos_fallidos, ['sede_3'])
+
+    def test_fragmentos_omite_el_nodo_que_falla(self):
+        def consultar(alias, query, params, timeout):
+            if alias == 'sede_2':
+                raise DatabaseError('sin conexión')
+            return [(alias, 2 if alias == 'sede_1' else 1)]
+
+        with mock.patch.object(distribucion, 'aliases_fragmentos', return_value=['sede_1', 'sede_2', 'sede_3']), \
+                mock.patch.object(distribucion, '_consultar_nodo', side_effect=consultar):
+            resultado = distribucion.ejecutar_query_fragmentos(
+                'SELECT 1', orden=lambda fila: fila[1], descendente=True, limite=1, timeout=5
+            )
+        self.assertEqual(resultado, [('sede_1', 2)])
+        self.assertEqual(resultado.nodos_fallidos, ['sede_2'])
+
+
+class OutboxCitasFragmentosTests(SimpleTestCase):
+    QUERY = 'SELECT c.id_cita, c.fecha_hora FROM {citas} c JOIN {empleados} e ON TRUE WHERE c.id_emp = %s'
+
+    def _ejecutar(self, consultas_nodo, nodo_caido=None):
+        def consultar(alias, query, params, timeout):
+            consultas_nodo.append(query)
+            if alias == nodo_caido:
+                raise DatabaseError('sin conexión')
+            return [(200000001, datetime(2024, 1, 2))] if alias == 'sede_2' else []
+
+        def coordinador(query, params=None):
+            if 'jsonb_populate_record' in query:
+                self.consulta_outbox = query
+                return [(200000002, datetime(2024, 1, 1))]
+            return [(7, 200000002)]   # (id_mensaje, id_cita) pendiente
+
+        with mock.patch.object(distribucion, 'aliases_fragmentos', return_value=['sede_2', 'sede_3']), \
+                mock.patch.object(distribucion, '_consultar_nodo', side_effect=consultar), \
+                mock.patch.object(distribucion, 'ejecutar_query', side_effect=coordinador):
+            return distribucion.ejecutar_citas_fragmentos(self.QUERY, [4], orden=lambda r: r[1])
+
+    def test_los_nodos_excluyen_lo_pendiente_y_se_suma_el_outbox(self):
+        consultas_nodo = []
+        resultado = self._ejecutar(consultas_nodo)
+        self.assertEqual([fila[0] for fila in resultado], [200000002, 200000001])
+        for query in consultas_nodo:
+            self.assertIn('(SELECT * FROM Citas WHERE id_cita NOT IN (200000002)) c', query)
+            self.assertIn('JOIN Empleados e', query)
+        self.assertIn('WHERE id_mensaje IN (7)', self.consulta_outbox)
+        self.assertIn('JOIN Empleados e', self.consulta_outbox)
+
+    def test_nodo_caido_outbox_sin_vistas_distribuidas(self):
+        resultado = self._ejecutar([], nodo_caido='sede_3')
+        self.assertEqual(resultado.nodos_fallidos, ['sede_3'])
+        self.assertIn('JOIN (SELECT * FROM empleados_local WHERE FALSE) e', self.consulta_outbox)
+
+
+# ============================================================================
+# BÚSQUEDA
+# ============================================================================
+
+
+class EscaparLikeTests(SimpleTestCase):
+
+    def test_comodines_literales(self):
+        self.assertEqual(escapar_like('50%_off'), '50\\%\\_off')
+
+    def test_barra_invertida_primero(self):
+        # La barra se escapa antes para no duplicar las que agregan % y _
+        self.assertEqual(escapar_like('a\\%'), 'a\\\\\\%')
+
+    def test_texto_sin_comodines(self):
+        self.assertEqual(escapar_like('Pérez'), 'Pérez')
+
+
+# ============================================================================
+# EXPORTACIÓN
+# ============================================================================
+
+
+def _lotes(filas, columnas=('id', 'nombre', 'fecha', 'monto')):
+    """Lotes como los de lotes_consulta: (columnas, filas) y al final un lote vacío"""
+    return iter([(list(columnas), filas), (list(columnas), [])])
+
+
+class ExportacionXlsxTests(SimpleTestCase):
+
+    def test_libro_valido_con_texto_escapado(self):
+        filas = [
+            (1, 'Ana & <Beto>', datetime(2024, 3, 1, 14, 5), Decimal('10.50')),
+            (2, None, None, 3.25),
+        ]
+        datos = b''.join(generar_xlsx(_lotes(filas), titulo='Citas del día'))
+        libro = zipfile.ZipFile(io.BytesIO(datos))
+        self.assertIsNone(libro.testzip())
+        self.assertIn('[Content_Types].xml', libro.namelist())
+        self.assertIn('Citas del día', libro.read('xl/workbook.xml').decode('utf-8'))
+
+        hoja = ElementTree.fromstring(libro.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        celdas = [
+            [c.findtext('s:v', namespaces=ns) or c.findtext('s:is/s:t', namespaces=ns) for c in fila]
+            for fila in hoja.iterfind('s:sheetData/s:row', ns)
+        ]
+        self.assertEqual(celdas, [
+            ['id', 'nombre', 'fecha', 'monto'],
+            ['1', 'Ana & <Beto>', '2024-03-01 14:05', '10.50'],
+            ['2', '', '', '3.25'],
+        ])
+
+    def test_sin_filas_solo_encabezado(self):
+        datos = b''.join(generar_xlsx(_lotes([]), titulo='Vacío'))
+        hoja = zipfile.ZipFile(io.BytesIO(datos)).read('xl/worksheets/sheet1.xml')
+        self.assertEqual(hoja.count(b'<row>'), 1)
+
+
+class ExportacionPdfTests(SimpleTestCase):
+
+    def _pdf(self, filas):
+        return b''.join(generar_pdf(_lotes(filas), titulo='Inventario (sede 1)'))
+
+    def test_xref_apunta_a_cada_objeto(self):
+        datos = self._pdf([(i, f'Medicamento {i}', None, i * 1.5) for i in range(PDF_LINEAS + 5)])
+        self.assertTrue(datos.startswith(b'%PDF-1.4\n'))
+        self.assertTrue(datos.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Count 2', datos)
+
+        inicio_xref = int(re.search(rb'startxref\n(\d+)\n', datos).group(1))
+        self.assertTrue(datos[inicio_xref:].startswith(b'xref\n'))
+        entradas = re.findall(rb'(\d{10}) 00000 n ', datos[inicio_xref:])
+        for numero, offset in enumerate(entradas, start=1):
+            with self.subTest(objeto=numero):
+                self.assertTrue(datos[int(offset):].startswith(f'{numero} 0 obj'.encode('latin-1')))
+
+    def test_sin_filas_una_pagina(self):
+        datos = self._pdf([])
+        self.assertIn(b'/Count 1', datos)
+        # Paréntesis del título escapados dentro del string del PDF
+        self.assertIn(b'Inventario \\(sede 1\\)', datos)
+
+
+# ============================================================================
+# ARCHIVO FRÍO DE AUDITORÍA
+# ============================================================================
+
+
+def _evento(id_evento, fecha, accion='SELECT', id_emp=1):
+    return (id_evento, fecha, 'Ana Pérez', 'Medico', 'Sede Norte', accion, 'Citas', str(id_evento),
+            '10.0.0.1', id_emp)
+
+
+class BuscarFriosTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        ajustes = override_settings(AUDITORIA_ARCHIVO_DIR=self.directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        enero = [_evento(i, datetime(2024, 1, 10 + i, 8)) for i in (1, 2, 3)]
+        febrero = [_evento(i, datetime(2024, 2, 1 + i, 8), accion='INSERT' if i == 5 else 'SELECT')
+                   for i in (4, 5, 6)]
+        self.archivos = [
+            (date(2024, 1, 1), date(2024, 2, 1), self._escribir('2024-01', enero)),
+            (date(2024, 2, 1), date(2024, 3, 1), self._escribir('2024-02', febrero)),
+        ]
+
+    def _escribir(self, mes, filas):
+        ruta = f'mes={mes}/auditoria.csv.gz'
+        os.makedirs(os.path.join(self.directorio, f'mes={mes}'))
+        _escribir_csv(os.path.join(self.directorio, ruta), [filas])
+        return ruta
+
+    def _buscar(self, filtros=None, cursor=None, adelante=True, limite=10, tope=None, archivos=None):
+        sin_leer = []
+        filas = _buscar_frios(self.archivos if archivos is None else archivos, filtros or {}, cursor,
+                              adelante, limite, tope, sin_leer)
+        return [fila[0] for fila in filas], sin_leer
+
+    def test_mas_recientes_primero_con_limite(self):
+        self.assertEqual(self._buscar(limite=4), ([6, 5, 4, 3], []))
+
+    def test_continua_despues_del_cursor(self):
+        cursor = (datetime(2024, 2, 6, 8), 5)
+        self.assertEqual(self._buscar(cursor=cursor, limite=3), ([4, 3, 2], []))
+
+    def test_hacia_atras(self):
+        cursor = (datetime(2024, 1, 12, 8), 2)
+        self.assertEqual(self._buscar(cursor=cursor, adelante=False, limite=2), ([3, 4], []))
+
+    def test_filtros(self):
+        self.assertEqual(self._buscar({'accion': 'INSERT'}), ([5], []))
+        self.assertEqual(self._buscar({'desde': datetime(2024, 1, 12), 'hasta': datetime(2024, 2, 6)}),
+                         ([4, 3, 2], []))
+
+    def test_tope_poda_meses_sin_leerlos(self):
+        # La base llenó la página con filas de marzo: ningún mes archivado puede aportar,
+        # ni siquiera uno cuyo archivo falta
+        faltante = (date(2023, 12, 1), date(2024, 1, 1), 'mes=2023-12/auditoria.csv.gz')
+        tope = _evento(99, datetime(2024, 3, 2))
+        self.assertEqual(self._buscar(tope=tope, archivos=self.archivos + [faltante]), ([], []))
+
+    def test_archivo_ilegible_se_informa(self):
+        faltante = (date(2023, 12, 1), date(2024, 1, 1), 'mes=2023-12/auditoria.csv.gz')
+        self.assertEqual(self._buscar(archivos=self.archivos + [faltante]),
+                         ([6, 5, 4, 3, 2, 1], ['2023-12']))
+
+
+# ============================================================================
+# IDENTIFICADORES
+# ============================================================================
+
+
+class SiguienteIdTests(SimpleTestCase):
+
+    def setUp(self):
+        identificadores._bloques.clear()
+        self.addCleanup(identificadores._bloques.clear)
+        self.reservas = []
+
+        def reservar(secuencia):
+            inicio = 200000001 + 50 * len(self.reservas)
+            self.reservas.append(secuencia)
+            return [inicio, inicio + 50]
+
+        parche = mock.patch.object(identificadores, '_reservar_bloque', side_effect=reservar)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_un_nextval_por_bloque(self):
+        ids = [identificadores.siguiente_id('Citas', 2) for _ in range(51)]
+        self.assertEqual(ids, list(range(200000001, 200000052)))
+        self.assertEqual(self.reservas, ['seq_citas_sede_2', 'seq_citas_sede_2'])
+
+    def test_bloques_separados_por_sede_y_tabla(self):
+        identificadores.siguiente_id('Citas', 2)
+        identificadores.siguiente_id('Citas', 3)
+        identificadores.siguiente_id('Pacientes', 2)
+        identificadores.siguiente_id('Citas', 2)
+        self.assertEqual(self.reservas, ['seq_citas_sede_2', 'seq_citas_sede_3', 'seq_pacientes_sede_2'])
+
+
+# ============================================================================
+# AUDITORÍA ASÍNCRONA
+# ============================================================================
+
+
+class EscritorAuditoriaTests(SimpleTestCase):
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        self.respaldo = os.path.join(directorio, 'pendiente.jsonl')
+        self.cuarentena = os.path.join(directorio, 'cuarentena.jsonl')
+        ajustes = override_settings(AUDITORIA_ARCHIVO_RESPALDO=self.respaldo,
+                                    AUDITORIA_ARCHIVO_CUARENTENA=self.cuarentena, AUDITORIA_LOTE=100)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        for parche in (mock.patch.object(auditoria, 'connections'),
+                       mock.patch.object(auditoria.EscritorAuditoria, '_iniciar')):
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.escritor = auditoria.EscritorAuditoria()
+        self.lotes = []
+        self.filas = []
+
+    def _insertar(self, error=None, rechazar=None):
+        """insertar_eventos que anota cada lote; falla con `error` o si el lote trae la acción `rechazar`"""
+        def insertar(eventos, using='default'):
+            if error is not None:
+                raise error
+            if any(evento[1] == rechazar for evento in eventos):
+                raise DataError('valor inválido')
+            self.lotes.append([evento[1] for evento in eventos])
+            self.filas.extend(eventos)
+        return mock.patch.object(auditoria, 'insertar_eventos', side_effect=insertar)
+
+    def _lineas(self, ruta):
+        with open(ruta, encoding='utf-8') as archivo:
+            return auditoria.leer_respaldo(archivo)
+
+    def test_un_insert_por_lote_con_textos_recortados(self):
+        for accion in ('SELECT', 'UPDATE', 'DELETE'):
+            self.escritor.registrar(1, accion, 'Citas', 7, ' 10.0.0.1\x00' + 'x' * 60)
+        with self._insertar():
+            self.escritor.vaciar()
+        self.assertEqual(self.lotes, [['SELECT', 'UPDATE', 'DELETE']])
+        self.assertEqual(self.filas[0][2:5], ('Citas', '7', '10.0.0.1' + 'x' * 37))
+        self.assertEqual(self.escritor._eventos, [])
+
+    def test_base_caida_guarda_respaldo_y_lo_reintenta_primero(self):
+        self.escritor.registrar(1, 'SELECT', 'Citas', 7, '10.0.0.1')
+        with self._insertar(error=OperationalError('sin conexión')):
+            self.escritor.vaciar()
+        self.assertEqual([e[1] for e in self._lineas(self.respaldo)], ['SELECT'])
+
+        self.escritor.registrar(1, 'UPDATE', 'Citas', 7, '10.0.0.1')
+        with self._insertar():
+            self.escritor.vaciar()
+        self.assertEqual(self.lotes, [['SELECT'], ['UPDATE']])
+        self.assertFalse(os.path.exists(self.respaldo))
+
+    def test_evento_rechazado_va_a_cuarentena_y_no_bloquea_el_lote(self):
+        for accion in ('SELECT', 'MALA', 'UPDATE'):
+            self.escritor.registrar(1, accion, 'Citas', 7, '10.0.0.1')
+        with self._insertar(rechazar='MALA'), self.assertLogs('his.auditoria', 'ERROR'):
+            self.escritor.vaciar()
+        self.assertEqual(self.lotes, [['SELECT'], ['UPDATE']])
+        self.assertEqual([e[1] for e in self._lineas(self.cuarentena)], ['MALA'])
+        self.assertFalse(os.path.exists(self.respaldo))
+
+
+# ============================================================================
+# DASHBOARD
+# ============================================================================
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'pruebas-dashboard'}},
+                   DASHBOARD_CACHE_TTL=30)
+class EstadisticasDashboardTests(SimpleTestCase):
+
+    def setUp(self):
+        estadisticas.cache.clear()
+        self.addCleanup(estadisticas.cache.clear)
+
+    def _obtener(self, filas, fallidos=()):
+        resultado = ResultadoDistribuido(filas, fallidos)
+        with mock.patch.object(estadisticas, 'ejecutar_citas_sede', return_value=resultado) as consulta:
+            return estadisticas.obtener_estadisticas_dashboard(2), consulta
+
+    def test_suma_nodo_y_outbox_y_guarda_en_cache(self):
+        # Fila del nodo y fila del outbox: el stock se repite y se toma una vez
+        stats, consulta = self._obtener([(3, 1, 5, 4), (1, 0, 1, 4)])
+        self.assertEqual(stats, {'citas_hoy': 4, 'pacientes_atendidos': 1,
+                                 'citas_pendientes': 6, 'alertas_stock': 4})
+        self.assertEqual(consulta.call_args.args[1:], ([2, 2], 2))
+        self.assertEqual(self._obtener([])[0], stats)
+
+    def test_resultado_parcial_no_se_guarda(self):
+        self._obtener([(1, 0, 1, 0)], fallidos=['sede_2'])
+        self.assertEqual(self._obtener([(3, 1, 5, 4)])[0]['citas_hoy'], 3)
+
+    def test_invalidar_descarta_solo_la_sede(self):
+        self._obtener([(3, 1, 5, 4)])
+        estadisticas.cache.set(estadisticas._clave(3), {'citas_hoy': 9})
+        estadisticas.invalidar_estadisticas_dashboard(2)
+        self.assertEqual(self._obtener([(1, 0, 0, 0)])[0]['citas_hoy'], 1)
+        self.assertEqual(estadisticas.cache.get(estadisticas._clave(3)), {'citas_hoy': 9})
+
+
+# ============================================================================
+# CATÁLOGOS
+# ============================================================================
+
+
+@override_settings(CATALOGOS_REVISION=60, CATALOGOS_TTL=30)
+class CatalogosTests(SimpleTestCase):
+
+    def setUp(self):
+        for nombre, valor in (('_cache', {}), ('_versiones', {}), ('_ultima_revision', 0.0)):
+            parche = mock.patch.object(catalogos, nombre, valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.version = 1
+        self.ahora = 1000.0
+        self.cargas = []
+
+        def ejecutar(query, params=None, using='default'):
+            if 'version_catalogos' in query:
+                return [('enfermedades', self.version)]
+            self.cargas.append(params)
+            return [(len(self.cargas), 'fila')]
+
+        for parche in (mock.patch.object(catalogos, '_ejecutar', side_effect=ejecutar),
+                       mock.patch.object(catalogos.time, 'monotonic', side_effect=lambda: self.ahora)):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def test_con_version_recarga_solo_si_sube(self):
+        self.assertEqual(catalogos.obtener_catalogo('enfermedades'), [(1, 'fila')])
+        self.ahora += 120
+        self.assertEqual(catalogos.obtener_catalogo('enfermedades'), [(1, 'fila')])
+        self.version = 2
+        self.ahora += 30
+        # Dentro de CATALOGOS_REVISION no se vuelve a mirar la versión
+        self.assertEqual(catalogos.obtener_catalogo('enfermedades'), [(1, 'fila')])
+        self.ahora += 60
+        self.assertEqual(catalogos.obtener_catalogo('enfermedades'), [(2, 'fila')])
+
+    def test_invalidar_fuerza_la_revision(self):
+        catalogos.obtener_catalogo('enfermedades')
+        self.version = 2
+        catalogos.invalidar_catalogos()
+        self.assertEqual(catalogos.obtener_catalogo('enfermedades'), [(2, 'fila')])
+
+    def test_sin_version_vence_por_ttl_y_por_sede(self):
+        catalogos.obtener_catalogo('medicamentos_disponibles', 2)
+        catalogos.obtener_catalogo('medicamentos_disponibles', 3)
+        self.ahora += 29
+        catalogos.obtener_catalogo('medicamentos_disponibles', 2)
+        self.assertEqual(self.cargas, [[2], [3]])
+        self.ahora += 1
+        catalogos.obtener_catalogo('medicamentos_disponibles', 2)
+        catalogos.invalidar_catalogos()
+        catalogos.obtener_catalogo('medicamentos_disponibles', 3)
+        self.assertEqual(self.cargas, [[2], [3], [2], [3]])
+
+
+# ============================================================================
+# COLA DE REPORTES
+# ============================================================================
+
+
+class ClaveReporteTests(SimpleTestCase):
+
+    def test_mismos_parametros_en_otro_orden(self):
+        self.assertEqual(cola_reportes.clave_reporte('citas', {'a': 1, 'b': date(2024, 1, 1)}, 1, 7),
+                         cola_reportes.clave_reporte('citas', {'b': date(2024, 1, 1), 'a': 1}, 1, 7))
+
+    def test_otro_empleado_u_otra_sede_no_comparten_reporte(self):
+        clave = cola_reportes.clave_reporte('citas', {}, 1, 7)
+        self.assertNotEqual(clave, cola_reportes.clave_reporte('citas', {}, 1, 8))
+        self.assertNotEqual(clave, cola_reportes.clave_reporte('citas', {}, 2, 7))
+
+    def test_puede_ver_reporte_de_su_sede_o_propio(self):
+        reporte = {'id_sede': 1, 'id_emp_generador': 7}
+        self.assertTrue(cola_reportes.puede_ver_reporte(reporte, 1, 8))
+        self.assertTrue(cola_reportes.puede_ver_reporte(reporte, 2, 7))
+        self.assertFalse(cola_reportes.puede_ver_reporte(reporte, 2, 8))
+
+
+class EncolarReporteTests(SimpleTestCase):
+    TIPO = next(iter(cola_reportes.CONSULTAS_REPORTE))
+
+    def setUp(self):
+        self.cursor = mock.MagicMock()
+        conexiones = mock.MagicMock()
+        conexiones.__getitem__.return_value.cursor.return_value.__enter__.return_value = self.cursor
+        transaccion = mock.MagicMock()
+        transaccion.atomic.side_effect = contextlib.nullcontext
+        for parche in (mock.patch.object(cola_reportes, 'connections', conexiones),
+                       mock.patch.object(cola_reportes, 'transaction', transaccion),
+                       mock.patch.object(cola_reportes, 'siguiente_id', return_value=100000051),
+                       mock.patch.object(cola_reportes, 'trabajador')):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def _encolar(self, existente):
+        self.cursor.fetchone.return_value = existente
+        return cola_reportes.encolar_reporte(self.TIPO, 'csv', 1, 7, {'desde': '2024-01-01'})
+
+    def _inserto(self):
+        return any('INSERT INTO Reportes_Generados' in c.args[0] for c in self.cursor.execute.call_args_list)
+
+    def test_pendiente_se_reutiliza(self):
+        self.assertEqual(self._encolar((100000001, cola_reportes.PENDIENTE, None)), (100000001, False))
+        self.assertFalse(self._inserto())
+
+    def test_completado_sin_archivo_se_genera_de_nuevo(self):
+        existente = (100000001, cola_reportes.COMPLETADO, '/no/existe/100000001.csv')
+        self.assertEqual(self._encolar(existente), (100000051, True))
+        self.assertTrue(self._inserto())
+        cola_reportes.trabajador.despertar.assert_called_once_with()
+
+    def test_completado_con_archivo_se_reutiliza(self):
+        with tempfile.NamedTemporaryFile() as archivo:
+            existente = (100000001, cola_reportes.COMPLETADO, archivo.name)
+            self.assertEqual(self._encolar(existente), (100000001, False))
+
+    def test_la_clave_incluye_al_solicitante(self):
+        self._encolar(None)
+        consulta = next(c for c in self.cursor.execute.call_args_list if 'clave_dedup = %s' in c.args[0])
+        self.assertEqual(consulta.args[1][0],
+                         cola_reportes.clave_reporte(self.TIPO, {'desde': '2024-01-01', 'formato': 'csv'}, 1, 7))
+
+    def test_tomar_siguiente_salta_los_bloqueados(self):
+        cursor = mock.MagicMock()
+        cursor.fetchone.return_value = (100000001, self.TIPO, '{}')
+        self.assertEqual(cola_reportes._tomar_siguiente(cursor), (100000001, self.TIPO, '{}'))
+        query, params = cursor.execute.call_args.args
+        self.assertIn('FOR UPDATE SKIP LOCKED', query)
+        self.assertEqual(params, [cola_reportes.EN_PROCESO, cola_reportes.PENDIENTE])
+
+
+# ============================================================================
+# INSTRUMENTACIÓN DE SQL
+# ============================================================================
+
+
+class HuellaTests(SimpleTestCase):
+
+    def test_literales_listas_y_comentarios(self):
+        sql = """SELECT * FROM Citas -- por sede
+                 WHERE id_sede = 2 AND estado = 'PROGRAMADA' AND id_cita IN (%s, %s, %s) /* x */"""
+        self.assertEqual(instrumentacion.huella(sql),
+                         'SELECT * FROM Citas WHERE id_sede = ? AND estado = ? AND id_cita IN (...)')
+
+    def test_redactar_oculta_textos_y_fechas(self):
+        self.assertEqual(instrumentacion.redactar([3, 'Ana Pérez', date(2024, 1, 1), [1, 2], None]),
+                         [3, '<texto:9>', '<fecha>', '<2 valores>', None])
+        self.assertEqual(instrumentacion.redactar({'doc': '123'}), {'doc': '<texto:3>'})
+
+
+@override_settings(SQL_INSTRUMENTACION=True, SQL_UMBRAL_LENTO_MS=200, SQL_METRICAS_IPS=('127.0.0.1',),
+                   DEBUG=False)
+class RecolectorSQLTests(SimpleTestCase):
+
+    def setUp(self):
+        parche = mock.patch.object(instrumentacion, 'metricas', instrumentacion.MetricasSQL())
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def _request(self, ip):
+        def vista(request):
+            instrumentacion.registrar_consulta('sede_2', "SELECT * FROM Citas WHERE nombre = 'Ana'", [], 12.5)
+            instrumentacion.registrar_consulta('default', 'SELECT * FROM Personas', [], 2.5)
+            return HttpResponse()
+
+        request = RequestFactory().get('/citas/', REMOTE_ADDR=ip)
+        return instrumentacion.InstrumentacionSQLMiddleware(vista)(request)['Server-Timing']
+
+    def test_server_timing_por_destino_sin_la_consulta(self):
+        cabecera = self._request('10.0.0.9')
+        self.assertIn('db;dur=15.0;desc="2 consultas"', cabecera)
+        self.assertIn('db-sede_2;dur=12.5;desc="1 consultas"', cabecera)
+        self.assertNotIn('sql-lenta', cabecera)
+
+    def test_detalle_para_las_ips_de_metricas(self):
+        cabecera = self._request('127.0.0.1')
+        self.assertIn('sql-lenta;dur=12.5;desc="sede_2: SELECT * FROM Citas WHERE nombre = ?"', cabecera)
+
+    def test_lenta_fuera_de_request_se_registra_redactada(self):
+        with self.assertLogs('his.sql', 'WARNING') as registro:
+            instrumentacion.registrar_consulta('default', 'SELECT * FROM Personas WHERE num_doc = %s',
+                                               ['1234567'], 250)
+        self.assertIn('"params": ["<texto:7>"]', registro.output[0])
+        self.assertIn('"ruta": "segundo plano"', registro.output[0])
+        self.assertNotIn('1234567', registro.output[0])
+
+
+# ============================================================================
+# AUTENTICACIÓN
+# ============================================================================
+
+
+@override_settings(AUTH_MAX_FALLOS=3, AUTH_MAX_FALLOS_IP=50, AUTH_VENTANA_FALLOS=300, AUTH_BCRYPT_COSTO=12)
+class AutenticarTests(SimpleTestCase):
+    HASH = '$2a$10$' + 'a' * 53
+    FILA = (7, 'Ana', 'Pérez', 'Medico', 2, 3, True, HASH)
+
+    def setUp(self):
+        self.ahora = 1000.0
+        self.guardar = mock.MagicMock(return_value=1)
+        for parche in (mock.patch.object(autenticacion, 'limite', autenticacion.LimiteIntentos()),
+                       mock.patch.object(autenticacion.time, 'monotonic', side_effect=lambda: self.ahora),
+                       mock.patch.object(autenticacion, 'buscar_empleado', return_value=(self.FILA, 'sede_2')),
+                       mock.patch.object(autenticacion, 'generar_hash', return_value='$2a$12$nuevo'),
+                       mock.patch.object(autenticacion, 'guardar_hash', self.guardar)):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def _autenticar(self, correcta=True, ip='10.0.0.1'):
+        with mock.patch.object(autenticacion, 'verificar_hash', return_value=correcta) as verificar:
+            try:
+                return autenticacion.autenticar(' Ana@his.org ', 'secreto', ip)
+            finally:
+                self.verificaciones = verificar.call_count
+
+    def test_costo_hash(self):
+        self.assertEqual(autenticacion.costo_hash(self.HASH), 10)
+        self.assertIsNone(autenticacion.costo_hash('sha256:abc'))
+        self.assertIsNone(autenticacion.costo_hash(None))
+
+    def test_bloquea_sin_verificar_el_hash(self):
+        for _ in range(3):
+            with self.assertRaises(autenticacion.ErrorAutenticacion):
+                self._autenticar(correcta=False)
+        with self.assertRaises(autenticacion.DemasiadosIntentos):
+            self._autenticar()
+        self.assertEqual(self.verificaciones, 0)
+
+        # Pasada la ventana se vuelve a intentar
+        self.ahora += 300
+        self.assertEqual(self._autenticar()['id_emp'], 7)
+
+    def test_exito_limpia_los_fallos_del_email(self):
+        for _ in range(2):
+            with self.assertRaises(autenticacion.ErrorAutenticacion):
+                self._autenticar(correcta=False)
+        self._autenticar()
+        with self.assertRaises(autenticacion.ErrorAutenticacion):
+            self._autenticar(correcta=False)
+        self.assertEqual(self._autenticar()['id_sede'], 2)
+
+    def test_limite_por_ip_es_independiente_del_email(self):
+        limite = autenticacion.limite
+        limite.fallo([('ip:10.0.0.1', 50)] * 50)
+        self.assertGreater(limite.espera(autenticacion._claves('otro@his.org', '10.0.0.1')), 0)
+        self.assertEqual(limite.espera(autenticacion._claves('otro@his.org', '10.0.0.2')), 0)
+
+    def test_rehash_con_otro_costo_en_el_nodo_dueno(self):
+        self._autenticar()
+        self.guardar.assert_called_once_with(7, '$2a$12$nuevo', 'sede_2', hash_anterior=self.HASH)
+
+    @override_settings(AUTH_BCRYPT_COSTO=10)
+    def test_sin_rehash_con_el_mismo_costo(self):
+        self._autenticar()
+        self.guardar.assert_not_called()
+
+    def test_rehash_que_falla_no_bloquea_el_inicio(self):
+        self.guardar.side_effect = DatabaseError('nodo caído')
+        self.assertEqual(self._autenticar()['rol'], 'Medico')
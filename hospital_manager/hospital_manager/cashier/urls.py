@@ -109,6 +109,8 @@ urlpatterns = [
     # Generación de reportes PDF/Excel
     path('reportes/generar/<str:tipo>/', views.generar_reporte, name='generar_reporte'),
     path('reportes/exportar/<str:tipo>/<str:formato>/', views.exportar_reporte, name='exportar_reporte'),
+    path('reportes/generados/', views.reportes_generados, name='reportes_generados'),
+    path('reportes/generados/<int:id_reporte>/descargar/', views.descargar_reporte, name='descargar_reporte'),
     
     # ============================================================================
     # 10. MÓDULO DE AUDITORÍA Y SEGURIDAD
@@ -151,6 +153,8 @@ urlpatterns = [
     path('api/medicamentos/buscar/', views.api_buscar_medicamentos, name='api_buscar_medicamentos'),
     path('api/stock/verificar/<int:med_id>/', views.api_verificar_stock, name='api_verificar_stock'),
     path('api/enfermedades/buscar/', views.api_buscar_enfermedades, name='api_buscar_enfermedades'),
+    path('api/reportes/<int:id_reporte>/estado/', views.api_estado_reporte, name='api_estado_reporte'),
+    path('metricas/sql/', views.metricas_sql, name='metricas_sql'),                  # Solo local
     
     # ============================================================================
     # 14. PÁGINAS DE ERROR Y AYUDA
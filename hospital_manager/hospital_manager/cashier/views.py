@@ -4,12 +4,14 @@ Sistema SIN ORM - Consultas SQL directas
 """
 
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponse
+from django.urls import reverse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
 from django.contrib import messages
+from django.conf import settings
 from django.db import connection
 from django.views.decorators.http import require_http_methods
-from datetime import datetime, date
-from functools import wraps
+from datetime import datetime, date, timedelta
+from functools import partial, wraps
 import json
 
 from .forms import (
@@ -17,6 +19,26 @@ from .forms import (
     CitaForm, DiagnosticoForm, PrescripcionForm, ActualizarStockForm,
     EquipamientoForm, FiltroReportesForm, ejecutar_query, ejecutar_query_one
 )
+from .distribucion import (
+    ejecutar_query_sede, ejecutar_citas_sede, ejecutar_query_fragmentos, ejecutar_citas_fragmentos,
+    filtro_citas, ResultadoDistribuido
+)
+from .identificadores import siguiente_id
+from .auditoria import escritor as escritor_auditoria
+from .estadisticas import obtener_estadisticas_dashboard, invalidar_estadisticas_dashboard
+from .busqueda import filtro_personas, relevancia_personas, filtro_medicamentos, filtro_enfermedades
+from .catalogos import obtener_catalogo, invalidar_catalogos
+from .analitica import consultar_resumen
+from .reportes import CONSULTAS_REPORTE, consulta_reporte
+from .paginacion import paginar
+from .exportacion import FORMATOS, generar_exportacion
+from .cola_reportes import (
+    COMPLETADO, encolar_reporte, estado_reporte, puede_ver_reporte, trabajador as trabajador_reportes
+)
+from .outbox import citas_fallidas, despachador as despachador_citas
+from .instrumentacion import metricas as metricas_sql_proceso
+from .autenticacion import ErrorAutenticacion, autenticar, establecer_password
+from .archivo_auditoria import buscar_auditoria, filtros_busqueda
 
 # ============================================================================
 # FUNCIONES HELPER
@@ -67,7 +89,10 @@ def role_required(*roles):
     return decorator
 
 def registrar_auditoria(id_emp, accion, tabla, id_registro, ip):
-    """Registra evento de auditoría"""
+    """Registra evento de auditoría (por lotes en segundo plano, ver auditoria.py)"""
+    if getattr(settings, 'AUDITORIA_ASINCRONA', True):
+        escritor_auditoria.registrar(id_emp, accion, tabla, id_registro, ip)
+        return
     query = """
         INSERT INTO Auditoria_Accesos 
         (id_emp, accion, tabla_afectada, id_registro_afectado, ip_origen)
@@ -76,9 +101,95 @@ def registrar_auditoria(id_emp, accion, tabla, id_registro, ip):
     ejecutar_update(query, [id_emp, accion, tabla, str(id_registro), ip])
 
 def get_client_ip(request):
-    """Obtiene IP del cliente"""
+    """Obtiene IP del cliente (X-Forwarded-For lo escribe el cliente: se recorta a ip_origen VARCHAR(45))"""
     x_forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
-    return x_forwarded.split(',')[0] if x_forwarded else request.META.get('REMOTE_ADDR')
+    return x_forwarded.split(',')[0].strip()[:45] if x_forwarded else request.META.get('REMOTE_ADDR')
+
+def get_client_ip_confiable(request):
+    """
+    IP del cliente para límites de intentos: REMOTE_ADDR, salvo que la conexión
+    venga de un proxy de AUTH_PROXIES_CONFIABLES. En ese caso se toma el último
+    salto de X-Forwarded-For que no sea un proxy propio (los anteriores los
+    puede escribir el cliente).
+    """
+    remota = request.META.get('REMOTE_ADDR')
+    confiables = getattr(settings, 'AUTH_PROXIES_CONFIABLES', ())
+    x_forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if not x_forwarded or remota not in confiables:
+        return remota
+    saltos = [ip.strip() for ip in x_forwarded.split(',') if ip.strip()]
+    for ip in reversed(saltos):
+        if ip not in confiables:
+            return ip
+    return saltos[0] if saltos else remota
+
+def avisar_resultado_parcial(request, resultado):
+    """Muestra un aviso si una consulta distribuida no obtuvo respuesta de todos los nodos"""
+    if getattr(resultado, 'parcial', False):
+        nodos = ', '.join(resultado.nodos_fallidos)
+        messages.warning(request, f'Resultados parciales: no respondieron los nodos {nodos}.')
+
+def avisar_citas_fallidas(request, user):
+    """Avisa al personal administrativo de las citas de su sede que el outbox no pudo entregar al nodo"""
+    if user['rol'] not in ('Administrador', 'Administrativo'):
+        return
+    fallidas = citas_fallidas(user['id_sede'])
+    if fallidas:
+        ids = ', '.join(f'#{fila[0]}' for fila in fallidas[:5])
+        messages.warning(
+            request,
+            f'{len(fallidas)} cita(s) de la sede no se pudieron entregar a su nodo ({ids}; último error: '
+            f'{fallidas[0][3] or "sin detalle"}). Corrija y ejecute "manage.py despachar_citas --reintentar-fallidas".'
+        )
+
+def avisar_meses_sin_leer(request, pagina):
+    """Muestra un aviso si algún mes archivado no se pudo leer (la búsqueda no está completa)"""
+    if getattr(pagina, 'meses_sin_leer', None):
+        meses = ', '.join(pagina.meses_sin_leer)
+        messages.warning(request, f'Resultados incompletos: no se pudo leer el archivo de auditoría de {meses}.')
+
+# Historias con sus diagnósticos (tablas del coordinador); los datos de la cita
+# se completan después con completar_historias()
+QUERY_HISTORIAS_BASE = """
+    SELECT hc.cod_hist, hc.cod_pac, p.nom_persona || ' ' || p.apellido_persona AS nombre_paciente,
+           p.num_doc, hc.fecha_registro, diag.id_cita, diag.id_diagnostico,
+           enf.nombre_enfermedad, diag.observacion
+    FROM Historias_Clinicas hc
+    INNER JOIN Pacientes pac ON hc.cod_pac = pac.cod_pac
+    INNER JOIN Personas p ON pac.id_persona = p.id_persona
+    LEFT JOIN Diagnostico diag ON hc.cod_hist = diag.cod_hist
+    LEFT JOIN Enfermedades enf ON diag.id_enfermedad = enf.id_enfermedad
+"""
+
+def completar_historias(base):
+    """
+    Agrega a las filas de QUERY_HISTORIAS_BASE los datos de su cita, consultando
+    en paralelo solo las citas referenciadas en cada nodo (y en el outbox). Las
+    filas resultantes tienen las mismas columnas que vista_historias_consolidadas.
+    """
+    ids_cita = {h[5] for h in base if h[5] is not None}
+    citas = ResultadoDistribuido()
+    if ids_cita:
+        where, params = filtro_citas(ids_cita=ids_cita)
+        query_citas = f"""
+            SELECT c.id_cita, c.fecha_hora, e.id_emp,
+                   pe.nom_persona || ' ' || pe.apellido_persona AS nombre_empleado,
+                   s.nom_sede, s.ciudad, d.nom_dept
+            FROM {{citas}} c
+            LEFT JOIN {{empleados}} e ON c.id_emp = e.id_emp
+            LEFT JOIN Personas pe ON e.id_persona = pe.id_persona
+            LEFT JOIN {{departamentos}} d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
+            LEFT JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
+            WHERE {where}
+        """
+        citas = ejecutar_citas_fragmentos(query_citas, params)
+    por_id = {r[0]: r for r in citas}
+    
+    historias = ResultadoDistribuido(nodos_fallidos=citas.nodos_fallidos)
+    for h in base:
+        datos_cita = por_id.get(h[5]) or (None,) * 7
+        historias.append(tuple(h[:5]) + tuple(datos_cita) + tuple(h[6:]))
+    return historias
 
 # ============================================================================
 # 1. AUTENTICACIÓN Y HOME
@@ -101,37 +212,23 @@ def login_view(request):
             error = 'Por favor ingrese email y contraseña.'
         else:
             try:
-                # Verificar credenciales con crypt de pgcrypto
-                query = """
-                    SELECT e.id_emp, p.nom_persona, p.apellido_persona, 
-                           r.nombre_rol, e.id_sede, e.id_dept, e.activo
-                    FROM Empleados e
-                    INNER JOIN Personas p ON e.id_persona = p.id_persona
-                    INNER JOIN Roles r ON e.id_rol = r.id_rol
-                    WHERE p.email_persona = %s 
-                    AND e.hash_contra = crypt(%s, e.hash_contra)
-                """
-                user = ejecutar_query_one(query, [email, password])
-                
-                if user:
-                    if not user[6]:  # activo = False
-                        error = 'Su cuenta está desactivada. Contacte al administrador.'
-                    else:
-                        # Login exitoso
-                        request.session['id_emp'] = user[0]
-                        request.session['email'] = email
-                        request.session['nombre'] = f"{user[1]} {user[2]}"
-                        request.session['rol'] = user[3]
-                        request.session['id_sede'] = user[4]
-                        request.session['id_dept'] = user[5]
-                        try:
-                            registrar_auditoria(user[0], 'LOGIN', 'Empleados', user[0], get_client_ip(request))
-                        except:
-                            pass  # No bloquear login si falla auditoría
-                        messages.success(request, f'Bienvenido, {user[1]}!')
-                        return redirect('hospital:dashboard')
-                else:
-                    error = 'Credenciales inválidas. Verifique su email y contraseña.'
+                # Un solo bcrypt, en el nodo de la sede del empleado (cashier/autenticacion.py)
+                # El límite por IP no usa get_client_ip: X-Forwarded-For lo escribe el cliente
+                user = autenticar(email, password, get_client_ip_confiable(request))
+                request.session['id_emp'] = user['id_emp']
+                request.session['email'] = email
+                request.session['nombre'] = f"{user['nombre']} {user['apellido']}"
+                request.session['rol'] = user['rol']
+                request.session['id_sede'] = user['id_sede']
+                request.session['id_dept'] = user['id_dept']
+                try:
+                    registrar_auditoria(user['id_emp'], 'LOGIN', 'Empleados', user['id_emp'], get_client_ip(request))
+                except:
+                    pass  # No bloquear login si falla auditoría
+                messages.success(request, f"Bienvenido, {user['nombre']}!")
+                return redirect('hospital:dashboard')
+            except ErrorAutenticacion as e:
+                error = str(e)
             except Exception as e:
                 error = f'Error de conexión a la base de datos: {str(e)}'
     
@@ -152,30 +249,8 @@ def dashboard(request):
     user = get_user_from_session(request)
     id_sede = user['id_sede']
     
-    # Estadísticas del día
-    stats = {}
-    
-    # Citas del día
-    query = "SELECT COUNT(*) FROM Citas WHERE id_sede = %s AND DATE(fecha_hora) = CURRENT_DATE"
-    result = ejecutar_query_one(query, [id_sede])
-    stats['citas_hoy'] = result[0] if result else 0
-    
-    # Pacientes atendidos
-    query = """SELECT COUNT(*) FROM Citas WHERE id_sede = %s 
-               AND DATE(fecha_hora) = CURRENT_DATE AND estado = 'COMPLETADA'"""
-    result = ejecutar_query_one(query, [id_sede])
-    stats['pacientes_atendidos'] = result[0] if result else 0
-    
-    # Citas pendientes
-    query = """SELECT COUNT(*) FROM Citas WHERE id_sede = %s 
-               AND estado = 'PROGRAMADA' AND fecha_hora >= NOW()"""
-    result = ejecutar_query_one(query, [id_sede])
-    stats['citas_pendientes'] = result[0] if result else 0
-    
-    # Alertas de inventario
-    query = "SELECT COUNT(*) FROM Inventario_Farmacia WHERE id_sede = %s AND stock_actual < 50"
-    result = ejecutar_query_one(query, [id_sede])
-    stats['alertas_stock'] = result[0] if result else 0
+    # Estadísticas del día (una consulta, en caché por sede)
+    stats = obtener_estadisticas_dashboard(id_sede)
     
     return render(request, 'cashier/menu.html', {'user': user, 'stats': stats})
 
@@ -204,14 +279,10 @@ def cambiar_password(request):
     """Cambiar contraseña"""
     user = get_user_from_session(request)
     if request.method == 'POST':
-        form = CambiarPasswordForm(user['email'], request.POST)
+        form = CambiarPasswordForm(user['email'], request.POST, ip=get_client_ip(request))
         if form.is_valid():
-            nueva = form.cleaned_data['password_nueva']
-            query = """
-                UPDATE Empleados SET hash_contra = crypt(%s, gen_salt('bf'))
-                WHERE id_emp = %s
-            """
-            ejecutar_update(query, [nueva, user['id_emp']])
+            # La contraseña actual ya se verificó en el formulario
+            establecer_password(form.empleado, form.cleaned_data['password_nueva'])
             messages.success(request, 'Contraseña actualizada correctamente.')
             return redirect('hospital:perfil')
     else:
@@ -226,38 +297,40 @@ def cambiar_password(request):
 def lista_pacientes(request):
     """Lista de pacientes"""
     user = get_user_from_session(request)
-    busqueda = request.GET.get('q', '')
-    
-    # Administrador solo ve pacientes de su sede (que tienen citas en su sede)
+    busqueda = request.GET.get('q', '').strip()
+    columnas = """pac.cod_pac, p.nom_persona, p.apellido_persona, p.num_doc,
+                  p.fecha_nac, p.genero, p.tel_persona, p.email_persona"""
+    claves = [('apellido_persona', 2, False), ('nom_persona', 1, False), ('cod_pac', 0, False)]
+    condiciones = []
+    params = []
+
+    if busqueda:
+        # La relevancia va como columna para poder continuar la página desde ella
+        relevancia, params_relevancia = relevancia_personas(busqueda)
+        columnas += f", {relevancia} AS relevancia"
+        params.extend(params_relevancia)
+        claves.insert(0, ('relevancia', 8, True))
+        where, _, params_where, _ = filtro_personas(busqueda)
+        condiciones.append(where)
+        params.extend(params_where)
+
+    # Administrador solo ve pacientes de su sede (con citas en su sede o sin citas)
     if user['rol'] == 'Administrador':
-        query = """
-            SELECT DISTINCT pac.cod_pac, p.nom_persona, p.apellido_persona, p.num_doc, 
-                   p.fecha_nac, p.genero, p.tel_persona, p.email_persona
-            FROM Pacientes pac
-            INNER JOIN Personas p ON pac.id_persona = p.id_persona
-            LEFT JOIN Citas c ON c.cod_pac = pac.cod_pac
-            WHERE (c.id_sede = %s OR c.id_cita IS NULL)
-        """
-        params = [user['id_sede']]
-        if busqueda:
-            query += " AND (p.num_doc LIKE %s OR p.nom_persona ILIKE %s OR p.apellido_persona ILIKE %s)"
-            params.extend([f'%{busqueda}%', f'%{busqueda}%', f'%{busqueda}%'])
-    else:
-        query = """
-            SELECT pac.cod_pac, p.nom_persona, p.apellido_persona, p.num_doc, 
-                   p.fecha_nac, p.genero, p.tel_persona, p.email_persona
-            FROM Pacientes pac
-            INNER JOIN Personas p ON pac.id_persona = p.id_persona
-        """
-        params = []
-        if busqueda:
-            query += " WHERE p.num_doc LIKE %s OR p.nom_persona ILIKE %s OR p.apellido_persona ILIKE %s"
-            params = [f'%{busqueda}%', f'%{busqueda}%', f'%{busqueda}%']
-    query += " ORDER BY p.apellido_persona, p.nom_persona LIMIT 100"
-    
-    pacientes = ejecutar_query(query, params)
+        condiciones.append("""(pac.cod_pac IN (SELECT cod_pac FROM Citas WHERE id_sede = %s)
+                               OR pac.cod_pac NOT IN (SELECT cod_pac FROM Citas))""")
+        params.append(user['id_sede'])
+
+    query = f"""
+        SELECT {columnas}
+        FROM Pacientes pac
+        INNER JOIN Personas p ON pac.id_persona = p.id_persona
+    """
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+
+    pacientes = paginar(request, query, params, claves)
     return render(request, 'cashier/gestion_pacientes.html', {
-        'user': user, 'pacientes': pacientes, 'busqueda': busqueda
+        'user': user, 'pacientes': pacientes, 'pagina': pacientes, 'busqueda': busqueda
     })
 
 @login_required_custom
@@ -269,9 +342,8 @@ def nuevo_paciente(request):
         form = PacienteForm(request.POST)
         if form.is_valid():
             data = form.cleaned_data
-            # Obtener siguiente ID
-            result = ejecutar_query_one("SELECT COALESCE(MAX(id_persona), 0) + 1 FROM Personas")
-            id_persona = result[0]
+            # Obtener siguiente ID (rango de la sede)
+            id_persona = siguiente_id('Personas', user['id_sede'])
             
             # Insertar persona
             query = """
@@ -286,8 +358,7 @@ def nuevo_paciente(request):
             ])
             
             # Insertar paciente
-            result = ejecutar_query_one("SELECT COALESCE(MAX(cod_pac), 0) + 1 FROM Pacientes")
-            cod_pac = result[0]
+            cod_pac = siguiente_id('Pacientes', user['id_sede'])
             ejecutar_update("INSERT INTO Pacientes (cod_pac, id_persona) VALUES (%s, %s)", 
                           [cod_pac, id_persona])
             
@@ -310,16 +381,17 @@ def detalle_paciente(request, pac_id):
     """
     paciente = ejecutar_query_one(query, [pac_id])
     
-    # Historial de citas
-    query_citas = """
+    # Historial de citas (filtrado por paciente en cada nodo)
+    where, params = filtro_citas(cod_pac=pac_id)
+    query_citas = f"""
         SELECT c.id_cita, c.fecha_hora, c.tipo_servicio, c.estado, c.motivo,
                pe.nom_persona || ' ' || pe.apellido_persona as medico
-        FROM Citas c
-        INNER JOIN Empleados e ON c.id_emp = e.id_emp
+        FROM {{citas}} c
+        INNER JOIN {{empleados}} e ON c.id_emp = e.id_emp
         INNER JOIN Personas pe ON e.id_persona = pe.id_persona
-        WHERE c.cod_pac = %s ORDER BY c.fecha_hora DESC LIMIT 20
+        WHERE {where} ORDER BY c.fecha_hora DESC LIMIT 20
     """
-    citas = ejecutar_query(query_citas, [pac_id])
+    citas = ejecutar_citas_fragmentos(query_citas, params, orden=lambda r: r[1], descendente=True, limite=20)
     
     registrar_auditoria(user['id_emp'], 'SELECT', 'Pacientes', pac_id, get_client_ip(request))
     return render(request, 'cashier/gestion_pacientes.html', {
@@ -371,6 +443,9 @@ def editar_paciente(request, pac_id):
 # 4. MÓDULO DE CITAS
 # ============================================================================
 
+# Más recientes primero; id_cita desempata citas a la misma hora
+CLAVES_CITAS = [('fecha_hora', 1, True), ('id_cita', 0, True)]
+
 @login_required_custom
 def lista_citas(request):
     """Lista todas las citas"""
@@ -379,16 +454,18 @@ def lista_citas(request):
         SELECT c.id_cita, c.fecha_hora, c.tipo_servicio, c.estado, c.motivo,
                p.nom_persona || ' ' || p.apellido_persona as paciente,
                pe.nom_persona || ' ' || pe.apellido_persona as medico, s.nom_sede
-        FROM Citas c
+        FROM {citas} c
         INNER JOIN Pacientes pac ON c.cod_pac = pac.cod_pac
         INNER JOIN Personas p ON pac.id_persona = p.id_persona
-        INNER JOIN Empleados e ON c.id_emp = e.id_emp
-        INNER JOIN Personas pe ON e.id_persona = pe.id_persona
+        LEFT JOIN {empleados} e ON c.id_emp = e.id_emp
+        LEFT JOIN Personas pe ON e.id_persona = pe.id_persona
         INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        WHERE c.id_sede = %s ORDER BY c.fecha_hora DESC LIMIT 100
+        WHERE c.id_sede = %s
     """
-    citas = ejecutar_query(query, [user['id_sede']])
-    return render(request, 'cashier/citas_pendientes.html', {'user': user, 'citas': citas})
+    citas = paginar(request, query, [user['id_sede']], CLAVES_CITAS,
+                    ejecutar=partial(ejecutar_citas_sede, id_sede=user['id_sede']))
+    avisar_resultado_parcial(request, citas)
+    return render(request, 'cashier/citas_pendientes.html', {'user': user, 'citas': citas, 'pagina': citas})
 
 @login_required_custom
 @role_required('Administrativo', 'Administrador')
@@ -399,8 +476,7 @@ def nueva_cita(request):
         form = CitaForm(user['id_sede'], request.POST)
         if form.is_valid():
             data = form.cleaned_data
-            result = ejecutar_query_one("SELECT COALESCE(MAX(id_cita), 0) + 1 FROM Citas")
-            id_cita = result[0]
+            id_cita = siguiente_id('Citas', user['id_sede'])
             query = """
                 INSERT INTO Citas (id_cita, id_sede, id_dept, id_emp, cod_pac, 
                     fecha_hora, fecha_hora_solicitada, tipo_servicio, estado, motivo)
@@ -411,6 +487,8 @@ def nueva_cita(request):
                 data['cod_pac'], data['fecha_hora'], data['tipo_servicio'],
                 data['estado'], data['motivo']
             ])
+            despachador_citas.despertar()
+            invalidar_estadisticas_dashboard(user['id_sede'])
             registrar_auditoria(user['id_emp'], 'INSERT', 'Citas', id_cita, get_client_ip(request))
             messages.success(request, 'Cita programada correctamente.')
             return redirect('hospital:lista_citas')
@@ -470,6 +548,7 @@ def editar_cita(request, cita_id):
                 data['fecha_hora'], data['tipo_servicio'], data['estado'],
                 data['motivo'], cita_id
             ])
+            despachador_citas.despertar()
             registrar_auditoria(user['id_emp'], 'UPDATE', 'Citas', cita_id, get_client_ip(request))
             messages.success(request, 'Cita actualizada.')
             return redirect('hospital:detalle_cita', cita_id=cita_id)
@@ -482,6 +561,8 @@ def cancelar_cita(request, cita_id):
     user = get_user_from_session(request)
     query = "UPDATE Citas SET estado = 'CANCELADA' WHERE id_cita = %s"
     ejecutar_update(query, [cita_id])
+    despachador_citas.despertar()
+    invalidar_estadisticas_dashboard(user['id_sede'])
     registrar_auditoria(user['id_emp'], 'UPDATE', 'Citas', cita_id, get_client_ip(request))
     messages.success(request, 'Cita cancelada.')
     return redirect('hospital:lista_citas')
@@ -493,13 +574,16 @@ def citas_pendientes(request):
     query = """
         SELECT c.id_cita, c.fecha_hora, c.tipo_servicio, c.estado, c.motivo,
                p.nom_persona || ' ' || p.apellido_persona as paciente
-        FROM Citas c
+        FROM {citas} c
         INNER JOIN Pacientes pac ON c.cod_pac = pac.cod_pac
         INNER JOIN Personas p ON pac.id_persona = p.id_persona
-        WHERE c.id_sede = %s AND DATE(c.fecha_hora) = CURRENT_DATE
+        WHERE c.id_sede = %s AND c.fecha_hora >= CURRENT_DATE AND c.fecha_hora < CURRENT_DATE + 1
         AND c.tipo_servicio = 'PROGRAMADA' ORDER BY c.fecha_hora
     """
-    citas = ejecutar_query(query, [user['id_sede']])
+    citas = ejecutar_citas_sede(query, [user['id_sede']], user['id_sede'])
+    citas.sort(key=lambda r: r[1])
+    avisar_resultado_parcial(request, citas)
+    avisar_citas_fallidas(request, user)
     return render(request, 'cashier/citas_pendientes.html', {'user': user, 'citas': citas, 'hoy': True})
 
 @login_required_custom
@@ -509,13 +593,16 @@ def citas_programadas(request):
     query = """
         SELECT c.id_cita, c.fecha_hora, c.tipo_servicio, c.estado, c.motivo,
                p.nom_persona || ' ' || p.apellido_persona as paciente
-        FROM Citas c
+        FROM {citas} c
         INNER JOIN Pacientes pac ON c.cod_pac = pac.cod_pac
         INNER JOIN Personas p ON pac.id_persona = p.id_persona
         WHERE c.id_sede = %s AND c.fecha_hora > NOW()
         AND c.tipo_servicio = 'PROGRAMADA' ORDER BY c.fecha_hora
     """
-    citas = ejecutar_query(query, [user['id_sede']])
+    citas = ejecutar_citas_sede(query, [user['id_sede']], user['id_sede'])
+    citas.sort(key=lambda r: r[1])
+    avisar_resultado_parcial(request, citas)
+    avisar_citas_fallidas(request, user)
     return render(request, 'cashier/citas_pendientes.html', {'user': user, 'citas': citas, 'futuras': True})
 
 @login_required_custom
@@ -525,14 +612,18 @@ def historial_citas(request):
     query = """
         SELECT c.id_cita, c.fecha_hora, c.tipo_servicio, c.estado, c.motivo,
                p.nom_persona || ' ' || p.apellido_persona as paciente
-        FROM Citas c
+        FROM {citas} c
         INNER JOIN Pacientes pac ON c.cod_pac = pac.cod_pac
         INNER JOIN Personas p ON pac.id_persona = p.id_persona
         WHERE c.id_sede = %s AND c.fecha_hora < NOW()
-        ORDER BY c.fecha_hora DESC LIMIT 100
     """
-    citas = ejecutar_query(query, [user['id_sede']])
-    return render(request, 'cashier/citas_pendientes.html', {'user': user, 'citas': citas, 'historial': True})
+    citas = paginar(request, query, [user['id_sede']], CLAVES_CITAS,
+                    ejecutar=partial(ejecutar_citas_sede, id_sede=user['id_sede']))
+    avisar_resultado_parcial(request, citas)
+    avisar_citas_fallidas(request, user)
+    return render(request, 'cashier/citas_pendientes.html', {
+        'user': user, 'citas': citas, 'pagina': citas, 'historial': True
+    })
 
 # ============================================================================
 # 5. MÓDULO CLÍNICO - HISTORIAS Y DIAGNÓSTICOS
@@ -544,30 +635,20 @@ def lista_historias(request):
     """Lista de historias clínicas"""
     user = get_user_from_session(request)
     
+    query = """
+        SELECT hc.cod_hist, hc.fecha_registro,
+               p.nom_persona || ' ' || p.apellido_persona as paciente, p.num_doc
+        FROM Historias_Clinicas hc
+        INNER JOIN Pacientes pac ON hc.cod_pac = pac.cod_pac
+        INNER JOIN Personas p ON pac.id_persona = p.id_persona
+    """
+    params = []
     # Médicos solo ven historias de sus propios pacientes
     if user['rol'] == 'Medico':
-        query = """
-            SELECT DISTINCT hc.cod_hist, hc.fecha_registro,
-                   p.nom_persona || ' ' || p.apellido_persona as paciente, p.num_doc
-            FROM Historias_Clinicas hc
-            INNER JOIN Pacientes pac ON hc.cod_pac = pac.cod_pac
-            INNER JOIN Personas p ON pac.id_persona = p.id_persona
-            INNER JOIN Citas c ON c.cod_pac = pac.cod_pac
-            WHERE c.id_emp = %s
-            ORDER BY hc.fecha_registro DESC LIMIT 100
-        """
-        historias = ejecutar_query(query, [user['id_emp']])
-    else:
-        query = """
-            SELECT hc.cod_hist, hc.fecha_registro,
-                   p.nom_persona || ' ' || p.apellido_persona as paciente, p.num_doc
-            FROM Historias_Clinicas hc
-            INNER JOIN Pacientes pac ON hc.cod_pac = pac.cod_pac
-            INNER JOIN Personas p ON pac.id_persona = p.id_persona
-            ORDER BY hc.fecha_registro DESC LIMIT 100
-        """
-        historias = ejecutar_query(query)
-    return render(request, 'cashier/ver_historial.html', {'user': user, 'historias': historias})
+        query += " WHERE hc.cod_pac IN (SELECT cod_pac FROM Citas WHERE id_emp = %s)"
+        params = [user['id_emp']]
+    historias = paginar(request, query, params, [('fecha_registro', 1, True), ('cod_hist', 0, True)])
+    return render(request, 'cashier/ver_historial.html', {'user': user, 'historias': historias, 'pagina': historias})
 
 @login_required_custom
 @role_required('Medico', 'Enfermero', 'Administrador', 'Administrativo')
@@ -588,8 +669,9 @@ def detalle_historia(request, hist_id):
             messages.error(request, 'No tiene permisos para ver esta historia clínica.')
             return redirect('hospital:lista_historias')
     
-    query = """SELECT * FROM vista_historias_consolidadas WHERE cod_hist = %s"""
-    historia = ejecutar_query(query, [hist_id])
+    base = ejecutar_query(QUERY_HISTORIAS_BASE + " WHERE hc.cod_hist = %s", [hist_id])
+    historia = completar_historias(base)
+    avisar_resultado_parcial(request, historia)
     
     # Obtener prescripciones asociadas a esta historia
     query_prescripciones = """
@@ -615,14 +697,19 @@ def historias_paciente(request, pac_id):
     
     # Médicos solo pueden ver historias de pacientes que han atendido
     if user['rol'] == 'Medico':
-        check_query = """SELECT 1 FROM Citas WHERE cod_pac = %s AND id_emp = %s"""
-        tiene_acceso = ejecutar_query_one(check_query, [pac_id, user['id_emp']])
+        where, params = filtro_citas(cod_pac=pac_id, id_emp=user['id_emp'])
+        # Incluye las citas del outbox: recién agendada ya da acceso
+        check_query = f"""SELECT 1 FROM {{citas}} c WHERE {where} LIMIT 1"""
+        tiene_acceso = ejecutar_citas_fragmentos(check_query, params, limite=1)
         if not tiene_acceso:
             messages.error(request, 'No tiene permisos para ver las historias de este paciente.')
             return redirect('hospital:lista_historias')
     
-    query = """SELECT * FROM vista_historias_consolidadas WHERE cod_pac = %s ORDER BY fecha_registro DESC"""
-    historias = ejecutar_query(query, [pac_id])
+    # Mismas columnas que vista_historias_consolidadas, pero las citas del
+    # paciente se filtran en cada nodo en vez de unir la vista distribuida completa
+    query = QUERY_HISTORIAS_BASE + " WHERE hc.cod_pac = %s ORDER BY hc.fecha_registro DESC"
+    historias = completar_historias(ejecutar_query(query, [pac_id]))
+    avisar_resultado_parcial(request, historias)
     return render(request, 'cashier/ver_historial.html', {'user': user, 'historias': historias, 'pac_id': pac_id})
 
 @login_required_custom
@@ -638,15 +725,13 @@ def registrar_diagnostico(request, cita_id):
             cita = ejecutar_query_one("SELECT cod_pac FROM Citas WHERE id_cita = %s", [cita_id])
             cod_pac = cita[0]
             
-            result = ejecutar_query_one("SELECT COALESCE(MAX(cod_hist), 0) + 1 FROM Historias_Clinicas")
-            cod_hist = result[0]
+            cod_hist = siguiente_id('Historias_Clinicas', user['id_sede'])
             ejecutar_update(
                 "INSERT INTO Historias_Clinicas (cod_hist, cod_pac) VALUES (%s, %s)",
                 [cod_hist, cod_pac]
             )
             
-            result = ejecutar_query_one("SELECT COALESCE(MAX(id_diagnostico), 0) + 1 FROM Diagnostico")
-            id_diag = result[0]
+            id_diag = siguiente_id('Diagnostico', user['id_sede'])
             query = """
                 INSERT INTO Diagnostico (id_diagnostico, id_enfermedad, id_cita, cod_hist, observacion)
                 VALUES (%s, %s, %s, %s, %s)
@@ -655,6 +740,8 @@ def registrar_diagnostico(request, cita_id):
             
             # Actualizar estado de cita
             ejecutar_update("UPDATE Citas SET estado = 'COMPLETADA' WHERE id_cita = %s", [cita_id])
+            despachador_citas.despertar()
+            invalidar_estadisticas_dashboard(user['id_sede'])
             
             registrar_auditoria(user['id_emp'], 'INSERT', 'Historias_Clinicas', cod_hist, get_client_ip(request))
             messages.success(request, 'Diagnóstico registrado.')
@@ -699,34 +786,24 @@ def editar_diagnostico(request, diag_id):
 def lista_prescripciones(request):
     """Lista de prescripciones"""
     user = get_user_from_session(request)
-    
+    query = """
+        SELECT pr.id_presc, pr.fecha_emision, m.nom_med, pr.dosis, pr.frecuencia,
+               p.nom_persona || ' ' || p.apellido_persona as paciente
+        FROM Prescripciones pr
+        INNER JOIN Catalogo_Medicamentos m ON pr.cod_med = m.cod_med
+        INNER JOIN Historias_Clinicas hc ON pr.cod_hist = hc.cod_hist
+        INNER JOIN Pacientes pac ON hc.cod_pac = pac.cod_pac
+        INNER JOIN Personas p ON pac.id_persona = p.id_persona
+    """
+    params = []
     # Médicos solo ven prescripciones de sus propios pacientes
     if user['rol'] == 'Medico':
-        query = """
-            SELECT pr.id_presc, pr.fecha_emision, m.nom_med, pr.dosis, pr.frecuencia,
-                   p.nom_persona || ' ' || p.apellido_persona as paciente
-            FROM Prescripciones pr
-            INNER JOIN Catalogo_Medicamentos m ON pr.cod_med = m.cod_med
-            INNER JOIN Historias_Clinicas hc ON pr.cod_hist = hc.cod_hist
-            INNER JOIN Pacientes pac ON hc.cod_pac = pac.cod_pac
-            INNER JOIN Personas p ON pac.id_persona = p.id_persona
-            WHERE pac.cod_pac IN (SELECT DISTINCT cod_pac FROM Citas WHERE id_emp = %s)
-            ORDER BY pr.fecha_emision DESC LIMIT 100
-        """
-        prescripciones = ejecutar_query(query, [user['id_emp']])
-    else:
-        query = """
-            SELECT pr.id_presc, pr.fecha_emision, m.nom_med, pr.dosis, pr.frecuencia,
-                   p.nom_persona || ' ' || p.apellido_persona as paciente
-            FROM Prescripciones pr
-            INNER JOIN Catalogo_Medicamentos m ON pr.cod_med = m.cod_med
-            INNER JOIN Historias_Clinicas hc ON pr.cod_hist = hc.cod_hist
-            INNER JOIN Pacientes pac ON hc.cod_pac = pac.cod_pac
-            INNER JOIN Personas p ON pac.id_persona = p.id_persona
-            ORDER BY pr.fecha_emision DESC LIMIT 100
-        """
-        prescripciones = ejecutar_query(query)
-    return render(request, 'cashier/prescribir_medicamento.html', {'user': user, 'prescripciones': prescripciones})
+        query += " WHERE pac.cod_pac IN (SELECT cod_pac FROM Citas WHERE id_emp = %s)"
+        params = [user['id_emp']]
+    prescripciones = paginar(request, query, params, [('fecha_emision', 1, True), ('id_presc', 0, True)])
+    return render(request, 'cashier/prescribir_medicamento.html', {
+        'user': user, 'prescripciones': prescripciones, 'pagina': prescripciones
+    })
 
 @login_required_custom
 @role_required('Medico', 'Administrador')
@@ -756,8 +833,7 @@ def prescribir_medicamento(request, hist_id):
                 "SELECT c.id_cita FROM Citas c INNER JOIN Historias_Clinicas hc ON c.cod_pac = hc.cod_pac WHERE hc.cod_hist = %s ORDER BY c.fecha_hora DESC LIMIT 1",
                 [hist_id]
             )
-            result = ejecutar_query_one("SELECT COALESCE(MAX(id_presc), 0) + 1 FROM Prescripciones")
-            id_presc = result[0]
+            id_presc = siguiente_id('Prescripciones', user['id_sede'])
             query = """
                 INSERT INTO Prescripciones (id_presc, cod_med, cod_hist, id_cita, dosis, frecuencia, duracion_dias, cantidad_total, fecha_emision)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_DATE)
@@ -771,6 +847,8 @@ def prescribir_medicamento(request, hist_id):
                 "UPDATE Inventario_Farmacia SET stock_actual = stock_actual - %s WHERE cod_med = %s AND id_sede = %s",
                 [data['cantidad_total'], data['cod_med'], user['id_sede']]
             )
+            invalidar_estadisticas_dashboard(user['id_sede'])
+            invalidar_catalogos()
             registrar_auditoria(user['id_emp'], 'INSERT', 'Prescripciones', id_presc, get_client_ip(request))
             messages.success(request, 'Medicamento prescrito.')
             return redirect('hospital:lista_prescripciones')
@@ -862,8 +940,11 @@ def actualizar_stock(request, inv_id):
         form = ActualizarStockForm(request.POST)
         if form.is_valid():
             data = form.cleaned_data
-            query = "UPDATE Inventario_Farmacia SET stock_actual = %s, fecha_actualizacion = NOW() WHERE id_inv = %s"
-            ejecutar_update(query, [data['stock_actual'], inv_id])
+            query = """UPDATE Inventario_Farmacia SET stock_actual = %s, fecha_actualizacion = NOW()
+                       WHERE id_inv = %s RETURNING id_sede"""
+            fila = ejecutar_query_one(query, [data['stock_actual'], inv_id])
+            invalidar_estadisticas_dashboard(fila[0] if fila else None)
+            invalidar_catalogos()
             messages.success(request, 'Stock actualizado.')
             return redirect('hospital:inventario_farmacia')
     else:
@@ -934,6 +1015,7 @@ def lista_equipamiento(request):
         LEFT JOIN Personas pe ON e.id_persona = pe.id_persona
         WHERE eq.id_sede = %s
     """
+    # Equipamiento no está fragmentado: solo existe completo en el coordinador
     equipos = ejecutar_query(query, [user['id_sede']])
     return render(request, 'cashier/gestion_equipamiento.html', {'user': user, 'equipos': equipos})
 
@@ -946,8 +1028,7 @@ def nuevo_equipamiento(request):
         form = EquipamientoForm(user['id_sede'], request.POST)
         if form.is_valid():
             data = form.cleaned_data
-            result = ejecutar_query_one("SELECT COALESCE(MAX(cod_eq), 0) + 1 FROM Equipamiento")
-            cod_eq = result[0]
+            cod_eq = siguiente_id('Equipamiento', user['id_sede'])
             query = """
                 INSERT INTO Equipamiento (cod_eq, id_sede, id_dept, nom_eq, marca_modelo, estado_equipo, fecha_ultimo_maint, responsable_id)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
@@ -1021,17 +1102,7 @@ def menu_reportes(request):
 def reporte_medicamentos_recetados(request):
     """Medicamentos más recetados por sede"""
     user = get_user_from_session(request)
-    query = """
-        SELECT s.nom_sede, s.ciudad, m.nom_med, COUNT(pr.id_presc) AS total_prescripciones,
-               SUM(pr.cantidad_total) AS cantidad_total_recetada
-        FROM Prescripciones pr
-        INNER JOIN Catalogo_Medicamentos m ON pr.cod_med = m.cod_med
-        INNER JOIN Citas c ON pr.id_cita = c.id_cita
-        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        WHERE pr.fecha_emision >= CURRENT_DATE - INTERVAL '1 month'
-        GROUP BY s.id_sede, s.nom_sede, s.ciudad, m.cod_med, m.nom_med
-        ORDER BY s.nom_sede, total_prescripciones DESC
-    """
+    query = consulta_reporte('medicamentos')
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'medicamentos'})
 
@@ -1039,39 +1110,17 @@ def reporte_medicamentos_recetados(request):
 def reporte_medicos_consultas(request):
     """Médicos con más consultas atendidas"""
     user = get_user_from_session(request)
-    query = """
-        SELECT p.nom_persona || ' ' || p.apellido_persona AS nombre_medico,
-               s.nom_sede, d.nom_dept, esp.nombre_esp AS especialidad,
-               DATE_TRUNC('week', c.fecha_hora) AS semana, COUNT(c.id_cita) AS total_consultas
-        FROM Citas c
-        INNER JOIN Empleados e ON c.id_emp = e.id_emp
-        INNER JOIN Personas p ON e.id_persona = p.id_persona
-        INNER JOIN Roles r ON e.id_rol = r.id_rol
-        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        INNER JOIN Departamentos d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
-        LEFT JOIN Emp_Posee_Esp epe ON e.id_emp = epe.id_emp
-        LEFT JOIN Especialidades esp ON epe.id_especialidad = esp.id_especialidad
-        WHERE r.nombre_rol = 'Medico' AND c.estado = 'COMPLETADA'
-        GROUP BY e.id_emp, p.nom_persona, p.apellido_persona, s.nom_sede, d.nom_dept, esp.nombre_esp, DATE_TRUNC('week', c.fecha_hora)
-        ORDER BY semana DESC, total_consultas DESC LIMIT 20
-    """
-    datos = ejecutar_query(query)
+    query = consulta_reporte('medicos', limite=20)
+    # Cada nodo devuelve su top 20; se combinan y se reordenan por (semana, consultas)
+    datos = ejecutar_query_fragmentos(query, orden=lambda r: (r[4], r[5]), descendente=True, limite=20)
+    avisar_resultado_parcial(request, datos)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'medicos'})
 
 @login_required_custom
 def reporte_tiempos_atencion(request):
     """Tiempo promedio de espera entre solicitud y cita"""
     user = get_user_from_session(request)
-    query = """
-        SELECT s.nom_sede, d.nom_dept,
-               ROUND(AVG(EXTRACT(EPOCH FROM (c.fecha_hora - c.fecha_hora_solicitada))/86400)::numeric, 2) AS dias_promedio,
-               COUNT(*) AS total_casos
-        FROM Citas c
-        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        INNER JOIN Departamentos d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
-        WHERE c.estado = 'COMPLETADA'
-        GROUP BY s.id_sede, s.nom_sede, d.nom_dept ORDER BY dias_promedio
-    """
+    query = consulta_reporte('tiempos')
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'tiempos'})
 
@@ -1079,17 +1128,7 @@ def reporte_tiempos_atencion(request):
 def reporte_pacientes_enfermedad(request):
     """Total de pacientes por enfermedad y sede"""
     user = get_user_from_session(request)
-    query = """
-        SELECT s.nom_sede, enf.nombre_enfermedad, COUNT(DISTINCT hc.cod_pac) AS total_pacientes,
-               COUNT(diag.id_diagnostico) AS total_diagnosticos
-        FROM Diagnostico diag
-        INNER JOIN Enfermedades enf ON diag.id_enfermedad = enf.id_enfermedad
-        INNER JOIN Historias_Clinicas hc ON diag.cod_hist = hc.cod_hist
-        INNER JOIN Citas c ON diag.id_cita = c.id_cita
-        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        GROUP BY s.id_sede, s.nom_sede, enf.id_enfermedad, enf.nombre_enfermedad
-        ORDER BY s.nom_sede, total_pacientes DESC
-    """
+    query = consulta_reporte('enfermedades')
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'enfermedades'})
 
@@ -1097,18 +1136,7 @@ def reporte_pacientes_enfermedad(request):
 def reporte_equipamiento_compartido(request):
     """Departamentos que comparten equipamiento"""
     user = get_user_from_session(request)
-    query = """
-        WITH equipo_compartido AS (
-            SELECT eq.nom_eq, eq.marca_modelo, COUNT(DISTINCT eq.id_sede) AS sedes_con_equipo
-            FROM Equipamiento eq GROUP BY eq.nom_eq, eq.marca_modelo HAVING COUNT(DISTINCT eq.id_sede) > 1
-        )
-        SELECT ec.nom_eq, ec.marca_modelo, s.nom_sede, d.nom_dept, eq.estado_equipo
-        FROM equipo_compartido ec
-        INNER JOIN Equipamiento eq ON ec.nom_eq = eq.nom_eq AND ec.marca_modelo = eq.marca_modelo
-        INNER JOIN Sedes_Hospitalarias s ON eq.id_sede = s.id_sede
-        INNER JOIN Departamentos d ON eq.id_dept = d.id_dept AND eq.id_sede = d.id_sede
-        ORDER BY ec.nom_eq, s.nom_sede
-    """
+    query = consulta_reporte('equipamiento')
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'equipamiento'})
 
@@ -1116,16 +1144,7 @@ def reporte_equipamiento_compartido(request):
 def reporte_enfermedades_trimestre(request):
     """Top enfermedades del trimestre"""
     user = get_user_from_session(request)
-    query = """
-        SELECT d.nom_dept, s.nom_sede, enf.nombre_enfermedad, COUNT(diag.id_diagnostico) AS total_casos
-        FROM Diagnostico diag
-        INNER JOIN Enfermedades enf ON diag.id_enfermedad = enf.id_enfermedad
-        INNER JOIN Citas c ON diag.id_cita = c.id_cita
-        INNER JOIN Departamentos d ON c.id_dept = d.id_dept AND c.id_sede = d.id_sede
-        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        WHERE c.fecha_hora >= CURRENT_DATE - INTERVAL '3 months'
-        GROUP BY d.nom_dept, s.nom_sede, enf.nombre_enfermedad ORDER BY total_casos DESC LIMIT 20
-    """
+    query = consulta_reporte('trimestre', limite=20)
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'trimestre'})
 
@@ -1133,30 +1152,25 @@ def reporte_enfermedades_trimestre(request):
 def reporte_consumo_medicamentos(request):
     """Consumo de medicamentos por departamento"""
     user = get_user_from_session(request)
-    query = """SELECT * FROM vista_consumo_medicamentos_dept ORDER BY cantidad_consumida DESC LIMIT 50"""
-    datos = ejecutar_query(query)
-    return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'consumo'})
+    datos, datos_al = consultar_resumen('mv_consumo_medicamentos_dept', 'cantidad_consumida DESC', 50)
+    return render(request, 'cashier/reportes_analitica.html', {
+        'user': user, 'datos': datos, 'tipo': 'consumo', 'datos_al': datos_al
+    })
 
 @login_required_custom
 def reporte_utilizacion_recursos(request):
     """Utilización de recursos por sede"""
     user = get_user_from_session(request)
-    query = """SELECT * FROM vista_utilizacion_recursos ORDER BY total_citas DESC"""
-    datos = ejecutar_query(query)
-    return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'recursos'})
+    datos, datos_al = consultar_resumen('mv_utilizacion_recursos', 'total_citas DESC')
+    return render(request, 'cashier/reportes_analitica.html', {
+        'user': user, 'datos': datos, 'tipo': 'recursos', 'datos_al': datos_al
+    })
 
 @login_required_custom
 def reporte_indices_atencion(request):
     """Índices de atención y tiempos de espera"""
     user = get_user_from_session(request)
-    query = """
-        SELECT s.nom_sede, COUNT(c.id_cita) AS total_citas,
-               ROUND(AVG(EXTRACT(EPOCH FROM (c.fecha_hora - c.fecha_hora_solicitada))/86400)::numeric, 1) AS dias_espera
-        FROM Citas c
-        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        WHERE c.fecha_hora >= CURRENT_DATE - INTERVAL '1 month'
-        GROUP BY s.id_sede, s.nom_sede ORDER BY dias_espera
-    """
+    query = consulta_reporte('indices')
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'indices'})
 
@@ -1164,16 +1178,7 @@ def reporte_indices_atencion(request):
 def reporte_especialidades_demandadas(request):
     """Especialidades más demandadas"""
     user = get_user_from_session(request)
-    query = """
-        SELECT esp.nombre_esp, s.nom_sede, COUNT(c.id_cita) AS total_consultas
-        FROM Especialidades esp
-        INNER JOIN Emp_Posee_Esp epe ON esp.id_especialidad = epe.id_especialidad
-        INNER JOIN Empleados e ON epe.id_emp = e.id_emp
-        INNER JOIN Citas c ON e.id_emp = c.id_emp
-        INNER JOIN Sedes_Hospitalarias s ON c.id_sede = s.id_sede
-        WHERE c.fecha_hora >= CURRENT_DATE - INTERVAL '1 month'
-        GROUP BY esp.nombre_esp, s.nom_sede ORDER BY total_consultas DESC
-    """
+    query = consulta_reporte('especialidades')
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'especialidades'})
 
@@ -1181,7 +1186,7 @@ def reporte_especialidades_demandadas(request):
 def reporte_inventario_critico(request):
     """Inventario crítico"""
     user = get_user_from_session(request)
-    query = """SELECT * FROM vista_inventario_consolidado WHERE stock_actual < 100 ORDER BY stock_actual"""
+    query = consulta_reporte('inventario')
     datos = ejecutar_query(query)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'inventario'})
 
@@ -1189,37 +1194,114 @@ def reporte_inventario_critico(request):
 def reporte_productividad_medicos(request):
     """Productividad del personal médico"""
     user = get_user_from_session(request)
-    query = """SELECT * FROM vista_medicos_consultas ORDER BY total_consultas DESC"""
-    datos = ejecutar_query(query)
-    return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'productividad'})
+    datos, datos_al = consultar_resumen('mv_medicos_consultas', 'total_consultas DESC')
+    return render(request, 'cashier/reportes_analitica.html', {
+        'user': user, 'datos': datos, 'tipo': 'productividad', 'datos_al': datos_al
+    })
 
 @login_required_custom
 def reporte_tendencias_enfermedades(request):
     """Tendencias de enfermedades"""
     user = get_user_from_session(request)
-    query = """SELECT * FROM vista_enfermedades_por_sede ORDER BY total_diagnosticos DESC"""
-    datos = ejecutar_query(query)
-    return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos, 'tipo': 'tendencias'})
+    datos, datos_al = consultar_resumen('mv_enfermedades_por_sede', 'total_diagnosticos DESC')
+    return render(request, 'cashier/reportes_analitica.html', {
+        'user': user, 'datos': datos, 'tipo': 'tendencias', 'datos_al': datos_al
+    })
 
 @login_required_custom
 def generar_reporte(request, tipo):
-    """Generar reporte"""
+    """Encolar la generación del reporte completo (se descarga desde Reportes Generados)"""
+    user = get_user_from_session(request)
+    formato = request.GET.get('formato', 'csv')
+    if tipo not in CONSULTAS_REPORTE or formato not in FORMATOS:
+        messages.error(request, f'No se puede generar el reporte {tipo} en formato {formato}.')
+        return redirect('hospital:menu_reportes')
+
+    id_reporte, nuevo = encolar_reporte(tipo, formato, user['id_sede'], user['id_emp'])
+    if nuevo:
+        registrar_auditoria(user['id_emp'], 'INSERT', 'Reportes_Generados', id_reporte, get_client_ip(request))
+        messages.success(request, f'Reporte {tipo} en cola (#{id_reporte}).')
+    else:
+        messages.info(request, f'El reporte {tipo} ya se pidió hace poco: se reutiliza el #{id_reporte}.')
+    return redirect('hospital:reportes_generados')
+
+@login_required_custom
+def reportes_generados(request):
+    """Reportes encolados recientes con su estado"""
     user = get_user_from_session(request)
-    # Registrar generación de reporte
-    result = ejecutar_query_one("SELECT COALESCE(MAX(id_reporte), 0) + 1 FROM Reportes_Generados")
-    id_reporte = result[0]
-    query = """INSERT INTO Reportes_Generados (id_reporte, id_sede, id_emp_generador, fecha_generacion, tipo_reporte)
-               VALUES (%s, %s, %s, NOW(), %s)"""
-    ejecutar_update(query, [id_reporte, user['id_sede'], user['id_emp'], tipo])
-    messages.success(request, f'Reporte {tipo} generado.')
-    return redirect('hospital:menu_reportes')
+    trabajador_reportes.despertar()
+    query = """
+        SELECT rg.id_reporte, rg.tipo_reporte, rg.parametros_json, rg.estado, rg.fecha_generacion,
+               rg.duracion_ms, rg.mensaje_error
+        FROM Reportes_Generados rg
+        WHERE rg.id_sede = %s OR rg.id_emp_generador = %s
+        ORDER BY rg.fecha_generacion DESC LIMIT 50
+    """
+    reportes = []
+    for id_reporte, tipo, parametros, estado, fecha, duracion_ms, error in ejecutar_query(
+            query, [user['id_sede'], user['id_emp']]):
+        reportes.append({
+            'id_reporte': id_reporte, 'tipo': tipo, 'formato': json.loads(parametros or '{}').get('formato', ''),
+            'estado': estado, 'fecha': fecha, 'duracion_ms': duracion_ms, 'error': error,
+        })
+    pendientes = any(r['estado'] in ('PENDIENTE', 'EN_PROCESO') for r in reportes)
+    return render(request, 'cashier/reportes_generados.html', {
+        'user': user, 'reportes': reportes, 'pendientes': pendientes
+    })
+
+@login_required_custom
+def api_estado_reporte(request, id_reporte):
+    """API: estado de un reporte encolado (para consultar hasta que termine)"""
+    user = get_user_from_session(request)
+    reporte = estado_reporte(id_reporte)
+    # Un reporte ajeno responde igual que uno inexistente
+    if reporte is None or not puede_ver_reporte(reporte, user['id_sede'], user['id_emp']):
+        return JsonResponse({'error': 'Reporte no encontrado'}, status=404)
+    return JsonResponse({
+        'id_reporte': reporte['id_reporte'],
+        'tipo': reporte['tipo'],
+        'estado': reporte['estado'],
+        'duracion_ms': reporte['duracion_ms'],
+        'error': reporte['mensaje_error'],
+        'descarga': (reverse('hospital:descargar_reporte', args=[id_reporte])
+                     if reporte['estado'] == COMPLETADO else None),
+    })
+
+@login_required_custom
+def descargar_reporte(request, id_reporte):
+    """Descargar el archivo de un reporte ya generado (de su sede o pedido por el empleado)"""
+    user = get_user_from_session(request)
+    reporte = estado_reporte(id_reporte)
+    if (reporte is None or not puede_ver_reporte(reporte, user['id_sede'], user['id_emp'])
+            or reporte['estado'] != COMPLETADO or not reporte['ruta_archivo']):
+        messages.error(request, 'El reporte no está disponible para descarga.')
+        return redirect('hospital:reportes_generados')
+    try:
+        archivo = open(reporte['ruta_archivo'], 'rb')
+    except FileNotFoundError:
+        messages.error(request, 'El archivo del reporte ya no existe; vuelva a generarlo.')
+        return redirect('hospital:reportes_generados')
+    formato = reporte['parametros'].get('formato', 'csv')
+    return FileResponse(archivo, as_attachment=True,
+                        filename=f"reporte_{reporte['tipo']}_{id_reporte}.{formato}",
+                        content_type=FORMATOS[formato][1])
 
 @login_required_custom
 def exportar_reporte(request, tipo, formato):
-    """Exportar reporte en formato específico"""
+    """Exportar reporte completo (sin el LIMIT de pantalla) en CSV, XLSX o PDF"""
+    if tipo not in CONSULTAS_REPORTE or formato not in FORMATOS:
+        messages.error(request, f'No se puede exportar el reporte {tipo} en formato {formato}.')
+        return redirect('hospital:menu_reportes')
+
     user = get_user_from_session(request)
-    messages.info(request, f'Exportando {tipo} en formato {formato}.')
-    return redirect('hospital:menu_reportes')
+    titulo = CONSULTAS_REPORTE[tipo][0]
+    contenido, content_type = generar_exportacion(formato, consulta_reporte(tipo), titulo)
+    registrar_auditoria(user['id_emp'], 'EXPORT', 'Reportes', None, get_client_ip(request))
+
+    response = StreamingHttpResponse(contenido, content_type=content_type)
+    nombre = f"reporte_{tipo}_{datetime.now():%Y%m%d_%H%M}.{formato}"
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return response
 
 # ============================================================================
 # 10. MÓDULO DE AUDITORÍA
@@ -1237,18 +1319,9 @@ def auditoria_principal(request):
 def auditoria_accesos(request):
     """Auditoría de accesos"""
     user = get_user_from_session(request)
-    query = """
-        SELECT aa.id_evento, aa.fecha_evento, p.nom_persona || ' ' || p.apellido_persona AS empleado,
-               r.nombre_rol, s.nom_sede, aa.accion, aa.tabla_afectada, aa.id_registro_afectado, aa.ip_origen
-        FROM Auditoria_Accesos aa
-        LEFT JOIN Empleados e ON aa.id_emp = e.id_emp
-        LEFT JOIN Personas p ON e.id_persona = p.id_persona
-        LEFT JOIN Roles r ON e.id_rol = r.id_rol
-        LEFT JOIN Sedes_Hospitalarias s ON e.id_sede = s.id_sede
-        ORDER BY aa.fecha_evento DESC LIMIT 100
-    """
-    logs = ejecutar_query(query)
-    return render(request, 'cashier/auditoria_logs.html', {'user': user, 'logs': logs})
+    logs = buscar_auditoria(request)
+    avisar_meses_sin_leer(request, logs)
+    return render(request, 'cashier/auditoria_logs.html', {'user': user, 'logs': logs, 'pagina': logs})
 
 @login_required_custom
 @role_required('Administrador', 'Auditor')
@@ -1262,12 +1335,15 @@ def auditoria_historias(request):
 @login_required_custom
 @role_required('Administrador', 'Auditor')
 def filtrar_auditoria(request):
-    """Filtrar auditoría"""
+    """Filtrar auditoría (incluye los meses archivados)"""
     user = get_user_from_session(request)
-    tabla = request.GET.get('tabla', '')
-    query = """SELECT * FROM Auditoria_Accesos WHERE tabla_afectada = %s ORDER BY fecha_evento DESC LIMIT 100"""
-    logs = ejecutar_query(query, [tabla]) if tabla else []
-    return render(request, 'cashier/auditoria_logs.html', {'user': user, 'logs': logs})
+    filtros = filtros_busqueda(request.GET)
+    if not filtros:
+        return render(request, 'cashier/auditoria_logs.html', {'user': user, 'logs': [], 'filtros': request.GET})
+    logs = buscar_auditoria(request, filtros)
+    avisar_meses_sin_leer(request, logs)
+    return render(request, 'cashier/auditoria_logs.html',
+                  {'user': user, 'logs': logs, 'pagina': logs, 'filtros': request.GET})
 
 # ============================================================================
 # 11. VISTAS DISTRIBUIDAS
@@ -1277,8 +1353,9 @@ def filtrar_auditoria(request):
 def vista_historias_consolidadas(request):
     """Historias clínicas consolidadas"""
     user = get_user_from_session(request)
-    query = """SELECT * FROM vista_historias_consolidadas ORDER BY fecha_registro DESC LIMIT 100"""
-    datos = ejecutar_query(query)
+    query = QUERY_HISTORIAS_BASE + " ORDER BY hc.fecha_registro DESC LIMIT 100"
+    datos = completar_historias(ejecutar_query(query))
+    avisar_resultado_parcial(request, datos)
     return render(request, 'cashier/ver_historial.html', {'user': user, 'historias': datos, 'consolidado': True})
 
 @login_required_custom
@@ -1293,8 +1370,10 @@ def vista_medicamentos_sede(request):
 def vista_medicos_consultas(request):
     """Médicos y consultas"""
     user = get_user_from_session(request)
-    query = """SELECT * FROM vista_medicos_consultas ORDER BY total_consultas DESC"""
-    datos = ejecutar_query(query)
+    query = """SELECT * FROM vista_medicos_consultas"""
+    # Cada nodo agrega sus propias citas; los grupos incluyen la sede y no se solapan
+    datos = ejecutar_query_fragmentos(query, orden=lambda r: r[5], descendente=True)
+    avisar_resultado_parcial(request, datos)
     return render(request, 'cashier/reportes_analitica.html', {'user': user, 'datos': datos})
 
 @login_required_custom
@@ -1389,8 +1468,7 @@ def admin_desactivar_empleado(request, emp_id):
 def admin_sedes(request):
     """Gestión de sedes"""
     user = get_user_from_session(request)
-    query = "SELECT * FROM Sedes_Hospitalarias ORDER BY nom_sede"
-    sedes = ejecutar_query(query)
+    sedes = obtener_catalogo('sedes')
     return render(request, 'cashier/menu.html', {'user': user, 'sedes': sedes})
 
 @login_required_custom
@@ -1410,8 +1488,7 @@ def admin_departamentos(request):
 def admin_roles(request):
     """Gestión de roles"""
     user = get_user_from_session(request)
-    query = "SELECT * FROM Roles ORDER BY id_rol"
-    roles = ejecutar_query(query)
+    roles = obtener_catalogo('roles')
     return render(request, 'cashier/menu.html', {'user': user, 'roles': roles})
 
 @login_required_custom
@@ -1419,8 +1496,7 @@ def admin_roles(request):
 def admin_especialidades(request):
     """Gestión de especialidades"""
     user = get_user_from_session(request)
-    query = "SELECT * FROM Especialidades ORDER BY nombre_esp"
-    especialidades = ejecutar_query(query)
+    especialidades = obtener_catalogo('especialidades')
     return render(request, 'cashier/menu.html', {'user': user, 'especialidades': especialidades})
 
 # ============================================================================
@@ -1430,14 +1506,29 @@ def admin_especialidades(request):
 @login_required_custom
 def api_buscar_pacientes(request):
     """API: Buscar pacientes"""
-    q = request.GET.get('q', '')
-    query = """
+    q = request.GET.get('q', '').strip()
+    try:
+        pagina = max(int(request.GET.get('pagina', 1)), 1)
+    except ValueError:
+        pagina = 1
+    if not q:
+        return JsonResponse({'pacientes': [], 'pagina': pagina, 'mas': False})
+    por_pagina = 10
+    where, order, params_where, params_order = filtro_personas(q)
+    # Se pide una fila de más para saber si hay otra página
+    query = f"""
         SELECT pac.cod_pac, p.nom_persona || ' ' || p.apellido_persona as nombre, p.num_doc
         FROM Pacientes pac INNER JOIN Personas p ON pac.id_persona = p.id_persona
-        WHERE p.num_doc LIKE %s OR p.nom_persona ILIKE %s LIMIT 10
+        WHERE {where} ORDER BY {order}, pac.cod_pac LIMIT %s OFFSET %s
     """
-    results = ejecutar_query(query, [f'%{q}%', f'%{q}%'])
-    return JsonResponse({'pacientes': [{'id': r[0], 'nombre': r[1], 'doc': r[2]} for r in results]})
+    results = ejecutar_query(
+        query, params_where + params_order + [por_pagina + 1, (pagina - 1) * por_pagina]
+    )
+    return JsonResponse({
+        'pacientes': [{'id': r[0], 'nombre': r[1], 'doc': r[2]} for r in results[:por_pagina]],
+        'pagina': pagina,
+        'mas': len(results) > por_pagina,
+    })
 
 @login_required_custom
 def api_medicos_disponibles(request):
@@ -1449,7 +1540,7 @@ def api_medicos_disponibles(request):
         INNER JOIN Roles r ON e.id_rol = r.id_rol
         WHERE r.nombre_rol = 'Medico' AND e.id_sede = %s AND e.activo = TRUE
     """
-    results = ejecutar_query(query, [user['id_sede']])
+    results = ejecutar_query_sede(query, [user['id_sede']], user['id_sede'])
     return JsonResponse({'medicos': [{'id': r[0], 'nombre': r[1]} for r in results]})
 
 @login_required_custom
@@ -1457,18 +1548,30 @@ def api_disponibilidad_citas(request):
     """API: Disponibilidad de citas"""
     fecha = request.GET.get('fecha', '')
     medico_id = request.GET.get('medico_id', '')
-    query = """
-        SELECT fecha_hora FROM Citas WHERE id_emp = %s AND DATE(fecha_hora) = %s AND estado = 'PROGRAMADA'
-    """
-    results = ejecutar_query(query, [medico_id, fecha]) if fecha and medico_id else []
+    results = []
+    if fecha and medico_id:
+        try:
+            dia = date.fromisoformat(fecha)
+        except ValueError:
+            return JsonResponse({'ocupados': []})
+        where, params = filtro_citas(
+            id_emp=medico_id, desde=dia, hasta=dia + timedelta(days=1), estado='PROGRAMADA'
+        )
+        # Las citas aún en el outbox también ocupan el horario (si no, se agenda dos veces)
+        query = f"SELECT c.fecha_hora FROM {{citas}} c WHERE {where}"
+        results = ejecutar_citas_fragmentos(query, params, orden=lambda r: r[0])
     return JsonResponse({'ocupados': [str(r[0]) for r in results]})
 
 @login_required_custom
 def api_buscar_medicamentos(request):
     """API: Buscar medicamentos"""
-    q = request.GET.get('q', '')
-    query = "SELECT cod_med, nom_med, principio_activo FROM Catalogo_Medicamentos WHERE nom_med ILIKE %s LIMIT 10"
-    results = ejecutar_query(query, [f'%{q}%'])
+    q = request.GET.get('q', '').strip()
+    if not q:
+        return JsonResponse({'medicamentos': []})
+    where, order, params_where, params_order = filtro_medicamentos(q)
+    query = f"""SELECT m.cod_med, m.nom_med, m.principio_activo FROM Catalogo_Medicamentos m
+                WHERE {where} ORDER BY {order}, m.nom_med LIMIT 10"""
+    results = ejecutar_query(query, params_where + params_order)
     return JsonResponse({'medicamentos': [{'id': r[0], 'nombre': r[1], 'principio': r[2]} for r in results]})
 
 @login_required_custom
@@ -1482,11 +1585,28 @@ def api_verificar_stock(request, med_id):
 @login_required_custom
 def api_buscar_enfermedades(request):
     """API: Buscar enfermedades"""
-    q = request.GET.get('q', '')
-    query = "SELECT id_enfermedad, nombre_enfermedad FROM Enfermedades WHERE nombre_enfermedad ILIKE %s LIMIT 10"
-    results = ejecutar_query(query, [f'%{q}%'])
+    q = request.GET.get('q', '').strip()
+    if not q:
+        return JsonResponse({'enfermedades': []})
+    where, order, params_where, params_order = filtro_enfermedades(q)
+    query = f"""SELECT e.id_enfermedad, e.nombre_enfermedad FROM Enfermedades e
+                WHERE {where} ORDER BY {order}, e.nombre_enfermedad LIMIT 10"""
+    results = ejecutar_query(query, params_where + params_order)
     return JsonResponse({'enfermedades': [{'id': r[0], 'nombre': r[1]} for r in results]})
 
+def metricas_sql(request):
+    """API: consultas y tiempo en la base por ruta y por huella (solo desde la misma máquina)"""
+    # REMOTE_ADDR y no get_client_ip: X-Forwarded-For lo puede escribir cualquiera
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'SQL_METRICAS_IPS', ('127.0.0.1', '::1')):
+        return JsonResponse({'error': 'Solo disponible localmente'}, status=403)
+    if request.GET.get('reiniciar') == '1':
+        metricas_sql_proceso.reiniciar()
+    try:
+        limite = int(request.GET.get('limite', 50))
+    except ValueError:
+        limite = 50
+    return JsonResponse(metricas_sql_proceso.resumen(limite))
+
 # ============================================================================
 # 14. PÁGINAS AUXILIARES
 # ============================================================================
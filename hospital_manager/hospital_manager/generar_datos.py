@@ -0,0 +1,339 @@
+"""
+Generador de datos sintéticos para pruebas de carga
+Ejecutar: python generar_datos.py [--escala 1] [--semilla 42] [--sedes 1 2 3] [--limpiar] [--csv DIR]
+
+Carga con COPY un volumen realista y reproducible (misma semilla y misma fecha
+de referencia = mismas filas):
+  - Personas, Pacientes e Historias_Clinicas en el coordinador y en cada nodo
+  - Citas de cada sede en el nodo que la almacena (sede 1 en citas_local)
+  - Diagnostico, Prescripciones y Auditoria_Accesos en el coordinador
+
+Con --escala 1 son 10.000 pacientes y unas 100.000 citas; --escala 10 da
+alrededor de un millón de citas. Los IDs salen de la mitad alta del rango de
+cada sede (sección 19 del script del coordinador), así no chocan con las
+secuencias de la aplicación y --limpiar borra solo lo generado.
+Los médicos, departamentos, enfermedades y medicamentos se toman de la base.
+"""
+import argparse
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import django
+
+# Configurar Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automatic_cashier.settings')
+django.setup()
+
+from django.db import connections
+
+from cashier.distribucion import alias_para_sede
+
+# Primer ID generado de cada sede: sede N usa N*100000000 + 50000000 en adelante
+TAMANO_RANGO = 100_000_000
+INICIO_SINTETICO = 50_000_000
+# Rango de pruebas de red (RFC 2544): identifica la auditoría generada
+IP_SINTETICA = '198.18.{}.{}'
+
+PACIENTES_BASE = 10_000
+CITAS_POR_PACIENTE = 10
+
+NOMBRES = ['María', 'José', 'Luis', 'Ana', 'Carlos', 'Laura', 'Jorge', 'Sofía', 'Andrés', 'Valentina',
+           'Juan', 'Camila', 'Diego', 'Isabella', 'Pedro', 'Daniela', 'Miguel', 'Paula', 'Felipe', 'Lucía']
+APELLIDOS = ['García', 'Rodríguez', 'Martínez', 'López', 'González', 'Hernández', 'Pérez', 'Sánchez',
+             'Ramírez', 'Torres', 'Flórez', 'Gómez', 'Díaz', 'Vargas', 'Castro', 'Moreno', 'Rojas',
+             'Jiménez', 'Muñoz', 'Ortiz', 'Álvarez', 'Ruiz', 'Suárez', 'Restrepo', 'Cárdenas']
+CIUDADES = {1: 'Bogotá', 2: 'Medellín', 3: 'Cali'}
+SERVICIOS = ['Consulta', 'Control', 'Especialidad', 'Urgencia']
+MOTIVOS = ['Dolor abdominal', 'Control de tensión', 'Cefalea persistente', 'Chequeo general',
+           'Fiebre y malestar', 'Dolor lumbar', 'Seguimiento de tratamiento', 'Tos crónica']
+DOSIS = ['250 mg', '500 mg', '1 g', '10 mg', '20 mg', '5 ml']
+FRECUENCIAS = ['Cada 8 horas', 'Cada 12 horas', 'Cada 24 horas', 'Cada 6 horas']
+
+# tabla -> columnas del COPY
+COLUMNAS = {
+    'personas': ('id_persona', 'nom_persona', 'apellido_persona', 'tipo_doc', 'num_doc', 'fecha_nac',
+                 'genero', 'dir_persona', 'tel_persona', 'email_persona', 'ciudad_residencia'),
+    'pacientes': ('cod_pac', 'id_persona'),
+    'historias_clinicas': ('cod_hist', 'cod_pac', 'fecha_registro'),
+    'citas': ('id_cita', 'id_sede', 'id_dept', 'id_emp', 'cod_pac', 'fecha_hora',
+              'fecha_hora_solicitada', 'tipo_servicio', 'estado', 'motivo'),
+    'diagnostico': ('id_diagnostico', 'id_enfermedad', 'id_cita', 'cod_hist', 'observacion'),
+    'prescripciones': ('id_presc', 'cod_med', 'cod_hist', 'id_cita', 'dosis', 'frecuencia',
+                       'duracion_dias', 'cantidad_total', 'fecha_emision'),
+    'auditoria_accesos': ('id_emp', 'accion', 'tabla_afectada', 'id_registro_afectado',
+                          'fecha_evento', 'ip_origen'),
+}
+
+# Tablas replicadas en todos los nodos (sección 26): se cargan en cada uno
+REPLICADAS = ('personas', 'pacientes', 'historias_clinicas')
+
+
+def primer_id(id_sede):
+    return id_sede * TAMANO_RANGO + INICIO_SINTETICO
+
+
+def _sin_tildes(texto):
+    return texto.lower().translate(str.maketrans('áéíóúñ', 'aeioun'))
+
+
+# ============================================================================
+# CATÁLOGOS EXISTENTES
+# ============================================================================
+
+def leer_catalogos(sedes):
+    """Médicos por sede, empleados por sede, enfermedades y medicamentos (ordenados: resultado estable)"""
+    with connections['default'].cursor() as cursor:
+        cursor.execute("""
+            SELECT e.id_emp, e.id_sede, e.id_dept, r.nombre_rol
+            FROM Empleados e INNER JOIN Roles r ON e.id_rol = r.id_rol
+            WHERE e.activo AND e.id_sede = ANY(%s)
+            ORDER BY e.id_emp
+        """, [list(sedes)])
+        empleados = cursor.fetchall()
+        cursor.execute("SELECT id_enfermedad FROM Enfermedades ORDER BY id_enfermedad")
+        enfermedades = [fila[0] for fila in cursor.fetchall()]
+        cursor.execute("SELECT cod_med FROM Catalogo_Medicamentos ORDER BY cod_med")
+        medicamentos = [fila[0] for fila in cursor.fetchall()]
+
+    medicos = {s: [(e, d) for e, sede, d, rol in empleados if sede == s and rol == 'Medico'] for s in sedes}
+    personal = {s: [e for e, sede, _, _ in empleados if sede == s] for s in sedes}
+    return medicos, personal, enfermedades, medicamentos
+
+
+# ============================================================================
+# GENERACIÓN (una sola pasada, un CSV por tabla y destino)
+# ============================================================================
+
+class Archivos:
+    """Un csv.writer por (tabla, id_sede de destino); cuenta las filas escritas"""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._abiertos = {}
+        self.filas = {}
+
+    def ruta(self, tabla, id_sede):
+        return os.path.join(self.directorio, f'{tabla}_sede{id_sede}.csv')
+
+    def escribir(self, tabla, id_sede, fila):
+        clave = (tabla, id_sede)
+        if clave not in self._abiertos:
+            archivo = open(self.ruta(tabla, id_sede), 'w', newline='', encoding='utf-8')
+            self._abiertos[clave] = (archivo, csv.writer(archivo, lineterminator='\n'))
+            self.filas[clave] = 0
+        self._abiertos[clave][1].writerow(fila)
+        self.filas[clave] += 1
+
+    def cerrar(self):
+        for archivo, _ in self._abiertos.values():
+            archivo.close()
+
+
+def generar(args, archivos, medicos, personal, enfermedades, medicamentos):
+    referencia = datetime.combine(args.fecha_referencia, datetime.min.time())
+    pesos = dict(zip([1, 2, 3], args.reparto))
+    total_peso = sum(pesos[s] for s in args.sedes)
+    contadores = {s: {'cita': 0, 'diag': 0, 'presc': 0} for s in args.sedes}
+    total_pacientes = args.pacientes or int(PACIENTES_BASE * args.escala)
+
+    for sede_casa in args.sedes:
+        n_pacientes = round(total_pacientes * pesos[sede_casa] / total_peso)
+        for i in range(n_pacientes):
+            # Un generador por paciente: cambiar la escala no altera a los pacientes anteriores
+            rng = random.Random(f'{args.semilla}:{sede_casa}:{i}')
+            id_persona = cod_pac = cod_hist = primer_id(sede_casa) + i
+            nombre, apellido = rng.choice(NOMBRES), rng.choice(APELLIDOS)
+            persona = (
+                id_persona, nombre, f'{apellido} {rng.choice(APELLIDOS)}', 'CC', f'S{id_persona}',
+                date(1940, 1, 1) + timedelta(days=rng.randrange(29_000)), rng.choice('MF'),
+                f'Calle {rng.randint(1, 200)} #{rng.randint(1, 99)}-{rng.randint(1, 99)}',
+                f'3{rng.randint(100000000, 199999999)}',
+                f'{_sin_tildes(nombre)}.{_sin_tildes(apellido)}.{id_persona}@correo.test',
+                CIUDADES[sede_casa],
+            )
+            citas = []
+            for _ in range(rng.randint(0, 2 * args.citas_por_paciente)):
+                # 80% en la sede de residencia
+                sede = sede_casa if rng.random() < 0.8 or len(args.sedes) == 1 else rng.choice(args.sedes)
+                if not medicos[sede]:
+                    continue
+                id_emp, id_dept = rng.choice(medicos[sede])
+                fecha = referencia + timedelta(days=rng.randint(-730, 30),
+                                               hours=rng.randint(7, 17), minutes=rng.choice((0, 20, 40)))
+                solicitada = fecha - timedelta(days=rng.randint(0, 30), hours=rng.randint(0, 8))
+                if fecha >= referencia:
+                    estado = 'PROGRAMADA' if rng.random() < 0.9 else 'CANCELADA'
+                else:
+                    sorteo = rng.random()
+                    estado = 'COMPLETADA' if sorteo < 0.85 else ('CANCELADA' if sorteo < 0.95 else 'PROGRAMADA')
+                contadores[sede]['cita'] += 1
+                id_cita = primer_id(sede) + contadores[sede]['cita']
+                citas.append((sede, (id_cita, sede, id_dept, id_emp, cod_pac, fecha, solicitada,
+                                     rng.choice(SERVICIOS), estado, rng.choice(MOTIVOS))))
+
+            for destino in args.destinos_replicadas:
+                archivos.escribir('personas', destino, persona)
+                archivos.escribir('pacientes', destino, (cod_pac, id_persona))
+                if citas:
+                    archivos.escribir('historias_clinicas', destino, (cod_hist, cod_pac, min(c[1][6] for c in citas)))
+
+            for sede, cita in citas:
+                id_cita, _, _, id_emp, _, fecha, solicitada, _, estado, _ = cita
+                archivos.escribir('citas', sede, cita)
+                ip = IP_SINTETICA.format(sede, rng.randint(1, 254))
+                if personal[sede]:
+                    archivos.escribir('auditoria_accesos', 1, (rng.choice(personal[sede]), 'INSERT', 'Citas',
+                                                               id_cita, solicitada, ip))
+                if estado != 'COMPLETADA' or not enfermedades:
+                    continue
+                contadores[sede]['diag'] += 1
+                archivos.escribir('diagnostico', 1, (primer_id(sede) + contadores[sede]['diag'],
+                                                     rng.choice(enfermedades), id_cita, cod_hist,
+                                                     f'Observación de la consulta {id_cita}'))
+                archivos.escribir('auditoria_accesos', 1, (id_emp, 'SELECT', 'Historias_Clinicas',
+                                                           cod_hist, fecha, ip))
+                archivos.escribir('auditoria_accesos', 1, (id_emp, 'INSERT', 'Historias_Clinicas',
+                                                           cod_hist, fecha + timedelta(minutes=15), ip))
+                if not medicamentos or rng.random() >= 0.6:
+                    continue
+                for _ in range(rng.randint(1, 3)):
+                    contadores[sede]['presc'] += 1
+                    dias = rng.randint(3, 14)
+                    archivos.escribir('prescripciones', 1, (
+                        primer_id(sede) + contadores[sede]['presc'], rng.choice(medicamentos), cod_hist,
+                        id_cita, rng.choice(DOSIS), rng.choice(FRECUENCIAS), dias, dias * rng.randint(1, 4),
+                        fecha.date(),
+                    ))
+
+
+# ============================================================================
+# CARGA
+# ============================================================================
+
+def _alias(id_sede):
+    return 'default' if id_sede == 1 else alias_para_sede(id_sede)
+
+
+def _tabla_destino(tabla, id_sede):
+    # En el coordinador Citas es la vista distribuida: la sede 1 vive en citas_local
+    return 'citas_local' if tabla == 'citas' and id_sede == 1 else tabla
+
+
+def _sin_replicacion(cursor, activo):
+    """Los triggers de la sección 26 no registran la carga (ya va a todos los nodos)"""
+    cursor.execute("SELECT set_config('his_replicacion.aplicando', %s, false)", ['on' if activo else 'off'])
+
+
+def limpiar(sedes, destinos):
+    """Borra lo generado antes (rangos sintéticos de cada sede e IP de prueba)"""
+    rangos = [(primer_id(s), s * TAMANO_RANGO + TAMANO_RANGO - 1) for s in sedes]
+    with connections['default'].cursor() as cursor:
+        cursor.execute("DELETE FROM Auditoria_Accesos WHERE ip_origen LIKE '198.18.%%'")
+        for desde, hasta in rangos:
+            cursor.execute("DELETE FROM Prescripciones WHERE id_presc BETWEEN %s AND %s", [desde, hasta])
+            cursor.execute("DELETE FROM Diagnostico WHERE id_diagnostico BETWEEN %s AND %s", [desde, hasta])
+    for id_sede in sedes:
+        with connections[_alias(id_sede)].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {_tabla_destino('citas', id_sede)} WHERE id_cita BETWEEN %s AND %s",
+                           [primer_id(id_sede), id_sede * TAMANO_RANGO + TAMANO_RANGO - 1])
+    for destino in destinos:
+        with connections[_alias(destino)].cursor() as cursor:
+            _sin_replicacion(cursor, True)
+            for desde, hasta in rangos:
+                cursor.execute("DELETE FROM Historias_Clinicas WHERE cod_hist BETWEEN %s AND %s", [desde, hasta])
+                cursor.execute("DELETE FROM Pacientes WHERE cod_pac BETWEEN %s AND %s", [desde, hasta])
+                cursor.execute("DELETE FROM Personas WHERE id_persona BETWEEN %s AND %s", [desde, hasta])
+            _sin_replicacion(cursor, False)
+
+
+def cargar(archivos):
+    """COPY de cada archivo en su destino, en orden de llaves foráneas"""
+    for tabla in COLUMNAS:
+        for (nombre, id_sede), filas in sorted(archivos.filas.items()):
+            if nombre != tabla:
+                continue
+            alias = _alias(id_sede)
+            destino = _tabla_destino(tabla, id_sede)
+            inicio = time.perf_counter()
+            with connections[alias].cursor() as cursor:
+                _sin_replicacion(cursor, True)
+                with open(archivos.ruta(tabla, id_sede), encoding='utf-8') as archivo:
+                    cursor.cursor.copy_expert(
+                        f"COPY {destino} ({', '.join(COLUMNAS[tabla])}) FROM STDIN WITH (FORMAT csv)", archivo
+                    )
+                _sin_replicacion(cursor, False)
+                cursor.execute(f"ANALYZE {destino}")
+            print(f"  {destino:<20} {alias:<8} {filas:>12,} filas  ({time.perf_counter() - inicio:.1f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Carga datos sintéticos con COPY')
+    parser.add_argument('--escala', type=float, default=1.0,
+                        help=f'Múltiplo de {PACIENTES_BASE:,} pacientes y ~{CITAS_POR_PACIENTE} citas por paciente')
+    parser.add_argument('--pacientes', type=int, default=None, help='Total de pacientes (ignora --escala)')
+    parser.add_argument('--citas-por-paciente', type=int, default=CITAS_POR_PACIENTE)
+    parser.add_argument('--reparto', type=float, nargs=3, default=[0.5, 0.3, 0.2],
+                        metavar=('SEDE1', 'SEDE2', 'SEDE3'), help='Peso de cada sede en pacientes')
+    parser.add_argument('--sedes', type=int, nargs='+', default=[1, 2, 3], choices=[1, 2, 3])
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--fecha-referencia', type=date.fromisoformat, default=date.today(),
+                        help='"Hoy" para las fechas de las citas (AAAA-MM-DD); fijarla para repetir la carga')
+    parser.add_argument('--limpiar', action='store_true', help='Borrar antes lo generado en otra corrida')
+    parser.add_argument('--csv', default=None, help='Solo escribir los CSV en este directorio (sin cargar)')
+    args = parser.parse_args()
+
+    # Sedes sin nodo propio no se pueden cargar (sus citas solo existen detrás de dblink)
+    sedes = []
+    for id_sede in sorted(set(args.sedes)):
+        if id_sede != 1 and _alias(id_sede) == 'default' and not args.csv:
+            print(f"⚠️  La sede {id_sede} no tiene alias en SEDE_DB_ALIAS; se omite")
+            continue
+        sedes.append(id_sede)
+    if not sedes:
+        sys.exit(1)
+    args.sedes = sedes
+    args.destinos_replicadas = sorted(set([1] + sedes))
+
+    print("=" * 70)
+    print(f"DATOS SINTÉTICOS (escala {args.escala}, semilla {args.semilla}, referencia {args.fecha_referencia})")
+    print("=" * 70)
+    medicos, personal, enfermedades, medicamentos = leer_catalogos(sedes)
+    for id_sede in sedes:
+        if not medicos[id_sede]:
+            print(f"⚠️  La sede {id_sede} no tiene médicos activos: no tendrá citas")
+
+    directorio = args.csv or tempfile.mkdtemp(prefix='his_datos_')
+    os.makedirs(directorio, exist_ok=True)
+    archivos = Archivos(directorio)
+    inicio = time.perf_counter()
+    try:
+        generar(args, archivos, medicos, personal, enfermedades, medicamentos)
+        archivos.cerrar()
+        print(f"\n  Generado en {time.perf_counter() - inicio:.1f} s:")
+        for (tabla, id_sede), filas in sorted(archivos.filas.items()):
+            print(f"    {tabla:<20} sede {id_sede}  {filas:>12,}")
+        if args.csv:
+            print(f"\n  Archivos en {directorio}")
+            return
+
+        if args.limpiar:
+            print("\n  Borrando la carga anterior...")
+            limpiar(sedes, args.destinos_replicadas)
+        print("\n  Cargando con COPY...")
+        cargar(archivos)
+    finally:
+        archivos.cerrar()
+        if not args.csv:
+            shutil.rmtree(directorio, ignore_errors=True)
+    print(f"\n✅ Listo en {time.perf_counter() - inicio:.1f} s. "
+          "Refrescar los resúmenes con: python manage.py refrescar_analitica")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""
+Prueba de carga con tráfico por rol
+Ejecutar: python prueba_carga.py [--usuarios 20] [--duracion 60] [--semilla 42] [--url http://localhost:8000] [--solo-lectura] [--json resultados.json]
+
+Cada usuario virtual toma un rol según su peso (administrativos que programan
+citas y buscan pacientes, médicos que atienden y diagnostican, auditores que
+revisan la auditoría y los reportes) y repite las acciones de ese rol con una
+pausa entre una y otra. Al final muestra p50/p95/p99 por ruta de cashier/urls.py.
+
+Sin --url las peticiones van al cliente de pruebas de Django en este mismo
+proceso (como benchmark_conexiones.py); con --url van por HTTP a un servidor ya
+levantado. Programar citas y diagnosticar escribe de verdad: usar contra una
+base cargada con generar_datos.py, o con --solo-lectura.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+
+import django
+
+# Configurar Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automatic_cashier.settings')
+django.setup()
+
+from django.db import connections
+from django.test import Client
+from django.urls import Resolver404, resolve, reverse
+
+from cashier.distribucion import alias_para_sede
+from cashier.forms import ejecutar_query
+
+# rol -> (peso, email, contraseña); usuarios de usuarios_hospital.txt.
+# El auditor entra como Administrador (las vistas de auditoría también lo admiten)
+ROLES = {
+    'administrativo': (0.5, 'isabel.moreno@hospital.com', 'admin123'),
+    'medico': (0.35, 'maria.gonzalez@hospital.com', 'medico123'),
+    'auditor': (0.15, 'carlos.rodriguez@hospital.com', 'admin123'),
+}
+TABLAS_AUDITADAS = ['Citas', 'Historias_Clinicas', 'Personas', 'Pacientes', 'Diagnostico']
+REPORTES = ['reporte_medicos_consultas', 'reporte_tiempos_atencion', 'reporte_especialidades_demandadas']
+
+
+# ============================================================================
+# CLIENTES (en proceso o HTTP)
+# ============================================================================
+
+class ClienteDjango:
+    """Cliente de pruebas de Django: mide solo la vista (no sigue redirecciones)"""
+
+    def __init__(self, url_base=None):
+        self._client = Client(HTTP_HOST='localhost')
+
+    def get(self, ruta):
+        return self._client.get(ruta).status_code
+
+    def post(self, ruta, datos):
+        return self._client.post(ruta, datos).status_code
+
+    def cerrar(self):
+        connections.close_all()
+
+
+class _SinRedireccion(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHTTP:
+    """Cliente urllib con sesión y CSRF contra un servidor levantado"""
+
+    def __init__(self, url_base):
+        self._base = url_base.rstrip('/')
+        self._cookies = CookieJar()
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self._cookies), _SinRedireccion
+        )
+
+    def _csrf(self):
+        return next((c.value for c in self._cookies if c.name == 'csrftoken'), '')
+
+    def _abrir(self, peticion):
+        try:
+            with self._opener.open(peticion, timeout=60) as respuesta:
+                respuesta.read()
+                return respuesta.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def get(self, ruta):
+        return self._abrir(urllib.request.Request(self._base + ruta))
+
+    def post(self, ruta, datos):
+        if not self._csrf():
+            self.get(ruta)
+        cuerpo = urllib.parse.urlencode({**datos, 'csrfmiddlewaretoken': self._csrf()}).encode()
+        return self._abrir(urllib.request.Request(
+            self._base + ruta, data=cuerpo,
+            headers={'X-CSRFToken': self._csrf(), 'Referer': self._base + ruta},
+        ))
+
+    def cerrar(self):
+        pass
+
+
+# ============================================================================
+# MEDICIÓN
+# ============================================================================
+
+class Registro:
+    """Tiempos (ms) y errores por nombre de ruta"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tiempos = defaultdict(list)
+        self.errores = defaultdict(int)
+
+    def medir(self, metodo, ruta, llamada):
+        try:
+            nombre = resolve(ruta.split('?')[0]).url_name
+        except Resolver404:
+            nombre = ruta
+        clave = f'{metodo} {nombre}'
+        inicio = time.perf_counter()
+        try:
+            estado = llamada()
+        except Exception:
+            estado = 599
+        ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self.tiempos[clave].append(ms)
+            if estado >= 400:
+                self.errores[clave] += 1
+        return estado
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano"""
+    ordenados = sorted(valores)
+    return ordenados[max(math.ceil(p / 100 * len(ordenados)) - 1, 0)]
+
+
+# ============================================================================
+# DATOS PARA LOS FORMULARIOS
+# ============================================================================
+
+def _empleado(email):
+    fila = ejecutar_query("""
+        SELECT e.id_emp, e.id_sede FROM Empleados e
+        INNER JOIN Personas p ON e.id_persona = p.id_persona
+        WHERE p.email_persona = %s
+    """, [email])
+    if not fila:
+        print(f"❌ No existe el empleado {email}")
+        sys.exit(1)
+    return fila[0]
+
+
+def cargar_datos(roles):
+    """Valores válidos para cada rol (ordenados: la misma semilla repite las mismas acciones)"""
+    datos = {}
+    _, sede_adm = _empleado(roles['administrativo'][1])
+    datos['medicos'] = ejecutar_query("""
+        SELECT e.id_emp, e.id_dept FROM Empleados e INNER JOIN Roles r ON e.id_rol = r.id_rol
+        WHERE r.nombre_rol = 'Medico' AND e.activo AND e.id_sede = %s ORDER BY e.id_emp
+    """, [sede_adm])
+    datos['pacientes'] = [f[0] for f in ejecutar_query("SELECT cod_pac FROM Pacientes ORDER BY cod_pac DESC LIMIT 2000")]
+    datos['apellidos'] = [f[0] for f in ejecutar_query(
+        "SELECT DISTINCT split_part(apellido_persona, ' ', 1) FROM Personas ORDER BY 1 LIMIT 200"
+    )]
+    id_medico, sede_medico = _empleado(roles['medico'][1])
+    # Las citas del médico se leen en el nodo de su sede (sin pasar por dblink)
+    datos['citas_medico'] = [f[0] for f in ejecutar_query("""
+        SELECT id_cita FROM Citas WHERE id_emp = %s AND estado = 'PROGRAMADA'
+        ORDER BY fecha_hora LIMIT 2000
+    """, [id_medico], using=alias_para_sede(sede_medico))]
+    datos['enfermedades'] = [f[0] for f in ejecutar_query("SELECT id_enfermedad FROM Enfermedades ORDER BY 1")]
+    return datos
+
+
+# ============================================================================
+# ACCIONES POR ROL
+# ============================================================================
+
+class UsuarioVirtual:
+    def __init__(self, numero, rol, cliente, registro, datos, rng, solo_lectura):
+        self.numero = numero
+        self.rol = rol
+        self.cliente = cliente
+        self.registro = registro
+        self.datos = datos
+        self.rng = rng
+        self.solo_lectura = solo_lectura
+
+    def get(self, ruta):
+        return self.registro.medir('GET', ruta, lambda: self.cliente.get(ruta))
+
+    def post(self, ruta, datos):
+        return self.registro.medir('POST', ruta, lambda: self.cliente.post(ruta, datos))
+
+    def iniciar_sesion(self):
+        _, email, password = ROLES[self.rol]
+        ruta = reverse('hospital:login')
+        return self.post(ruta, {'email': email, 'password': password}) == 302
+
+    # --- Administrativo ---
+
+    def ver_citas(self):
+        self.get(reverse(self.rng.choice(['hospital:lista_citas', 'hospital:citas_programadas',
+                                          'hospital:historial_citas'])))
+
+    def buscar_paciente(self):
+        if self.datos['apellidos']:
+            termino = self.rng.choice(self.datos['apellidos'])[:self.rng.randint(3, 6)]
+            self.get(reverse('hospital:api_buscar_pacientes') + '?' + urllib.parse.urlencode({'q': termino}))
+
+    def programar_cita(self):
+        ruta = reverse('hospital:nueva_cita')
+        self.get(ruta)
+        if self.solo_lectura or not self.datos['medicos'] or not self.datos['pacientes']:
+            return
+        id_emp, id_dept = self.rng.choice(self.datos['medicos'])
+        fecha = datetime.now() + timedelta(days=self.rng.randint(1, 60), hours=self.rng.randint(0, 8))
+        self.post(ruta, {
+            'cod_pac': self.rng.choice(self.datos['pacientes']), 'id_emp': id_emp, 'id_dept': id_dept,
+            'fecha_hora': fecha.strftime('%Y-%m-%dT%H:%M'), 'tipo_servicio': 'Consulta',
+            'motivo': f'Prueba de carga {self.numero}', 'estado': 'PROGRAMADA',
+        })
+
+    def ver_pacientes(self):
+        self.get(reverse('hospital:lista_pacientes'))
+
+    def ver_dashboard(self):
+        self.get(reverse('hospital:dashboard'))
+
+    # --- Médico ---
+
+    def ver_pendientes(self):
+        self.get(reverse('hospital:citas_pendientes'))
+
+    def ver_cita(self):
+        if self.datos['citas_medico']:
+            self.get(reverse('hospital:detalle_cita', args=[self.rng.choice(self.datos['citas_medico'])]))
+
+    def diagnosticar(self):
+        citas = self.datos['citas_medico']
+        if not citas:
+            return
+        id_cita = self.rng.choice(citas)
+        ruta = reverse('hospital:registrar_diagnostico', args=[id_cita])
+        self.get(ruta)
+        if self.solo_lectura or not self.datos['enfermedades']:
+            return
+        # Cada cita se diagnostica una sola vez
+        try:
+            citas.remove(id_cita)
+        except ValueError:
+            return
+        self.post(ruta, {'id_enfermedad': self.rng.choice(self.datos['enfermedades']),
+                         'observacion': f'Prueba de carga {self.numero}'})
+
+    def ver_historias(self):
+        self.get(reverse('hospital:lista_historias'))
+
+    # --- Auditor ---
+
+    def ver_accesos(self):
+        self.get(reverse('hospital:auditoria_accesos'))
+
+    def filtrar_auditoria(self):
+        self.get(reverse('hospital:filtrar_auditoria') + '?' +
+                 urllib.parse.urlencode({'tabla': self.rng.choice(TABLAS_AUDITADAS)}))
+
+    def ver_reporte(self):
+        self.get(reverse(f'hospital:{self.rng.choice(REPORTES)}'))
+
+    def ver_auditoria_historias(self):
+        self.get(reverse('hospital:auditoria_historias'))
+
+    ACCIONES = {
+        'administrativo': [(0.30, ver_citas), (0.25, buscar_paciente), (0.20, programar_cita),
+                           (0.15, ver_pacientes), (0.10, ver_dashboard)],
+        'medico': [(0.30, ver_pendientes), (0.20, ver_cita), (0.25, diagnosticar),
+                   (0.15, ver_historias), (0.10, ver_dashboard)],
+        'auditor': [(0.35, ver_accesos), (0.30, filtrar_auditoria), (0.20, ver_reporte),
+                    (0.15, ver_auditoria_historias)],
+    }
+
+    def siguiente_accion(self):
+        pesos, acciones = zip(*self.ACCIONES[self.rol])
+        self.rng.choices(acciones, weights=pesos)[0](self)
+
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+def ejecutar(args, datos, registro):
+    clase_cliente = ClienteHTTP if args.url else ClienteDjango
+    fin = time.perf_counter() + args.duracion
+    nombres, pesos = zip(*((rol, peso) for rol, (peso, _, _) in ROLES.items()))
+    fallidos = []
+
+    def trabajador(numero):
+        rng = random.Random(f'{args.semilla}:{numero}')
+        usuario = UsuarioVirtual(numero, rng.choices(nombres, weights=pesos)[0],
+                                 clase_cliente(args.url), registro, datos, rng, args.solo_lectura)
+        try:
+            if not usuario.iniciar_sesion():
+                fallidos.append(usuario.rol)
+                return
+            while time.perf_counter() < fin:
+                usuario.siguiente_accion()
+                if args.pausa > 0:
+                    time.sleep(rng.expovariate(1 / args.pausa))
+        finally:
+            usuario.cliente.cerrar()
+
+    hilos = [threading.Thread(target=trabajador, args=(n,)) for n in range(args.usuarios)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    if fallidos:
+        print(f"⚠️  {len(fallidos)} usuarios no pudieron iniciar sesión ({', '.join(sorted(set(fallidos)))})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga por roles contra las rutas de cashier')
+    parser.add_argument('--usuarios', type=int, default=20, help='Usuarios virtuales concurrentes')
+    parser.add_argument('--duracion', type=float, default=60, help='Segundos de carga')
+    parser.add_argument('--pausa', type=float, default=0.5, help='Pausa media entre acciones (s); 0 = sin pausa')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--url', default=None, help='Servidor a probar, p. ej. http://localhost:8000')
+    parser.add_argument('--solo-lectura', action='store_true', help='No enviar formularios')
+    parser.add_argument('--json', default=None, help='Guardar los resultados en este archivo')
+    args = parser.parse_args()
+
+    print("=" * 78)
+    modo = args.url or 'en proceso'
+    print(f"PRUEBA DE CARGA: {args.usuarios} usuarios, {args.duracion:.0f} s, {modo}")
+    print("=" * 78)
+    datos = cargar_datos(ROLES)
+    connections.close_all()
+
+    registro = Registro()
+    inicio = time.perf_counter()
+    ejecutar(args, datos, registro)
+    transcurrido = time.perf_counter() - inicio
+
+    resultados = []
+    for clave in sorted(registro.tiempos, key=lambda c: -len(registro.tiempos[c])):
+        tiempos = registro.tiempos[clave]
+        resultados.append({
+            'ruta': clave, 'n': len(tiempos), 'errores': registro.errores[clave],
+            'p50': percentil(tiempos, 50), 'p95': percentil(tiempos, 95),
+            'p99': percentil(tiempos, 99), 'max': max(tiempos),
+        })
+
+    print(f"\n{'ruta':<42}{'n':>7}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    print("-" * 91)
+    for r in resultados:
+        print(f"{r['ruta']:<42}{r['n']:>7}{r['errores']:>6}"
+              f"{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}{r['max']:>9.1f}")
+    total = sum(r['n'] for r in resultados)
+    print("-" * 91)
+    print(f"{total} requests en {transcurrido:.1f} s ({total / transcurrido:.1f} req/s), "
+          f"{sum(r['errores'] for r in resultados)} con error")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as archivo:
+            json.dump({'parametros': vars(args), 'duracion_real': transcurrido, 'rutas': resultados},
+                      archivo, indent=2, ensure_ascii=False)
+        print(f"Resultados en {args.json}")
+
+
+if __name__ == '__main__':
+    main()
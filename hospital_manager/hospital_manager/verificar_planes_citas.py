@@ -0,0 +1,94 @@
+"""
+Verificación de planes de ejecución sobre Citas
+Ejecutar: python verificar_planes_citas.py
+
+Corre EXPLAIN de las consultas por día / médico / paciente en cada nodo de sede
+con enable_seqscan = off. Si aun así el plan hace Seq Scan sobre Citas es que
+no hay índice utilizable (o el filtro dejó de ser sargable) y el script falla.
+"""
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+import django
+
+# Configurar Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automatic_cashier.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from cashier.distribucion import SEDE_DB_ALIAS_DEFAULT, aliases_fragmentos, alias_para_sede, filtro_citas
+from cashier.estadisticas import QUERY_ESTADISTICAS
+
+HOY = date.today()
+MANANA = HOY + timedelta(days=1)
+
+
+def consultas(id_sede):
+    """Consultas (nombre, sql, params) que deben usar los índices de Citas"""
+    where_emp, params_emp = filtro_citas(id_emp=1, desde=HOY, hasta=MANANA, estado='PROGRAMADA')
+    where_pac, params_pac = filtro_citas(cod_pac=1)
+    return [
+        ('dashboard', QUERY_ESTADISTICAS, [id_sede, id_sede]),
+        ('citas_pendientes',
+         "SELECT c.id_cita FROM Citas c WHERE c.id_sede = %s "
+         "AND c.fecha_hora >= CURRENT_DATE AND c.fecha_hora < CURRENT_DATE + 1",
+         [id_sede]),
+        ('api_disponibilidad_citas', f"SELECT c.fecha_hora FROM Citas c WHERE {where_emp}", params_emp),
+        ('detalle_paciente',
+         f"SELECT c.id_cita FROM Citas c WHERE {where_pac} ORDER BY c.fecha_hora DESC LIMIT 20",
+         params_pac),
+    ]
+
+
+def scans_secuenciales(nodo):
+    """Retorna las tablas de citas recorridas con Seq Scan dentro del plan"""
+    encontrados = []
+    if nodo.get('Node Type') == 'Seq Scan' and nodo.get('Relation Name', '').startswith('citas'):
+        encontrados.append(nodo['Relation Name'])
+    for hijo in nodo.get('Plans', []):
+        encontrados.extend(scans_secuenciales(hijo))
+    return encontrados
+
+
+def verificar(alias, id_sede):
+    errores = 0
+    with transaction.atomic(using=alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            for nombre, query, params in consultas(id_sede):
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                seq = scans_secuenciales(plan[0]['Plan'])
+                if seq:
+                    errores += 1
+                    print(f"  ❌ {alias:<8} {nombre:<26} Seq Scan sobre {', '.join(seq)}")
+                else:
+                    print(f"  ✅ {alias:<8} {nombre:<26} usa índice")
+    return errores
+
+
+def main():
+    print("\n" + "=" * 60)
+    print("VERIFICACIÓN DE PLANES - CITAS")
+    print("=" * 60)
+
+    if aliases_fragmentos() is None:
+        print("❌ No hay nodos de sede configurados (SEDE_DB_ALIAS)")
+        sys.exit(1)
+
+    errores = 0
+    for id_sede in sorted(getattr(settings, 'SEDE_DB_ALIAS', SEDE_DB_ALIAS_DEFAULT)):
+        errores += verificar(alias_para_sede(id_sede), id_sede)
+
+    print("=" * 60 + "\n")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
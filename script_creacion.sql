@@ -437,19 +437,45 @@ GROUP BY d.id_dept, d.nom_dept, s.id_sede, s.nom_sede, m.cod_med, m.nom_med, DAT
 
 -- Vista 10: Utilización de recursos por sede
 CREATE VIEW vista_utilizacion_recursos AS
+-- Cada dimensión se agrega por separado (por sede y mes) y luego se unen los
+-- resultados pequeños. Unir Citas x Historias x Equipamiento x Empleados antes
+-- de agrupar multiplicaba las filas por sede antes del COUNT(DISTINCT ...).
+-- Citas se lee una sola vez (en el coordinador es una vista con dblink)
+WITH citas_base AS (
+    SELECT id_sede, DATE_TRUNC('month', fecha_hora) AS mes, cod_pac
+    FROM Citas
+),
+citas_mes AS (
+    SELECT id_sede, mes, COUNT(*) AS total_citas, COUNT(DISTINCT cod_pac) AS total_pacientes
+    FROM citas_base
+    GROUP BY id_sede, mes
+),
+pacientes_mes AS (
+    SELECT DISTINCT id_sede, mes, cod_pac FROM citas_base
+),
+historias_mes AS (
+    SELECT pm.id_sede, pm.mes, COUNT(DISTINCT hc.cod_hist) AS total_historias
+    FROM pacientes_mes pm
+    INNER JOIN Historias_Clinicas hc ON hc.cod_pac = pm.cod_pac
+    GROUP BY pm.id_sede, pm.mes
+),
+equipos_sede AS (
+    SELECT id_sede, COUNT(*) AS total_equipamiento FROM Equipamiento GROUP BY id_sede
+),
+empleados_sede AS (
+    SELECT id_sede, COUNT(*) AS total_empleados FROM Empleados GROUP BY id_sede
+)
 SELECT 
     s.id_sede,
     s.nom_sede,
-    COUNT(DISTINCT c.id_cita) AS total_citas,
-    COUNT(DISTINCT hc.cod_hist) AS total_historias,
-    COUNT(DISTINCT eq.cod_eq) AS total_equipamiento,
-    COUNT(DISTINCT e.id_emp) AS total_empleados,
-    COUNT(DISTINCT pac.cod_pac) AS total_pacientes_atendidos,
-    DATE_TRUNC('month', c.fecha_hora) AS mes
+    COALESCE(cm.total_citas, 0) AS total_citas,
+    COALESCE(hm.total_historias, 0) AS total_historias,
+    COALESCE(eq.total_equipamiento, 0) AS total_equipamiento,
+    COALESCE(em.total_empleados, 0) AS total_empleados,
+    COALESCE(cm.total_pacientes, 0) AS total_pacientes_atendidos,
+    cm.mes
 FROM Sedes_Hospitalarias s
-LEFT JOIN Citas c ON s.id_sede = c.id_sede
-LEFT JOIN Historias_Clinicas hc ON c.cod_pac = hc.cod_pac
-LEFT JOIN Equipamiento eq ON s.id_sede = eq.id_sede
-LEFT JOIN Empleados e ON s.id_sede = e.id_sede
-LEFT JOIN Pacientes pac ON c.cod_pac = pac.cod_pac
-GROUP BY s.id_sede, s.nom_sede, DATE_TRUNC('month', c.fecha_hora);
\ No newline at end of file
+LEFT JOIN citas_mes cm ON cm.id_sede = s.id_sede
+LEFT JOIN historias_mes hm ON hm.id_sede = cm.id_sede AND hm.mes = cm.mes
+LEFT JOIN equipos_sede eq ON eq.id_sede = s.id_sede
+LEFT JOIN empleados_sede em ON em.id_sede = s.id_sede;
\ No newline at end of file